@@ -11,6 +11,7 @@ from datetime import datetime, timedelta
 from app import db
 from models import User, Bot, AdminAction, SystemStats, AccessStatus, AdminActionType
 from services.access_control import AccessControlService
+from utils.helpers import as_date
 
 # Admin blueprint yaratish
 admin = Blueprint('admin', __name__, url_prefix='/admin')
@@ -212,24 +213,34 @@ def statistics():
     """Batafsil statistikalar"""
     stats = AccessControlService.get_user_statistics()
     
-    # Oxirgi 30 kunlik statistika
+    # Oxirgi 30 kunlik statistika: saqlangan kunlar, kunlik yangi foydalanuvchilar va
+    # oynadan oldingi jami - uchta so'rov, kun boshiga emas
+    today = datetime.utcnow().date()
+    first_day = today - timedelta(days=29)
+    stored = {
+        day_stats.date: day_stats
+        for day_stats in SystemStats.query.filter(SystemStats.date >= first_day, SystemStats.date <= today)
+    }
+    day = db.func.date(User.created_at)
+    new_users = {
+        as_date(value): count
+        for value, count in db.session.query(day, db.func.count(User.id))
+        .filter(User.created_at >= datetime.combine(first_day, datetime.min.time())).group_by(day)
+    }
+    running_total = User.query.filter(User.created_at < datetime.combine(first_day, datetime.min.time())).count()
+    
     daily_stats = []
     for i in range(30):
-        date = datetime.utcnow().date() - timedelta(days=i)
-        day_stats = SystemStats.query.filter(
-            SystemStats.date == date
-        ).first()
+        date = first_day + timedelta(days=i)
+        running_total += new_users.get(date, 0)
+        day_stats = stored.get(date)
         
         if not day_stats:
             # Agar o'sha kun uchun statistika bo'lmasa, hisoblash
             day_data = {
                 'date': date,
-                'total_users': User.query.filter(
-                    db.func.date(User.created_at) <= date
-                ).count(),
-                'new_users': User.query.filter(
-                    db.func.date(User.created_at) == date
-                ).count()
+                'total_users': running_total,
+                'new_users': new_users.get(date, 0)
             }
         else:
             day_data = {
@@ -240,8 +251,6 @@ def statistics():
         
         daily_stats.append(day_data)
     
-    daily_stats.reverse()  # Eskilardan yangiga
-    
     return render_template('admin/statistics.html', 
                          stats=stats,
                          daily_stats=daily_stats)
@@ -254,6 +263,14 @@ def api_user_stats():
     stats = AccessControlService.get_user_statistics()
     return jsonify(stats)
 
+@admin.route('/api/metrics')
+@login_required
+@admin_required
+def api_metrics():
+    """API: Servis metrikalari (circuit breaker holati, AI so'rovlari)"""
+    from services.metrics import metrics
+    return jsonify(metrics.snapshot())
+
 @admin.route('/settings')
 @login_required
 @admin_required
@@ -1,11 +1,17 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort, send_file
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 from sqlalchemy import func
+from sqlalchemy.orm import aliased, contains_eager, joinedload, selectinload
 
 from app import app, db
 from models import User, Bot, Conversation, Message, AdminAction, SystemStats, Notification, UserNotification, NotificationStatus, NotificationType, AccessStatus
-from utils.helpers import admin_required
+from utils.helpers import admin_required, as_date
+from services.message_partitions import message_partitions
+from services.conversations import conversation_counts, latest_conversations
+from services.query_profiler import query_profiler
+from services.request_profiler import request_profiler
+from services.segments import segments, DELIVERABLE as DELIVERABLE_SEGMENTS
 from services.marketing_service import MarketingEmailService, get_trial_expired_users, get_active_trial_users, get_all_users
 import logging
 
@@ -30,7 +36,7 @@ def admin_dashboard():
     
     total_bots = Bot.query.count()
     total_conversations = Conversation.query.count()
-    total_messages = Message.query.count()
+    total_messages = message_partitions.count_messages()
     
     # Recent registrations
     recent_users = User.query.filter_by(is_admin=False).order_by(
@@ -247,14 +253,17 @@ def toggle_user_active(user_id):
 @admin_required
 def admin_trial_expired():
     """Sinov muddati tugagan foydalanuvchilar"""
-    users = User.query.filter(
+    users = User.query.options(selectinload(User.bots)).filter(
         User.is_trial_active == True,
         User.trial_end_date <= datetime.utcnow(),
         User.admin_approved == False,
         User.is_admin == False
     ).order_by(User.trial_end_date.desc()).all()
     
-    return render_template('admin/trial_expired.html', users=users)
+    counts = conversation_counts([bot.id for user in users for bot in user.bots])
+    
+    return render_template('admin/trial_expired.html', users=users, conversation_counts=counts,
+                           today=datetime.utcnow().date())
 
 @app.route('/admin/bots')
 @login_required
@@ -264,11 +273,16 @@ def admin_bots():
     page = request.args.get('page', 1, type=int)
     per_page = 20
     
-    bots = Bot.query.join(User).order_by(Bot.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    bots = Bot.query.join(User, User.id == Bot.user_id).options(contains_eager(Bot.owner)).order_by(
+        Bot.created_at.desc()
+    ).paginate(page=page, per_page=per_page, error_out=False)
+    
+    # Conversation counts and the latest five per bot: two queries for the whole page
+    bot_ids = [bot.id for bot in bots.items]
     
-    return render_template('admin/bots.html', bots=bots)
+    return render_template('admin/bots.html', bots=bots,
+                           conversation_counts=conversation_counts(bot_ids),
+                           recent_conversations=latest_conversations(bot_ids, limit=5))
 
 @app.route('/admin/conversations')
 @login_required
@@ -278,11 +292,17 @@ def admin_conversations():
     page = request.args.get('page', 1, type=int)
     per_page = 20
     
-    conversations = Conversation.query.join(Bot).join(User).order_by(
+    conversations = Conversation.query.join(Bot, Bot.id == Conversation.bot_id).join(
+        User, User.id == Bot.user_id
+    ).options(contains_eager(Conversation.bot).contains_eager(Bot.owner)).order_by(
         Conversation.updated_at.desc()
     ).paginate(page=page, per_page=per_page, error_out=False)
     
-    return render_template('admin/conversations.html', conversations=conversations)
+    # Counts come from the summary columns; the modals' history is one query for the whole page
+    recent_messages = message_partitions.latest_messages([conv.id for conv in conversations.items], limit=10)
+    
+    return render_template('admin/conversations.html', conversations=conversations,
+                           recent_messages=recent_messages)
 
 @app.route('/admin/actions')
 @login_required
@@ -292,8 +312,11 @@ def admin_actions():
     page = request.args.get('page', 1, type=int)
     per_page = 20
     
+    target = aliased(User)
     actions = AdminAction.query.join(
         User, AdminAction.admin_id == User.id
+    ).join(target, AdminAction.target_user_id == target.id).options(
+        contains_eager(AdminAction.admin), contains_eager(AdminAction.target_user.of_type(target))
     ).order_by(AdminAction.action_date.desc()).paginate(
         page=page, per_page=per_page, error_out=False
     )
@@ -315,19 +338,52 @@ def admin_stats():
         User.created_at >= thirty_days_ago,
         User.is_admin == False
     ).group_by(func.date(User.created_at)).all()
+    # SQLite returns date() as a string; the template formats real dates
+    daily_stats = [{'date': as_date(row.date), 'new_users': row.new_users} for row in daily_stats]
     
-    # Message stats
-    message_stats = db.session.query(
-        func.date(Message.created_at).label('date'),
-        func.count(Message.id).label('message_count')
-    ).filter(
-        Message.created_at >= thirty_days_ago
-    ).group_by(func.date(Message.created_at)).all()
+    # Message stats (reads only the partitions inside the window)
+    message_stats = message_partitions.daily_message_counts(thirty_days_ago)
     
     return render_template('admin/stats.html',
                          daily_stats=daily_stats,
                          message_stats=message_stats)
 
+@app.route('/admin/queries')
+@login_required
+@admin_required
+def admin_queries():
+    """SQL so'rovlar profili: eng ko'p vaqt olgan sahifalar va sekin so'rovlar"""
+    return render_template('admin/queries.html', report=query_profiler.report())
+
+@app.route('/admin/queries/reset', methods=['POST'])
+@login_required
+@admin_required
+def reset_query_profile():
+    """SQL profil statistikasini tozalash"""
+    query_profiler.reset()
+    flash('SQL profil statistikasi tozalandi.', 'success')
+    return redirect(url_for('admin_queries'))
+
+@app.route('/admin/profiles')
+@login_required
+@admin_required
+def admin_profiles():
+    """Eng sekin so'rovlarning stek profillari"""
+    endpoint = request.args.get('endpoint') or None
+    return render_template('admin/profiles.html', profiles=request_profiler.worst(endpoint=endpoint),
+                           endpoints=request_profiler.endpoint_names(), endpoint=endpoint,
+                           enabled=request_profiler.enabled)
+
+@app.route('/admin/profiles/<name>')
+@login_required
+@admin_required
+def download_profile(name):
+    """Profil faylini yuklab olish (flamegraph.pl / speedscope uchun)"""
+    path = request_profiler.path(name)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=name)
+
 @app.route('/admin/settings', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -350,34 +406,8 @@ def admin_marketing():
         Notification.title.contains('Telegram') | Notification.title.contains('Marketing')
     ).order_by(Notification.created_at.desc()).limit(10).all()
     
-    # Count users by type for Telegram marketing
-    all_users_count = User.query.filter_by(is_admin=False).count()
-    all_telegram_users_count = User.query.filter(
-        User.is_admin == False,
-        User.telegram_chat_id != None,
-        User.marketing_opt_out == False
-    ).count()
-    
-    # Import Telegram marketing functions
-    from services.telegram_marketing_service import get_trial_expired_telegram_users
-    trial_expired_count = len(get_trial_expired_telegram_users())
-    
-    # Count active trial users with Telegram
-    active_trial_telegram_count = User.query.filter(
-        User.is_trial_active == True,
-        User.trial_end_date > datetime.utcnow(),
-        User.admin_approved == False,
-        User.is_admin == False,
-        User.telegram_chat_id != None,
-        User.marketing_opt_out == False
-    ).count()
-    
-    user_counts = {
-        'all': all_users_count,
-        'all_telegram': all_telegram_users_count,
-        'trial_expired': trial_expired_count,
-        'trial_active': active_trial_telegram_count
-    }
+    # Audience sizes, one query (cached briefly)
+    user_counts = segments.counts()
     
     return render_template('admin/notifications.html', 
                          notifications=notifications,
@@ -400,92 +430,60 @@ def send_marketing_telegram():
             return redirect(url_for('admin_marketing'))
         
         # Initialize Telegram marketing service
-        from services.telegram_marketing_service import TelegramMarketingService, get_trial_expired_telegram_users
+        from services.telegram_marketing_service import TelegramMarketingService, update_marketing_sent_timestamp
         marketing_service = TelegramMarketingService()
         
-        # Get target users based on audience
-        if target_audience == 'trial_expired':
-            target_users = get_trial_expired_telegram_users()
-        elif target_audience == 'trial_active':
-            # Get active trial users with Telegram
-            target_users = []
-            users = User.query.filter(
-                User.is_trial_active == True,
-                User.trial_end_date > datetime.utcnow(),
-                User.admin_approved == False,
-                User.is_admin == False,
-                User.telegram_chat_id != None,
-                User.marketing_opt_out == False
-            ).all()
-            
-            for user in users:
-                target_users.append({
-                    'id': user.id,
-                    'username': user.username,
-                    'full_name': user.full_name or user.username,
-                    'telegram_chat_id': user.telegram_chat_id
-                })
-        elif target_audience == 'all_telegram':
-            # Get all users with Telegram
-            target_users = []
-            users = User.query.filter(
-                User.is_admin == False,
-                User.telegram_chat_id != None,
-                User.marketing_opt_out == False
-            ).all()
-            
-            for user in users:
-                target_users.append({
-                    'id': user.id,
-                    'username': user.username,
-                    'full_name': user.full_name or user.username,
-                    'telegram_chat_id': user.telegram_chat_id
-                })
-        else:
+        if target_audience not in DELIVERABLE_SEGMENTS:
             flash('Noto\'g\'ri auditoriya tanlandi!', 'error')
             return redirect(url_for('admin_marketing'))
         
-        if not target_users:
+        if not segments.member_ids(target_audience):
             flash('Tanlangan auditoriyada Telegram bog\'lagan foydalanuvchilar topilmadi!', 'error')
             return redirect(url_for('admin_marketing'))
         
-        # Send Telegram messages to each user
+        # Send Telegram messages, one chunk of members at a time
         sent_count = 0
         failed_count = 0
         
-        for user_data in target_users:
-            try:
-                if target_audience == 'trial_expired':
-                    # Use predefined trial expired message
-                    result = marketing_service.send_trial_expired_message(
-                        chat_id=user_data['telegram_chat_id'],
-                        user_name=user_data['full_name'] or user_data['username']
-                    )
-                else:
-                    # Use custom message
-                    custom_message = content
-                    if include_contact:
-                        custom_message += "\n\n📞 Aloqa:\n• Telefon: +998 99 644 84 44\n• Telegram: @Akramjon1984"
+        for members in segments.iter_members(target_audience):
+            delivered = []
+            for member in members:
+                try:
+                    if target_audience == 'trial_expired':
+                        # Use predefined trial expired message
+                        result = marketing_service.send_marketing_message(
+                            chat_id=member.telegram_chat_id,
+                            message=marketing_service.create_trial_expired_message(
+                                user_name=member.full_name or member.username
+                            )
+                        )
+                    else:
+                        # Use custom message
+                        custom_message = content
+                        if include_contact:
+                            custom_message += "\n\n📞 Aloqa:\n• Telefon: +998 99 644 84 44\n• Telegram: @Akramjon1984"
+                        
+                        result = marketing_service.send_marketing_message(
+                            chat_id=member.telegram_chat_id,
+                            message=custom_message
+                        )
                     
-                    result = marketing_service.send_marketing_message(
-                        chat_id=user_data['telegram_chat_id'],
-                        message=custom_message
-                    )
-                
-                if result and result.get('success'):
-                    sent_count += 1
-                    
-                    # Update user's marketing last sent timestamp
-                    user = User.query.get(user_data['id'])
-                    if user:
-                        user.marketing_last_sent_at = datetime.utcnow()
-                        db.session.commit()
-                else:
+                    if result and result.get('success'):
+                        sent_count += 1
+                        delivered.append(member.id)
+                    else:
+                        failed_count += 1
+                        
+                except Exception as user_error:
                     failed_count += 1
-                    
-            except Exception as user_error:
-                failed_count += 1
-                logging.error(f"Error sending Telegram to user {user_data['full_name']}: {user_error}")
+                    logging.error(f"Error sending Telegram to user {member.full_name or member.username}: {user_error}")
+            
+            # Marketing last sent timestamp of the chunk, one UPDATE
+            if delivered:
+                update_marketing_sent_timestamp(delivered)
+        
+        # Sends changed marketing_last_sent_at
+        segments.invalidate()
         
         # Create notification record
         notification = Notification(
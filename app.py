@@ -1,5 +1,6 @@
 import os
 import logging
+import multiprocessing
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
@@ -47,6 +48,8 @@ app.config['SESSION_COOKIE_SECURE'] = is_production  # HTTPS only in production
 app.config['SESSION_COOKIE_HTTPONLY'] = True  # No JavaScript access
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # CSRF protection
 app.config['PERMANENT_SESSION_LIFETIME'] = 86400  # 24 hours
+# Knowledge files are streamed to disk and ingested in chunks, so large uploads are fine
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", 500)) * 1024 * 1024
 
 # Environment-specific settings
 if is_production:
@@ -60,6 +63,14 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+if app.config["SQLALCHEMY_DATABASE_URI"] not in ("sqlite://", "sqlite:///:memory:"):
+    # Every request thread and Telegram update worker of a process may hold a connection at once;
+    # the overflow covers the background pools (Instagram/WhatsApp batches, knowledge ingestion)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update(
+        pool_size=int(os.environ.get("DATABASE_POOL_SIZE") or
+                      int(os.environ.get("GUNICORN_THREADS", 8)) + int(os.environ.get("TELEGRAM_UPDATES_WORKERS", 8))),
+        max_overflow=int(os.environ.get("DATABASE_MAX_OVERFLOW", 10)),
+    )
 
 # Babel configuration
 app.config['LANGUAGES'] = {
@@ -70,6 +81,12 @@ app.config['LANGUAGES'] = {
 app.config['BABEL_DEFAULT_LOCALE'] = 'uz'
 app.config['BABEL_DEFAULT_TIMEZONE'] = 'UTC'
 
+# Rate limits: counters shared by all workers (services/rate_limiting.py registers the SQL schemes)
+from services.rate_limiting import default_storage_uri
+app.config['RATELIMIT_STORAGE_URI'] = os.environ.get("RATELIMIT_STORAGE_URI") or default_storage_uri()
+# If the shared store is unreachable, limit per process rather than failing requests
+app.config['RATELIMIT_IN_MEMORY_FALLBACK_ENABLED'] = True
+
 # Initialize extensions
 db.init_app(app)
 migrate.init_app(app, db)
@@ -77,6 +94,14 @@ login_manager.init_app(app)
 csrf.init_app(app)
 limiter.init_app(app)
 
+# SQL statement counts and N+1 warnings per request (QUERY_PROFILING=true)
+from services.query_profiler import query_profiler
+query_profiler.init_app(app, db)
+
+# Sampled stack profiles of selected requests (REQUEST_PROFILING=true)
+from services.request_profiler import request_profiler
+request_profiler.init_app(app)
+
 # Initialize Talisman for security headers
 talisman = Talisman(
     app,
@@ -202,6 +227,11 @@ from admin_routes import *
 from admin_panel import admin
 app.register_blueprint(admin)
 
+# CLI commands (flask messages ..., flask telegram ...)
+from commands import messages_cli, telegram_cli
+app.cli.add_command(messages_cli)
+app.cli.add_command(telegram_cli)
+
 # Start scheduler only once (prevent multiple instances in multi-worker environment)
 def start_scheduler_once():
     """Start scheduler with proper multi-worker protection"""
@@ -233,5 +263,7 @@ def start_scheduler_once():
         pass
 
 # Only start scheduler in production or if ENABLE_SCHEDULER is set
-if os.environ.get('FLASK_ENV') == 'production' or os.environ.get('ENABLE_SCHEDULER', 'false').lower() == 'true':
+# (never in multiprocessing children, e.g. knowledge file parsers that re-import main)
+if (os.environ.get('FLASK_ENV') == 'production' or os.environ.get('ENABLE_SCHEDULER', 'false').lower() == 'true') \
+        and multiprocessing.parent_process() is None:
     start_scheduler_once()
\ No newline at end of file
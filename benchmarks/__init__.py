@@ -0,0 +1,4 @@
+"""
+Load and performance benchmarks
+Yuklama va unumdorlik benchmarklari - `python -m benchmarks.<name> --help`
+"""
@@ -0,0 +1,323 @@
+"""
+Database hot-path benchmark at production scale
+Ma'lumotlar bazasidagi eng ko'p ishlatiladigan so'rovlarni production hajmida o'lchash
+
+Seeds SQLite or Postgres with production-shaped data and times the queries
+the app actually runs (the views and helpers are called directly where
+possible, so query changes show up here without editing this file):
+
+    conversation_lookup   webhook conversation lookup by (bot, platform, chat)
+    history_fetch         last 10 messages of a busy conversation
+    message_count         Message.query.count() used by the dashboards
+    admin_dashboard       /admin view (counts, recent users, approvals)
+    admin_stats           /admin/stats view (daily user and message group-bys)
+    admin_bots            /admin/bots list (owners, conversation counts, recent conversations)
+    admin_conversations   /admin/conversations list
+    admin_trial_expired   /admin/trial_expired list
+    marketing_chat_ids    get_user_chat_ids_from_conversations()
+    cleanup_old_data      the scheduler's retention job (destructive, runs last, once)
+
+Each result also records `queries`, the statements one call executes - a
+list view whose count grows with its rows has an N+1.
+
+Usage:
+    python -m benchmarks.db_hot_paths --scale smoke --output before.json
+    python -m benchmarks.db_hot_paths --scale smoke --compare before.json
+    python -m benchmarks.db_hot_paths --scale production --database-url postgresql://... --output pg.json
+    python -m benchmarks.db_hot_paths --database-url sqlite:///seeded.db --skip-seed --skip-cleanup
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+
+from benchmarks.environment import prepare_environment
+from benchmarks.stats import summarize
+
+# users, bots, conversations, messages
+SCALES = {
+    'smoke': (1_000, 500, 5_000, 50_000),
+    'small': (10_000, 5_000, 50_000, 1_000_000),
+    'production': (100_000, 50_000, 500_000, 10_000_000),
+}
+BATCH_SIZE = 10_000
+# Messages span this many days, so roughly half are older than the 90-day retention
+HISTORY_DAYS = 180
+TEXTS = [
+    "Assalomu alaykum, narxlar qancha?",
+    "Здравствуйте, сколько стоит доставка?",
+    "Hello, what are your prices?",
+    "Buyurtmangiz qabul qilindi, rahmat!",
+    "Yetkazib berish 1-2 kun ichida amalga oshiriladi.",
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time the database hot paths on seeded data")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='smoke')
+    parser.add_argument('--users', type=int, help="Override the scale's user count")
+    parser.add_argument('--bots', type=int)
+    parser.add_argument('--conversations', type=int)
+    parser.add_argument('--messages', type=int)
+    parser.add_argument('--database-url', default=None, help="Defaults to a temporary SQLite file")
+    parser.add_argument('--skip-seed', action='store_true', help="Reuse an already seeded database")
+    parser.add_argument('--skip-cleanup', action='store_true', help="Keep the data (cleanup deletes rows)")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per query")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--label', default=None, help="Run label, defaults to the git commit")
+    parser.add_argument('--output', default=None, help="Write the JSON results to this file")
+    parser.add_argument('--compare', default=None, help="Baseline JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="Median slowdown ratio reported as a regression")
+    return parser.parse_args(argv)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _insert_batches(db, table, rows_iter, total, label):
+    batch = []
+    started = time.perf_counter()
+    for done, row in enumerate(rows_iter, 1):
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+            batch = []
+            if done % (BATCH_SIZE * 50) == 0:
+                print(f"  {label}: {done}/{total} ({time.perf_counter() - started:.0f}s)", file=sys.stderr)
+    if batch:
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+
+
+def seed(db, users, bots, conversations, messages, rng):
+    """Bulk-insert production-shaped rows with Core inserts (ids are assigned sequentially)"""
+    from models import User, Bot, Conversation, Message, AccessStatus
+
+    now = datetime.utcnow()
+    statuses = [AccessStatus.TRIAL, AccessStatus.PENDING, AccessStatus.APPROVED, AccessStatus.MONTHLY]
+
+    def user_rows():
+        yield {'username': 'bench_admin', 'email': 'bench_admin@example.com', 'password_hash': '-',
+               'is_admin': True, 'admin_approved': True, 'is_active': True,
+               'access_status': AccessStatus.APPROVED, 'created_at': now}
+        for i in range(1, users):
+            created = now - timedelta(days=rng.uniform(0, 365))
+            status = rng.choice(statuses)
+            yield {
+                'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': '-',
+                'is_admin': False, 'is_active': True, 'access_status': status,
+                'admin_approved': status != AccessStatus.TRIAL and status != AccessStatus.PENDING,
+                'is_trial_active': status == AccessStatus.TRIAL,
+                'trial_start_date': created, 'trial_end_date': created + timedelta(days=3),
+                'telegram_chat_id': str(700000000 + i) if rng.random() < 0.3 else None,
+                'marketing_opt_out': rng.random() < 0.05,
+                'created_at': created,
+            }
+
+    def bot_rows():
+        for i in range(bots):
+            yield {'name': f'Bot {i}', 'user_id': rng.randint(2, users), 'system_prompt': 'Yordamchi bot',
+                   'telegram_token': f'{100000 + i}:TOKEN', 'is_active': True,
+                   'created_at': now - timedelta(days=rng.uniform(0, 365))}
+
+    def conversation_rows():
+        for i in range(conversations):
+            yield {'bot_id': rng.randint(1, bots), 'user_id': rng.randint(2, users) if rng.random() < 0.2 else None,
+                   'platform': 'telegram' if rng.random() < 0.85 else 'instagram',
+                   'platform_user_id': str(500000000 + i), 'platform_username': f'chat{i}',
+                   'language': rng.choice(['uz', 'uz', 'ru', 'en']), 'is_active': True,
+                   'created_at': now - timedelta(days=HISTORY_DAYS), 'updated_at': now}
+
+    # Skewed traffic: a small share of conversations receives most messages
+    weights = [1.0 / (rank + 1) ** 0.8 for rank in range(conversations)]
+    cumulative = []
+    total_weight = 0.0
+    for weight in weights:
+        total_weight += weight
+        cumulative.append(total_weight)
+
+    def message_rows():
+        start = now - timedelta(days=HISTORY_DAYS)
+        step = timedelta(days=HISTORY_DAYS) / max(messages, 1)
+        # Ordered by time, like real inserts, so primary keys follow created_at
+        for i in range(messages):
+            conversation_id = rng.choices(range(1, conversations + 1), cum_weights=cumulative)[0]
+            yield {'conversation_id': conversation_id, 'content': TEXTS[i % len(TEXTS)],
+                   'message_type': 'text', 'is_from_user': i % 2 == 0, 'tokens_used': 0,
+                   'response_time': 0.0, 'created_at': start + step * i}
+
+    _insert_batches(db, User.__table__, user_rows(), users, 'users')
+    _insert_batches(db, Bot.__table__, bot_rows(), bots, 'bots')
+    _insert_batches(db, Conversation.__table__, conversation_rows(), conversations, 'conversations')
+    _insert_batches(db, Message.__table__, message_rows(), messages, 'messages')
+
+
+def time_query(db, func, repeat):
+    """Run func `repeat` times with a clean session; returns timing summary, row and statement counts"""
+    from services.query_profiler import count_queries
+
+    durations = []
+    rows = None
+    with count_queries(db.engine) as statements:
+        for _ in range(repeat):
+            db.session.remove()
+            started = time.perf_counter()
+            result = func()
+            durations.append(time.perf_counter() - started)
+            rows = len(result) if hasattr(result, '__len__') else result
+    db.session.remove()
+    summary = summarize(durations)
+    summary['min_ms'] = round(min(durations) * 1000, 2)
+    summary['rows'] = rows
+    summary['queries'] = round(sum(statements.values()) / repeat, 1)
+    return summary
+
+
+def run_benchmarks(app, db, args):
+    from models import User, Conversation, Message
+    from services.telegram_service import get_user_chat_ids_from_conversations
+
+    client = app.test_client()
+    admin = User.query.filter_by(is_admin=True).order_by(User.id).first()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+        session['_fresh'] = True
+
+    # The busiest conversation (rank 1 in the seeding skew) and a typical one
+    busy = Conversation.query.order_by(Conversation.id).first()
+    lookup_keys = [(c.bot_id, c.platform, c.platform_user_id)
+                   for c in Conversation.query.filter_by(platform='telegram').order_by(Conversation.id.desc()).limit(50)]
+    db.session.remove()
+
+    def conversation_lookup():
+        # Same query as the Telegram webhook, over 50 different chats
+        found = []
+        for bot_id, platform, platform_user_id in lookup_keys:
+            found.append(Conversation.query.filter_by(
+                bot_id=bot_id, platform=platform, platform_user_id=platform_user_id
+            ).first())
+        return found
+
+    def history_fetch():
+        # Same query as the webhooks' context window
+        return Message.query.filter_by(
+            conversation_id=busy.id
+        ).order_by(Message.created_at.desc()).limit(10).all()
+
+    def view(path):
+        def call():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+            return 1
+        return call
+
+    cases = [
+        ('conversation_lookup', conversation_lookup),
+        ('history_fetch', history_fetch),
+        ('message_count', lambda: Message.query.count()),
+        ('admin_dashboard', view('/admin')),
+        ('admin_stats', view('/admin/stats')),
+        ('admin_bots', view('/admin/bots')),
+        ('admin_conversations', view('/admin/conversations')),
+        ('admin_trial_expired', view('/admin/trial_expired')),
+        ('marketing_chat_ids', get_user_chat_ids_from_conversations),
+    ]
+
+    results = {}
+    for name, func in cases:
+        print(f"timing {name}", file=sys.stderr)
+        try:
+            results[name] = time_query(db, func, args.repeat)
+        except Exception as e:
+            # Keep going - a broken path is itself a result worth recording
+            db.session.rollback()
+            results[name] = {'error': str(e)}
+
+    if not args.skip_cleanup:
+        from tasks.scheduler import cleanup_old_data
+        print("timing cleanup_old_data", file=sys.stderr)
+        before = Message.query.count()
+        db.session.remove()
+        results['cleanup_old_data'] = time_query(db, cleanup_old_data, 1)
+        results['cleanup_old_data']['rows'] = before - Message.query.count()
+        db.session.remove()
+
+    return results
+
+
+def compare(current, baseline, threshold):
+    """Print per-query median ratios; returns the names that regressed"""
+    regressions = []
+    print(f"\n{'query':<22}{'baseline ms':>14}{'current ms':>14}{'ratio':>9}", file=sys.stderr)
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if 'error' in result:
+            print(f"{name:<22}{base.get('p50_ms', '-') if base else '-':>14}{'error':>14}", file=sys.stderr)
+            regressions.append(name)
+            continue
+        if not base or not base.get('p50_ms'):
+            print(f"{name:<22}{'-':>14}{result['p50_ms']:>14}{'new':>9}", file=sys.stderr)
+            continue
+        ratio = result['p50_ms'] / base['p50_ms']
+        flag = '  REGRESSION' if ratio > threshold else ''
+        print(f"{name:<22}{base['p50_ms']:>14}{result['p50_ms']:>14}{ratio:>9.2f}{flag}", file=sys.stderr)
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    users, bots, conversations, messages = SCALES[args.scale]
+    users = args.users or users
+    bots = args.bots or bots
+    conversations = args.conversations or conversations
+    messages = args.messages or messages
+
+    database_url = prepare_environment(args.database_url, 'db_hot_paths_')
+    from app import app, db
+
+    report = {
+        'label': args.label or git_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'dialect': None,
+        'scale': {'name': args.scale, 'users': users, 'bots': bots,
+                  'conversations': conversations, 'messages': messages},
+    }
+
+    with app.app_context():
+        report['dialect'] = db.engine.dialect.name
+        if not args.skip_seed:
+            print(f"seeding {database_url.split('@')[-1]}", file=sys.stderr)
+            started = time.perf_counter()
+            seed(db, users, bots, conversations, messages, random.Random(args.seed))
+            report['seed_seconds'] = round(time.perf_counter() - started, 1)
+        report['results'] = run_benchmarks(app, db, args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,28 @@
+"""
+Process environment for benchmarks - must be applied before `app` is imported
+Benchmark muhiti: app import qilinishidan oldin sozlanadi
+"""
+import os
+import tempfile
+from typing import Optional
+
+
+def prepare_environment(database_url: Optional[str] = None, prefix: str = 'bench_',
+                        log_level: str = 'WARNING') -> str:
+    """
+    Point the app at a benchmark database and disable background side effects
+
+    Returns the database URL in use (a throwaway SQLite file when none is given).
+    """
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+    os.environ.setdefault('SESSION_SECRET', 'benchmark')
+    os.environ['ENABLE_SCHEDULER'] = 'false'
+    os.environ.pop('FLASK_ENV', None)
+    os.environ['LOG_LEVEL'] = log_level.upper()
+    # Retention archives from cleanup runs must not land in the working tree
+    os.environ.setdefault('RETENTION_ARCHIVE_DIR', tempfile.mkdtemp(prefix=prefix + 'archive_'))
+    os.environ.setdefault('RETENTION_BATCH_PAUSE_SECONDS', '0')
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix=prefix), 'bench.db')
+    os.environ['DATABASE_URL'] = database_url
+    return database_url
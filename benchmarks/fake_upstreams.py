@@ -0,0 +1,341 @@
+"""
+Local stand-ins for the Telegram Bot API, Instagram/WhatsApp Graph API and Gemini
+Telegram, Instagram va Gemini API'larining mahalliy soxta serverlari (yuklama testlari uchun)
+
+The services read their API roots from TELEGRAM_API_BASE, GRAPH_API_BASE and
+GEMINI_API_BASE, so pointing those at this server exercises the real client
+code paths without touching live APIs.
+
+WhatsApp sends are remembered (FakeUpstreams.whatsapp_sent), and
+whatsapp_message_payload / whatsapp_status_payload build the webhook bodies
+the Cloud API would post back, so tests can replay inbound messages and the
+status callbacks of what was actually sent.
+
+Telegram updates queued with push_telegram_update are served by getUpdates
+(offset, limit and the long-poll timeout are honoured); sendMessage calls
+are remembered in FakeUpstreams.telegram_sent.
+
+Standalone:
+    python -m benchmarks.fake_upstreams --port 8099 --gemini-latency-ms 800 --error-rate 0.01
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+TELEGRAM_PATH = re.compile(r'^/bot(?P<token>[^/]+)/(?P<method>\w+)')
+GRAPH_PATH = re.compile(r'^/v\d+\.\d+/(?P<object_id>[^/?]+)(?P<edge>/\w+)?')
+GEMINI_PATH = re.compile(r'^/v1(?:beta|alpha)?/models/(?P<model>[^/:]+):(?P<action>\w+)')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+
+
+@dataclass
+class UpstreamProfile:
+    """Simulated behaviour of one upstream: latency and failure rate"""
+    latency_ms: float = 50.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+
+    def delay(self, rng: random.Random) -> float:
+        jitter = rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000.0
+
+    def should_fail(self, rng: random.Random) -> bool:
+        return self.error_rate > 0 and rng.random() < self.error_rate
+
+
+class FakeUpstreams:
+    """One threaded HTTP server answering Telegram, Graph and Gemini requests"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 telegram: Optional[UpstreamProfile] = None,
+                 graph: Optional[UpstreamProfile] = None,
+                 gemini: Optional[UpstreamProfile] = None,
+                 reply_text: str = "Rahmat! Savolingiz qabul qilindi.",
+                 seed: Optional[int] = None):
+        self.profiles = {
+            'telegram': telegram or UpstreamProfile(),
+            'graph': graph or UpstreamProfile(),
+            'gemini': gemini or UpstreamProfile(latency_ms=800.0),
+        }
+        self.reply_text = reply_text
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._message_id = 0
+        # (wamid, recipient, message type) of every accepted WhatsApp send
+        self.whatsapp_sent = []
+        # (token, chat_id, text) of every Telegram sendMessage
+        self.telegram_sent = []
+        # token -> pending updates, for getUpdates
+        self._telegram_updates: Dict[str, List[Dict]] = {}
+        self._updates_ready = threading.Condition()
+        self.stats: Dict[str, Dict[str, int]] = {
+            name: {'requests': 0, 'errors': 0} for name in self.profiles
+        }
+
+        handler = type('FakeUpstreamHandler', (_Handler,), {'upstreams': self})
+        self.server = _Server((host, port), handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> Dict[str, str]:
+        """Environment variables that point the services at this server"""
+        return {
+            'TELEGRAM_API_BASE': self.base_url,
+            'GRAPH_API_BASE': self.base_url,
+            'GEMINI_API_BASE': self.base_url,
+        }
+
+    def start(self) -> 'FakeUpstreams':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-upstreams', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def simulate(self, upstream: str) -> bool:
+        """Sleep for the upstream's latency and decide whether this call fails"""
+        profile = self.profiles[upstream]
+        with self._rng_lock:
+            delay = profile.delay(self._rng)
+            failed = profile.should_fail(self._rng)
+        if delay:
+            time.sleep(delay)
+        with self._stats_lock:
+            self.stats[upstream]['requests'] += 1
+            if failed:
+                self.stats[upstream]['errors'] += 1
+        return failed
+
+    def next_message_id(self) -> int:
+        with self._stats_lock:
+            self._message_id += 1
+            return self._message_id
+
+    def record_whatsapp(self, message_id: str, to: str, kind: str) -> None:
+        with self._stats_lock:
+            self.whatsapp_sent.append((message_id, to, kind))
+
+
+    def push_telegram_update(self, token: str, update: Dict) -> None:
+        """Queue an update for the bot's getUpdates"""
+        with self._updates_ready:
+            self._telegram_updates.setdefault(token, []).append(update)
+            self._updates_ready.notify_all()
+
+    def get_telegram_updates(self, token: str, offset: Optional[int], limit: int, timeout: float) -> List[Dict]:
+        """getUpdates semantics: confirm below `offset`, wait up to `timeout` for anything newer"""
+        deadline = time.monotonic() + min(timeout, 50)
+        with self._updates_ready:
+            while True:
+                queue = self._telegram_updates.setdefault(token, [])
+                if offset is not None:
+                    queue[:] = [update for update in queue if update['update_id'] >= offset]
+                remaining = deadline - time.monotonic()
+                if queue or remaining <= 0:
+                    return queue[:limit]
+                self._updates_ready.wait(remaining)
+
+    def record_telegram(self, token: str, chat_id, text: str) -> None:
+        with self._stats_lock:
+            self.telegram_sent.append((token, chat_id, text))
+
+
+def whatsapp_message_payload(phone_number_id: str, messages) -> Dict:
+    """Cloud API webhook body for inbound text messages: `messages` is [(wa_id, name, text), ...]"""
+    now = str(int(time.time()))
+    return {'object': 'whatsapp_business_account', 'entry': [{
+        'id': 'WABA_FAKE',
+        'changes': [{'field': 'messages', 'value': {
+            'messaging_product': 'whatsapp',
+            'metadata': {'display_phone_number': '998900000000', 'phone_number_id': phone_number_id},
+            'contacts': [{'profile': {'name': name}, 'wa_id': wa_id} for wa_id, name, _ in messages],
+            'messages': [{'from': wa_id, 'id': f'wamid.IN{index}{now}', 'timestamp': now,
+                          'type': 'text', 'text': {'body': text}}
+                         for index, (wa_id, _, text) in enumerate(messages)],
+        }}],
+    }]}
+
+
+def whatsapp_status_payload(phone_number_id: str, statuses) -> Dict:
+    """Cloud API webhook body for status callbacks: `statuses` is [(wamid, recipient, status), ...]"""
+    now = str(int(time.time()))
+    return {'object': 'whatsapp_business_account', 'entry': [{
+        'id': 'WABA_FAKE',
+        'changes': [{'field': 'messages', 'value': {
+            'messaging_product': 'whatsapp',
+            'metadata': {'display_phone_number': '998900000000', 'phone_number_id': phone_number_id},
+            'statuses': [{'id': wamid, 'recipient_id': recipient, 'status': status, 'timestamp': now}
+                         for wamid, recipient, status in statuses],
+        }}],
+    }]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive so pooled clients (requests.Session, httpx) reuse connections
+    protocol_version = 'HTTP/1.1'
+    upstreams: FakeUpstreams = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+        self._dispatch(body)
+
+    def _dispatch(self, body):
+        path = self.path.split('?', 1)[0]
+
+        match = GEMINI_PATH.match(path)
+        if match:
+            return self._gemini(match.group('model'), body)
+        match = TELEGRAM_PATH.match(path)
+        if match:
+            return self._telegram(match.group('token'), match.group('method'), body)
+        match = GRAPH_PATH.match(path)
+        if match:
+            return self._graph(match.group('object_id'), match.group('edge'), body)
+
+        self._send_json(404, {'error': f'Unknown path {path}'})
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _telegram(self, token, method, body):
+        if self.upstreams.simulate('telegram'):
+            return self._send_json(429, {
+                'ok': False, 'error_code': 429,
+                'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1}
+            })
+
+        if method in ('sendMessage', 'editMessageText'):
+            if method == 'sendMessage':
+                self.upstreams.record_telegram(token, body.get('chat_id'), body.get('text', ''))
+            result = {
+                'message_id': body.get('message_id') or self.upstreams.next_message_id(),
+                'date': int(time.time()),
+                'chat': {'id': body.get('chat_id'), 'type': 'private'},
+                'text': body.get('text', '')
+            }
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Benchmark Bot', 'username': 'benchmark_bot'}
+        elif method == 'getUpdates':
+            result = self.upstreams.get_telegram_updates(token, body.get('offset'), int(body.get('limit') or 100),
+                                                         float(body.get('timeout') or 0))
+        else:
+            # setWebhook, deleteWebhook, answerCallbackQuery, ...
+            result = True
+        self._send_json(200, {'ok': True, 'result': result})
+
+    def _graph(self, object_id, edge, body):
+        if self.upstreams.simulate('graph'):
+            if body.get('messaging_product') == 'whatsapp':
+                return self._send_json(429, {
+                    'error': {'message': '(#130429) Rate limit hit', 'type': 'OAuthException', 'code': 130429}
+                })
+            return self._send_json(500, {
+                'error': {'message': 'An unexpected error has occurred. Please retry your request later.',
+                          'type': 'OAuthException', 'code': 2}
+            })
+
+        if edge == '/messages':
+            message_id = self.upstreams.next_message_id()
+            if body.get('messaging_product') == 'whatsapp':
+                self.upstreams.record_whatsapp(f'wamid.FAKE{message_id}', body.get('to'), body.get('type', 'text'))
+                return self._send_json(200, {
+                    'messaging_product': 'whatsapp',
+                    'contacts': [{'input': body.get('to'), 'wa_id': body.get('to')}],
+                    'messages': [{'id': f'wamid.FAKE{message_id}'}]
+                })
+            return self._send_json(200, {
+                'recipient_id': (body.get('recipient') or {}).get('id'),
+                'message_id': f'mid.FAKE{message_id}'
+            })
+
+        self._send_json(200, {'id': object_id, 'name': 'Benchmark Page', 'followers_count': 0})
+
+    def _gemini(self, model, body):
+        if self.upstreams.simulate('gemini'):
+            return self._send_json(503, {
+                'error': {'code': 503, 'message': 'The model is overloaded. Please try again later.',
+                          'status': 'UNAVAILABLE'}
+            })
+
+        self._send_json(200, {
+            'candidates': [{
+                'content': {'parts': [{'text': self.upstreams.reply_text}], 'role': 'model'},
+                'finishReason': 'STOP',
+                'index': 0
+            }],
+            'usageMetadata': {'promptTokenCount': 50, 'candidatesTokenCount': 12, 'totalTokenCount': 62},
+            'modelVersion': model
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram/Graph/Gemini upstreams")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=50.0, help="Telegram and Graph latency")
+    parser.add_argument('--gemini-latency-ms', type=float, default=800.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    def profile(latency):
+        return UpstreamProfile(latency, args.jitter_ms, args.error_rate)
+
+    upstreams = FakeUpstreams(args.host, args.port, telegram=profile(args.latency_ms),
+                              graph=profile(args.latency_ms), gemini=profile(args.gemini_latency_ms),
+                              seed=args.seed)
+    for key, value in upstreams.env().items():
+        print(f"export {key}={value}")
+    try:
+        upstreams.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        upstreams.server.server_close()
+        print(json.dumps(upstreams.stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
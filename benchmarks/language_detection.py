@@ -0,0 +1,203 @@
+"""
+Accuracy and throughput of the language detector
+Til aniqlash aniqligi va tezligi
+
+Scores utils.language on a labelled set of customer messages (none of them
+in the training corpus) and times it on single messages and in batches.
+The character-count heuristic the app used before is run on the same set
+for comparison.
+
+Usage:
+    python -m benchmarks.language_detection
+    python -m benchmarks.language_detection --messages 200000 --errors
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from collections import Counter, defaultdict
+
+# (label, text); the label is the profile name so both Uzbek scripts are scored apart
+LABELLED = [
+    ('uz_latn', "Salom, bu ko'ylakning narxi qancha?"),
+    ('uz_latn', "Yetkazib berasizlarmi? Men Chilonzorda yashayman"),
+    ('uz_latn', "Qachon ochilasizlar?"),
+    ('uz_latn', "Rahmat, kutaman"),
+    ('uz_latn', "Menga katta o'lchami kerak edi"),
+    ('uz_latn', "Karta orqali to'lasam bo'ladimi"),
+    ('uz_latn', "Buyurtmam qayerda? Uch kundan beri kutyapman"),
+    ('uz_latn', "Nechta qoldi omborda?"),
+    ('uz_latn', "Iltimos, menga qo'ng'iroq qiling"),
+    ('uz_latn', "Assalomu alaykum, kurslaringiz haqida ma'lumot bersangiz"),
+    ('uz_latn', "Bugun olib kelsangiz bo'ladimi?"),
+    ('uz_latn', "Qaysi biri yaxshiroq, oq yoki qora?"),
+    ('uz_latn', "Chegirma bo'ladimi agar ikkita olsam"),
+    ('uz_latn', "Xizmatingiz yoqdi, do'stlarimga ham aytaman"),
+    ('uz_latn', "Samarqandga jo'natasizlarmi"),
+    ('uz_latn', "Men bilan bog'laning"),
+    ('uz_latn', "O‘zbekistonning qaysi shaharlarida filialingiz bor?"),
+    ('uz_latn', "Narx juda qimmat ekan"),
+    ('uz_latn', "Kechqurun soat nechagacha ishlaysiz"),
+    ('uz_latn', "Qanday hujjatlar kerak bo'ladi?"),
+    ('uz_latn', "yaxshimisiz"),
+    ('uz_latn', "qalaysiz, ishlar yaxshimi"),
+    ('uz_latn', "bor"),
+    ('uz_latn', "kerak emas, rahmat"),
+    ('uz_latn', "tushunmadim, qaytadan tushuntirib bering"),
+    ('uz_cyrl', "Салом, бу кўйлакнинг нархи қанча?"),
+    ('uz_cyrl', "Етказиб берасизларми? Мен Чилонзорда яшайман"),
+    ('uz_cyrl', "Қачон очиласизлар?"),
+    ('uz_cyrl', "Раҳмат, кутаман"),
+    ('uz_cyrl', "Менга катта ўлчами керак эди"),
+    ('uz_cyrl', "Карта орқали тўласам бўладими"),
+    ('uz_cyrl', "Буюртмам қаерда? Уч кундан бери кутяпман"),
+    ('uz_cyrl', "Нечта қолди омборда?"),
+    ('uz_cyrl', "Илтимос, менга қўнғироқ қилинг"),
+    ('uz_cyrl', "Ассалому алайкум, курсларингиз ҳақида маълумот берсангиз"),
+    ('uz_cyrl', "Бугун олиб келсангиз буладими?"),
+    ('uz_cyrl', "Кайси бири яхширок, ок ёки кора?"),
+    ('uz_cyrl', "Чегирма буладими агар иккита олсам"),
+    ('uz_cyrl', "Хизматингиз ёкди, дустларимга хам айтаман"),
+    ('uz_cyrl', "Самарқандга жўнатасизларми"),
+    ('uz_cyrl', "Мен билан боғланинг"),
+    ('uz_cyrl', "Нарх жуда қиммат экан"),
+    ('uz_cyrl', "Кечқурун соат нечагача ишлайсиз"),
+    ('uz_cyrl', "Қандай ҳужжатлар керак бўлади?"),
+    ('uz_cyrl', "яхшимисиз"),
+    ('uz_cyrl', "керак эмас, раҳмат"),
+    ('uz_cyrl', "тушунмадим, қайтадан тушунтириб беринг"),
+    ('ru', "Здравствуйте, сколько стоит это платье?"),
+    ('ru', "Вы доставляете? Я живу в Чиланзаре"),
+    ('ru', "Когда вы открываетесь?"),
+    ('ru', "Спасибо, буду ждать"),
+    ('ru', "Мне нужен большой размер"),
+    ('ru', "Можно оплатить картой"),
+    ('ru', "Где мой заказ? Жду уже три дня"),
+    ('ru', "Сколько осталось на складе?"),
+    ('ru', "Пожалуйста, позвоните мне"),
+    ('ru', "Добрый день, расскажите о ваших курсах"),
+    ('ru', "Можете привезти сегодня?"),
+    ('ru', "Какой лучше, белый или чёрный?"),
+    ('ru', "Будет скидка если возьму два"),
+    ('ru', "Понравился ваш сервис, расскажу друзьям"),
+    ('ru', "Отправляете в Самарканд"),
+    ('ru', "Свяжитесь со мной"),
+    ('ru', "В каких городах есть ваши филиалы?"),
+    ('ru', "Слишком дорого"),
+    ('ru', "До скольки вы работаете вечером"),
+    ('ru', "Какие документы нужны?"),
+    ('ru', "как дела"),
+    ('ru', "есть"),
+    ('ru', "не надо, спасибо"),
+    ('ru', "не понял, объясните ещё раз"),
+    ('en', "Hi, how much is this dress?"),
+    ('en', "Do you deliver? I live downtown"),
+    ('en', "When do you open?"),
+    ('en', "Thanks, I will wait"),
+    ('en', "I need a larger size"),
+    ('en', "Can I pay by card"),
+    ('en', "Where is my order? I have been waiting for three days"),
+    ('en', "How many are left in stock?"),
+    ('en', "Please call me"),
+    ('en', "Good afternoon, tell me about your courses"),
+    ('en', "Could you bring it today?"),
+    ('en', "Which one is better, white or black?"),
+    ('en', "Is there a discount if I buy two"),
+    ('en', "Loved your service, will tell my friends"),
+    ('en', "Do you ship to Samarkand"),
+    ('en', "Get in touch with me"),
+    ('en', "Which cities have your branches?"),
+    ('en', "Too expensive"),
+    ('en', "Until what time are you open in the evening"),
+    ('en', "What documents are needed?"),
+    ('en', "how are you"),
+    ('en', "no need, thanks"),
+    ('en', "I did not understand, explain again"),
+]
+
+
+def legacy_detect(text):
+    """The character-count heuristic utils.helpers.detect_language used before"""
+    if not text:
+        return 'uz'
+    uzbek_count = sum(1 for char in text.lower() if char in set('qxʻoʻgʻ'))
+    russian_count = sum(1 for char in text.lower() if char in set('ёяю'))
+    cyrillic_count = sum(1 for char in text if 'Ѐ' <= char <= 'ӿ')
+    if russian_count > 0 or cyrillic_count > len(text) * 0.3:
+        return 'ru'
+    elif uzbek_count > 0 or any(ord(char) > 127 for char in text):
+        return 'uz'
+    return 'en'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Language detection accuracy and throughput")
+    parser.add_argument('--messages', type=int, default=50_000, help="Messages timed for throughput")
+    parser.add_argument('--errors', action='store_true', help="List the misclassified messages")
+    return parser.parse_args(argv)
+
+
+def accuracy(detect, profiles):
+    per_label = defaultdict(Counter)
+    errors = []
+    for label, text in LABELLED:
+        expected = profiles[label][0]
+        got = detect(text)
+        per_label[label][got == expected] += 1
+        if got != expected:
+            errors.append({'label': label, 'text': text, 'got': got})
+    correct = sum(c[True] for c in per_label.values())
+    return {
+        'accuracy': round(correct / len(LABELLED), 3),
+        'per_label': {label: round(c[True] / sum(c.values()), 3) for label, c in sorted(per_label.items())},
+    }, errors
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from utils import language
+    from utils.language import PROFILES, detect_language, detect_languages, identify
+
+    report = {'labelled_messages': len(LABELLED)}
+    report['detector'], errors = accuracy(detect_language, PROFILES)
+    report['legacy'], legacy_errors = accuracy(legacy_detect, PROFILES)
+    scripts = sum(1 for label, text in LABELLED if identify(text).script == PROFILES[label][1])
+    report['detector']['script_accuracy'] = round(scripts / len(LABELLED), 3)
+
+    rng = random.Random(42)
+    texts = [text for _, text in LABELLED]
+    # Mostly distinct messages, as the webhooks see them
+    messages = [f"{rng.choice(texts)} {rng.choice(texts)}" for _ in range(args.messages)]
+    report['throughput'] = {'messages': args.messages,
+                            'mean_chars': round(sum(map(len, messages)) / len(messages), 1)}
+    for name, detect in (('detector', detect_language), ('legacy', legacy_detect)):
+        started = time.perf_counter()
+        for message in messages:
+            detect(message)
+        elapsed = time.perf_counter() - started
+        report['throughput'][name + '_per_second'] = round(args.messages / elapsed)
+
+    # Every word unseen: the worst case for the detector's word cache
+    cold = messages[:min(len(messages), 10_000)]
+    started = time.perf_counter()
+    for message in cold:
+        language._word_cache.clear()
+        detect_language(message)
+    report['throughput']['detector_uncached_per_second'] = round(len(cold) / (time.perf_counter() - started))
+
+    # A broadcast: the same few texts to many recipients
+    broadcast = [rng.choice(texts[:5]) for _ in range(args.messages)]
+    started = time.perf_counter()
+    detect_languages(broadcast)
+    report['throughput']['batch_broadcast_per_second'] = round(args.messages / (time.perf_counter() - started))
+
+    if args.errors:
+        report['errors'] = errors
+        report['legacy_errors'] = legacy_errors
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
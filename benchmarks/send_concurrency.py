@@ -0,0 +1,74 @@
+"""
+Sequential vs asyncio fan-out for outbound Telegram sends
+Ketma-ket (sinxron) va asyncio orqali parallel yuborishni solishtirish
+
+Sends the same N messages to the fake Telegram API twice: once with the sync
+TelegramService in a loop (how broadcasts used to work) and once through
+gather_limited + AsyncTelegramService on the async bridge.
+
+Usage:
+    python -m benchmarks.send_concurrency --messages 500 --latency-ms 150 --limit 50
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+from benchmarks.environment import prepare_environment
+from benchmarks.fake_upstreams import FakeUpstreams, UpstreamProfile
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare sequential and async Telegram sends")
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=150.0)
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--limit', type=int, default=50, help="Async sends in flight")
+    parser.add_argument('--rate', type=float, default=None, help="Async sends started per second")
+    parser.add_argument('--skip-sync', action='store_true', help="Only run the async variant")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    upstreams = FakeUpstreams(telegram=UpstreamProfile(args.latency_ms, args.jitter_ms)).start()
+    os.environ.update(upstreams.env())
+    prepare_environment(prefix='send_bench_')
+
+    # The service modules expect the app to be imported first (same order as at runtime)
+    import app  # noqa: F401
+    from services.platform_service import TelegramService
+    from services.async_service import AsyncTelegramService
+    from services.async_bridge import run_async, gather_limited
+
+    token = '123456:BENCHMARK'
+    chat_ids = [600000000 + i for i in range(args.messages)]
+    report = {'messages': args.messages, 'latency_ms': args.latency_ms}
+
+    if not args.skip_sync:
+        service = TelegramService(token)
+        started = time.perf_counter()
+        sent = sum(1 for chat_id in chat_ids if service.send_message(chat_id, "Benchmark").success)
+        elapsed = time.perf_counter() - started
+        report['sequential'] = {'seconds': round(elapsed, 3), 'sent': sent,
+                                'messages_per_second': round(args.messages / elapsed, 1)}
+
+    service = AsyncTelegramService(token)
+    started = time.perf_counter()
+    results = run_async(gather_limited((service.send_message(chat_id, "Benchmark") for chat_id in chat_ids),
+                                       limit=args.limit, rate_per_second=args.rate))
+    elapsed = time.perf_counter() - started
+    report['async'] = {'seconds': round(elapsed, 3), 'limit': args.limit, 'rate_per_second': args.rate,
+                       'sent': sum(1 for r in results if not isinstance(r, Exception) and r.success),
+                       'messages_per_second': round(args.messages / elapsed, 1)}
+    if 'sequential' in report:
+        report['speedup'] = round(report['sequential']['seconds'] / elapsed, 1)
+
+    upstreams.stop()
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Timing helpers shared by the benchmarks
+Benchmarklar uchun vaqt o'lchash va persentil yordamchilari
+"""
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: Iterable[float]) -> Dict[str, float]:
+    """count/mean/p50/p90/p99/max of a list of durations (seconds in, milliseconds out)"""
+    values = sorted(samples)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 2),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p90_ms': round(percentile(values, 90) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2),
+    }
+
+
+class StageRecorder:
+    """Accumulates time spent per stage for the request running in the current thread"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def begin(self) -> None:
+        self._local.stages = defaultdict(float)
+
+    def add(self, stage: str, seconds: float) -> None:
+        stages = getattr(self._local, 'stages', None)
+        if stages is not None:
+            stages[stage] += seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def end(self, total: float) -> None:
+        """Close the current request; a stage's count is the number of requests that reached it"""
+        stages = getattr(self._local, 'stages', None) or {}
+        self._local.stages = None
+        with self._lock:
+            self.samples['total'].append(total)
+            for name, seconds in stages.items():
+                self.samples[name].append(seconds)
+
+    def hand_off(self, func):
+        """Return func recording into the calling thread's request, wherever it runs
+
+        For work a request hands to another thread (the webhook's
+        KeyedScheduler): the stages land in the request, not in the worker
+        thread's (absent) one. The request must wait for the work before end().
+        """
+        stages = getattr(self._local, 'stages', None)
+        if stages is None:
+            return func
+
+        def handed_off(*args, **kwargs):
+            previous = getattr(self._local, 'stages', None)
+            self._local.stages = stages
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.stages = previous
+        handed_off.__wrapped__ = func
+        return handed_off
+
+    def wrap(self, stage: str, func):
+        """Return func timed under the given stage name"""
+        def timed(*args, **kwargs):
+            with self.stage(stage):
+                return func(*args, **kwargs)
+        timed.__wrapped__ = func
+        return timed
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: summarize(values) for name, values in sorted(self.samples.items())}
@@ -0,0 +1,151 @@
+"""
+Peak memory of the bulk user and conversation scans as the tables grow
+Katta ro'yxatlarni o'qishda xotira sarfi: ORM .all() va oqimli (streaming) o'qish
+
+Seeds users and one bot's conversations up to each of --sizes rows and
+measures the peak Python allocation (tracemalloc) of:
+
+    orm_all_users            User.query...all() into dicts (how the e-mail audiences used to load)
+    get_all_users            marketing_service.get_all_users(), streamed
+    get_all_telegram_users   telegram_marketing_service.get_all_telegram_users(), streamed
+    check_trial_expiry       the scheduler job
+    broadcast_message        POST /bot/<id>/broadcast-message to every conversation (the bot has no
+                             platform tokens, so each send fails fast - no network, the scan is what's measured)
+
+Streamed paths should stay flat as the sizes grow; orm_all_users grows with them.
+
+Usage:
+    python -m benchmarks.streaming_memory --sizes 5000,20000,50000
+    python -m benchmarks.streaming_memory --database-url postgresql://... --output memory.json
+"""
+import gc
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.environment import prepare_environment
+
+BATCH_SIZE = 5_000
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Peak memory of bulk scans at growing table sizes")
+    parser.add_argument('--sizes', default='5000,20000,50000',
+                        help="Comma-separated user (and conversation) counts, ascending")
+    parser.add_argument('--database-url', default=None, help="Defaults to a temporary SQLite file")
+    parser.add_argument('--output', default=None, help="Write the JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def grow(db, owner_id, bot_id, start, stop):
+    """Add users and conversations numbered start..stop-1"""
+    from models import User, Conversation, AccessStatus
+
+    now = datetime.utcnow()
+    for first in range(start, stop, BATCH_SIZE):
+        numbers = range(first, min(first + BATCH_SIZE, stop))
+        db.session.execute(User.__table__.insert(), [{
+            'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': '-',
+            'full_name': f'Foydalanuvchi {i}', 'is_admin': False, 'is_active': True,
+            'access_status': AccessStatus.TRIAL, 'admin_approved': False, 'is_trial_active': True,
+            'trial_end_date': now - timedelta(days=1) if i % 2 else now + timedelta(days=2),
+            'telegram_chat_id': str(700000000 + i), 'marketing_opt_out': False, 'created_at': now,
+        } for i in numbers])
+        db.session.execute(Conversation.__table__.insert(), [{
+            'bot_id': bot_id, 'platform': 'telegram', 'platform_user_id': str(500000000 + i),
+            'platform_username': f'chat{i}', 'language': 'uz', 'is_active': True,
+            'created_at': now, 'updated_at': now, 'message_count': 0, 'unread_count': 0,
+        } for i in numbers])
+        db.session.commit()
+
+
+def measure(db, func):
+    """Peak traced allocation (KiB), duration and rows of one call"""
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        rows = func()
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        db.session.remove()
+    return {'peak_kib': round(peak / 1024), 'seconds': round(elapsed, 3), 'rows': rows}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    database_url = prepare_environment(args.database_url, 'streaming_memory_')
+
+    from app import app, db, limiter
+    from models import User, Bot, AccessStatus
+    from services.marketing_service import get_all_users
+    from services.telegram_marketing_service import get_all_telegram_users
+    from tasks.scheduler import check_trial_expiry
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    limiter.enabled = False
+    client = app.test_client()
+    results = {}
+
+    with app.app_context():
+        db.create_all()
+        owner = User(username='bench_owner', email='bench_owner@example.com', password_hash='-',
+                     is_admin=True, admin_approved=True, access_status=AccessStatus.APPROVED)
+        db.session.add(owner)
+        db.session.flush()
+        bot = Bot(user_id=owner.id, name='Broadcast bot')
+        db.session.add(bot)
+        db.session.commit()
+        owner_id, bot_id = owner.id, bot.id
+        with client.session_transaction() as session:
+            session['_user_id'] = str(owner_id)
+            session['_fresh'] = True
+
+        def orm_all_users():
+            users = User.query.filter(User.is_admin == False, User.email.isnot(None)).all()
+            return len([{'email': user.email, 'name': user.username or user.full_name} for user in users])
+
+        def broadcast():
+            response = client.post(f'/bot/{bot_id}/broadcast-message', data={'message': 'Yangi aksiya!'})
+            return response.get_json().get('error', '')[:60]
+
+        cases = [
+            ('orm_all_users', orm_all_users),
+            ('get_all_users', lambda: sum(1 for _ in get_all_users())),
+            ('get_all_telegram_users', lambda: sum(1 for _ in get_all_telegram_users())),
+            ('check_trial_expiry', lambda: check_trial_expiry()),
+            ('broadcast_message', broadcast),
+        ]
+
+        seeded = 0
+        print(f"database {database_url.split('@')[-1]}", file=sys.stderr)
+        for size in sizes:
+            print(f"seeding to {size}", file=sys.stderr)
+            grow(db, owner_id, bot_id, seeded, size)
+            seeded = size
+            for name, func in cases:
+                results.setdefault(name, {})[size] = measure(db, func)
+
+    print(f"\n{'peak KiB':<24}" + ''.join(f'{size:>12}' for size in sizes) + f"{'growth':>10}", file=sys.stderr)
+    for name, by_size in results.items():
+        peaks = [by_size[size]['peak_kib'] for size in sizes]
+        growth = peaks[-1] / peaks[0] if peaks[0] else float('inf')
+        print(f"{name:<24}" + ''.join(f'{peak:>12}' for peak in peaks) + f"{growth:>9.1f}x", file=sys.stderr)
+
+    output = json.dumps({'created_at': datetime.utcnow().isoformat(), 'sizes': sizes, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Webhook load benchmark against local fake upstreams
+Telegram (va Instagram) webhook'lariga realistik trafikni qayta yuborib, bosqichlar bo'yicha o'lchash
+
+Starts FakeUpstreams, points the services at it, seeds a bot in a throwaway
+database and replays generated Telegram updates (text in uz/ru/en, commands,
+language callbacks, optionally Instagram events) through the real webhook
+views with N concurrent clients. Reports throughput and latency percentiles
+per stage:
+
+    total   - whole webhook request; for Telegram, until the update has been
+              answered (the view acknowledges at once and hands it to the scheduler)
+    ai      - AIService.generate_response* (Gemini stand-in)
+    send    - Telegram/Instagram send, edit and callback calls
+    sql     - time inside SQL statement execution
+    commit  - db.session.commit() (includes the flush, so it overlaps sql)
+
+Usage:
+    python -m benchmarks.webhook_load --requests 1000 --concurrency 32 --gemini-latency-ms 800
+    python -m benchmarks.webhook_load --database-url postgresql://... --output report.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.environment import prepare_environment
+from benchmarks.fake_upstreams import FakeUpstreams, UpstreamProfile
+from benchmarks.stats import StageRecorder
+
+SAMPLE_MESSAGES = {
+    'uz': [
+        "Assalomu alaykum, narxlar qancha?",
+        "Yetkazib berish bormi Toshkent bo'ylab?",
+        "Ish vaqtingiz qanday?",
+        "Buyurtma qanday beriladi?",
+        "Rahmat, tushundim",
+    ],
+    'ru': [
+        "Здравствуйте, сколько стоит доставка?",
+        "Какой у вас график работы?",
+        "Можно оплатить картой?",
+        "Спасибо, понятно",
+    ],
+    'en': [
+        "Hello, what are your prices?",
+        "Do you deliver to Samarkand?",
+        "How can I place an order?",
+        "Thanks, that helps",
+    ],
+}
+COMMANDS = ['/start', '/help', '/til']
+CALLBACKS = ['lang_uz', 'lang_ru', 'lang_en']
+
+
+class TrafficGenerator:
+    """Deterministic stream of webhook payloads with a skewed (Zipf-like) chat distribution"""
+
+    def __init__(self, chats=200, command_ratio=0.05, callback_ratio=0.02,
+                 instagram_ratio=0.0, page_id='1784000000', seed=42):
+        self.rng = random.Random(seed)
+        self.chats = chats
+        self.command_ratio = command_ratio
+        self.callback_ratio = callback_ratio
+        self.instagram_ratio = instagram_ratio
+        self.page_id = page_id
+        self.update_id = 100000
+        # A few chats are very chatty, most send a message or two
+        self.weights = [1.0 / (rank + 1) for rank in range(chats)]
+
+    def _chat_id(self):
+        return 500000000 + self.rng.choices(range(self.chats), weights=self.weights)[0]
+
+    def _text(self):
+        language = self.rng.choices(['uz', 'ru', 'en'], weights=[6, 3, 1])[0]
+        return self.rng.choice(SAMPLE_MESSAGES[language])
+
+    def next(self):
+        """Return (platform, payload)"""
+        self.update_id += 1
+        chat_id = self._chat_id()
+        roll = self.rng.random()
+
+        if roll < self.instagram_ratio:
+            return 'instagram', {
+                'object': 'instagram',
+                'entry': [{
+                    'id': self.page_id,
+                    'time': int(time.time() * 1000),
+                    'messaging': [{
+                        'sender': {'id': str(chat_id)},
+                        'recipient': {'id': self.page_id},
+                        'timestamp': int(time.time() * 1000),
+                        'message': {'mid': f'mid.{self.update_id}', 'text': self._text()}
+                    }]
+                }]
+            }
+
+        sender = {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id % 1000}',
+                  'username': f'user{chat_id}'}
+        roll -= self.instagram_ratio
+        if roll < self.callback_ratio:
+            return 'telegram', {
+                'update_id': self.update_id,
+                'callback_query': {
+                    'id': str(self.update_id),
+                    'from': sender,
+                    'message': {'message_id': self.update_id, 'chat': {'id': chat_id, 'type': 'private'}},
+                    'data': self.rng.choice(CALLBACKS)
+                }
+            }
+
+        roll -= self.callback_ratio
+        text = self.rng.choice(COMMANDS) if roll < self.command_ratio else self._text()
+        return 'telegram', {
+            'update_id': self.update_id,
+            'message': {
+                'message_id': self.update_id,
+                'from': sender,
+                'chat': {'id': chat_id, 'type': 'private'},
+                'date': int(time.time()),
+                'text': text
+            }
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay webhook traffic against local fake upstreams")
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=20, help="Requests excluded from the report")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--command-ratio', type=float, default=0.05)
+    parser.add_argument('--callback-ratio', type=float, default=0.02)
+    parser.add_argument('--instagram-ratio', type=float, default=0.0)
+    parser.add_argument('--latency-ms', type=float, default=60.0, help="Telegram/Graph latency")
+    parser.add_argument('--gemini-latency-ms', type=float, default=800.0)
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--database-url', default=None, help="Defaults to a temporary SQLite file")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None, help="Write the JSON report to this file")
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+def seed_bot(db, page_id):
+    from models import User, Bot, AccessStatus
+
+    user = User(username=f'bench_{int(time.time())}', email=f'bench_{int(time.time())}@example.com',
+                password_hash='-', access_status=AccessStatus.APPROVED, admin_approved=True)
+    db.session.add(user)
+    db.session.flush()
+    bot = Bot(name='Benchmark Bot', user_id=user.id,
+              system_prompt="Siz do'kon yordamchisisiz. Qisqa javob bering.",
+              telegram_token='123456:BENCHMARK', instagram_token='IGBENCHMARK',
+              instagram_page_id=page_id)
+    db.session.add(bot)
+    db.session.commit()
+    return bot.id
+
+
+def instrument(recorder, db, handed_off):
+    """Time the stages by wrapping the real calls (the calls themselves still happen)
+
+    Telegram updates submitted by the calling thread's webhook are left in
+    handed_off.future, for the replay to wait on.
+    """
+    from sqlalchemy import event
+    import routes
+    from services.platform_service import TelegramService, InstagramService
+
+    routes.ai_service.generate_response = recorder.wrap('ai', routes.ai_service.generate_response)
+    routes.ai_service.generate_response_with_context = recorder.wrap(
+        'ai', routes.ai_service.generate_response_with_context)
+    for cls, methods in ((TelegramService, ('send_message', 'edit_message', 'answer_callback_query')),
+                         (InstagramService, ('send_message',))):
+        for name in methods:
+            setattr(cls, name, recorder.wrap('send', getattr(cls, name)))
+    db.session.commit = recorder.wrap('commit', db.session.commit)
+    # Telegram updates run on KeyedScheduler threads after the webhook returns: record them into its request
+    submit = routes.telegram_updates.submit
+
+    def submit_recorded(key, fn, *args, **kwargs):
+        handed_off.future = submit(key, recorder.hand_off(fn), *args, **kwargs)
+        return handed_off.future
+    routes.telegram_updates.submit = submit_recorded
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        context._bench_started = time.perf_counter()
+
+    @event.listens_for(db.engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        recorder.add('sql', time.perf_counter() - context._bench_started)
+
+
+def run(args):
+    profile = lambda latency: UpstreamProfile(latency, args.jitter_ms, args.error_rate)
+    upstreams = FakeUpstreams(telegram=profile(args.latency_ms), graph=profile(args.latency_ms),
+                              gemini=profile(args.gemini_latency_ms), seed=args.seed).start()
+    # Services read the API roots at construction time, so this precedes the app import
+    os.environ.update(upstreams.env())
+    prepare_environment(args.database_url, 'webhook_load_', args.log_level)
+
+    from app import app, db, limiter
+    from services.metrics import metrics
+
+    logging.getLogger().setLevel(args.log_level.upper())
+    # Every replayed request comes from 127.0.0.1; the per-IP webhook limit would cap the run
+    limiter.enabled = False
+
+    generator = TrafficGenerator(args.chats, args.command_ratio, args.callback_ratio,
+                                 args.instagram_ratio, seed=args.seed)
+    with app.app_context():
+        bot_id = seed_bot(db, generator.page_id)
+        recorder = StageRecorder()
+        handed_off = threading.local()
+        instrument(recorder, db, handed_off)
+
+    paths = {'telegram': f'/webhook/telegram/{bot_id}', 'instagram': f'/webhook/instagram/{bot_id}'}
+    payloads = [generator.next() for _ in range(args.warmup + args.requests)]
+    clients = threading.local()
+    statuses = Counter()
+    statuses_lock = threading.Lock()
+
+    def replay(item, measured=True):
+        platform, payload = item
+        client = getattr(clients, 'client', None)
+        if client is None:
+            client = clients.client = app.test_client()
+        recorder.begin()
+        handed_off.future = None
+        started = time.perf_counter()
+        response = client.post(paths[platform], json=payload)
+        status = response.status_code
+        if handed_off.future is not None:
+            try:
+                _, status = handed_off.future.result()
+            except Exception:
+                status = 500
+        elapsed = time.perf_counter() - started
+        if measured:
+            recorder.end(elapsed)
+            with statuses_lock:
+                statuses[f'{platform}:{status}'] += 1
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda item: replay(item, measured=False), payloads[:args.warmup]))
+        started = time.perf_counter()
+        list(pool.map(replay, payloads[args.warmup:]))
+        wall = time.perf_counter() - started
+
+    upstreams.stop()
+    counters = metrics.snapshot()['counters']
+    return {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'log_level')},
+        'database': os.environ['DATABASE_URL'].split('@')[-1],
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(args.requests / wall, 2) if wall else 0.0,
+        'status_codes': dict(sorted(statuses.items())),
+        'stages': recorder.report(),
+        'upstream_requests': upstreams.stats,
+        'ai_metrics': {key: value for key, value in counters.items() if key.startswith(('ai_', 'upstream_'))},
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+    return 0 if report['status_codes'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
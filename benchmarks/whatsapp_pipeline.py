@@ -0,0 +1,198 @@
+"""
+WhatsApp webhook and bulk send pipeline against local fake upstreams
+WhatsApp: kiruvchi xabarlar, shablon tarqatish va holat qayta qo'ng'iroqlari bo'yicha o'lchov
+
+Runs the whole WhatsApp path of the app with the Cloud API and Gemini
+replaced by FakeUpstreams:
+
+    verify     - the GET subscription handshake
+    inbound    - signed webhook deliveries with several senders each; reports
+                 the acknowledgement latency and how long the background
+                 batches took to answer everything
+    templates  - send_templates to many recipients (rate limited, pooled)
+    statuses   - sent/delivered/read callbacks for every message the fake API
+                 accepted, one webhook call each as Meta sends them; reports
+                 SQL statements per callback once the buffer is flushed
+
+Usage:
+    python -m benchmarks.whatsapp_pipeline --deliveries 50 --senders-per-delivery 4 --templates 1000
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.environment import prepare_environment
+from benchmarks.fake_upstreams import (FakeUpstreams, UpstreamProfile, whatsapp_message_payload,
+                                       whatsapp_status_payload)
+from benchmarks.stats import summarize
+
+PHONE_NUMBER_ID = '106540352242922'
+VERIFY_TOKEN = 'benchmark-verify'
+APP_SECRET = 'benchmark-secret'
+TEXTS = ["Assalomu alaykum, narxi qancha?", "Yetkazib berish bormi?", "Здравствуйте, есть доставка?",
+         "Ish vaqtingiz qanday?", "Do you ship to Samarkand?"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="WhatsApp webhook and bulk send benchmark")
+    parser.add_argument('--deliveries', type=int, default=40, help="Inbound webhook calls")
+    parser.add_argument('--senders-per-delivery', type=int, default=4)
+    parser.add_argument('--templates', type=int, default=500, help="Template recipients")
+    parser.add_argument('--concurrency', type=int, default=16, help="Webhook calls in flight")
+    parser.add_argument('--latency-ms', type=float, default=80.0, help="Cloud API latency")
+    parser.add_argument('--gemini-latency-ms', type=float, default=800.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Cloud API rate-limit responses")
+    parser.add_argument('--database-url', default=None, help="Defaults to a temporary SQLite file")
+    parser.add_argument('--timeout', type=float, default=120.0, help="Seconds to wait for background work")
+    return parser.parse_args(argv)
+
+
+def seed_bot(db):
+    from models import User, Bot, AccessStatus
+
+    user = User(username=f'wa_bench_{int(time.time())}', email=f'wa_bench_{int(time.time())}@example.com',
+                password_hash='-', access_status=AccessStatus.APPROVED, admin_approved=True)
+    db.session.add(user)
+    db.session.flush()
+    bot = Bot(name='WhatsApp Benchmark', user_id=user.id, system_prompt="Qisqa javob bering.",
+              whatsapp_token='WABENCHMARK', whatsapp_phone_number_id=PHONE_NUMBER_ID)
+    db.session.add(bot)
+    db.session.commit()
+    return bot.id
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    upstreams = FakeUpstreams(graph=UpstreamProfile(args.latency_ms, 20.0, args.error_rate),
+                              gemini=UpstreamProfile(args.gemini_latency_ms, 100.0), seed=42).start()
+    os.environ.update(upstreams.env())
+    os.environ['WHATSAPP_VERIFY_TOKEN'] = VERIFY_TOKEN
+    os.environ['WHATSAPP_APP_SECRET'] = APP_SECRET
+    prepare_environment(args.database_url, 'whatsapp_bench_')
+
+    from sqlalchemy import event
+    from app import app, db, limiter
+    from models import Bot, DeliveryStatus, Message, WhatsAppDelivery
+    from services.metrics import metrics
+    from services.whatsapp_batch import send_templates, whatsapp_batches
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # Every call comes from 127.0.0.1; the per-IP webhook limit would cap the run
+    limiter.enabled = False
+    statements = Counter()
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements['total'] += 1
+
+    with app.app_context():
+        bot_id = seed_bot(db)
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+    path = f'/webhook/whatsapp/{bot_id}'
+
+    clients = threading.local()
+
+    def post(payload):
+        client = getattr(clients, 'client', None)
+        if client is None:
+            client = clients.client = app.test_client()
+        body = json.dumps(payload).encode()
+        signature = 'sha256=' + hmac.new(APP_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        started = time.perf_counter()
+        response = client.post(path, data=body, content_type='application/json',
+                               headers={'X-Hub-Signature-256': signature})
+        return response.status_code, time.perf_counter() - started
+
+    report = {'config': {k: v for k, v in vars(args).items() if k != 'database_url'}}
+    client = app.test_client()
+    handshake = client.get(path, query_string={'hub.mode': 'subscribe', 'hub.verify_token': VERIFY_TOKEN,
+                                               'hub.challenge': '1158201444'})
+    wrong = client.get(path, query_string={'hub.mode': 'subscribe', 'hub.verify_token': 'wrong',
+                                           'hub.challenge': '1'})
+    report['verify'] = {'challenge_echoed': handshake.get_data(as_text=True) == '1158201444',
+                        'wrong_token_status': wrong.status_code}
+
+    # Inbound: each delivery carries messages from several senders
+    rng = random.Random(7)
+    specs = [[
+        (f'99890{rng.randrange(1000000):07d}', f'Mijoz {d}-{s}', rng.choice(TEXTS))
+        for s in range(args.senders_per_delivery)
+    ] for d in range(args.deliveries)]
+    deliveries = [whatsapp_message_payload(PHONE_NUMBER_ID, spec) for spec in specs]
+    expected = args.deliveries * args.senders_per_delivery
+    # A delivery is processed as one batch per sender
+    batches = sum(len({phone for phone, _, _ in spec}) for spec in specs)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(post, deliveries))
+    acked = time.perf_counter() - started
+    while metrics.get('whatsapp_batches_total') < batches and time.perf_counter() - started < args.timeout:
+        time.sleep(0.05)
+    answered = time.perf_counter() - started
+    with app.app_context():
+        stored = db.session.query(Message).count()
+    report['inbound'] = {
+        'messages': expected,
+        'status_codes': dict(Counter(code for code, _ in results)),
+        'ack': summarize([elapsed for _, elapsed in results]),
+        'all_acked_seconds': round(acked, 3),
+        'answered_seconds': round(answered, 3),
+        'messages_stored': stored,
+        'replies_sent': len(upstreams.whatsapp_sent),
+    }
+
+    # Templates: one bulk send through the pooled async client
+    recipients = [(f'99891{i:07d}', None) for i in range(args.templates)]
+    with app.app_context():
+        bot = db.session.get(Bot, bot_id)
+        started = time.perf_counter()
+        responses = send_templates(bot, recipients, 'hello_world', 'en_US')
+        elapsed = time.perf_counter() - started
+    sent = sum(1 for r in responses if not isinstance(r, Exception) and r.success)
+    report['templates'] = {'recipients': args.templates, 'sent': sent, 'seconds': round(elapsed, 3),
+                           'messages_per_second': round(args.templates / elapsed, 1)}
+
+    # Status callbacks: three per accepted message, one webhook call each
+    callbacks = [whatsapp_status_payload(PHONE_NUMBER_ID, [(wamid, to, status)])
+                 for status in ('sent', 'delivered', 'read') for wamid, to, _ in list(upstreams.whatsapp_sent)]
+    before = statements['total']
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(post, callbacks))
+    acked = time.perf_counter() - started
+    # Timer flushes ran during the calls; this writes what is still buffered
+    started = time.perf_counter()
+    changed = whatsapp_batches.flush_statuses()
+    flush_seconds = time.perf_counter() - started
+    status_statements = statements['total'] - before
+    with app.app_context():
+        by_status = Counter(status.value for (status,) in db.session.query(WhatsAppDelivery.status))
+    report['statuses'] = {
+        'callbacks': len(callbacks),
+        'status_codes': dict(Counter(code for code, _ in results)),
+        'ack': summarize([elapsed for _, elapsed in results]),
+        'all_acked_seconds': round(acked, 3),
+        'final_flush_seconds': round(flush_seconds, 3),
+        'final_flush_changed': changed,
+        # Webhook requests plus every flush
+        'sql_statements': status_statements,
+        'sql_statements_per_callback': round(status_statements / max(len(callbacks), 1), 3),
+        'deliveries_by_status': dict(by_status),
+    }
+
+    upstreams.stop()
+    report['upstream_requests'] = upstreams.stats
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0 if by_status.get(DeliveryStatus.READ.value) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Flask CLI commands
+Boshqaruv buyruqlari: `flask messages ...`, `flask telegram ...`
+"""
+import json
+import signal
+import asyncio
+
+import click
+from flask.cli import AppGroup
+
+messages_cli = AppGroup('messages', help="Message storage maintenance")
+telegram_cli = AppGroup('telegram', help="Telegram ingestion")
+
+
+@messages_cli.command('partition')
+@click.option('--batch-size', default=50000, show_default=True, help="Rows copied per transaction")
+def partition_command(batch_size):
+    """Convert messages to monthly partitions (Postgres) or rotate finished months (SQLite)"""
+    from services.message_partitions import message_partitions
+
+    if message_partitions.dialect == 'postgresql':
+        copied = message_partitions.convert(batch_size=batch_size)
+        created = message_partitions.ensure_partitions()
+        click.echo(f"Partitioned message table ready: {copied} rows copied, "
+                   f"{len(created)} new partitions")
+    else:
+        moved = message_partitions.rotate()
+        click.echo(f"Rotated {moved} messages into monthly tables")
+
+
+@messages_cli.command('partitions')
+def partitions_command():
+    """List message partitions with row counts"""
+    from sqlalchemy import func, select
+    from app import db
+    from services.message_partitions import message_partitions
+
+    partitions = message_partitions.list_partitions()
+    if not partitions:
+        click.echo("No message partitions")
+        return
+    for partition in partitions:
+        table = message_partitions.table(partition.name)
+        rows = db.session.execute(select(func.count()).select_from(table)).scalar()
+        click.echo(f"{partition.name}  {partition.start:%Y-%m-%d} .. {partition.end:%Y-%m-%d}  {rows} rows")
+
+
+@messages_cli.command('retention')
+def retention_command():
+    """Run the message retention job now"""
+    from tasks.retention import RetentionEngine
+
+    progress = RetentionEngine().run()
+    click.echo(json.dumps(progress, indent=2))
+
+
+@messages_cli.command('summaries')
+@click.option('--batch-size', default=500, show_default=True, help="Conversations updated per transaction")
+def summaries_command(batch_size):
+    """Rebuild the conversations' message summaries (count, last message) from stored messages"""
+    from services.conversations import backfill_summaries
+
+    updated = backfill_summaries(batch_size=batch_size)
+    click.echo(f"Rebuilt summaries of {updated} conversations")
+
+
+@telegram_cli.command('poll')
+@click.option('--timeout', type=int, default=None, help="getUpdates long-poll seconds (TELEGRAM_POLL_TIMEOUT_SECONDS)")
+@click.option('--workers', type=int, default=None, help="Threads for offset reads and batches (TELEGRAM_POLL_WORKERS)")
+def poll_command(timeout, workers):
+    """Long-poll getUpdates for every connected bot until SIGTERM/SIGINT"""
+    from services.telegram_poller import TelegramPoller, polling_enabled
+
+    if not polling_enabled():
+        raise click.ClickException("Set TELEGRAM_INGESTION=polling first: bots deployed in webhook mode "
+                                   "would have their webhooks removed")
+
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        await TelegramPoller(poll_timeout=timeout, workers=workers).run(stop)
+
+    click.echo("Polling Telegram updates (Ctrl+C to stop)")
+    asyncio.run(main())
@@ -9,7 +9,10 @@ backlog = 2048
 
 # Worker processes - Use WEB_CONCURRENCY if available (for Render deployment)
 workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
-worker_class = "sync"
+# Threads, so live-inbox streams (/bot/<id>/events) do not pin whole workers; at most
+# CHANGE_FEED_MAX_STREAMS of a worker's threads wait on streams, the rest stay for requests
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
 worker_connections = 1000
 timeout = 30
 keepalive = 2
@@ -0,0 +1,47 @@
+"""Conversation.last_customer_message_at
+
+Revision ID: 2d6e9a4c7b10
+Revises: f06b4d2c9e81
+Create Date: 2026-10-19 10:10:00.000000
+
+Filled from the `message` table here (on Postgres its partitions included);
+on SQLite, months already rotated out are covered by
+`flask --app main messages summaries`.
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2d6e9a4c7b10'
+down_revision = 'f06b4d2c9e81'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.migration')
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if 'last_customer_message_at' in _columns('conversation'):
+        return
+    op.add_column('conversation', sa.Column('last_customer_message_at', sa.DateTime(), nullable=True))
+
+    conversation = sa.table('conversation', sa.column('id'), sa.column('last_customer_message_at'))
+    message = sa.table('message', sa.column('conversation_id'), sa.column('is_from_user'), sa.column('created_at'))
+    latest = sa.select(sa.func.max(message.c.created_at)).where(
+        message.c.conversation_id == conversation.c.id, message.c.is_from_user.is_(True)
+    ).scalar_subquery()
+    result = op.get_bind().execute(sa.update(conversation).values(last_customer_message_at=latest))
+    logger.info(f"Last customer message time filled for {result.rowcount} conversations")
+
+
+def downgrade():
+    with op.batch_alter_table('conversation') as batch_op:
+        batch_op.drop_column('last_customer_message_at')
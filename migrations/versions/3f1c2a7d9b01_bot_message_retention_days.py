@@ -0,0 +1,31 @@
+"""Bot.message_retention_days
+
+Revision ID: 3f1c2a7d9b01
+Revises:
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9b01'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    # NULL = the MESSAGE_RETENTION_DAYS default, 0 = keep forever
+    if 'message_retention_days' not in _columns('bot'):
+        op.add_column('bot', sa.Column('message_retention_days', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('bot') as batch_op:
+        batch_op.drop_column('message_retention_days')
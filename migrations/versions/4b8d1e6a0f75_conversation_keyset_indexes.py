@@ -0,0 +1,33 @@
+"""Keyset pagination indexes of conversations and messages
+
+Revision ID: 4b8d1e6a0f75
+Revises: d27c5f8e1a93
+Create Date: 2026-10-19 09:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8d1e6a0f75'
+down_revision = 'd27c5f8e1a93'
+branch_labels = None
+depends_on = None
+
+
+def _indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    if 'ix_conversation_bot_updated' not in _indexes('conversation'):
+        op.create_index('ix_conversation_bot_updated', 'conversation', ['bot_id', 'updated_at', 'id'])
+    # `flask messages partition` creates it itself on the partitioned table
+    if 'ix_message_conversation_id' not in _indexes('message'):
+        op.create_index('ix_message_conversation_id', 'message', ['conversation_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_message_conversation_id', table_name='message')
+    op.drop_index('ix_conversation_bot_updated', table_name='conversation')
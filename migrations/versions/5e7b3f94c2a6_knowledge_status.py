@@ -0,0 +1,44 @@
+"""KnowledgeBase background processing status
+
+Revision ID: 5e7b3f94c2a6
+Revises: c52d9e0b4a18
+Create Date: 2026-10-19 09:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7b3f94c2a6'
+down_revision = 'c52d9e0b4a18'
+branch_labels = None
+depends_on = None
+
+knowledge_status = sa.Enum('QUEUED', 'PROCESSING', 'INDEXED', 'FAILED', name='knowledgestatus')
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if 'status' in _columns('knowledge_base'):
+        return
+    knowledge_status.create(op.get_bind(), checkfirst=True)
+    op.add_column('knowledge_base', sa.Column('status', knowledge_status, nullable=True))
+    op.add_column('knowledge_base', sa.Column('progress', sa.Integer(), nullable=True))
+    op.add_column('knowledge_base', sa.Column('error_message', sa.String(length=500), nullable=True))
+    op.add_column('knowledge_base', sa.Column('status_updated_at', sa.DateTime(), nullable=True))
+    # Files uploaded so far were processed inline: they are indexed (searchable_files
+    # compares status, which a NULL would fail)
+    op.execute("UPDATE knowledge_base SET status = 'INDEXED', progress = 100, status_updated_at = created_at")
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_base') as batch_op:
+        batch_op.drop_column('status_updated_at')
+        batch_op.drop_column('error_message')
+        batch_op.drop_column('progress')
+        batch_op.drop_column('status')
+    knowledge_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,37 @@
+"""Bot.notification_mode
+
+Revision ID: 71d8b2e5f603
+Revises: e19a0c6d7b45
+Create Date: 2026-10-19 09:25:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '71d8b2e5f603'
+down_revision = 'e19a0c6d7b45'
+branch_labels = None
+depends_on = None
+
+notification_mode = sa.Enum('IMMEDIATE', 'BATCHED', 'DIGEST', name='notificationmode')
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if 'notification_mode' in _columns('bot'):
+        return
+    notification_mode.create(op.get_bind(), checkfirst=True)
+    op.add_column('bot', sa.Column('notification_mode', notification_mode, nullable=True))
+    # Existing bots keep notifying after every conversation
+    op.execute("UPDATE bot SET notification_mode = 'IMMEDIATE'")
+
+
+def downgrade():
+    with op.batch_alter_table('bot') as batch_op:
+        batch_op.drop_column('notification_mode')
+    notification_mode.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,30 @@
+"""Index of conversations by the customer's last message
+
+Revision ID: 7e1f3b5a9c24
+Revises: 2d6e9a4c7b10
+Create Date: 2026-10-19 10:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e1f3b5a9c24'
+down_revision = '2d6e9a4c7b10'
+branch_labels = None
+depends_on = None
+
+
+def _indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    if 'ix_conversation_bot_customer_message' not in _indexes('conversation'):
+        op.create_index('ix_conversation_bot_customer_message', 'conversation',
+                        ['bot_id', 'last_customer_message_at'])
+
+
+def downgrade():
+    op.drop_index('ix_conversation_bot_customer_message', table_name='conversation')
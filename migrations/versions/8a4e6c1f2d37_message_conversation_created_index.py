@@ -0,0 +1,30 @@
+"""Message history index (conversation_id, created_at)
+
+Revision ID: 8a4e6c1f2d37
+Revises: 3f1c2a7d9b01
+Create Date: 2026-10-19 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e6c1f2d37'
+down_revision = '3f1c2a7d9b01'
+branch_labels = None
+depends_on = None
+
+
+def _indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    # `flask messages partition` creates it itself on the partitioned table
+    if 'ix_message_conversation_created' not in _indexes('message'):
+        op.create_index('ix_message_conversation_created', 'message', ['conversation_id', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_message_conversation_created', table_name='message')
@@ -0,0 +1,48 @@
+"""Message summary columns of conversations
+
+Revision ID: 9c3a7f2e4d58
+Revises: 4b8d1e6a0f75
+Create Date: 2026-10-19 09:50:00.000000
+
+The columns start empty: run `flask --app main messages summaries` after
+upgrading to fill them from the stored messages.
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3a7f2e4d58'
+down_revision = '4b8d1e6a0f75'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.migration')
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    columns = _columns('conversation')
+    if 'message_count' in columns:
+        return
+    if 'last_message_at' not in columns:
+        op.add_column('conversation', sa.Column('last_message_at', sa.DateTime(), nullable=True))
+        op.add_column('conversation', sa.Column('last_message_preview', sa.String(length=200), nullable=True))
+    # NOT NULL on a table with rows needs a server default
+    op.add_column('conversation', sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('conversation', sa.Column('unread_count', sa.Integer(), nullable=False, server_default='0'))
+    logger.info("Conversation summaries are empty: run `flask --app main messages summaries`")
+
+
+def downgrade():
+    with op.batch_alter_table('conversation') as batch_op:
+        batch_op.drop_column('unread_count')
+        batch_op.drop_column('message_count')
+        batch_op.drop_column('last_message_preview')
+        batch_op.drop_column('last_message_at')
@@ -0,0 +1,31 @@
+"""Bot.whatsapp_phone_number_id
+
+Revision ID: a6f04d3c8e29
+Revises: 71d8b2e5f603
+Create Date: 2026-10-19 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6f04d3c8e29'
+down_revision = '71d8b2e5f603'
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    # Cloud API sender number; the whatsapp_delivery table is new and comes from create_all
+    if 'whatsapp_phone_number_id' not in _columns('bot'):
+        op.add_column('bot', sa.Column('whatsapp_phone_number_id', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('bot') as batch_op:
+        batch_op.drop_column('whatsapp_phone_number_id')
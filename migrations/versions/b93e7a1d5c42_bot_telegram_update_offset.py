@@ -0,0 +1,31 @@
+"""Bot.telegram_update_offset
+
+Revision ID: b93e7a1d5c42
+Revises: a6f04d3c8e29
+Create Date: 2026-10-19 09:35:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b93e7a1d5c42'
+down_revision = 'a6f04d3c8e29'
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    # Next getUpdates offset of long-polling ingestion; NULL until the first poll
+    if 'telegram_update_offset' not in _columns('bot'):
+        op.add_column('bot', sa.Column('telegram_update_offset', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('bot') as batch_op:
+        batch_op.drop_column('telegram_update_offset')
@@ -0,0 +1,105 @@
+"""KnowledgeBase.chunk_count, and chunks for files uploaded before chunking
+
+Revision ID: c52d9e0b4a18
+Revises: 8a4e6c1f2d37
+Create Date: 2026-10-19 09:10:00.000000
+
+"""
+import os
+import zlib
+import hashlib
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52d9e0b4a18'
+down_revision = '8a4e6c1f2d37'
+branch_labels = None
+depends_on = None
+
+CHUNK_CHARS = int(os.environ.get("KNOWLEDGE_CHUNK_CHARS", 1500))
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _chunk_pieces(pieces, max_chars=CHUNK_CHARS):
+    # Frozen copy of services.knowledge_ingest.chunk_pieces as of this revision,
+    # so later changes to the ingest do not change what this backfill writes
+    target_chars = max(max_chars // 2, 1)
+    min_chars = max_chars // 8
+    parts = []
+    size = 0
+    for piece in pieces:
+        piece = piece.strip()
+        if not piece:
+            continue
+
+        while len(piece) > max_chars:
+            cut = piece.rfind(' ', 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if parts:
+                yield '\n'.join(parts)
+                parts, size = [], 0
+            yield piece[:cut].rstrip()
+            piece = piece[cut:].lstrip()
+        if not piece:
+            continue
+
+        if parts and size + len(piece) + 1 > max_chars:
+            yield '\n'.join(parts)
+            parts, size = [], 0
+        parts.append(piece)
+        size += len(piece) + 1
+
+        if size >= min_chars and zlib.crc32(piece.encode('utf-8')) % target_chars < len(piece):
+            yield '\n'.join(parts)
+            parts, size = [], 0
+
+    if parts:
+        yield '\n'.join(parts)
+
+
+def upgrade():
+    if 'chunk_count' in _columns('knowledge_base'):
+        return
+    op.add_column('knowledge_base', sa.Column('chunk_count', sa.Integer(), nullable=True))
+
+    # Files uploaded before chunking kept their whole text in knowledge_base.content;
+    # chunk it the way the ingest does, or search_chunks would never find them
+    bind = op.get_bind()
+    has_hash = 'content_hash' in _columns('knowledge_chunk')
+    chunk = sa.table('knowledge_chunk', sa.column('knowledge_base_id'), sa.column('bot_id'),
+                     sa.column('position'), sa.column('content'), sa.column('created_at'),
+                     *([sa.column('content_hash')] if has_hash else []))
+    ids = bind.execute(sa.text(
+        "SELECT id FROM knowledge_base WHERE content IS NOT NULL ORDER BY id"
+    )).scalars().all()
+    for kb_id in ids:
+        bot_id, content = bind.execute(sa.text(
+            "SELECT bot_id, content FROM knowledge_base WHERE id = :id"
+        ), {'id': kb_id}).one()
+        now = datetime.utcnow()
+        rows = [dict({'knowledge_base_id': kb_id, 'bot_id': bot_id, 'position': position,
+                      'content': text, 'created_at': now},
+                     **({'content_hash': _content_hash(text)} if has_hash else {}))
+                for position, text in enumerate(_chunk_pieces(content.splitlines()))]
+        if rows:
+            bind.execute(chunk.insert(), rows)
+        bind.execute(sa.text("UPDATE knowledge_base SET chunk_count = :count WHERE id = :id"),
+                     {'count': len(rows), 'id': kb_id})
+    op.execute("UPDATE knowledge_base SET chunk_count = 0 WHERE chunk_count IS NULL")
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_base') as batch_op:
+        batch_op.drop_column('chunk_count')
@@ -0,0 +1,107 @@
+"""Unique conversation per (bot_id, platform, platform_user_id)
+
+Revision ID: d27c5f8e1a93
+Revises: b93e7a1d5c42
+Create Date: 2026-10-19 09:40:00.000000
+
+The old lookup-then-insert could create two conversations for one user when
+their first messages arrived together. Those are merged into the oldest one
+(every table with a conversation_id column is repointed) before the key is
+added.
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd27c5f8e1a93'
+down_revision = 'b93e7a1d5c42'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.migration')
+
+NAME = 'uq_conversation_platform_user'
+KEY_COLUMNS = ['bot_id', 'platform', 'platform_user_id']
+
+
+def _has_key(inspector):
+    keys = [constraint['column_names'] for constraint in inspector.get_unique_constraints('conversation')]
+    keys += [index['column_names'] for index in inspector.get_indexes('conversation') if index['unique']]
+    return any(set(columns) == set(KEY_COLUMNS) for columns in keys)
+
+
+def _merge_duplicates(bind, inspector):
+    referencing = [table for table in inspector.get_table_names()
+                   if table != 'conversation'
+                   and 'conversation_id' in {column['name'] for column in inspector.get_columns(table)}]
+    columns = {column['name'] for column in inspector.get_columns('conversation')}
+    summary = 'message_count' in columns
+
+    groups = bind.execute(sa.text(
+        "SELECT bot_id, platform, platform_user_id FROM conversation "
+        "GROUP BY bot_id, platform, platform_user_id HAVING count(*) > 1"
+    )).all()
+    for bot_id, platform, platform_user_id in groups:
+        ids = bind.execute(sa.text(
+            "SELECT id FROM conversation WHERE bot_id = :bot_id AND platform = :platform "
+            "AND platform_user_id = :user ORDER BY id"
+        ), {'bot_id': bot_id, 'platform': platform, 'user': platform_user_id}).scalars().all()
+        keep, duplicates = ids[0], ids[1:]
+        params = {'keep': keep, 'duplicates': duplicates}
+        expanding = sa.bindparam('duplicates', expanding=True)
+
+        for table in referencing:
+            bind.execute(sa.text(f"UPDATE {table} SET conversation_id = :keep "
+                                 f"WHERE conversation_id IN :duplicates").bindparams(expanding), params)
+        bind.execute(sa.text(
+            "UPDATE conversation SET updated_at = (SELECT max(updated_at) FROM conversation "
+            "WHERE id = :keep OR id IN :duplicates) WHERE id = :keep"
+        ).bindparams(expanding), params)
+        if summary:
+            bind.execute(sa.text(
+                "UPDATE conversation SET "
+                "message_count = (SELECT sum(message_count) FROM conversation WHERE id = :keep OR id IN :duplicates), "
+                "unread_count = (SELECT sum(unread_count) FROM conversation WHERE id = :keep OR id IN :duplicates) "
+                "WHERE id = :keep"
+            ).bindparams(expanding), params)
+            latest = bind.execute(sa.text(
+                "SELECT last_message_at, last_message_preview FROM conversation "
+                "WHERE (id = :keep OR id IN :duplicates) AND last_message_at IS NOT NULL "
+                "ORDER BY last_message_at DESC LIMIT 1"
+            ).bindparams(expanding), params).first()
+            if latest:
+                bind.execute(sa.text(
+                    "UPDATE conversation SET last_message_at = :at, last_message_preview = :preview WHERE id = :keep"
+                ), {'at': latest.last_message_at, 'preview': latest.last_message_preview, 'keep': keep})
+        bind.execute(sa.text("DELETE FROM conversation WHERE id IN :duplicates").bindparams(expanding), params)
+    return len(groups)
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if _has_key(inspector):
+        return
+    if bind.dialect.name == 'postgresql':
+        # No new duplicates between the merge and the constraint
+        op.execute("LOCK TABLE conversation IN SHARE ROW EXCLUSIVE MODE")
+    merged = _merge_duplicates(bind, inspector)
+    if merged:
+        logger.info(f"Merged duplicate conversations of {merged} users")
+
+    if bind.dialect.name == 'sqlite':
+        # A unique index serves ON CONFLICT just as well, without rebuilding the table
+        op.create_index(NAME, 'conversation', KEY_COLUMNS, unique=True)
+    else:
+        op.create_unique_constraint(NAME, 'conversation', KEY_COLUMNS)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.drop_index(NAME, table_name='conversation')
+    else:
+        op.drop_constraint(NAME, 'conversation', type_='unique')
@@ -0,0 +1,62 @@
+"""KnowledgeBase.version and content hashes of chunks and catalog rows
+
+Revision ID: e19a0c6d7b45
+Revises: 5e7b3f94c2a6
+Create Date: 2026-10-19 09:20:00.000000
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e19a0c6d7b45'
+down_revision = '5e7b3f94c2a6'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def upgrade():
+    if 'version' not in _columns('knowledge_base'):
+        op.add_column('knowledge_base', sa.Column('version', sa.Integer(), nullable=True))
+        op.execute("UPDATE knowledge_base SET version = 1")
+    if 'content_hash' not in _columns('catalog_item'):
+        # Rows without a hash are simply not reused by the next re-index
+        op.add_column('catalog_item', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    if 'content_hash' not in _columns('knowledge_chunk'):
+        op.add_column('knowledge_chunk', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+    # Hash existing chunks, so re-uploading an unchanged file reuses them
+    bind = op.get_bind()
+    last = 0
+    while True:
+        rows = bind.execute(sa.text(
+            "SELECT id, content FROM knowledge_chunk WHERE content_hash IS NULL AND id > :last "
+            "ORDER BY id LIMIT :limit"
+        ), {'last': last, 'limit': BATCH_SIZE}).all()
+        if not rows:
+            break
+        bind.execute(sa.text("UPDATE knowledge_chunk SET content_hash = :hash WHERE id = :id"),
+                     [{'id': row.id, 'hash': _content_hash(row.content)} for row in rows])
+        last = rows[-1].id
+
+
+def downgrade():
+    with op.batch_alter_table('knowledge_chunk') as batch_op:
+        batch_op.drop_column('content_hash')
+    with op.batch_alter_table('catalog_item') as batch_op:
+        batch_op.drop_column('content_hash')
+    with op.batch_alter_table('knowledge_base') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,89 @@
+"""Casefolded search text and full-text index of knowledge chunks
+
+Revision ID: f06b4d2c9e81
+Revises: 9c3a7f2e4d58
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f06b4d2c9e81'
+down_revision = '9c3a7f2e4d58'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.migration')
+
+BATCH_SIZE = 1000
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_chunk_fts USING fts5("
+    "search_text, content='knowledge_chunk', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS knowledge_chunk_fts_insert AFTER INSERT ON knowledge_chunk BEGIN "
+    "INSERT INTO knowledge_chunk_fts (rowid, search_text) VALUES (new.id, new.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS knowledge_chunk_fts_delete AFTER DELETE ON knowledge_chunk BEGIN "
+    "INSERT INTO knowledge_chunk_fts (knowledge_chunk_fts, rowid, search_text) "
+    "VALUES ('delete', old.id, old.search_text); END",
+    "CREATE TRIGGER IF NOT EXISTS knowledge_chunk_fts_update AFTER UPDATE OF search_text ON knowledge_chunk BEGIN "
+    "INSERT INTO knowledge_chunk_fts (knowledge_chunk_fts, rowid, search_text) "
+    "VALUES ('delete', old.id, old.search_text); "
+    "INSERT INTO knowledge_chunk_fts (rowid, search_text) VALUES (new.id, new.search_text); END",
+]
+POSTGRES_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_knowledge_chunk_search ON knowledge_chunk "
+    "USING gin (to_tsvector('simple', coalesce(search_text, '')))",
+]
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    bind = op.get_bind()
+    if 'search_text' not in _columns('knowledge_chunk'):
+        op.add_column('knowledge_chunk', sa.Column('search_text', sa.Text(), nullable=True))
+
+    # Python's casefold, not SQL lower(): SQLite's only folds ASCII
+    last = 0
+    while True:
+        rows = bind.execute(sa.text(
+            "SELECT id, content FROM knowledge_chunk WHERE search_text IS NULL AND id > :last "
+            "ORDER BY id LIMIT :limit"
+        ), {'last': last, 'limit': BATCH_SIZE}).all()
+        if not rows:
+            break
+        bind.execute(sa.text("UPDATE knowledge_chunk SET search_text = :search_text WHERE id = :id"),
+                     [{'id': row.id, 'search_text': row.content.casefold()} for row in rows])
+        last = rows[-1].id
+
+    if bind.dialect.name == 'postgresql':
+        for statement in POSTGRES_DDL:
+            op.execute(statement)
+    elif bind.dialect.name == 'sqlite':
+        if sa.inspect(bind).has_table('knowledge_chunk_fts'):
+            return
+        try:
+            for statement in SQLITE_DDL:
+                op.execute(statement)
+        except sa.exc.OperationalError as e:
+            logger.warning(f"SQLite has no FTS5, knowledge search will scan chunks: {e}")
+            return
+        op.execute("INSERT INTO knowledge_chunk_fts (knowledge_chunk_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_knowledge_chunk_search")
+    elif bind.dialect.name == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            op.execute(f"DROP TRIGGER IF EXISTS knowledge_chunk_fts_{trigger}")
+        op.execute("DROP TABLE IF EXISTS knowledge_chunk_fts")
+    with op.batch_alter_table('knowledge_chunk') as batch_op:
+        batch_op.drop_column('search_text')
@@ -1,7 +1,11 @@
 from datetime import datetime, timedelta
 from app import db
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.hybrid import hybrid_property
 from flask_login import UserMixin
 import enum
+import logging
 
 class AccessStatus(enum.Enum):
     TRIAL = "trial"           # 3 kunlik sinov
@@ -31,6 +35,25 @@ class NotificationStatus(enum.Enum):
     SENT = "sent"
     FAILED = "failed"
 
+class NotificationMode(enum.Enum):
+    IMMEDIATE = "immediate"     # Har bir suhbatdan keyin (darhol)
+    BATCHED = "batched"         # Bir necha soniyada bir marta, birlashtirilgan
+    DIGEST = "digest"           # Soatlik hisobot
+
+class KnowledgeStatus(enum.Enum):
+    QUEUED = "queued"           # Yuklangan, navbatda
+    PROCESSING = "processing"   # Fonda qayta ishlanmoqda
+    INDEXED = "indexed"         # Tayyor
+    FAILED = "failed"           # Xatolik
+
+class DeliveryStatus(enum.Enum):
+    # Order matters: a status callback never moves a delivery backwards
+    ACCEPTED = "accepted"       # API qabul qildi
+    SENT = "sent"               # Yuborildi
+    DELIVERED = "delivered"     # Yetkazildi
+    READ = "read"               # O'qildi
+    FAILED = "failed"           # Yetkazilmadi
+
 class NotificationType(enum.Enum):
     GENERAL = "general"
     SUBSCRIPTION = "subscription"
@@ -75,7 +98,8 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
     
-    @property
+    # Hybrid: User.is_active also works in queries (a plain property compared as False there)
+    @hybrid_property
     def is_active(self):
         return self._is_active
     
@@ -194,17 +218,21 @@ class Bot(db.Model):
     # Platform integrations
     telegram_token = db.Column(db.String(500))
     telegram_webhook_url = db.Column(db.String(300))
+    telegram_update_offset = db.Column(db.BigInteger)  # Next getUpdates offset (polling ingestion)
     whatsapp_token = db.Column(db.String(500))
+    whatsapp_phone_number_id = db.Column(db.String(100))  # Cloud API sender number
     instagram_token = db.Column(db.String(500))
     instagram_page_id = db.Column(db.String(100))
     
     # Monitoring settings
     admin_chat_id = db.Column(db.String(100))  # Admin's personal Telegram chat ID
     notification_channel = db.Column(db.String(100))  # Telegram channel for team notifications
+    notification_mode = db.Column(db.Enum(NotificationMode), default=NotificationMode.IMMEDIATE)
     
     # Settings
     is_active = db.Column(db.Boolean, default=True)
     max_daily_messages = db.Column(db.Integer, default=100)
+    message_retention_days = db.Column(db.Integer)  # None = MESSAGE_RETENTION_DAYS, 0 = keep forever
     
     # Metadata
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -233,9 +261,26 @@ class Conversation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Message summary, kept current on every Message insert (services/conversations.py)
+    last_message_at = db.Column(db.DateTime)
+    last_message_preview = db.Column(db.String(200))
+    message_count = db.Column(db.Integer, default=0, nullable=False)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    # Latest customer message: WhatsApp's 24-hour window runs from it, not from our own sends
+    last_customer_message_at = db.Column(db.DateTime)
+    
     # Relationships
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (
+        # One conversation per platform user; services/conversations.py upserts against it
+        db.UniqueConstraint('bot_id', 'platform', 'platform_user_id', name='uq_conversation_platform_user'),
+        # Keyset pages of a bot's conversations, most recently active first
+        db.Index('ix_conversation_bot_updated', 'bot_id', 'updated_at', 'id'),
+        # Hourly digests: a bot's conversations customers wrote to in the period
+        db.Index('ix_conversation_bot_customer_message', 'bot_id', 'last_customer_message_at'),
+    )
+    
     def __repr__(self):
         return f'<Conversation {self.platform}:{self.platform_user_id}>'
 
@@ -255,6 +300,13 @@ class Message(db.Model):
     # Metadata
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # History fetch: latest messages of one conversation
+        db.Index('ix_message_conversation_created', 'conversation_id', 'created_at'),
+        # Keyset pages (before_id / after_id) of one conversation
+        db.Index('ix_message_conversation_id', 'conversation_id', 'id'),
+    )
+    
     def __repr__(self):
         return f'<Message {self.id}>'
 
@@ -268,17 +320,182 @@ class KnowledgeBase(db.Model):
     file_type = db.Column(db.String(50), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
     
-    # Content
+    # Content (preview only - the full text lives in KnowledgeChunk rows)
     content = db.Column(db.Text)
     summary = db.Column(db.Text)
+    chunk_count = db.Column(db.Integer, default=0)
+    version = db.Column(db.Integer, default=1)  # Bumped by every re-upload or text edit
+    
+    # Background processing
+    status = db.Column(db.Enum(KnowledgeStatus), default=KnowledgeStatus.INDEXED)
+    progress = db.Column(db.Integer, default=0)  # 0-100
+    error_message = db.Column(db.String(500))
+    status_updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Metadata
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
     
+    # Relationships
+    chunks = db.relationship('KnowledgeChunk', backref='knowledge_base', lazy=True, cascade='all, delete-orphan')
+    catalog_items = db.relationship('CatalogItem', backref='knowledge_base', lazy=True, cascade='all, delete-orphan')
+    versions = db.relationship('KnowledgeVersion', backref='knowledge_base', lazy=True, cascade='all, delete-orphan',
+                               order_by='KnowledgeVersion.version')
+    
+    @property
+    def is_pending(self):
+        return self.status in (KnowledgeStatus.QUEUED, KnowledgeStatus.PROCESSING)
+    
+    def to_status_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status.value if self.status else KnowledgeStatus.INDEXED.value,
+            'progress': self.progress or 0,
+            'chunk_count': self.chunk_count or 0,
+            'version': self.version or 1,
+            'error': self.error_message
+        }
+    
     def __repr__(self):
         return f'<KnowledgeBase {self.original_filename}>'
 
+class KnowledgeChunk(db.Model):
+    """Bilim bazasi bo'lagi - retrieval unit of an ingested knowledge file"""
+    id = db.Column(db.Integer, primary_key=True)
+    knowledge_base_id = db.Column(db.Integer, db.ForeignKey('knowledge_base.id'), nullable=False)
+    bot_id = db.Column(db.Integer, db.ForeignKey('bot.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    content_hash = db.Column(db.String(64))  # sha256 of content - unchanged chunks are reused
+    search_text = db.Column(db.Text)  # content.casefold() - the full-text index reads this
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_knowledge_chunk_kb_position', 'knowledge_base_id', 'position'),
+    )
+    
+    def __repr__(self):
+        return f'<KnowledgeChunk {self.knowledge_base_id}:{self.position}>'
+
+# Full-text index of KnowledgeChunk.search_text (services/knowledge_ingest.search_chunks):
+# an FTS5 table kept in sync by triggers on SQLite, a GIN tsvector index on Postgres.
+# New tables get it here; existing ones from the migration.
+KNOWLEDGE_CHUNK_SEARCH_DDL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_chunk_fts USING fts5("
+        "search_text, content='knowledge_chunk', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        "CREATE TRIGGER IF NOT EXISTS knowledge_chunk_fts_insert AFTER INSERT ON knowledge_chunk BEGIN "
+        "INSERT INTO knowledge_chunk_fts (rowid, search_text) VALUES (new.id, new.search_text); END",
+        "CREATE TRIGGER IF NOT EXISTS knowledge_chunk_fts_delete AFTER DELETE ON knowledge_chunk BEGIN "
+        "INSERT INTO knowledge_chunk_fts (knowledge_chunk_fts, rowid, search_text) "
+        "VALUES ('delete', old.id, old.search_text); END",
+        "CREATE TRIGGER IF NOT EXISTS knowledge_chunk_fts_update AFTER UPDATE OF search_text ON knowledge_chunk BEGIN "
+        "INSERT INTO knowledge_chunk_fts (knowledge_chunk_fts, rowid, search_text) "
+        "VALUES ('delete', old.id, old.search_text); "
+        "INSERT INTO knowledge_chunk_fts (rowid, search_text) VALUES (new.id, new.search_text); END",
+    ],
+    'postgresql': [
+        "CREATE INDEX IF NOT EXISTS ix_knowledge_chunk_search ON knowledge_chunk "
+        "USING gin (to_tsvector('simple', coalesce(search_text, '')))",
+    ],
+}
+
+@event.listens_for(KnowledgeChunk.__table__, 'after_create')
+def create_knowledge_chunk_search_index(target, connection, **kw):
+    try:
+        for statement in KNOWLEDGE_CHUNK_SEARCH_DDL.get(connection.dialect.name, []):
+            connection.exec_driver_sql(statement)
+    except OperationalError as e:
+        # SQLite built without FTS5: search_chunks falls back to LIKE
+        logging.warning(f"Knowledge full-text index not created: {e}")
+
+class KnowledgeVersion(db.Model):
+    """Bilim bazasi fayli versiyasi - one indexed revision of a knowledge file"""
+    id = db.Column(db.Integer, primary_key=True)
+    knowledge_base_id = db.Column(db.Integer, db.ForeignKey('knowledge_base.id'), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    file_size = db.Column(db.Integer, nullable=False)
+    
+    # Re-indexing cost of this revision
+    chunk_count = db.Column(db.Integer, default=0)
+    chunks_reused = db.Column(db.Integer, default=0)
+    chunks_inserted = db.Column(db.Integer, default=0)
+    chunks_deleted = db.Column(db.Integer, default=0)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<KnowledgeVersion {self.knowledge_base_id} v{self.version}>'
+
+class CatalogItem(db.Model):
+    """Katalog mahsuloti - one row of a tabular (CSV) product catalog"""
+    id = db.Column(db.Integer, primary_key=True)
+    bot_id = db.Column(db.Integer, db.ForeignKey('bot.id'), nullable=False)
+    knowledge_base_id = db.Column(db.Integer, db.ForeignKey('knowledge_base.id'), nullable=False, index=True)
+    
+    # Product data
+    sku = db.Column(db.String(100))  # Upper-cased for case-insensitive lookup
+    name = db.Column(db.String(300), nullable=False)
+    name_normalized = db.Column(db.String(300), nullable=False)  # Search key (lowercase, no punctuation)
+    price = db.Column(db.String(100))  # As written in the file, e.g. "25000 so'm"
+    price_value = db.Column(db.Float)
+    description = db.Column(db.Text)
+    image_url = db.Column(db.String(1000))
+    attributes = db.Column(db.Text)  # JSON object of the remaining columns
+    content_hash = db.Column(db.String(64))  # sha256 of the row - unchanged rows are reused
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_catalog_item_bot_name', 'bot_id', 'name_normalized'),
+        db.Index('ix_catalog_item_bot_sku', 'bot_id', 'sku'),
+    )
+    
+    def __repr__(self):
+        return f'<CatalogItem {self.name}>'
+
+class WhatsAppDelivery(db.Model):
+    """WhatsApp xabari holati - delivery state of one outbound WhatsApp message"""
+    id = db.Column(db.Integer, primary_key=True)
+    bot_id = db.Column(db.Integer, db.ForeignKey('bot.id'), nullable=False, index=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=True)
+    message_id = db.Column(db.String(128), unique=True, nullable=False)  # wamid.* from the Cloud API
+    recipient_id = db.Column(db.String(100), nullable=False)
+    template_name = db.Column(db.String(100))  # None for free-form text
+    
+    status = db.Column(db.Enum(DeliveryStatus), default=DeliveryStatus.ACCEPTED, nullable=False)
+    error_code = db.Column(db.Integer)
+    error_message = db.Column(db.String(500))
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status_at = db.Column(db.DateTime, default=datetime.utcnow)  # Time of the latest status callback
+    
+    def __repr__(self):
+        return f'<WhatsAppDelivery {self.message_id} {self.status.value}>'
+
+class ConversationEvent(db.Model):
+    """Suhbat o'zgarishlari jurnali - append-only change feed of new messages, one row per Message
+
+    The id is the resume token of the live inbox (services/change_feed.py).
+    No foreign keys: the log is pruned on its own schedule and must not
+    block deleting conversations or partitioned messages.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    bot_id = db.Column(db.Integer, nullable=False)
+    conversation_id = db.Column(db.Integer, nullable=False)
+    message_id = db.Column(db.Integer, nullable=False)
+    is_from_user = db.Column(db.Boolean, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    __table_args__ = (
+        # Feed reads: events of one bot after a resume token
+        db.Index('ix_conversation_event_bot_id', 'bot_id', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<ConversationEvent {self.id} bot={self.bot_id}>'
+
 class AdminAction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -291,8 +508,9 @@ class AdminAction(db.Model):
     # METADATA
     action_date = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # RELATIONSHIPS (relationships will be added after all models are defined)
-    # admin va target_user relationships are defined later
+    # RELATIONSHIPS
+    admin = db.relationship('User', foreign_keys=[admin_id])
+    target_user = db.relationship('User', foreign_keys=[target_user_id])
     
     @property
     def action_display(self):
@@ -1,22 +1,43 @@
-from flask import render_template, request, redirect, url_for, flash, session, jsonify
+from flask import render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
+from sqlalchemy import func, select
 import os
 import logging
-import csv
 import hashlib
 import hmac
 import base64
 import secrets
+import json
+import time
 
 from flask import send_from_directory
 from app import app, db, limiter, csrf
-from models import User, Bot, Conversation, Message, KnowledgeBase, AdminAction
+from models import User, Bot, Conversation, Message, KnowledgeBase, KnowledgeStatus, NotificationMode, AdminAction
 from services.ai_service import AIService
-from services.platform_service import TelegramService, InstagramService, PlatformManager
-from utils.helpers import allowed_file, detect_language
+from services.platform_service import TelegramService, InstagramService, WhatsAppService, PlatformManager
+from services.async_service import AsyncTelegramService, AsyncInstagramService, AsyncWhatsAppService
+from services.knowledge_ingest import ingest_text
+from services.knowledge_worker import knowledge_file_path, knowledge_worker, record_version
+from services.async_bridge import run_async, gather_limited
+from services.message_partitions import message_partitions
+from services.notification_aggregator import notification_aggregator
+from services.instagram_batch import instagram_batches, parse_events as parse_instagram_events
+from services.whatsapp_batch import (whatsapp_batches, parse_events as parse_whatsapp_events, send_templates,
+                                     record_deliveries, in_service_window, REENGAGEMENT_CODE)
+from services.telegram_poller import polling_enabled, update_chat_id
+from services.conversations import get_or_create_conversation, conversation_page, encode_cursor, mark_read
+from services.keyed_scheduler import KeyedScheduler
+from services.change_feed import change_feed
+from services.rate_limiting import (webhook_rate_limit, webhook_bot_key, trusted_webhook_source,
+                                    dashboard_rate_limit, dashboard_user_key, charged_response)
+from services.query_profiler import query_profiler
+from services.request_profiler import request_profiler
+from utils.helpers import allowed_file, page_limit, conditional_json
+from utils.streaming import stream_by_key
+from utils.language import detect_language
 
 # Initialize AI service
 ai_service = AIService()
@@ -227,14 +248,20 @@ def bot_detail(bot_id):
                 flash('Instagram ma\'lumotlari o\'chirildi', 'info')
         
         elif platform == 'whatsapp':
-            # Handle WhatsApp token update
+            # Handle WhatsApp token and phone number ID update
             whatsapp_token = request.form.get('whatsapp_token', '').strip()
+            whatsapp_phone_number_id = request.form.get('whatsapp_phone_number_id', '').strip()
             if whatsapp_token:
                 bot.whatsapp_token = whatsapp_token
+                bot.whatsapp_phone_number_id = whatsapp_phone_number_id or None
                 db.session.commit()
-                flash('WhatsApp token muvaffaqiyatli saqlandi!', 'success')
+                
+                # Callback URL - user needs to set this in the Meta App Dashboard (WhatsApp > Configuration)
+                webhook_url = f"{request.host_url}webhook/whatsapp/{bot.id}"
+                flash(f'WhatsApp token muvaffaqiyatli saqlandi! Webhook URL: {webhook_url}', 'success')
             else:
                 bot.whatsapp_token = None
+                bot.whatsapp_phone_number_id = None
                 db.session.commit()
                 flash('WhatsApp token o\'chirildi', 'info')
         
@@ -245,6 +272,9 @@ def bot_detail(bot_id):
             
             bot.admin_chat_id = admin_chat_id if admin_chat_id else None
             bot.notification_channel = notification_channel if notification_channel else None
+            notification_mode = request.form.get('notification_mode')
+            if notification_mode in {mode.value for mode in NotificationMode}:
+                bot.notification_mode = NotificationMode(notification_mode)
             db.session.commit()
             flash('Telegram bildirishnoma sozlamalari yangilandi!', 'success')
         
@@ -255,6 +285,8 @@ def bot_detail(bot_id):
             system_prompt = request.form.get('system_prompt')
             languages = ','.join(request.form.getlist('languages'))
             max_daily_messages = request.form.get('max_daily_messages', type=int)
+            # Empty field keeps the platform default retention
+            message_retention_days = request.form.get('message_retention_days', type=int)
             is_active = 'is_active' in request.form
             
             if name:
@@ -263,6 +295,7 @@ def bot_detail(bot_id):
                 bot.system_prompt = system_prompt
                 bot.languages = languages
                 bot.max_daily_messages = max_daily_messages
+                bot.message_retention_days = max(0, message_retention_days) if message_retention_days is not None else None
                 bot.is_active = is_active
                 bot.updated_at = datetime.utcnow()
                 db.session.commit()
@@ -285,6 +318,9 @@ def bot_detail(bot_id):
                          conversations=conversations,
                          knowledge_files=knowledge_files)
 
+# Messages per page of the web chat history
+CHAT_PAGE_SIZE = 30
+
 @app.route('/bot/<int:bot_id>/chat', methods=['GET', 'POST'])
 @login_required
 def bot_chat(bot_id):
@@ -307,22 +343,11 @@ def bot_chat(bot_id):
             detected_language = detect_language(message_content)
             
             # Get or create conversation
-            conversation = Conversation.query.filter_by(
-                bot_id=bot.id,
-                platform='web',
-                platform_user_id=str(current_user.id)
-            ).first()
-            
-            if not conversation:
-                conversation = Conversation(
-                    bot_id=bot.id,
-                    platform='web',
-                    platform_user_id=str(current_user.id),
-                    platform_username=current_user.username,
-                    language=detected_language
-                )
-                db.session.add(conversation)
-                db.session.flush()
+            conversation, _ = get_or_create_conversation(
+                bot.id, 'web', current_user.id,
+                platform_username=current_user.username,
+                language=detected_language
+            )
             
             # Save user message
             user_message = Message(
@@ -370,13 +395,23 @@ def bot_chat(bot_id):
         platform_user_id=str(current_user.id)
     ).first()
     
+    # Latest page only; older messages are fetched from get_conversation_messages on scroll
     messages = []
+    has_older = False
     if conversation:
-        messages = Message.query.filter_by(
-            conversation_id=conversation.id
-        ).order_by(Message.created_at.asc()).all()
+        messages = message_partitions.message_page(conversation.id, limit=CHAT_PAGE_SIZE + 1)
+        has_older = len(messages) > CHAT_PAGE_SIZE
+        messages = messages[-CHAT_PAGE_SIZE:]
+    
+    # Sidebar totals from the conversations' summary columns, one query
+    conversation_stats = db.session.query(
+        func.count(Conversation.id).label('conversations'),
+        func.coalesce(func.sum(Conversation.message_count), 0).label('messages'),
+        func.max(Conversation.updated_at).label('last_activity')
+    ).filter(Conversation.bot_id == bot.id).one()
     
-    return render_template('chat.html', bot=bot, messages=messages)
+    return render_template('chat.html', bot=bot, messages=messages, conversation=conversation,
+                           has_older=has_older, page_size=CHAT_PAGE_SIZE, conversation_stats=conversation_stats)
 
 @app.route('/bot/<int:bot_id>/upload_knowledge', methods=['POST'])
 @login_required
@@ -413,35 +448,49 @@ def upload_knowledge(bot_id):
             file_path = os.path.join(upload_dir, unique_filename)
             file.save(file_path)
             
-            # Read file content
-            content = ""
-            if filename.endswith('.txt'):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-            elif filename.endswith('.csv'):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    csv_reader = csv.reader(f)
-                    rows = []
-                    for row in csv_reader:
-                        rows.append(','.join(row))
-                    content = '\n'.join(rows)
+            # A file with the same name replaces the earlier upload (re-indexed incrementally)
+            kb = KnowledgeBase.query.filter_by(
+                bot_id=bot.id, original_filename=filename, is_active=True
+            ).order_by(KnowledgeBase.id.desc()).first()
+            if kb and kb.is_pending:
+                os.remove(file_path)
+                flash('Bu fayl hali qayta ishlanmoqda, keyinroq qayta yuklang', 'error')
+                return redirect(url_for('bot_detail', bot_id=bot_id))
             
-            # Create knowledge base entry
-            kb = KnowledgeBase(
-                bot_id=bot.id,
-                filename=unique_filename,
-                original_filename=filename,
-                file_type=file.content_type,
-                file_size=os.path.getsize(file_path),
-                content=content
-            )
+            if kb:
+                if not kb.versions and kb.status == KnowledgeStatus.INDEXED:
+                    # Uploaded before versions were kept: remember it to fall back on
+                    count = kb.chunk_count or 0
+                    record_version(kb, {'total': count, 'reused': 0, 'inserted': count, 'deleted': 0})
+                kb.filename = unique_filename
+                kb.file_type = file.content_type
+                kb.file_size = os.path.getsize(file_path)
+                kb.version = (kb.version or 1) + 1
+                kb.status = KnowledgeStatus.QUEUED
+                kb.progress = 0
+                kb.status_updated_at = datetime.utcnow()
+            else:
+                # Create knowledge base entry; parsing and indexing run in the background
+                kb = KnowledgeBase(
+                    bot_id=bot.id,
+                    filename=unique_filename,
+                    original_filename=filename,
+                    file_type=file.content_type,
+                    file_size=os.path.getsize(file_path),
+                    status=KnowledgeStatus.QUEUED
+                )
+                db.session.add(kb)
             
-            db.session.add(kb)
             db.session.commit()
+            knowledge_worker.submit(kb.id)
             
-            flash('Fayl muvaffaqiyatli yuklandi!', 'success')
+            if kb.version > 1:
+                flash(f'Fayl yangilandi (versiya {kb.version}) va qayta ishlanmoqda', 'success')
+            else:
+                flash('Fayl yuklandi va qayta ishlanmoqda', 'success')
             
         except Exception as e:
+            db.session.rollback()
             logging.error(f"File upload error: {e}")
             flash('Fayl yuklashda xatolik yuz berdi', 'error')
     else:
@@ -449,6 +498,30 @@ def upload_knowledge(bot_id):
     
     return redirect(url_for('bot_detail', bot_id=bot_id))
 
+@app.route('/bot/<int:bot_id>/knowledge/status')
+@limiter.limit(dashboard_rate_limit, key_func=dashboard_user_key, deduct_when=charged_response)
+@login_required
+def knowledge_status(bot_id):
+    """Bilim bazasi fayllarining qayta ishlash holati (polling)"""
+    if not current_user.has_access:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    bot = Bot.query.get_or_404(bot_id)
+    
+    # Check ownership
+    if bot.user_id != current_user.id:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    knowledge_files = KnowledgeBase.query.filter_by(
+        bot_id=bot.id, is_active=True
+    ).all()
+    
+    files = [kb.to_status_dict() for kb in knowledge_files]
+    return jsonify({
+        'files': files,
+        'pending': any(kb.is_pending for kb in knowledge_files)
+    })
+
 @app.route('/bot/<int:bot_id>/add_text_knowledge', methods=['POST'])
 @login_required
 def add_text_knowledge(bot_id):
@@ -473,27 +546,122 @@ def add_text_knowledge(bot_id):
         return redirect(url_for('bot_detail', bot_id=bot_id))
     
     try:
-        # Create knowledge base entry
+        # The text is kept as a file too, so it can be edited later
+        filename = save_text_knowledge(content)
         kb = KnowledgeBase(
             bot_id=bot.id,
-            filename=f"text_knowledge_{datetime.utcnow().timestamp()}.txt",
+            filename=filename,
             original_filename=f"{title}.txt",
             file_type="text/plain",
-            file_size=len(content.encode('utf-8')),
-            content=content
+            file_size=len(content.encode('utf-8'))
         )
         
         db.session.add(kb)
+        db.session.flush()
+        record_version(kb, ingest_text(kb, content))
         db.session.commit()
         
         flash('Matn bilim bazasiga muvaffaqiyatli qo\'shildi!', 'success')
         
     except Exception as e:
+        db.session.rollback()
         logging.error(f"Text knowledge add error: {e}")
         flash('Matn qo\'shishda xatolik yuz berdi', 'error')
     
     return redirect(url_for('bot_detail', bot_id=bot_id))
 
+def save_text_knowledge(content):
+    """Matnli bilimni uploads/knowledge ga yozish; fayl nomini qaytaradi"""
+    filename = f"text_knowledge_{datetime.utcnow().timestamp()}.txt"
+    upload_dir = os.path.join(app.root_path, 'uploads', 'knowledge')
+    os.makedirs(upload_dir, exist_ok=True)
+    with open(os.path.join(upload_dir, filename), 'w', encoding='utf-8') as f:
+        f.write(content)
+    return filename
+
+@app.route('/bot/<int:bot_id>/knowledge/<int:kb_id>/text')
+@login_required
+def knowledge_text(bot_id, kb_id):
+    """Matnli bilimni tahrirlash uchun olish"""
+    bot = Bot.query.get_or_404(bot_id)
+    kb = KnowledgeBase.query.filter_by(id=kb_id, bot_id=bot_id).first_or_404()
+    
+    # Check ownership
+    if bot.user_id != current_user.id:
+        return jsonify({'error': 'Access denied'}), 403
+    if kb.file_type != 'text/plain':
+        return jsonify({'error': 'Faqat matnli bilimni tahrirlash mumkin'}), 400
+    
+    try:
+        with open(knowledge_file_path(kb.filename), encoding='utf-8') as f:
+            content = f.read()
+    except OSError:
+        # Texts added before they were saved as files: only the preview is left
+        content = kb.content or ''
+    
+    return jsonify({
+        'title': kb.original_filename.rsplit('.', 1)[0],
+        'content': content,
+        'version': kb.version or 1
+    })
+
+@app.route('/bot/<int:bot_id>/knowledge/<int:kb_id>/edit', methods=['POST'])
+@login_required
+def edit_text_knowledge(bot_id, kb_id):
+    """Matnli bilimni tahrirlash - faqat o'zgargan qismlar qayta indekslanadi"""
+    if not current_user.has_access:
+        return redirect(url_for('trial_expired'))
+    
+    bot = Bot.query.get_or_404(bot_id)
+    kb = KnowledgeBase.query.filter_by(id=kb_id, bot_id=bot_id).first_or_404()
+    
+    # Check ownership
+    if bot.user_id != current_user.id:
+        flash('Bu chatbotga ruxsatingiz yo\'q', 'error')
+        return redirect(url_for('dashboard'))
+    if kb.file_type != 'text/plain':
+        flash('Faqat matnli bilimni tahrirlash mumkin', 'error')
+        return redirect(url_for('bot_detail', bot_id=bot_id))
+    
+    content = request.form.get('content', '').strip()
+    if not content:
+        flash('Matn to\'ldirilishi shart', 'error')
+        return redirect(url_for('bot_detail', bot_id=bot_id))
+    
+    old_filename = kb.filename
+    filename = None
+    try:
+        filename = save_text_knowledge(content)
+        kb.filename = filename
+        kb.file_size = len(content.encode('utf-8'))
+        kb.version = (kb.version or 1) + 1
+        kb.error_message = None
+        stats = ingest_text(kb, content)
+        record_version(kb, stats)
+        db.session.commit()
+        
+        if old_filename != filename:
+            try:
+                os.remove(knowledge_file_path(old_filename))
+            except OSError:
+                pass
+        
+        logging.info(f"Text knowledge {kb.id} v{kb.version}: {stats['reused']} chunks reused, "
+                     f"{stats['inserted']} new, {stats['deleted']} removed")
+        flash(f'Matn yangilandi (versiya {kb.version})', 'success')
+        
+    except Exception as e:
+        db.session.rollback()
+        if filename:
+            try:
+                os.remove(knowledge_file_path(filename))
+            except OSError:
+                pass
+        logging.error(f"Text knowledge edit error: {e}")
+        flash('Matnni yangilashda xatolik yuz berdi', 'error')
+    
+    return redirect(url_for('bot_detail', bot_id=bot_id))
+
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
@@ -513,7 +681,12 @@ def profile():
         flash('Profil muvaffaqiyatli yangilandi!', 'success')
         return redirect(url_for('profile'))
     
-    return render_template('profile.html')
+    # Totals from the conversations' summary columns, one query
+    conversation_total, message_total = db.session.query(
+        func.count(Conversation.id), func.coalesce(func.sum(Conversation.message_count), 0)
+    ).join(Bot, Bot.id == Conversation.bot_id).filter(Bot.user_id == current_user.id).one()
+    
+    return render_template('profile.html', conversation_total=conversation_total, message_total=message_total)
 
 @app.route('/connect_telegram')
 @login_required
@@ -559,7 +732,7 @@ def knowledge_guide():
 
 @app.route('/webhook/telegram/<int:bot_id>', methods=['POST'])
 @csrf.exempt
-@limiter.limit("100 per minute")
+@limiter.limit(webhook_rate_limit, key_func=webhook_bot_key, exempt_when=trusted_webhook_source)
 def telegram_webhook(bot_id):
     """Telegram webhook handler"""
     try:
@@ -582,11 +755,37 @@ def telegram_webhook(bot_id):
             logging.error(f"Bot {bot_id} has no Telegram token")
             return "No token", 400
         
-        # Get incoming message data
-        data = request.get_json()
-        
+        # Acknowledge at once; the update is answered on the scheduler, after the chat's
+        # earlier updates (other chats run in parallel)
+        data = request.get_json(silent=True)
+        telegram_updates.submit((bot.id, update_chat_id(data)), request_profiler.hand_off(run_telegram_update),
+                                bot.id, data, order=(data or {}).get('update_id'))
+        return "OK", 200
+            
+    except Exception as e:
+        logging.error(f"Telegram webhook error: {e}")
+        db.session.rollback()
+        return "Error", 500
+
+# Telegram updates of one chat are answered in order, different chats concurrently
+telegram_updates = KeyedScheduler('telegram_updates')
+
+def run_telegram_update(bot_id, data):
+    """process_telegram_update on a scheduler thread, with its own app context"""
+    with app.app_context(), query_profiler.scope('telegram_update'):
+        try:
+            bot = db.session.get(Bot, bot_id)
+            if bot is None or not bot.telegram_token:
+                return "No token", 400
+            return process_telegram_update(bot, data)
+        finally:
+            db.session.remove()
+
+def process_telegram_update(bot, data):
+    """Answer one Telegram update (from the webhook or the getUpdates poller); returns (body, status)"""
+    try:
         # Handle callback queries (inline keyboard responses)
-        if 'callback_query' in data:
+        if data and 'callback_query' in data:
             return handle_telegram_callback(bot, data['callback_query'])
         
         if not data or 'message' not in data:
@@ -603,30 +802,17 @@ def telegram_webhook(bot_id):
         if user_message.startswith('/'):
             return handle_telegram_command(bot, chat_id, user_message, message)
         
-        # Create or get conversation
-        conversation = Conversation.query.filter_by(
-            bot_id=bot.id,
-            platform='telegram',
-            platform_user_id=str(chat_id)
-        ).first()
-        
         # Extract username from message
         telegram_username = message['from'].get('username')
         user_display_name = message['from'].get('first_name', 'Unknown')
         
-        if not conversation:
-            # Detect language for new conversations
-            detected_language = detect_language(user_message)
-            conversation = Conversation(
-                bot_id=bot.id,
-                platform='telegram',
-                platform_user_id=str(chat_id),
-                platform_username=telegram_username or user_display_name,
-                language=detected_language
-            )
-            db.session.add(conversation)
-            db.session.commit()
-        else:
+        # Create or get conversation (language detected for new conversations)
+        conversation, created = get_or_create_conversation(
+            bot.id, 'telegram', chat_id,
+            platform_username=telegram_username or user_display_name,
+            language=detect_language(user_message)
+        )
+        if not created:
             # Update username if it exists and is different
             if telegram_username and conversation.platform_username != telegram_username:
                 conversation.platform_username = telegram_username
@@ -642,11 +828,11 @@ def telegram_webhook(bot_id):
             is_from_user=True
         )
         db.session.add(user_msg)
+        # Committed before the AI call: no write transaction stays open while it answers
+        db.session.commit()
         
         # Get conversation history for context
-        history = Message.query.filter_by(
-            conversation_id=conversation.id
-        ).order_by(Message.created_at.desc()).limit(10).all()
+        history = message_partitions.recent_messages(conversation.id, limit=10)
         
         # Generate AI response using user's language preference and knowledge base
         try:
@@ -697,64 +883,20 @@ def telegram_webhook(bot_id):
             return "Send failed", 500
             
     except Exception as e:
-        logging.error(f"Telegram webhook error: {e}")
+        logging.error(f"Telegram update error: {e}")
         db.session.rollback()
         return "Error", 500
 
 def send_monitoring_notification(bot, conversation, user_message, bot_response, platform):
-    """Send monitoring notification to admin chat or channel"""
+    """Queue a monitoring notification for the admin chat and channel (sent in the background)"""
     try:
-        if not bot.telegram_token:
-            return
-            
-        telegram_service = TelegramService(bot.telegram_token)
-        
-        # Format notification message
-        platform_emoji = {'telegram': '💬', 'instagram': '📸', 'whatsapp': '💚'}.get(platform, '🤖')
-        
-        # Format username safely with @ symbol
-        if conversation.platform_username:
-            username = f"@{conversation.platform_username}"
-        else:
-            username = "Noma'lum"
-        
-        notification_text = f"""
-{platform_emoji} {platform.title()} Conversation
-
-👤 Foydalanuvchi: {username}
-🆔 Chat ID: {conversation.platform_user_id}
-🤖 Bot: {bot.name}
-
-📝 Foydalanuvchi xabari:
-{user_message}
-
-🤖 Bot javobi:
-{bot_response}
-
-🕐 Vaqt: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC
-"""
-
-        # Send to admin chat if configured
-        if bot.admin_chat_id:
-            try:
-                telegram_service.send_message(bot.admin_chat_id, notification_text)
-                logging.info(f"Monitoring notification sent to admin chat {bot.admin_chat_id}")
-            except Exception as e:
-                logging.error(f"Failed to send notification to admin chat: {e}")
-        
-        # Send to notification channel if configured
-        if bot.notification_channel:
-            try:
-                telegram_service.send_message(bot.notification_channel, notification_text)
-                logging.info(f"Monitoring notification sent to channel {bot.notification_channel}")
-            except Exception as e:
-                logging.error(f"Failed to send notification to channel: {e}")
-                
+        notification_aggregator.notify(bot, conversation, user_message, bot_response, platform)
     except Exception as e:
         logging.error(f"Monitoring notification error: {e}")
 
 @app.route('/webhook/instagram/<int:bot_id>', methods=['GET', 'POST'])
-@limiter.limit("100 per minute")
+@csrf.exempt
+@limiter.limit(webhook_rate_limit, key_func=webhook_bot_key, exempt_when=trusted_webhook_source)
 def instagram_webhook(bot_id):
     """Instagram webhook handler"""
     
@@ -786,102 +928,10 @@ def instagram_webhook(bot_id):
         if not data or 'entry' not in data:
             return "No entry", 400
         
-        # Process each entry
-        for entry in data['entry']:
-            if 'messaging' in entry:
-                for messaging_event in entry['messaging']:
-                    if 'message' in messaging_event:
-                        message = messaging_event['message']
-                        sender_id = messaging_event['sender']['id']
-                        
-                        # Skip if no text in message
-                        if 'text' not in message:
-                            continue
-                            
-                        user_message = message['text']
-                        
-                        # Create or get conversation
-                        conversation = Conversation.query.filter_by(
-                            bot_id=bot.id,
-                            platform='instagram',
-                            platform_user_id=str(sender_id)
-                        ).first()
-                        
-                        if not conversation:
-                            # Detect language for new conversations
-                            detected_language = detect_language(user_message)
-                            conversation = Conversation(
-                                bot_id=bot.id,
-                                platform='instagram',
-                                platform_user_id=str(sender_id),
-                                platform_username='Instagram User',
-                                language=detected_language
-                            )
-                            db.session.add(conversation)
-                            db.session.commit()
-                        
-                        # Use the conversation's language preference
-                        user_language = conversation.language
-                        
-                        # Save user message
-                        user_msg = Message(
-                            conversation_id=conversation.id,
-                            content=user_message,
-                            is_from_user=True
-                        )
-                        db.session.add(user_msg)
-                        
-                        # Get conversation history for context
-                        history = Message.query.filter_by(
-                            conversation_id=conversation.id
-                        ).order_by(Message.created_at.desc()).limit(10).all()
-                        
-                        # Generate AI response using user's language preference and knowledge base
-                        try:
-                            if len(history) > 1:
-                                response_text = ai_service.generate_response_with_context(
-                                    user_message, 
-                                    history[1:], 
-                                    bot.system_prompt,
-                                    user_language,
-                                    bot.id
-                                )
-                            else:
-                                response_text = ai_service.generate_response(
-                                    user_message,
-                                    bot.system_prompt,
-                                    user_language,
-                                    bot.id
-                                )
-                        except Exception as e:
-                            logging.error(f"AI service error: {e}")
-                            response_text = ai_service._get_fallback_response(user_language)
-                        
-                        # Save bot response
-                        bot_msg = Message(
-                            conversation_id=conversation.id,
-                            content=response_text,
-                            is_from_user=False
-                        )
-                        db.session.add(bot_msg)
-                        
-                        # Update conversation
-                        conversation.updated_at = datetime.utcnow()
-                        db.session.commit()
-                        
-                        # Send response via Instagram
-                        # Use the stored page_id for Instagram service
-                        if bot.instagram_page_id:
-                            instagram_service = InstagramService(bot.instagram_token, bot.instagram_page_id)
-                            result = instagram_service.send_message(sender_id, response_text)
-                            
-                            if result:
-                                logging.info(f"Instagram message sent successfully to user {sender_id}")
-                                
-                                # Send monitoring notification if configured
-                                send_monitoring_notification(bot, conversation, user_message, response_text, 'instagram')
-                            else:
-                                logging.error(f"Failed to send Instagram message to user {sender_id}")
+        # Acknowledge at once; replies are generated and sent in the background
+        messages = parse_instagram_events(data)
+        if messages:
+            instagram_batches.submit(bot.id, messages)
         
         return "OK", 200
             
@@ -890,35 +940,76 @@ def instagram_webhook(bot_id):
         db.session.rollback()
         return "Error", 500
 
+@app.route('/webhook/whatsapp/<int:bot_id>', methods=['GET', 'POST'])
+@csrf.exempt
+@limiter.limit(webhook_rate_limit, key_func=webhook_bot_key, exempt_when=trusted_webhook_source)
+def whatsapp_webhook(bot_id):
+    """WhatsApp Cloud API webhook handler"""
+    
+    # Handle GET request for webhook verification
+    if request.method == 'GET':
+        verify_token = os.environ.get('WHATSAPP_VERIFY_TOKEN')
+        verify_token_param = request.args.get('hub.verify_token', '')
+        
+        if (verify_token and request.args.get('hub.mode') == 'subscribe'
+                and hmac.compare_digest(verify_token_param, verify_token)):
+            return request.args.get('hub.challenge', '')
+        else:
+            return "Forbidden", 403
+    
+    # Handle POST request for incoming messages and status callbacks
+    try:
+        # Verify the payload signature when the app secret is configured
+        app_secret = os.environ.get('WHATSAPP_APP_SECRET')
+        if app_secret:
+            expected = 'sha256=' + hmac.new(app_secret.encode(), request.get_data(), hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(request.headers.get('X-Hub-Signature-256', ''), expected):
+                logging.warning(f"Invalid WhatsApp webhook signature for bot {bot_id}")
+                return "Unauthorized", 401
+        
+        # Get bot
+        bot = Bot.query.get_or_404(bot_id)
+        
+        # Check if bot has whatsapp token
+        if not bot.whatsapp_token:
+            logging.error(f"Bot {bot_id} has no WhatsApp token")
+            return "No token", 400
+        
+        # Get incoming message data
+        data = request.get_json(silent=True)
+        
+        if not data or 'entry' not in data:
+            return "No entry", 400
+        
+        # Acknowledge at once; replies and status updates are handled in the background
+        messages, statuses = parse_whatsapp_events(data)
+        if messages:
+            whatsapp_batches.submit(bot.id, messages)
+        if statuses:
+            whatsapp_batches.add_statuses(bot.id, statuses)
+        
+        return "OK", 200
+            
+    except Exception as e:
+        logging.error(f"WhatsApp webhook error: {e}")
+        db.session.rollback()
+        return "Error", 500
+
 def handle_telegram_command(bot, chat_id, command, message):
     """Handle Telegram bot commands"""
     try:
         telegram_service = TelegramService(bot.telegram_token)
         
         # Get or create conversation
-        conversation = Conversation.query.filter_by(
-            bot_id=bot.id,
-            platform='telegram',
-            platform_user_id=str(chat_id)
-        ).first()
-        
-        if not conversation:
-            # Extract username from message  
-            telegram_username = message['from'].get('username')
-            user_display_name = message['from'].get('first_name', 'Unknown')
-            
-            conversation = Conversation(
-                bot_id=bot.id,
-                platform='telegram',
-                platform_user_id=str(chat_id),
-                platform_username=telegram_username or user_display_name,
-                language='uz'  # Default to Uzbek
-            )
-            db.session.add(conversation)
-            db.session.commit()
-        else:
+        telegram_username = message['from'].get('username')
+        user_display_name = message['from'].get('first_name', 'Unknown')
+        conversation, created = get_or_create_conversation(
+            bot.id, 'telegram', chat_id,
+            platform_username=telegram_username or user_display_name,
+            language='uz'  # Default to Uzbek
+        )
+        if not created:
             # Update username if it exists and is different
-            telegram_username = message['from'].get('username')
             if telegram_username and conversation.platform_username != telegram_username:
                 conversation.platform_username = telegram_username
                 db.session.commit()
@@ -1139,9 +1230,13 @@ def deploy_telegram(bot_id):
         
         bot_info = bot_info_response.data
         
-        # Set webhook URL
-        webhook_url = f"{request.host_url}webhook/telegram/{bot_id}"
-        webhook_response = telegram_service.set_webhook(webhook_url)
+        if polling_enabled():
+            # Updates come from `flask telegram poll`; getUpdates fails while a webhook is set
+            webhook_url = None
+            webhook_response = telegram_service.set_webhook('')
+        else:
+            webhook_url = f"{request.host_url}webhook/telegram/{bot_id}"
+            webhook_response = telegram_service.set_webhook(webhook_url)
         
         if webhook_response.success:
             # Save token to bot
@@ -1246,9 +1341,14 @@ def send_manual_message(bot_id):
                 elif platform == 'instagram' and bot.instagram_token:
                     instagram_service = InstagramService(bot.instagram_token, bot.instagram_page_id)
                     response = instagram_service.send_message(platform_user_id, message_text)
-                elif platform == 'whatsapp':
-                    error_message = 'WhatsApp integratsiyasi hozircha mavjud emas'
-                    return jsonify({'success': False, 'error': error_message})
+                elif platform == 'whatsapp' and bot.whatsapp_token and bot.whatsapp_phone_number_id:
+                    whatsapp_service = WhatsAppService(bot.whatsapp_token, bot.whatsapp_phone_number_id)
+                    response = whatsapp_service.send_message(platform_user_id, message_text)
+                    if response.success:
+                        record_deliveries(bot.id, [(conversation.id, platform_user_id, response, None)])
+                    elif response.status_code == REENGAGEMENT_CODE:
+                        return jsonify({'success': False, 'error': '24 soatlik muloqot oynasi yopilgan: '
+                                        'WhatsApp mijozga faqat shablon xabar yuborishga ruxsat beradi'})
                 else:
                     error_message = f'{platform.title()} platformasi uchun kerakli konfiguratsiya yo\'q'
                     return jsonify({'success': False, 'error': error_message})
@@ -1284,9 +1384,12 @@ def send_manual_message(bot_id):
             return jsonify({'success': False, 'error': 'Server xatoligi'})
     
     # GET request - show message sending page
-    conversations = Conversation.query.filter_by(bot_id=bot.id, is_active=True).order_by(Conversation.updated_at.desc()).limit(50).all()
+    # First page; the rest is fetched from bot_conversations as the user asks for more
+    conversations, has_more = conversation_page(bot.id, limit=20, active_only=True)
     
-    return render_template('bot/send_message.html', bot=bot, conversations=conversations)
+    return render_template('bot/send_message.html', bot=bot, conversations=conversations, has_more=has_more,
+                           next_cursor=encode_cursor(conversations[-1]) if conversations else '',
+                           newest_cursor=encode_cursor(conversations[0]) if conversations else '')
 
 
 @app.route('/bot/<int:bot_id>/broadcast-message', methods=['GET', 'POST'])
@@ -1310,64 +1413,121 @@ def broadcast_message(bot_id):
             if not message_text or not message_text.strip():
                 return jsonify({'success': False, 'error': 'Xabar matnini kiriting'})
             
-            # Get all active conversations for this bot
-            conversations = Conversation.query.filter_by(bot_id=bot.id, is_active=True).all()
-            
-            if not conversations:
-                return jsonify({'success': False, 'error': 'Hech qanday faol suhbat topilmadi'})
-            
             successful_sends = 0
             failed_sends = 0
+            total = 0
+            # First errors only (failed_sends counts them all)
             errors = []
             
-            # Send message to each conversation
-            for conversation in conversations:
-                try:
-                    response = None
-                    
-                    # Send via appropriate platform
-                    if conversation.platform == 'telegram' and bot.telegram_token:
-                        telegram_service = TelegramService(bot.telegram_token)
-                        response = telegram_service.send_message(conversation.platform_user_id, message_text)
-                    elif conversation.platform == 'instagram' and bot.instagram_token:
-                        instagram_service = InstagramService(bot.instagram_token, bot.instagram_page_id)
-                        response = instagram_service.send_message(conversation.platform_user_id, message_text)
-                    elif conversation.platform == 'whatsapp':
-                        errors.append(f'WhatsApp (@{conversation.platform_username}): Integratsiya mavjud emas')
-                        failed_sends += 1
-                        continue
+            def note_error(error):
+                if len(errors) < 5:
+                    errors.append(error)
+            
+            # Send concurrently through the async service layer, then save results
+            telegram_service = AsyncTelegramService(bot.telegram_token) if bot.telegram_token else None
+            instagram_service = AsyncInstagramService(bot.instagram_token, bot.instagram_page_id) if bot.instagram_token else None
+            whatsapp_service = (AsyncWhatsAppService(bot.whatsapp_token, bot.whatsapp_phone_number_id)
+                                if bot.whatsapp_token and bot.whatsapp_phone_number_id else None)
+            # WhatsApp allows free-form text only within 24 hours of the customer's last message;
+            # the others get the approved template, when one is given
+            whatsapp_template = request.form.get('whatsapp_template', '').strip()
+            whatsapp_template_language = request.form.get('whatsapp_template_language', '').strip() or 'en_US'
+            
+            # Active conversations of this bot, a chunk of column rows at a time (memory stays flat
+            # however many customers the bot has); each chunk is sent and saved before the next
+            active_conversations = select(
+                Conversation.id, Conversation.platform, Conversation.platform_user_id,
+                Conversation.platform_username, Conversation.last_customer_message_at
+            ).where(Conversation.bot_id == bot.id, Conversation.is_active.is_(True))
+            
+            for conversations in stream_by_key(active_conversations, Conversation.id):
+                total += len(conversations)
+                pending_sends = []
+                template_targets = []
+                
+                for conversation in conversations:
+                    if conversation.platform == 'telegram' and telegram_service:
+                        pending_sends.append((conversation, telegram_service.send_message(conversation.platform_user_id, message_text)))
+                    elif conversation.platform == 'instagram' and instagram_service:
+                        pending_sends.append((conversation, instagram_service.send_message(conversation.platform_user_id, message_text)))
+                    elif conversation.platform == 'whatsapp' and whatsapp_service:
+                        if in_service_window(conversation):
+                            pending_sends.append((conversation, whatsapp_service.send_message(conversation.platform_user_id, message_text)))
+                        elif whatsapp_template:
+                            template_targets.append(conversation)
+                        else:
+                            note_error(f'WhatsApp (@{conversation.platform_username}): 24 soatlik oyna yopilgan, shablon nomini kiriting')
+                            failed_sends += 1
                     else:
-                        errors.append(f'{conversation.platform.title()} (@{conversation.platform_username}): Konfiguratsiya yo\'q')
+                        note_error(f'{conversation.platform.title()} (@{conversation.platform_username}): Konfiguratsiya yo\'q')
                         failed_sends += 1
-                        continue
-                    
-                    if response and response.success:
-                        # Save message to database
-                        try:
-                            with db.session.begin():
-                                message = Message(
-                                    conversation_id=conversation.id,
-                                    content=message_text,
-                                    is_from_user=False,  # This is from admin/bot
-                                    created_at=datetime.utcnow()
-                                )
-                                db.session.add(message)
-                                conversation.updated_at = datetime.utcnow()
-                            successful_sends += 1
-                        except Exception as db_error:
-                            logging.error(f"Database error for conversation {conversation.id}: {db_error}")
-                            errors.append(f'@{conversation.platform_username}: Xabar yuborildi, lekin saqlashda xatolik')
-                            failed_sends += 1
+                
+                responses = run_async(gather_limited(
+                    [send for _, send in pending_sends],
+                    limit=int(os.environ.get('BROADCAST_CONCURRENCY', 20)),
+                    rate_per_second=float(os.environ.get('BROADCAST_RATE_PER_SECOND', 25))
+                ))
+                
+                results = []
+                whatsapp_sent = []
+                for (conversation, _), response in zip(pending_sends, responses):
+                    if conversation.platform == 'whatsapp' and not isinstance(response, Exception):
+                        if response.success:
+                            whatsapp_sent.append((conversation.id, conversation.platform_user_id, response, None))
+                        elif response.status_code == REENGAGEMENT_CODE and whatsapp_template:
+                            # The window closed after the last activity we know of
+                            template_targets.append(conversation)
+                            continue
+                    results.append((conversation, response, message_text))
+                if whatsapp_sent:
+                    record_deliveries(bot.id, whatsapp_sent)
+                
+                if template_targets:
+                    template_responses = send_templates(
+                        bot, [(c.platform_user_id, c.id) for c in template_targets],
+                        whatsapp_template, whatsapp_template_language
+                    )
+                    results.extend((conversation, response, f'[Shablon: {whatsapp_template}]')
+                                   for conversation, response in zip(template_targets, template_responses))
+                
+                delivered = []
+                for conversation, response, content in results:
+                    if isinstance(response, Exception):
+                        logging.error(f"Error sending broadcast to conversation {conversation.id}: {response}")
+                        note_error(f'@{conversation.platform_username}: Xatolik - {str(response)}')
+                        failed_sends += 1
+                    elif response.success:
+                        delivered.append((conversation, content))
                     else:
-                        error_detail = response.error_message if response else 'Platform xizmati javob bermadi'
+                        error_detail = response.error_message or 'Platform xizmati javob bermadi'
                         logging.error(f"Failed to send broadcast to {conversation.platform}:{conversation.platform_user_id}: {error_detail}")
-                        errors.append(f'@{conversation.platform_username} ({conversation.platform}): {error_detail}')
+                        note_error(f'@{conversation.platform_username} ({conversation.platform}): {error_detail}')
                         failed_sends += 1
-                        
-                except Exception as send_error:
-                    logging.error(f"Error sending broadcast to conversation {conversation.id}: {send_error}")
-                    errors.append(f'@{conversation.platform_username}: Xatolik - {str(send_error)}')
-                    failed_sends += 1
+                
+                # Save the chunk's messages in one transaction (the conversations' summary
+                # update in the same flush also moves their updated_at)
+                if delivered:
+                    try:
+                        now = datetime.utcnow()
+                        db.session.add_all([
+                            Message(
+                                conversation_id=conversation.id,
+                                content=content,
+                                is_from_user=False,  # This is from admin/bot
+                                created_at=now
+                            ) for conversation, content in delivered
+                        ])
+                        db.session.commit()
+                        successful_sends += len(delivered)
+                    except Exception as db_error:
+                        db.session.rollback()
+                        logging.error(f"Database error saving broadcast messages of bot {bot.id}: {db_error}")
+                        for conversation, _ in delivered:
+                            note_error(f'@{conversation.platform_username}: Xabar yuborildi, lekin saqlashda xatolik')
+                        failed_sends += len(delivered)
+            
+            if not total:
+                return jsonify({'success': False, 'error': 'Hech qanday faol suhbat topilmadi'})
             
             # Prepare result message
             if successful_sends > 0:
@@ -1375,14 +1535,14 @@ def broadcast_message(bot_id):
                 if failed_sends > 0:
                     result_message += f'\n❌ {failed_sends} ta xabar yuborilmadi'
                     if errors:
-                        result_message += f'\n\nXatoliklar:\n' + '\n'.join(errors[:5])  # Show first 5 errors
-                        if len(errors) > 5:
-                            result_message += f'\n... va yana {len(errors) - 5} ta xatolik'
+                        result_message += f'\n\nXatoliklar:\n' + '\n'.join(errors)  # Show first 5 errors
+                        if failed_sends > len(errors):
+                            result_message += f'\n... va yana {failed_sends - len(errors)} ta xatolik'
                 
                 return jsonify({'success': True, 'message': result_message, 'stats': {
                     'successful': successful_sends,
                     'failed': failed_sends,
-                    'total': len(conversations)
+                    'total': total
                 }})
             else:
                 return jsonify({'success': False, 'error': f'Hech qanday xabar yuborilmadi. {failed_sends} ta xatolik.'})
@@ -1401,10 +1561,54 @@ def broadcast_message(bot_id):
                          conversations_count=conversations_count,
                          platforms=platform_list)
 
+@app.route('/bot/<int:bot_id>/conversations')
+@limiter.limit(dashboard_rate_limit, key_func=dashboard_user_key, deduct_when=charged_response)
+@login_required
+def bot_conversations(bot_id):
+    """A bot's conversations, most recently active first (keyset pages: before / after cursors)"""
+    if not current_user.has_access:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    bot = Bot.query.get_or_404(bot_id)
+    
+    # Check ownership
+    if bot.user_id != current_user.id:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    after = request.args.get('after')
+    conversations, has_more = conversation_page(
+        bot.id,
+        before=request.args.get('before'),
+        after=after,
+        limit=page_limit(request.args.get('limit')),
+        active_only=request.args.get('active') == '1'
+    )
+    
+    return conditional_json({
+        'conversations': [{
+            'id': conversation.id,
+            'platform': conversation.platform,
+            'platform_user_id': conversation.platform_user_id,
+            'platform_username': conversation.platform_username,
+            'language': conversation.language,
+            'is_active': conversation.is_active,
+            'updated_at': conversation.updated_at.isoformat(),
+            'last_message_at': conversation.last_message_at.isoformat() if conversation.last_message_at else None,
+            'last_message_preview': conversation.last_message_preview,
+            'message_count': conversation.message_count,
+            'unread_count': conversation.unread_count
+        } for conversation in conversations],
+        'has_more': has_more,
+        # Cursors: `before` for the next (older) page, `after` to poll for new activity
+        'before': encode_cursor(conversations[-1]) if conversations else None,
+        'after': encode_cursor(conversations[0]) if conversations else after
+    })
+
 @app.route('/conversation/<int:conversation_id>/messages')
+@limiter.limit(dashboard_rate_limit, key_func=dashboard_user_key, deduct_when=charged_response)
 @login_required
 def get_conversation_messages(conversation_id):
-    """Get messages for a conversation"""
+    """Messages of a conversation, oldest first (keyset pages: before_id / after_id, limit)"""
     if not current_user.has_access:
         return jsonify({'error': 'Access denied'}), 403
         
@@ -1414,20 +1618,104 @@ def get_conversation_messages(conversation_id):
     if conversation.bot.user_id != current_user.id:
         return jsonify({'error': 'Access denied'}), 403
     
-    messages = Message.query.filter_by(conversation_id=conversation_id)\
-                           .order_by(Message.created_at.desc())\
-                           .limit(10).all()
-    
-    messages_data = []
-    for message in reversed(messages):  # Reverse to show oldest first
-        messages_data.append({
-            'id': message.id,
-            'content': message.content,
-            'is_from_user': message.is_from_user,
-            'created_at': message.created_at.isoformat()
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    limit = page_limit(request.args.get('limit'))
+    
+    # One extra row tells whether the page is the last one
+    messages = message_partitions.message_page(conversation_id, before_id=before_id, after_id=after_id,
+                                               limit=limit + 1)
+    has_more = len(messages) > limit
+    if has_more:
+        messages = messages[:limit] if after_id is not None else messages[1:]
+    
+    # The newest messages are on screen now
+    if before_id is None:
+        mark_read(conversation)
+    
+    messages_data = [{
+        'id': message.id,
+        'content': message.content,
+        'is_from_user': message.is_from_user,
+        'response_time': message.response_time,
+        'created_at': message.created_at.isoformat()
+    } for message in messages]
+    
+    return conditional_json({
+        'messages': messages_data,
+        # Older messages (latest or before_id page) or newer ones (after_id page) remain
+        'has_more': has_more,
+        'oldest_id': messages[0].id if messages else before_id,
+        'newest_id': messages[-1].id if messages else after_id
+    })
+
+@app.route('/bot/<int:bot_id>/events')
+@limiter.exempt
+@login_required
+def bot_events(bot_id):
+    """Live inbox: the bot's new messages as they arrive
+    
+    Server-sent events when the client accepts text/event-stream (resumes from
+    Last-Event-ID), otherwise a JSON long poll (?after=<event id>&wait=<seconds>).
+    Without a token the feed starts at the newest event. When the process's
+    stream slots are taken, streams get 503 and long polls do not wait.
+    """
+    if not current_user.has_access:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    bot = Bot.query.get_or_404(bot_id)
+    
+    # Check ownership
+    if bot.user_id != current_user.id:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+    if after is None:
+        after = change_feed.latest_id(bot_id)
+    # The connection stays open: give the pooled session back now
+    db.session.remove()
+    
+    if request.accept_mimetypes.best == 'text/event-stream':
+        if not change_feed.open_stream():
+            return Response("Too many live streams", status=503, headers={'Retry-After': '30'})
+        
+        def stream(after):
+            deadline = time.monotonic() + float(os.environ.get("CHANGE_FEED_STREAM_SECONDS", 55))
+            keepalive = float(os.environ.get("CHANGE_FEED_KEEPALIVE_SECONDS", 15))
+            yield f"retry: 2000\nid: {after}\n\n"
+            while time.monotonic() < deadline:
+                if change_feed.wait(bot_id, after, min(keepalive, max(deadline - time.monotonic(), 0))):
+                    events = change_feed.read(bot_id, after)
+                    for item in events:
+                        yield f"id: {item['id']}\nevent: message\ndata: {json.dumps(item)}\n\n"
+                    if events:
+                        after = events[-1]['id']
+                        continue
+                yield ": keepalive\n\n"
+        
+        response = Response(stream_with_context(stream(after)), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
         })
+        # The slot is freed when the server closes the response, however the stream ended
+        response.call_on_close(change_feed.close_stream)
+        return response
     
-    return jsonify({'messages': messages_data})
+    wait = min(max(request.args.get('wait', 25, type=float), 0), 25)
+    events = change_feed.read(bot_id, after)
+    if not events and wait and change_feed.open_stream():
+        try:
+            if change_feed.wait(bot_id, after, wait):
+                events = change_feed.read(bot_id, after)
+        finally:
+            change_feed.close_stream()
+    
+    return jsonify({
+        'events': events,
+        'after': events[-1]['id'] if events else after
+    })
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -4,6 +4,8 @@ Bu xizmat sinov tizimi va admin nazoratini boshqaradi
 """
 
 from datetime import datetime, timedelta
+from sqlalchemy import case
+from sqlalchemy.orm import joinedload
 from app import db
 from models import User, AdminAction, AccessStatus, AdminActionType, SubscriptionType
 import logging
@@ -205,32 +207,33 @@ class AccessControlService:
     @staticmethod
     def get_recent_admin_actions(limit=50):
         """So'nggi admin harakatlarini olish"""
-        return AdminAction.query.order_by(AdminAction.action_date.desc()).limit(limit).all()
+        return AdminAction.query.options(
+            joinedload(AdminAction.admin), joinedload(AdminAction.target_user)
+        ).order_by(AdminAction.action_date.desc()).limit(limit).all()
     
     @staticmethod
     def get_user_statistics():
         """Foydalanuvchi statistikalarini olish"""
-        stats = {
-            'total_users': User.query.count(),
-            'trial_users': User.query.filter_by(access_status=AccessStatus.TRIAL).count(),
-            'pending_users': User.query.filter_by(access_status=AccessStatus.PENDING).count(),
-            'approved_users': User.query.filter_by(access_status=AccessStatus.APPROVED).count(),
-            'suspended_users': User.query.filter_by(access_status=AccessStatus.SUSPENDED).count(),
-            'admin_users': User.query.filter_by(is_admin=True).count(),
-        }
-        
-        # Bugun ro'yxatdan o'tganlar
-        today = datetime.utcnow().date()
-        stats['new_today'] = User.query.filter(
-            db.func.date(User.created_at) == today
-        ).count()
-        
-        # Sinov muddati tugash arafasida bo'lganlar (1 kun qolganda)
-        tomorrow = datetime.utcnow() + timedelta(days=1)
-        stats['expiring_soon'] = User.query.filter(
-            User.access_status == AccessStatus.TRIAL,
-            User.trial_end_date <= tomorrow,
-            User.trial_end_date > datetime.utcnow()
-        ).count()
-        
-        return stats
\ No newline at end of file
+        now = datetime.utcnow()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        
+        def matching(condition):
+            return db.func.count(case((condition, 1)))
+        
+        # Barcha hisoblar bitta so'rovda
+        row = db.session.query(
+            db.func.count(User.id).label('total_users'),
+            matching(User.access_status == AccessStatus.TRIAL).label('trial_users'),
+            matching(User.access_status == AccessStatus.PENDING).label('pending_users'),
+            matching(User.access_status == AccessStatus.APPROVED).label('approved_users'),
+            matching(User.access_status == AccessStatus.SUSPENDED).label('suspended_users'),
+            matching(User.is_admin == True).label('admin_users'),
+            # Bugun ro'yxatdan o'tganlar
+            matching(User.created_at >= today).label('new_today'),
+            # Sinov muddati tugash arafasida bo'lganlar (1 kun qolganda)
+            matching((User.access_status == AccessStatus.TRIAL) &
+                     (User.trial_end_date <= now + timedelta(days=1)) &
+                     (User.trial_end_date > now)).label('expiring_soon'),
+        ).one()
+        
+        return dict(row._mapping)
\ No newline at end of file
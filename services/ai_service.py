@@ -3,10 +3,24 @@ import logging
 import time
 import hashlib
 from functools import lru_cache
+import httpx
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from app import db
 from models import KnowledgeBase
+from services.catalog_service import direct_answer, format_items, search_catalog
+from services.knowledge_ingest import search_chunks
+from services.metrics import metrics
+from services.resilience import CircuitOpenError, call_with_retries, get_circuit_breaker
+from utils.language import detect_language
+
+DEFAULT_MODEL_CHAIN = "gemini-2.5-flash,gemini-2.5-flash-lite"
+
+def _is_retryable_error(error):
+    """Transient upstream errors worth retrying or failing over on"""
+    if isinstance(error, errors.APIError):
+        return error.code in (408, 429) or (error.code or 0) >= 500
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, ConnectionError, TimeoutError))
 
 class AIService:
     def __init__(self):
@@ -15,14 +29,39 @@ class AIService:
         api_key = os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("Neither GOOGLE_API_KEY nor GEMINI_API_KEY environment variable is set")
-        self.client = genai.Client(api_key=api_key)
-        self.model = "gemini-2.5-flash"
+        # GEMINI_API_BASE points the client at a compatible stand-in (load benchmarks)
+        api_base = os.environ.get("GEMINI_API_BASE")
+        http_options = types.HttpOptions(base_url=api_base) if api_base else None
+        self.client = genai.Client(api_key=api_key, http_options=http_options)
+        
+        # Fallback model chain, tried in order when a model is failing (e.g. flash -> flash-lite)
+        model_chain = os.environ.get("GEMINI_MODEL_CHAIN", DEFAULT_MODEL_CHAIN)
+        self.model_chain = [m.strip() for m in model_chain.split(',') if m.strip()]
+        self.model = self.model_chain[0]
+        
+        # Resilience settings: per-call timeout, overall deadline, bounded retries
+        self.request_timeout = float(os.environ.get("GEMINI_TIMEOUT_SECONDS", 10))
+        self.deadline_seconds = float(os.environ.get("GEMINI_DEADLINE_SECONDS", 20))
+        self.max_attempts = int(os.environ.get("GEMINI_MAX_ATTEMPTS", 2))
+        self.breaker_threshold = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", 5))
+        self.breaker_recovery = float(os.environ.get("GEMINI_BREAKER_RECOVERY_SECONDS", 30))
         self._knowledge_cache = {}
         self._cache_timeout = 300  # 5 minutes cache
     
-    def get_knowledge_base_content(self, bot_id):
+    def get_knowledge_base_content(self, bot_id, query=None):
         """Retrieve knowledge base content for the bot with caching"""
         try:
+            if query:
+                # Matched catalog rows make a tiny prompt instead of catalog text
+                products = search_catalog(bot_id, query)
+                if products:
+                    return "--- Mahsulotlar ---\n" + format_items(item for item, _ in products)
+                
+                # Chunks matching the user's message beat the first 2000 chars of every file
+                matches = search_chunks(bot_id, query, max_chars=2000)
+                if matches:
+                    return "\n\n".join(f"--- {filename} ---\n{text}" for filename, text in matches)
+            
             # Check cache first
             cache_key = f"kb_{bot_id}"
             current_time = time.time()
@@ -57,56 +96,96 @@ class AIService:
             logging.error(f"Knowledge base retrieval error: {e}")
             return None
         
+    def get_catalog_answer(self, user_message, language='uz', bot_id=None):
+        """Price questions about one clearly matched product, answered without Gemini"""
+        if not bot_id:
+            return None
+        try:
+            answer = direct_answer(bot_id, user_message, language)
+            if answer:
+                metrics.incr('catalog_direct_answers_total')
+            return answer
+        except Exception as e:
+            logging.error(f"Catalog lookup error: {e}")
+            return None
+        
+    def build_system_instruction(self, system_prompt=None, language='uz', bot_id=None, query=None):
+        """Build the system instruction (language rules, knowledge base, bot prompt)"""
+        language_instructions = {
+            'uz': "Siz O'zbek tilida javob beradigan yordamchi botsiz. Har doim O'zbek tilida javob bering.",
+            'ru': "Вы помощник-бот, отвечающий на русском языке. Всегда отвечайте на русском языке.",
+            'en': "You are an assistant bot that responds in English. Always respond in English."
+        }
+        
+        base_instruction = language_instructions.get(language, language_instructions['uz'])
+        
+        # Get knowledge base content if bot_id is provided
+        knowledge_content = None
+        if bot_id:
+            knowledge_content = self.get_knowledge_base_content(bot_id, query)
+        
+        # Build system instruction
+        system_instruction = base_instruction
+        
+        if knowledge_content:
+            kb_instructions = {
+                'uz': f"\n\nSizda quyidagi bilimlar bazasi mavjud. FAQAT ushbu bilimlar bazasidan topilgan ma'lumotlar asosida javob bering:\n{knowledge_content}\n\nMUHIM QOIDALAR:\n1. Agar savol bilimlar bazasida yo'q bo'lsa, \"Kechirasiz, bu haqida ma'lumotim yo'q. Faqat bizning mahsulotlar va xizmatlar haqida savol bering\" deb javob bering.\n2. Bilimlar bazasidan tashqari umumiy savollar (tarix, siyosat, boshqa mavzular) ga javob bermang.\n3. Agar mahsulot haqida so'ralsa va rasm URL si mavjud bo'lsa, uni ham ko'rsating.\n4. Faqat bilimlar bazasidagi ma'lumotlardan foydalaning.",
+                'ru': f"\n\nУ вас есть следующая база знаний. Отвечайте ТОЛЬКО на основе информации из этой базы знаний:\n{knowledge_content}\n\nВАЖНЫЕ ПРАВИЛА:\n1. Если вопроса нет в базе знаний, отвечайте: \"Извините, у меня нет информации об этом. Пожалуйста, задавайте вопросы только о наших продуктах и услугах\"\n2. Не отвечайте на общие вопросы (история, политика, другие темы) вне базы знаний.\n3. Если спрашивают о товаре и есть URL изображения, включите его.\n4. Используйте только информацию из базы знаний.",
+                'en': f"\n\nYou have the following knowledge base. Answer ONLY based on information from this knowledge base:\n{knowledge_content}\n\nIMPORTANT RULES:\n1. If the question is not in the knowledge base, respond: \"Sorry, I don't have information about that. Please ask questions only about our products and services\"\n2. Do not answer general questions (history, politics, other topics) outside the knowledge base.\n3. If asked about a product and there's an image URL, include it.\n4. Use only information from the knowledge base."
+            }
+            system_instruction += kb_instructions.get(language, kb_instructions['uz'])
+        else:
+            # If no knowledge base, refuse to answer any questions
+            no_kb_instructions = {
+                'uz': "\n\nSizda bilimlar bazasi mavjud emas. Hozircha hech qanday savolga javob bera olmaysiz. Foydalanuvchiga bilimlar bazasi yuklanmaganini ayting.",
+                'ru': "\n\nУ вас нет базы знаний. Вы не можете отвечать на вопросы сейчас. Сообщите пользователю, что база знаний не загружена.",
+                'en': "\n\nYou don't have a knowledge base. You cannot answer questions right now. Tell the user that the knowledge base is not loaded."
+            }
+            system_instruction += no_kb_instructions.get(language, no_kb_instructions['uz'])
+        
+        if system_prompt:
+            system_instruction += f"\n\nQo'shimcha ko'rsatmalar: {system_prompt}"
+        
+        return system_instruction
+    
+    def build_contents(self, user_message, conversation_history=None):
+        """Build Gemini contents from conversation history and the current message"""
+        contents = []
+        
+        # Add conversation history
+        for msg in (conversation_history or [])[-10:]:  # Last 10 messages for context
+            role = "user" if msg.is_from_user else "model"
+            contents.append(
+                types.Content(role=role, parts=[types.Part(text=msg.content)])
+            )
+        
+        # Add current message
+        contents.append(
+            types.Content(role="user", parts=[types.Part(text=user_message)])
+        )
+        return contents
+    
+    def build_chat_config(self, system_instruction):
+        """Generation settings for chat replies"""
+        return types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            temperature=0.6,
+            max_output_tokens=500
+        )
+    
     def generate_response(self, user_message, system_prompt=None, language='uz', bot_id=None):
         """Generate AI response using Gemini"""
         try:
-            # Prepare system instruction based on language
-            language_instructions = {
-                'uz': "Siz O'zbek tilida javob beradigan yordamchi botsiz. Har doim O'zbek tilida javob bering.",
-                'ru': "Вы помощник-бот, отвечающий на русском языке. Всегда отвечайте на русском языке.",
-                'en': "You are an assistant bot that responds in English. Always respond in English."
-            }
+            catalog_answer = self.get_catalog_answer(user_message, language, bot_id)
+            if catalog_answer:
+                return catalog_answer
             
-            base_instruction = language_instructions.get(language, language_instructions['uz'])
-            
-            # Get knowledge base content if bot_id is provided
-            knowledge_content = None
-            if bot_id:
-                knowledge_content = self.get_knowledge_base_content(bot_id)
-            
-            # Build system instruction
-            system_instruction = base_instruction
-            
-            if knowledge_content:
-                kb_instructions = {
-                    'uz': f"\n\nSizda quyidagi bilimlar bazasi mavjud. FAQAT ushbu bilimlar bazasidan topilgan ma'lumotlar asosida javob bering:\n{knowledge_content}\n\nMUHIM QOIDALAR:\n1. Agar savol bilimlar bazasida yo'q bo'lsa, \"Kechirasiz, bu haqida ma'lumotim yo'q. Faqat bizning mahsulotlar va xizmatlar haqida savol bering\" deb javob bering.\n2. Bilimlar bazasidan tashqari umumiy savollar (tarix, siyosat, boshqa mavzular) ga javob bermang.\n3. Agar mahsulot haqida so'ralsa va rasm URL si mavjud bo'lsa, uni ham ko'rsating.\n4. Faqat bilimlar bazasidagi ma'lumotlardan foydalaning.",
-                    'ru': f"\n\nУ вас есть следующая база знаний. Отвечайте ТОЛЬКО на основе информации из этой базы знаний:\n{knowledge_content}\n\nВАЖНЫЕ ПРАВИЛА:\n1. Если вопроса нет в базе знаний, отвечайте: \"Извините, у меня нет информации об этом. Пожалуйста, задавайте вопросы только о наших продуктах и услугах\"\n2. Не отвечайте на общие вопросы (история, политика, другие темы) вне базы знаний.\n3. Если спрашивают о товаре и есть URL изображения, включите его.\n4. Используйте только информацию из базы знаний.",
-                    'en': f"\n\nYou have the following knowledge base. Answer ONLY based on information from this knowledge base:\n{knowledge_content}\n\nIMPORTANT RULES:\n1. If the question is not in the knowledge base, respond: \"Sorry, I don't have information about that. Please ask questions only about our products and services\"\n2. Do not answer general questions (history, politics, other topics) outside the knowledge base.\n3. If asked about a product and there's an image URL, include it.\n4. Use only information from the knowledge base."
-                }
-                system_instruction += kb_instructions.get(language, kb_instructions['uz'])
-            else:
-                # If no knowledge base, refuse to answer any questions
-                no_kb_instructions = {
-                    'uz': "\n\nSizda bilimlar bazasi mavjud emas. Hozircha hech qanday savolga javob bera olmaysiz. Foydalanuvchiga bilimlar bazasi yuklanmaganini ayting.",
-                    'ru': "\n\nУ вас нет базы знаний. Вы не можете отвечать на вопросы сейчас. Сообщите пользователю, что база знаний не загружена.",
-                    'en': "\n\nYou don't have a knowledge base. You cannot answer questions right now. Tell the user that the knowledge base is not loaded."
-                }
-                system_instruction += no_kb_instructions.get(language, no_kb_instructions['uz'])
-            
-            if system_prompt:
-                system_instruction += f"\n\nQo'shimcha ko'rsatmalar: {system_prompt}"
+            system_instruction = self.build_system_instruction(system_prompt, language, bot_id, user_message)
             
             # Generate response
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=[
-                    types.Content(role="user", parts=[types.Part(text=user_message)])
-                ],
-                config=types.GenerateContentConfig(
-                    system_instruction=system_instruction,
-                    temperature=0.6,
-                    max_output_tokens=500
-                )
+            response = self._generate_content(
+                contents=self.build_contents(user_message),
+                config=self.build_chat_config(system_instruction)
             )
             
             if response.text:
@@ -121,66 +200,16 @@ class AIService:
     def generate_response_with_context(self, user_message, conversation_history, system_prompt=None, language='uz', bot_id=None):
         """Generate AI response with conversation context"""
         try:
-            # Prepare conversation history
-            contents = []
-            
-            # Add conversation history
-            for msg in conversation_history[-10:]:  # Last 10 messages for context
-                role = "user" if msg.is_from_user else "model"
-                contents.append(
-                    types.Content(role=role, parts=[types.Part(text=msg.content)])
-                )
-            
-            # Add current message
-            contents.append(
-                types.Content(role="user", parts=[types.Part(text=user_message)])
-            )
-            
-            # Prepare system instruction
-            language_instructions = {
-                'uz': "Siz O'zbek tilida javob beradigan yordamchi botsiz. Har doim O'zbek tilida javob bering.",
-                'ru': "Вы помощник-бот, отвечающий на русском языке. Всегда отвечайте на русском языке.",
-                'en': "You are an assistant bot that responds in English. Always respond in English."
-            }
+            catalog_answer = self.get_catalog_answer(user_message, language, bot_id)
+            if catalog_answer:
+                return catalog_answer
             
-            base_instruction = language_instructions.get(language, language_instructions['uz'])
-            
-            # Get knowledge base content if bot_id is provided
-            knowledge_content = None
-            if bot_id:
-                knowledge_content = self.get_knowledge_base_content(bot_id)
-            
-            # Build system instruction
-            system_instruction = base_instruction
-            
-            if knowledge_content:
-                kb_instructions = {
-                    'uz': f"\n\nSizda quyidagi bilimlar bazasi mavjud. FAQAT ushbu bilimlar bazasidan topilgan ma'lumotlar asosida javob bering:\n{knowledge_content}\n\nMUHIM QOIDALAR:\n1. Agar savol bilimlar bazasida yo'q bo'lsa, \"Kechirasiz, bu haqida ma'lumotim yo'q. Faqat bizning mahsulotlar va xizmatlar haqida savol bering\" deb javob bering.\n2. Bilimlar bazasidan tashqari umumiy savollar (tarix, siyosat, boshqa mavzular) ga javob bermang.\n3. Agar mahsulot haqida so'ralsa va rasm URL si mavjud bo'lsa, uni ham ko'rsating.\n4. Faqat bilimlar bazasidagi ma'lumotlardan foydalaning.",
-                    'ru': f"\n\nУ вас есть следующая база знаний. Отвечайте ТОЛЬКО на основе информации из этой базы знаний:\n{knowledge_content}\n\nВАЖНЫЕ ПРАВИЛА:\n1. Если вопроса нет в базе знаний, отвечайте: \"Извините, у меня нет информации об этом. Пожалуйста, задавайте вопросы только о наших продуктах и услугах\"\n2. Не отвечайте на общие вопросы (история, политика, другие темы) вне базы знаний.\n3. Если спрашивают о товаре и есть URL изображения, включите его.\n4. Используйте только информацию из базы знаний.",
-                    'en': f"\n\nYou have the following knowledge base. Answer ONLY based on information from this knowledge base:\n{knowledge_content}\n\nIMPORTANT RULES:\n1. If the question is not in the knowledge base, respond: \"Sorry, I don't have information about that. Please ask questions only about our products and services\"\n2. Do not answer general questions (history, politics, other topics) outside the knowledge base.\n3. If asked about a product and there's an image URL, include it.\n4. Use only information from the knowledge base."
-                }
-                system_instruction += kb_instructions.get(language, kb_instructions['uz'])
-            else:
-                # If no knowledge base, refuse to answer any questions
-                no_kb_instructions = {
-                    'uz': "\n\nSizda bilimlar bazasi mavjud emas. Hozircha hech qanday savolga javob bera olmaysiz. Foydalanuvchiga bilimlar bazasi yuklanmaganini ayting.",
-                    'ru': "\n\nУ вас нет базы знаний. Вы не можете отвечать на вопросы сейчас. Сообщите пользователю, что база знаний не загружена.",
-                    'en': "\n\nYou don't have a knowledge base. You cannot answer questions right now. Tell the user that the knowledge base is not loaded."
-                }
-                system_instruction += no_kb_instructions.get(language, no_kb_instructions['uz'])
-            
-            if system_prompt:
-                system_instruction += f"\n\nQo'shimcha ko'rsatmalar: {system_prompt}"
+            system_instruction = self.build_system_instruction(system_prompt, language, bot_id, user_message)
             
             # Generate response
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    system_instruction=system_instruction,
-                    temperature=0.6,
-                    max_output_tokens=500
-                )
+            response = self._generate_content(
+                contents=self.build_contents(user_message, conversation_history),
+                config=self.build_chat_config(system_instruction)
             )
             
             if response.text:
@@ -209,8 +238,8 @@ class AIService:
             if user_message:
                 prompt += f" {user_message}"
             
-            response = self.client.models.generate_content(
-                model="gemini-2.5-pro",
+            response = self._generate_content(
+                models=["gemini-2.5-pro"],
                 contents=[
                     types.Part.from_bytes(
                         data=image_bytes,
@@ -240,8 +269,7 @@ class AIService:
             
             prompt = prompts.get(language, prompts['uz'])
             
-            response = self.client.models.generate_content(
-                model=self.model,
+            response = self._generate_content(
                 contents=prompt,
                 config=types.GenerateContentConfig(
                     temperature=0.3,
@@ -258,6 +286,60 @@ class AIService:
             logging.error(f"Text summarization error: {e}")
             return self._get_fallback_response(language)
     
+    def _get_breaker(self, model):
+        """Circuit breaker shared by all callers of the given model"""
+        return get_circuit_breaker(
+            f"gemini:{model}",
+            failure_threshold=self.breaker_threshold,
+            recovery_timeout=self.breaker_recovery
+        )
+    
+    def _call_config(self, config, remaining):
+        """Copy of config with the per-call timeout capped by the remaining deadline"""
+        timeout = min(self.request_timeout, remaining) if remaining else self.request_timeout
+        return config.model_copy(update={
+            'http_options': types.HttpOptions(timeout=int(timeout * 1000))
+        })
+    
+    def _generate_content(self, contents, config=None, models=None):
+        """Call Gemini with per-call timeouts, jittered retries, circuit breakers and model failover"""
+        deadline = time.monotonic() + self.deadline_seconds
+        config = config or types.GenerateContentConfig()
+        last_error = None
+        
+        for index, model in enumerate(models or self.model_chain):
+            if time.monotonic() >= deadline:
+                break
+            
+            def attempt(remaining):
+                return self.client.models.generate_content(
+                    model=model, contents=contents, config=self._call_config(config, remaining)
+                )
+            
+            try:
+                response = call_with_retries(
+                    attempt,
+                    attempts=self.max_attempts,
+                    deadline=deadline,
+                    is_retryable=_is_retryable_error,
+                    breaker=self._get_breaker(model)
+                )
+                metrics.incr('ai_requests_total', model=model, outcome='success')
+                if index > 0:
+                    metrics.incr('ai_failover_success_total', model=model)
+                return response
+            except CircuitOpenError as e:
+                last_error = e
+                metrics.incr('ai_requests_total', model=model, outcome='circuit_open')
+            except Exception as e:
+                metrics.incr('ai_requests_total', model=model, outcome='error')
+                if not _is_retryable_error(e):
+                    raise
+                last_error = e
+                logging.warning(f"Gemini model {model} failed, trying next model in chain: {e}")
+        
+        raise last_error or CircuitOpenError("All Gemini models are unavailable")
+    
     def _get_fallback_response(self, language):
         """Get fallback response when AI fails"""
         responses = {
@@ -268,14 +350,5 @@ class AIService:
         return responses.get(language, responses['uz'])
     
     def detect_language(self, text):
-        """Detect language of the text"""
-        try:
-            # Simple language detection based on character patterns
-            if any(char in text for char in "ёъ"):
-                return 'ru'
-            elif any(ord(char) > 127 for char in text):
-                return 'uz'
-            else:
-                return 'en'
-        except:
-            return 'uz'  # Default to Uzbek
+        """Detect language of the text ('uz', 'ru' or 'en'; see utils.language)"""
+        return detect_language(text)
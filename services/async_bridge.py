@@ -0,0 +1,130 @@
+"""
+Bridge between sync code (Flask views, background workers) and the asyncio service layer
+Sinxron kod va asyncio servislar orasidagi ko'prik
+"""
+import os
+import time
+import atexit
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future
+from typing import Awaitable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBridge:
+    """Runs one asyncio event loop in a daemon thread per process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Event loop of the bridge thread, started lazily (and again after a fork)"""
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._start()
+            return self._loop
+
+    def _start(self) -> None:
+        # Called with the lock held. A loop inherited from the parent process
+        # (gunicorn preload_app) has no running thread, so always start fresh.
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(ready.set)
+            loop.run_forever()
+
+        thread = threading.Thread(target=run, name='async-bridge', daemon=True)
+        thread.start()
+        ready.wait()
+
+        self._loop = loop
+        self._thread = thread
+        self._pid = os.getpid()
+        logger.info(f"Async bridge event loop started in process {self._pid}")
+
+    def submit(self, coro: Awaitable) -> Future:
+        """
+        Schedule a coroutine on the bridge loop
+
+        The caller's context variables (including the Flask app context) are
+        copied into the task. The scoped session in that context belongs to
+        the caller's thread: coroutines that query the database do it with
+        asyncio.to_thread in an app context of their own.
+        """
+        loop = self.loop
+        context = contextvars.copy_context()
+        future: Future = Future()
+
+        def create_task():
+            task = loop.create_task(coro, context=context)
+
+            def done(t):
+                if t.cancelled():
+                    future.cancel()
+                elif t.exception() is not None:
+                    future.set_exception(t.exception())
+                else:
+                    future.set_result(t.result())
+
+            task.add_done_callback(done)
+
+        loop.call_soon_threadsafe(create_task)
+        return future
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None):
+        """Run a coroutine on the bridge loop and block until it finishes"""
+        return self.submit(coro).result(timeout)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+            self._thread = None
+
+
+bridge = AsyncBridge()
+atexit.register(bridge.shutdown)
+
+
+def run_async(coro: Awaitable, timeout: Optional[float] = None):
+    """Run a coroutine from sync code (Flask view, scheduler job, worker thread)"""
+    return bridge.run(coro, timeout)
+
+
+async def gather_limited(coros: Iterable[Awaitable], limit: int = 50,
+                         rate_per_second: Optional[float] = None) -> List:
+    """
+    asyncio.gather with at most `limit` coroutines in flight
+
+    Optionally spaces out start times to stay under an upstream rate limit
+    (e.g. Telegram's ~30 messages per second per bot). Exceptions are
+    returned in the result list, not raised.
+    """
+    semaphore = asyncio.Semaphore(limit)
+    pacing_lock = asyncio.Lock()
+    interval = 1.0 / rate_per_second if rate_per_second else 0.0
+    next_start = [time.monotonic()]
+
+    async def run_one(coro):
+        async with semaphore:
+            if interval:
+                async with pacing_lock:
+                    now = time.monotonic()
+                    wait = next_start[0] - now
+                    next_start[0] = max(now, next_start[0]) + interval
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            return await coro
+
+    return await asyncio.gather(*(run_one(c) for c in coros), return_exceptions=True)
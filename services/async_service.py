@@ -0,0 +1,341 @@
+"""
+Asyncio service layer for Gemini, Telegram, Instagram and WhatsApp
+Bitta jarayonda minglab parallel so'rovlarni yuritish uchun async servislar
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+
+import httpx
+from google.genai import types
+
+from services.ai_service import AIService, _is_retryable_error
+from services.metrics import metrics
+from services.platform_service import ServiceResponse, graph_api_base, telegram_api_base
+from services.resilience import CircuitOpenError, async_call_with_retries
+
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO, which floods the log during broadcasts
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+# One pooled HTTP client per event loop (httpx clients are bound to the loop that uses them)
+_http_clients: Dict[int, httpx.AsyncClient] = {}
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared connection-pooled client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(id(loop))
+    if client is None or client.is_closed:
+        max_connections = int(os.environ.get("ASYNC_HTTP_MAX_CONNECTIONS", 200))
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections)
+        )
+        _http_clients[id(loop)] = client
+    return client
+
+
+class AsyncAIService:
+    """Async counterpart of AIService, sharing its prompts, breakers and model chain"""
+
+    def __init__(self, ai_service: Optional[AIService] = None):
+        self.ai = ai_service or AIService()
+        self.client = self.ai.client
+
+    async def generate_response(self, user_message, system_prompt=None, language='uz',
+                                bot_id=None, conversation_history=None):
+        """Generate AI response, optionally with conversation context"""
+        try:
+            # Catalog and knowledge base lookups query the database: off the loop, on a session of their own
+            catalog_answer, system_instruction = await asyncio.to_thread(
+                self._prepare, user_message, system_prompt, language, bot_id
+            )
+            if catalog_answer:
+                return catalog_answer
+
+            response = await self._generate_content(
+                contents=self.ai.build_contents(user_message, conversation_history),
+                config=self.ai.build_chat_config(system_instruction)
+            )
+
+            if response.text:
+                return response.text
+            else:
+                return self.ai._get_fallback_response(language)
+
+        except Exception as e:
+            logger.error(f"Async AI service error: {e}")
+            return self.ai._get_fallback_response(language)
+
+    def _prepare(self, user_message, system_prompt, language, bot_id):
+        """(catalog answer, system instruction), in an app context of its own on a worker thread
+
+        The coroutine may run on the bridge loop with the caller's copied app
+        context, whose scoped session belongs to the caller's thread.
+        """
+        from app import app, db
+
+        with app.app_context():
+            try:
+                catalog_answer = self.ai.get_catalog_answer(user_message, language, bot_id)
+                if catalog_answer:
+                    return catalog_answer, None
+                return None, self.ai.build_system_instruction(system_prompt, language, bot_id, user_message)
+            finally:
+                db.session.remove()
+
+    async def _generate_content(self, contents, config=None, models=None):
+        """Same resilience policy as AIService._generate_content, on client.aio"""
+        deadline = time.monotonic() + self.ai.deadline_seconds
+        config = config or types.GenerateContentConfig()
+        last_error = None
+
+        for index, model in enumerate(models or self.ai.model_chain):
+            if time.monotonic() >= deadline:
+                break
+
+            async def attempt(remaining, model=model):
+                return await self.client.aio.models.generate_content(
+                    model=model, contents=contents, config=self.ai._call_config(config, remaining)
+                )
+
+            try:
+                response = await async_call_with_retries(
+                    attempt,
+                    attempts=self.ai.max_attempts,
+                    deadline=deadline,
+                    is_retryable=_is_retryable_error,
+                    breaker=self.ai._get_breaker(model)
+                )
+                metrics.incr('ai_requests_total', model=model, outcome='success')
+                if index > 0:
+                    metrics.incr('ai_failover_success_total', model=model)
+                return response
+            except CircuitOpenError as e:
+                last_error = e
+                metrics.incr('ai_requests_total', model=model, outcome='circuit_open')
+            except Exception as e:
+                metrics.incr('ai_requests_total', model=model, outcome='error')
+                if not (_is_retryable_error(e) or isinstance(e, asyncio.TimeoutError)):
+                    raise
+                last_error = e
+                logger.warning(f"Gemini model {model} failed, trying next model in chain: {e}")
+
+        raise last_error or CircuitOpenError("All Gemini models are unavailable")
+
+
+class AsyncTelegramService:
+    """Async Telegram Bot API client returning the same ServiceResponse as TelegramService"""
+
+    def __init__(self, bot_token, client: Optional[httpx.AsyncClient] = None):
+        self.bot_token = bot_token
+        self.base_url = f"{telegram_api_base()}/bot{bot_token}"
+        self.timeout = 30
+        # A dedicated client (long polling) instead of the shared pool
+        self.client = client
+
+    async def _call(self, method, payload=None, timeout=None) -> ServiceResponse:
+        """POST a Bot API method and unwrap the {'ok': ..., 'result': ...} envelope"""
+        try:
+            response = await (self.client or get_http_client()).post(
+                f"{self.base_url}/{method}", json=payload or {}, timeout=timeout or self.timeout
+            )
+
+            try:
+                json_response = response.json()
+            except ValueError as e:
+                error_msg = f"Invalid JSON response from Telegram API: {str(e)}"
+                logger.error(error_msg)
+                return ServiceResponse(False, error_message=error_msg, status_code=response.status_code)
+
+            if response.status_code != 200 or not json_response.get('ok', False):
+                error_code = json_response.get('error_code', response.status_code)
+                error_description = json_response.get('description', 'No description provided')
+                error_msg = f"Telegram API error {error_code}: {error_description}"
+                logger.error(f"Telegram {method} failed: {error_msg}")
+                return ServiceResponse(False, data=json_response.get('parameters'),
+                                       error_message=error_msg, status_code=error_code)
+
+            return ServiceResponse(True, data=json_response.get('result'))
+
+        except httpx.TimeoutException:
+            error_msg = f"Timeout while calling Telegram {method}"
+            logger.error(error_msg)
+            return ServiceResponse(False, error_message=error_msg)
+        except httpx.HTTPError as e:
+            error_msg = f"Request error while calling Telegram {method}: {str(e)}"
+            logger.error(error_msg)
+            return ServiceResponse(False, error_message=error_msg)
+
+    async def send_message(self, chat_id, text, reply_markup=None) -> ServiceResponse:
+        """Send message to Telegram"""
+        data = {
+            'chat_id': chat_id,
+            'text': text,
+            'parse_mode': 'HTML'
+        }
+        if reply_markup:
+            data['reply_markup'] = reply_markup
+        return await self._call('sendMessage', data)
+
+    async def edit_message(self, chat_id, message_id, text, reply_markup=None) -> ServiceResponse:
+        """Edit existing message"""
+        data = {
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'text': text,
+            'parse_mode': 'HTML'
+        }
+        if reply_markup:
+            data['reply_markup'] = reply_markup
+        return await self._call('editMessageText', data)
+
+    async def answer_callback_query(self, callback_query_id, text=None) -> ServiceResponse:
+        """Answer callback query"""
+        data = {'callback_query_id': callback_query_id}
+        if text:
+            data['text'] = text
+        return await self._call('answerCallbackQuery', data)
+
+    async def get_bot_info(self) -> ServiceResponse:
+        """Get bot information"""
+        return await self._call('getMe')
+
+    async def get_updates(self, offset=None, limit=100, timeout=25, allowed_updates=None) -> ServiceResponse:
+        """Long-poll for updates; waits up to `timeout` seconds when there are none"""
+        data = {'limit': limit, 'timeout': timeout}
+        if offset is not None:
+            data['offset'] = offset
+        if allowed_updates is not None:
+            data['allowed_updates'] = allowed_updates
+        # The HTTP timeout must outlast the long poll itself
+        return await self._call('getUpdates', data, timeout=timeout + 10)
+
+    async def delete_webhook(self) -> ServiceResponse:
+        """Remove the webhook (getUpdates is refused while one is set)"""
+        return await self._call('deleteWebhook')
+
+
+class AsyncInstagramService:
+    """Async Instagram (Graph API) client returning ServiceResponse"""
+
+    def __init__(self, access_token, page_id):
+        self.access_token = access_token
+        self.page_id = page_id
+        self.base_url = f"{graph_api_base()}/v17.0/{page_id}"
+        self.timeout = 30
+
+    async def send_message(self, recipient_id, message_text) -> ServiceResponse:
+        """Send message to Instagram"""
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+            'Content-Type': 'application/json'
+        }
+        data = {
+            'recipient': {'id': recipient_id},
+            'message': {'text': message_text}
+        }
+
+        try:
+            response = await get_http_client().post(
+                f"{self.base_url}/messages", json=data, headers=headers, timeout=self.timeout
+            )
+
+            try:
+                json_response = response.json()
+            except ValueError as e:
+                error_msg = f"Invalid JSON response from Instagram API: {str(e)}"
+                logger.error(error_msg)
+                return ServiceResponse(False, error_message=error_msg, status_code=response.status_code)
+
+            if 'error' in json_response or response.status_code not in [200, 201]:
+                error_info = json_response.get('error', {})
+                error_code = error_info.get('code', response.status_code)
+                error_msg = f"Instagram API error {error_code}: {error_info.get('message', 'No error message provided')}"
+                logger.error(f"Failed to send message to {recipient_id}: {error_msg}")
+                return ServiceResponse(False, error_message=error_msg, status_code=error_code)
+
+            if not json_response.get('message_id'):
+                error_msg = "Instagram API returned no message ID"
+                logger.error(f"Failed to send message to {recipient_id}: {error_msg}")
+                return ServiceResponse(False, error_message=error_msg)
+
+            return ServiceResponse(True, data=json_response)
+
+        except httpx.TimeoutException:
+            error_msg = f"Timeout after {self.timeout} seconds while sending message to Instagram"
+            logger.error(error_msg)
+            return ServiceResponse(False, error_message=error_msg)
+        except httpx.HTTPError as e:
+            error_msg = f"Request error while sending message to Instagram: {str(e)}"
+            logger.error(error_msg)
+            return ServiceResponse(False, error_message=error_msg)
+
+
+class AsyncWhatsAppService:
+    """Async WhatsApp Cloud API client returning ServiceResponse"""
+
+    def __init__(self, access_token, phone_number_id):
+        self.access_token = access_token
+        self.phone_number_id = phone_number_id
+        self.base_url = f"{graph_api_base()}/v17.0/{phone_number_id}"
+        self.timeout = 30
+
+    async def _post_message(self, to, payload) -> ServiceResponse:
+        """POST to /messages; the response carries the wamid used by status callbacks"""
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+            'Content-Type': 'application/json'
+        }
+        data = {'messaging_product': 'whatsapp', 'recipient_type': 'individual', 'to': to, **payload}
+
+        try:
+            response = await get_http_client().post(
+                f"{self.base_url}/messages", json=data, headers=headers, timeout=self.timeout
+            )
+
+            try:
+                json_response = response.json()
+            except ValueError as e:
+                error_msg = f"Invalid JSON response from WhatsApp API: {str(e)}"
+                logger.error(error_msg)
+                return ServiceResponse(False, error_message=error_msg, status_code=response.status_code)
+
+            if 'error' in json_response or response.status_code not in [200, 201]:
+                error_info = json_response.get('error', {})
+                error_code = error_info.get('code', response.status_code)
+                error_msg = f"WhatsApp API error {error_code}: {error_info.get('message', 'No error message provided')}"
+                logger.error(f"Failed to send message to {to}: {error_msg}")
+                return ServiceResponse(False, error_message=error_msg, status_code=error_code)
+
+            if not json_response.get('messages'):
+                error_msg = "WhatsApp API returned no message ID"
+                logger.error(f"Failed to send message to {to}: {error_msg}")
+                return ServiceResponse(False, error_message=error_msg)
+
+            return ServiceResponse(True, data=json_response)
+
+        except httpx.TimeoutException:
+            error_msg = f"Timeout after {self.timeout} seconds while sending message to WhatsApp"
+            logger.error(error_msg)
+            return ServiceResponse(False, error_message=error_msg)
+        except httpx.HTTPError as e:
+            error_msg = f"Request error while sending message to WhatsApp: {str(e)}"
+            logger.error(error_msg)
+            return ServiceResponse(False, error_message=error_msg)
+
+    async def send_message(self, to, message_text) -> ServiceResponse:
+        """Send a free-form text message (only inside the 24-hour customer service window)"""
+        return await self._post_message(to, {'type': 'text', 'text': {'body': message_text}})
+
+    async def send_template_message(self, to, template_name, language_code='en_US',
+                                    components=None) -> ServiceResponse:
+        """Send an approved template message"""
+        template = {'name': template_name, 'language': {'code': language_code}}
+        if components:
+            template['components'] = components
+        return await self._post_message(to, {'type': 'template', 'template': template})
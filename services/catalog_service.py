@@ -0,0 +1,279 @@
+"""
+Product catalog index for tabular knowledge files
+Mahsulotlar katalogi: CSV fayllardan nom, SKU va narx bo'yicha qidiruv
+
+A CSV upload whose header names a product column plus a price, SKU or
+image column is also stored row by row in CatalogItem. Product questions
+are then answered from that table: a SKU or exact-name lookup on the
+(bot_id, ...) indexes, else a fuzzy name match (LIKE prefilter ranked in
+SQL by the keywords matched, then scored with difflib). Only the matched rows reach the prompt - or, for a clear
+price question about one product, the answer is built without Gemini.
+"""
+import os
+import re
+import json
+import logging
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import case, func, or_, select
+
+from services.knowledge_ingest import content_hash, csv_rows, searchable_files, sync_rows
+
+logger = logging.getLogger(__name__)
+
+COLUMN_ALIASES = {
+    'name': ('name', 'product', 'product name', 'title', 'item', 'nom', 'nomi', 'mahsulot',
+             'mahsulot nomi', 'tovar', 'название', 'наименование', 'товар', 'продукт'),
+    'sku': ('sku', 'code', 'article', 'kod', 'artikul', 'код', 'артикул'),
+    'price': ('price', 'cost', 'narx', 'narxi', 'нарх', 'цена', 'стоимость'),
+    'description': ('description', 'desc', 'tavsif', 'izoh', 'описание'),
+    'image_url': ('image', 'image url', 'img', 'photo', 'picture', 'rasm', 'rasm url', 'surat',
+                  'фото', 'изображение', 'картинка'),
+}
+
+PRICE_QUESTION_WORDS = ('narx', 'qancha', 'necha pul', 'pulga', 'цена', 'сколько', 'стоит',
+                        'стоимость', 'price', 'how much', 'cost')
+
+# Question and filler words (after normalize_name): they never name a product
+STOP_WORDS = frozenset('''
+    narx narxi narxlari narxini qancha qanchadan necha pul pulga som sum turadi bormi bor
+    qaysi nima nimaga kerak menga sizda sizlarda bu shu u va yoki uchun bilan haqida
+    цена цены сколько стоит стоимость есть ли у вас какой какая какие мне нужен нужна и или для
+    price prices how much is are the a an of do you have what cost costs for and or
+'''.split())
+
+MAX_CANDIDATES = 500
+MIN_SCORE = 0.3
+
+
+def _header_key(title: str) -> str:
+    return re.sub(r'[\s_\-]+', ' ', title.strip().lower())
+
+
+def normalize_name(text: str) -> str:
+    """Search key: lowercase words without punctuation (Uzbek apostrophes unified)"""
+    text = re.sub(r"[ʻʼ‘’`´]", "'", (text or '').lower())
+    return ' '.join(re.findall(r"[\w']+", text)).replace("'", '')
+
+
+def detect_columns(header: List[str]) -> Optional[Dict[str, int]]:
+    """
+    Map catalog fields to column indexes, or None when the file is not a catalog
+
+    A catalog needs a name column and at least one of price, SKU or image.
+    """
+    columns = {}
+    for index, title in enumerate(header):
+        key = _header_key(title)
+        for field, aliases in COLUMN_ALIASES.items():
+            if field not in columns and key in aliases:
+                columns[field] = index
+                break
+
+    if 'name' not in columns:
+        # Spreadsheet exports often leave the first (name) header blank
+        blank = [i for i, title in enumerate(header) if not title.strip() and i not in columns.values()]
+        if blank:
+            columns['name'] = blank[0]
+
+    if 'name' in columns and any(field in columns for field in ('price', 'sku', 'image_url')):
+        return columns
+    return None
+
+
+def parse_price(text: str) -> Optional[float]:
+    """Numeric value of "25 000 so'm", "1,200.50", "12,5" ..."""
+    digits = re.sub(r'[^\d.,]', '', text or '')
+    if not re.search(r'\d', digits):
+        return None
+    if ',' in digits and '.' in digits:
+        # The separator that comes first groups thousands
+        thousands = ',' if digits.index(',') < digits.index('.') else '.'
+        digits = digits.replace(thousands, '')
+    elif ',' in digits:
+        head, _, tail = digits.rpartition(',')
+        digits = digits.replace(',', '') if len(tail) == 3 else head.replace(',', '') + '.' + tail
+    elif digits.count('.') > 1:
+        digits = digits.replace('.', '')
+    try:
+        return float(digits)
+    except ValueError:
+        return None
+
+
+def catalog_rows(path: str) -> Iterator[Dict]:
+    """CatalogItem values for each row of a CSV catalog (nothing when it is not one)"""
+    rows = csv_rows(path)
+    header = next(rows, None)
+    columns = detect_columns(header) if header else None
+    if not columns:
+        return
+
+    extra = [(i, title.strip()) for i, title in enumerate(header)
+             if i not in columns.values() and title.strip()]
+    for cells in rows:
+        def cell(field):
+            index = columns.get(field)
+            return cells[index] if index is not None and index < len(cells) and cells[index] else None
+
+        name = cell('name')
+        if not name:
+            continue
+        attributes = {title: cells[i] for i, title in extra if i < len(cells) and cells[i]}
+        item = {
+            'sku': cell('sku').upper()[:100] if cell('sku') else None,
+            'name': name[:300],
+            'name_normalized': normalize_name(name)[:300],
+            'price': cell('price')[:100] if cell('price') else None,
+            'price_value': parse_price(cell('price')),
+            'description': cell('description'),
+            'image_url': cell('image_url')[:1000] if cell('image_url') else None,
+            'attributes': json.dumps(attributes, ensure_ascii=False) if attributes else None,
+        }
+        # Hashed here, in the parse process, so re-indexing can skip unchanged rows
+        item['content_hash'] = content_hash(json.dumps(item, sort_keys=True, ensure_ascii=False))
+        yield item
+
+
+def spool_catalog(path: str, spool_path: str) -> int:
+    """Write catalog rows of a CSV to a JSONL spool file; runs in a worker process"""
+    count = 0
+    with open(spool_path, 'w', encoding='utf-8') as spool:
+        for item in catalog_rows(path):
+            spool.write(json.dumps(item, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def store_catalog(kb, items: Iterable[Dict]) -> Dict[str, int]:
+    """Index catalog rows of `kb`, reusing unchanged ones (see sync_rows); the caller commits"""
+    from models import CatalogItem
+
+    return sync_rows(CatalogItem, kb, items)
+
+
+def _word_match(query_word: str, name_word: str) -> bool:
+    # Same word, an inflected form ("kabeli") or a typo ("quloqchn")
+    if query_word == name_word:
+        return True
+    if any(c.isdigit() for c in query_word):
+        # Model numbers and sizes: "15" is not "16"
+        return False
+    return (min(len(query_word), len(name_word)) >= 4 and query_word[:3] == name_word[:3]
+            and SequenceMatcher(None, query_word, name_word).ratio() >= 0.8)
+
+
+def _score(query_words: List[str], name_normalized: str) -> float:
+    name_words = name_normalized.split()
+    if not name_words:
+        return 0.0
+    matched_name = sum(1 for w in name_words if any(_word_match(q, w) for q in query_words))
+    if not matched_name:
+        return 0.0
+    matched_query = sum(1 for q in query_words if any(_word_match(q, w) for w in name_words))
+    return 0.7 * matched_name / len(name_words) + 0.3 * matched_query / len(query_words)
+
+
+def product_name(words: List[str]) -> str:
+    """The words of a normalized query without question and filler words"""
+    return ' '.join(w for w in words if w not in STOP_WORDS)
+
+
+def search_catalog(bot_id: int, query: str, limit: int = 5) -> List[Tuple[object, float]]:
+    """Catalog items matching `query`, best first, as (item, score) pairs"""
+    from app import db
+    from models import CatalogItem, KnowledgeBase
+
+    normalized = normalize_name(query)
+    words = normalized.split()
+    if not words:
+        return []
+    name = product_name(words)
+
+    visible = select(CatalogItem).join(
+        KnowledgeBase, KnowledgeBase.id == CatalogItem.knowledge_base_id
+    ).where(CatalogItem.bot_id == bot_id, searchable_files())
+
+    # Indexed lookups first: a SKU anywhere in the message, or the exact name
+    skus = {word.upper() for word in re.findall(r'[\w\-/.]+', query or '') 
+            if len(word) >= 3 and any(c.isdigit() for c in word)}
+    exact = db.session.execute(
+        visible.where(or_(CatalogItem.name_normalized.in_([normalized, name]),
+                          CatalogItem.sku.in_(skus)))
+        .limit(limit)
+    ).scalars().all()
+    if exact:
+        return [(item, 1.0) for item in exact]
+
+    # Model numbers and sizes ("15", "a5") are kept whole; other words need 3 letters
+    keywords = [w for w in words if w not in STOP_WORDS and (len(w) >= 3 or any(c.isdigit() for c in w))]
+    if not keywords:
+        return []
+    # Words match by their first 3 letters (inflections, typos); tokens with digits exactly
+    patterns = [CatalogItem.name_normalized.like(f'%{w}%' if any(c.isdigit() for c in w) else f'%{w[:3]}%')
+                for w in keywords]
+    # Names matching the most keywords (then the shortest) first, so the limit keeps the best
+    matched = sum(case((pattern, 1), else_=0) for pattern in patterns)
+    candidates = db.session.execute(
+        visible.where(or_(*patterns))
+        .order_by(matched.desc(), func.length(CatalogItem.name_normalized), CatalogItem.id)
+        .limit(MAX_CANDIDATES)
+    ).scalars().all()
+
+    scored = [(item, _score(keywords, item.name_normalized)) for item in candidates]
+    scored = [pair for pair in scored if pair[1] >= MIN_SCORE]
+    scored.sort(key=lambda pair: (-pair[1], -SequenceMatcher(None, name, pair[0].name_normalized).ratio()))
+    return scored[:limit]
+
+
+def format_items(items: Iterable) -> str:
+    """Compact catalog lines for the prompt"""
+    lines = []
+    for item in items:
+        parts = [item.name]
+        if item.sku:
+            parts.append(f"SKU: {item.sku}")
+        if item.price:
+            parts.append(f"narx: {item.price}")
+        if item.description:
+            parts.append(item.description[:200])
+        if item.attributes:
+            parts.extend(f"{key}: {value}" for key, value in json.loads(item.attributes).items())
+        if item.image_url:
+            parts.append(f"rasm: {item.image_url}")
+        lines.append('- ' + ' | '.join(parts))
+    return '\n'.join(lines)
+
+
+def is_price_question(text: str) -> bool:
+    text = (text or '').lower()
+    return any(word in text for word in PRICE_QUESTION_WORDS)
+
+
+def direct_answer(bot_id: int, query: str, language: str = 'uz') -> Optional[str]:
+    """
+    Answer "how much is X?" straight from the catalog
+
+    Only when exactly one product clearly matches and it has a price;
+    anything less certain goes to Gemini with the matched rows.
+    """
+    if os.environ.get("CATALOG_DIRECT_ANSWERS", "true").lower() != "true" or not is_price_question(query):
+        return None
+
+    matches = search_catalog(bot_id, query, limit=2)
+    if not matches or matches[0][1] < 0.8 or not matches[0][0].price:
+        return None
+    if len(matches) > 1 and matches[0][1] - matches[1][1] < 0.2:
+        return None
+
+    item = matches[0][0]
+    templates = {
+        'uz': "{name} narxi: {price}",
+        'ru': "Цена {name}: {price}",
+        'en': "{name} price: {price}",
+    }
+    answer = templates.get(language, templates['uz']).format(name=item.name, price=item.price)
+    if item.image_url:
+        answer += f"\n{item.image_url}"
+    return answer
@@ -0,0 +1,203 @@
+"""
+Per-bot change feed of new messages (live inbox)
+Yangi xabarlar oqimi - operator sahifasi uchun real vaqt yangilanishlari
+
+Every Message insert writes a ConversationEvent row in the same flush (one
+INSERT ... SELECT, see record_message_events), so the log is exactly as
+durable as the messages. Event ids are the resume tokens clients send back
+(SSE Last-Event-ID or the long-poll `after`).
+
+Waiting clients cost no queries: one watcher thread per process reads the
+newest event id per bot above the lowest waiting token (one small query
+every CHANGE_FEED_POLL_SECONDS, only while someone is waiting) and wakes the
+clients of bots that moved.
+Events committed by this process wake them at once. Clients then read
+their new events with one indexed query.
+
+Each waiting client holds a request thread, and gunicorn has GUNICORN_THREADS
+per worker for webhooks and pages too: at most CHANGE_FEED_MAX_STREAMS streams
+and long polls wait at a time per process (open_stream). Past that, streams
+are refused with 503 and long polls answer at once (a short poll).
+
+Events older than CHANGE_FEED_RETENTION_HOURS are pruned by the scheduler.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.orm import Session
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    """Newest event id per bot, and waiting for it to move"""
+
+    def __init__(self, poll_seconds: float = None, max_streams: int = None):
+        self.poll_seconds = poll_seconds or float(os.environ.get("CHANGE_FEED_POLL_SECONDS", 1))
+        # Default: a quarter of the request threads
+        self.max_streams = max_streams or int(os.environ.get("CHANGE_FEED_MAX_STREAMS") or
+                                              max(1, int(os.environ.get("GUNICORN_THREADS", 8)) // 4))
+        self._condition = threading.Condition()
+        self._streams = 0
+        # bot_id -> newest event id seen by this process
+        self._latest: Dict[int, int] = {}
+        # Event id the watcher has read up to (never above a waiter's token)
+        self._cursor = None
+        self._waiters = 0
+        self._pid = None
+
+    def _ensure_watcher(self) -> None:
+        # Called with the condition held; gunicorn forks after the app is loaded
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._latest.clear()
+            self._cursor = None
+            threading.Thread(target=self._watch, name='change-feed', daemon=True).start()
+
+    def publish(self, events: Dict[int, int]) -> None:
+        """bot_id -> newest event id, committed by this process"""
+        with self._condition:
+            for bot_id, event_id in events.items():
+                if event_id > self._latest.get(bot_id, 0):
+                    self._latest[bot_id] = event_id
+            self._condition.notify_all()
+
+    def open_stream(self) -> bool:
+        """Take one of the process's stream slots; False when all are held"""
+        with self._condition:
+            if self._streams >= self.max_streams:
+                metrics.incr('change_feed_streams_rejected_total')
+                return False
+            self._streams += 1
+            metrics.set_gauge('change_feed_streams', self._streams)
+            return True
+
+    def close_stream(self) -> None:
+        with self._condition:
+            self._streams -= 1
+            metrics.set_gauge('change_feed_streams', self._streams)
+
+    def wait(self, bot_id: int, after: int, timeout: float) -> bool:
+        """Block until the bot has an event newer than `after`; False on timeout"""
+        with self._condition:
+            self._ensure_watcher()
+            if self._cursor is None or after < self._cursor:
+                self._cursor = after
+            self._waiters += 1
+            metrics.set_gauge('change_feed_waiters', self._waiters)
+            try:
+                return self._condition.wait_for(lambda: self._latest.get(bot_id, 0) > after, timeout)
+            finally:
+                self._waiters -= 1
+                metrics.set_gauge('change_feed_waiters', self._waiters)
+
+    def read(self, bot_id: int, after: int, limit: int = 100) -> List[Dict]:
+        """Events of the bot after the resume token, oldest first"""
+        from app import db
+        from models import ConversationEvent
+
+        table = ConversationEvent.__table__
+        with db.engine.connect() as connection:
+            rows = connection.execute(
+                select(table).where(table.c.bot_id == bot_id, table.c.id > after)
+                .order_by(table.c.id).limit(limit)
+            ).all()
+        metrics.incr('change_feed_reads_total')
+        if rows:
+            self.publish({bot_id: rows[-1].id})
+        return [{
+            'id': row.id,
+            'conversation_id': row.conversation_id,
+            'message_id': row.message_id,
+            'is_from_user': row.is_from_user,
+            'created_at': row.created_at.isoformat(),
+        } for row in rows]
+
+    def latest_id(self, bot_id: int) -> int:
+        """Newest event id of a bot (the token a fresh client starts from)"""
+        from app import db
+        from models import ConversationEvent
+
+        with db.engine.connect() as connection:
+            return connection.execute(
+                select(func.max(ConversationEvent.id)).where(ConversationEvent.bot_id == bot_id)
+            ).scalar() or 0
+
+    def _watch(self) -> None:
+        from app import app, db
+        from models import ConversationEvent
+
+        table = ConversationEvent.__table__
+        while True:
+            time.sleep(self.poll_seconds)
+            if not self._waiters:
+                # Nobody is listening: no queries
+                continue
+            try:
+                with app.app_context(), db.engine.connect() as connection:
+                    rows = connection.execute(
+                        select(table.c.bot_id, func.max(table.c.id)).where(table.c.id > self._cursor)
+                        .group_by(table.c.bot_id)
+                    ).all()
+                metrics.incr('change_feed_watch_queries_total')
+                if rows:
+                    with self._condition:
+                        self._cursor = max(self._cursor, max(newest for _, newest in rows))
+                    self.publish(dict(rows))
+            except Exception as e:
+                logger.error(f"Change feed watcher error: {e}")
+
+
+change_feed = ChangeFeed()
+
+
+@event.listens_for(Session, 'after_flush')
+def record_message_events(session, flush_context):
+    """Write one ConversationEvent per Message inserted by this flush"""
+    from models import Conversation, ConversationEvent, Message
+
+    message_ids = [obj.id for obj in session.new if isinstance(obj, Message)]
+    if not message_ids:
+        return
+    source = select(Conversation.bot_id, Message.conversation_id, Message.id, Message.is_from_user,
+                    func.coalesce(Message.created_at, datetime.utcnow()))\
+        .join(Conversation, Conversation.id == Message.conversation_id)\
+        .where(Message.id.in_(message_ids)).order_by(Message.id)
+    statement = insert(ConversationEvent).from_select(
+        ['bot_id', 'conversation_id', 'message_id', 'is_from_user', 'created_at'], source
+    ).returning(ConversationEvent.bot_id, ConversationEvent.id)
+    pending = session.info.setdefault('conversation_events', {})
+    for bot_id, event_id in session.connection().execute(statement):
+        pending[bot_id] = max(event_id, pending.get(bot_id, 0))
+    metrics.incr('change_feed_events_total', len(message_ids))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_committed(session):
+    pending = session.info.pop('conversation_events', None)
+    if pending:
+        change_feed.publish(pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back(session):
+    session.info.pop('conversation_events', None)
+
+
+def prune_events(retention_hours: float = None) -> int:
+    """Delete events older than the retention window; returns rows deleted"""
+    from app import db
+    from models import ConversationEvent
+
+    hours = retention_hours or float(os.environ.get("CHANGE_FEED_RETENTION_HOURS", 24))
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    deleted = ConversationEvent.query.filter(ConversationEvent.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,355 @@
+"""
+Race-free conversation lookup and creation
+Suhbatni atomik tarzda topish yoki yaratish
+
+Conversations are unique per (bot_id, platform, platform_user_id). Two
+first messages from the same user arriving at once would both miss a
+`.first()` lookup and both insert; here the insert is an
+INSERT ... ON CONFLICT DO NOTHING followed by a read, so whichever request
+loses the race simply picks up the winner's row. ON CONFLICT needs the
+unique key, which databases created before it only get from the migration
+(`flask db upgrade`); until then inserts fall back to one savepoint per row.
+
+conversation_page lists a bot's conversations, most recently active first,
+by keyset: the cursor is the (updated_at, id) of the edge row.
+
+Conversation rows carry a summary of their messages (last_message_at,
+last_message_preview, message_count, unread_count, last_customer_message_at)
+so lists render from the conversation table alone. update_summaries keeps it current in the same
+flush as every Message insert, with one UPDATE of relative increments per
+conversation; `flask messages summaries` rebuilds it from stored messages.
+message_count counts messages as they arrive - retention does not lower it.
+unread_count counts customer messages since the owner last opened the
+conversation (mark_read). last_customer_message_at is the customer's own
+activity: updated_at also moves on replies and broadcasts.
+"""
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, event, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMNS = ['bot_id', 'platform', 'platform_user_id']
+SUMMARY_COLUMNS = ['last_message_at', 'last_message_preview', 'message_count', 'unread_count',
+                   'last_customer_message_at', 'updated_at']
+PREVIEW_LENGTH = 200
+# A missing unique key is looked up again after this long (the migration may have run since)
+UNIQUE_KEY_RECHECK_SECONDS = 60
+
+_unique_key_lock = threading.Lock()
+# (monotonic time, present) of the last lookup
+_unique_key = None
+
+
+def _has_unique_key() -> bool:
+    """Whether the conversation table has a unique constraint or index on KEY_COLUMNS"""
+    global _unique_key
+    from sqlalchemy import inspect
+    from app import db
+
+    with _unique_key_lock:
+        if _unique_key and (_unique_key[1] or time.monotonic() - _unique_key[0] < UNIQUE_KEY_RECHECK_SECONDS):
+            return _unique_key[1]
+    inspector = inspect(db.engine)
+    keys = [constraint['column_names'] for constraint in inspector.get_unique_constraints('conversation')]
+    keys += [index['column_names'] for index in inspector.get_indexes('conversation') if index['unique']]
+    present = any(set(columns) == set(KEY_COLUMNS) for columns in keys)
+    if not present:
+        logger.warning("conversation has no unique key on (bot_id, platform, platform_user_id); "
+                       "run `flask db upgrade` - inserting without ON CONFLICT until then")
+    with _unique_key_lock:
+        _unique_key = (time.monotonic(), present)
+    return present
+
+
+def _insert_ignoring_conflicts(rows):
+    """Insert conversation rows, skipping the ones that already exist; returns rows inserted"""
+    from app import db
+    from models import Conversation
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql' and _has_unique_key():
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite' and _has_unique_key():
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        # No ON CONFLICT (or no unique key for it to use): one savepoint per row
+        inserted = 0
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(Conversation(**row))
+                inserted += 1
+            except IntegrityError:
+                pass
+        return inserted
+
+    # A multi-row VALUES needs the same columns in every row
+    columns = set().union(*rows)
+    rows = [{column: row.get(column) for column in columns} for row in rows]
+    statement = insert(Conversation).values(rows).on_conflict_do_nothing(index_elements=KEY_COLUMNS)
+    return db.session.execute(statement).rowcount
+
+
+def _row(bot_id: int, platform: str, platform_user_id: str, defaults: Dict) -> Dict:
+    now = datetime.utcnow()
+    row = {'platform_username': None, 'language': 'uz', 'is_active': True, 'created_at': now, 'updated_at': now}
+    row.update(defaults)
+    row.update(bot_id=bot_id, platform=platform, platform_user_id=str(platform_user_id))
+    return row
+
+
+def get_or_create_conversation(bot_id: int, platform: str, platform_user_id,
+                               **defaults) -> Tuple[object, bool]:
+    """The user's conversation and whether this call created it
+
+    `defaults` (platform_username, language, ...) are only used for a new row.
+    Creating commits the session.
+    """
+    from app import db
+    from models import Conversation
+
+    lookup = Conversation.query.filter_by(bot_id=bot_id, platform=platform, platform_user_id=str(platform_user_id))
+    conversation = lookup.first()
+    if conversation is not None:
+        return conversation, False
+
+    created = _insert_ignoring_conflicts([_row(bot_id, platform, platform_user_id, defaults)]) == 1
+    db.session.commit()
+    return lookup.one(), created
+
+
+def get_or_create_conversations(bot_id: int, platform: str,
+                                users: Dict[str, Dict]) -> Dict[str, object]:
+    """Conversations of many users at once: {platform_user_id: defaults} -> {platform_user_id: Conversation}
+
+    One query for the existing rows, one insert for the missing ones. Creating commits the session.
+    """
+    from app import db
+    from models import Conversation
+
+    def load(user_ids):
+        return {
+            conversation.platform_user_id: conversation
+            for conversation in Conversation.query.filter(
+                Conversation.bot_id == bot_id,
+                Conversation.platform == platform,
+                Conversation.platform_user_id.in_(user_ids)
+            )
+        }
+
+    conversations = load([str(user_id) for user_id in users])
+    missing = [str(user_id) for user_id in users if str(user_id) not in conversations]
+    if missing:
+        _insert_ignoring_conflicts([_row(bot_id, platform, user_id, users.get(user_id) or {})
+                                    for user_id in missing])
+        db.session.commit()
+        conversations.update(load(missing))
+    return conversations
+
+
+def encode_cursor(conversation) -> str:
+    """Opaque page cursor of a conversation row"""
+    return f"{conversation.updated_at.isoformat()}~{conversation.id}"
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    try:
+        updated_at, conversation_id = cursor.rsplit('~', 1)
+        return datetime.fromisoformat(updated_at), int(conversation_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def conversation_page(bot_id: int, before: Optional[str] = None, after: Optional[str] = None,
+                      limit: int = 20, active_only: bool = False) -> Tuple[List, bool]:
+    """A bot's conversations, most recently active first, and whether more lie beyond the page
+
+    `before` continues the list downwards (older activity); `after` returns
+    the conversations active since that cursor, for polling. Invalid cursors
+    are ignored.
+    """
+    from sqlalchemy import and_, or_
+    from models import Conversation
+
+    query = Conversation.query.filter(Conversation.bot_id == bot_id)
+    if active_only:
+        query = query.filter(Conversation.is_active.is_(True))
+    key = decode_cursor(after) if after else None
+    if key is not None:
+        updated_at, conversation_id = key
+        rows = query.filter(or_(
+            Conversation.updated_at > updated_at,
+            and_(Conversation.updated_at == updated_at, Conversation.id > conversation_id)
+        )).order_by(Conversation.updated_at.asc(), Conversation.id.asc()).limit(limit + 1).all()
+        return rows[:limit][::-1], len(rows) > limit
+
+    key = decode_cursor(before) if before else None
+    if key is not None:
+        updated_at, conversation_id = key
+        query = query.filter(or_(
+            Conversation.updated_at < updated_at,
+            and_(Conversation.updated_at == updated_at, Conversation.id < conversation_id)
+        ))
+    rows = query.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def conversation_counts(bot_ids: List[int]) -> Dict[int, int]:
+    """Number of conversations of each bot, one grouped query"""
+    from app import db
+    from models import Conversation
+
+    if not bot_ids:
+        return {}
+    return dict(db.session.query(Conversation.bot_id, func.count(Conversation.id))
+                .filter(Conversation.bot_id.in_(bot_ids)).group_by(Conversation.bot_id))
+
+
+def latest_conversations(bot_ids: List[int], limit: int = 5) -> Dict[int, List]:
+    """Each bot's `limit` most recently active conversations, one query
+
+    Rows carry only the columns list views show (no ORM instances to load).
+    """
+    from app import db
+    from models import Conversation
+
+    if not bot_ids:
+        return {}
+    rank = func.row_number().over(partition_by=Conversation.bot_id,
+                                  order_by=(Conversation.updated_at.desc(), Conversation.id.desc()))
+    ranked = select(Conversation.id, Conversation.bot_id, Conversation.platform, Conversation.platform_user_id,
+                    Conversation.platform_username, Conversation.language, Conversation.updated_at,
+                    Conversation.message_count, rank.label('rank'))\
+        .where(Conversation.bot_id.in_(bot_ids)).subquery()
+    rows = db.session.execute(
+        select(ranked).where(ranked.c.rank <= limit).order_by(ranked.c.bot_id, ranked.c.rank)
+    )
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row.bot_id, []).append(row)
+    return grouped
+
+
+def message_preview(content: Optional[str]) -> str:
+    """One-line preview of a message, at most PREVIEW_LENGTH characters"""
+    text = ' '.join((content or '').split())
+    return text if len(text) <= PREVIEW_LENGTH else text[:PREVIEW_LENGTH - 1] + '…'
+
+
+@event.listens_for(Session, 'after_flush')
+def update_summaries(session, flush_context):
+    """Fold the messages inserted by this flush into their conversations' summary columns"""
+    from models import Conversation, Message
+
+    groups = {}
+    for obj in session.new:
+        if isinstance(obj, Message):
+            groups.setdefault(obj.conversation_id, []).append(obj)
+    if not groups:
+        return
+
+    table = Conversation.__table__
+    connection = session.connection()
+    for conversation_id, messages in groups.items():
+        last = max(messages, key=lambda message: message.id)
+        last_at = last.created_at or datetime.utcnow()
+        # Out-of-order commits must not put an older message in front
+        newer = or_(table.c.last_message_at.is_(None), table.c.last_message_at <= last_at)
+        values = dict(
+            message_count=func.coalesce(table.c.message_count, 0) + len(messages),
+            unread_count=func.coalesce(table.c.unread_count, 0) + sum(1 for m in messages if m.is_from_user),
+            last_message_at=case((newer, last_at), else_=table.c.last_message_at),
+            last_message_preview=case((newer, message_preview(last.content)), else_=table.c.last_message_preview),
+        )
+        customer = [message.created_at or datetime.utcnow() for message in messages if message.is_from_user]
+        if customer:
+            customer_at = max(customer)
+            values['last_customer_message_at'] = case(
+                (or_(table.c.last_customer_message_at.is_(None), table.c.last_customer_message_at < customer_at),
+                 customer_at),
+                else_=table.c.last_customer_message_at)
+        connection.execute(update(table).where(table.c.id == conversation_id).values(**values))
+        # Loaded instances would show the values from before the increment
+        conversation = session.identity_map.get(session.identity_key(Conversation, conversation_id))
+        if conversation is not None:
+            session.expire(conversation, SUMMARY_COLUMNS)
+
+
+def mark_read(conversation) -> None:
+    """Reset the unread counter once the owner has seen the conversation (commits)"""
+    from app import db
+    from models import Conversation
+
+    if not conversation.unread_count:
+        return
+    # Reading is not activity: keep updated_at (and the conversation's place in lists)
+    Conversation.query.filter(Conversation.id == conversation.id).update(
+        {'unread_count': 0, 'updated_at': Conversation.updated_at}, synchronize_session=False)
+    db.session.commit()
+
+
+def backfill_summaries(batch_size: int = 500) -> int:
+    """Recompute every conversation's summary from its stored messages; returns conversations updated
+
+    Works in id order, one transaction per `batch_size` conversations.
+    unread_count is left alone - what the owner has read is not recorded anywhere else.
+    """
+    from app import db
+    from models import Conversation
+    from services.message_partitions import message_partitions
+
+    tables = message_partitions.storage_tables()
+    updated = 0
+    last_id = 0
+    while True:
+        ids = [row[0] for row in db.session.execute(
+            select(Conversation.id).where(Conversation.id > last_id).order_by(Conversation.id).limit(batch_size)
+        )]
+        if not ids:
+            return updated
+
+        counts = dict.fromkeys(ids, 0)
+        latest = {}
+        customer_at = {}
+        for table in tables:
+            for conversation_id, count, newest_id, newest_customer in db.session.execute(
+                select(table.c.conversation_id, func.count(), func.max(table.c.id),
+                       func.max(case((table.c.is_from_user.is_(True), table.c.created_at))))
+                .where(table.c.conversation_id.in_(ids)).group_by(table.c.conversation_id)
+            ):
+                counts[conversation_id] += count
+                latest[conversation_id] = max(newest_id, latest.get(conversation_id, 0))
+                if newest_customer is not None:
+                    customer_at[conversation_id] = max(newest_customer, customer_at.get(conversation_id, newest_customer))
+
+        last_messages = {}
+        for table in tables:
+            for row in db.session.execute(
+                select(table.c.conversation_id, table.c.content, table.c.created_at)
+                .where(table.c.id.in_(list(latest.values())))
+            ):
+                last_messages[row.conversation_id] = row
+
+        table = Conversation.__table__
+        for conversation_id in ids:
+            last = last_messages.get(conversation_id)
+            db.session.execute(update(table).where(table.c.id == conversation_id).values(
+                message_count=counts[conversation_id],
+                last_message_at=last.created_at if last else None,
+                last_message_preview=message_preview(last.content) if last else None,
+                last_customer_message_at=customer_at.get(conversation_id),
+                unread_count=func.coalesce(table.c.unread_count, 0),
+                # A backfill is not activity
+                updated_at=table.c.updated_at,
+            ))
+        db.session.commit()
+        updated += len(ids)
+        last_id = ids[-1]
+        logger.info(f"Conversation summaries rebuilt up to id {last_id}")
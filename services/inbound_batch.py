@@ -0,0 +1,238 @@
+"""
+Batch processing of inbound webhook deliveries
+Webhook orqali kelgan xabarlarni paket holda qayta ishlash (Instagram, WhatsApp)
+
+Meta may deliver many messaging events in one webhook call. The webhook
+parses them, hands the batch to a processor and acknowledges at once. The
+batch is split by sender, and each sender's part runs on a KeyedScheduler
+keyed by (bot_id, sender_id) with <PLATFORM>_WORKER_THREADS threads: one
+sender's deliveries are answered in arrival order, never two at once,
+different senders in parallel. A worker thread then:
+
+1. loads the sender's conversation (upserting it if missing, in its own
+   commit) and its recent history
+2. generates the replies on the async bridge, in message order
+3. stores all messages of the part in one transaction
+4. sends the replies and queues the monitoring notifications
+
+process() takes several senders at once as well; their replies are then
+generated and sent concurrently (<PLATFORM>_BATCH_CONCURRENCY).
+
+Platforms subclass InboundBatchProcessor with their credentials check and
+async send client (abstract methods: a platform missing one fails when its
+processor is created, at import, not on its first delivery).
+"""
+import os
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from services.async_bridge import gather_limited, run_async
+from services.keyed_scheduler import KeyedScheduler
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class InboundMessage:
+    """One text message from a messaging event"""
+    sender_id: str
+    text: str
+    message_id: Optional[str] = None
+    # Profile name, when the platform sends one
+    username: Optional[str] = None
+
+
+@dataclass
+class SenderBatch:
+    """Everything one sender sent in a delivery, with what the bot answered"""
+    sender_id: str
+    messages: List[InboundMessage]
+    conversation: object = None
+    language: str = 'uz'
+    # Oldest first; grows with this batch's exchanges
+    history: List = field(default_factory=list)
+    replies: List[str] = field(default_factory=list)
+
+
+def group_by_sender(messages: List[InboundMessage]) -> List[SenderBatch]:
+    """One SenderBatch per sender, senders and their messages in arrival order"""
+    senders = OrderedDict()
+    for message in messages:
+        senders.setdefault(message.sender_id, []).append(message)
+    return [SenderBatch(sender_id, batch) for sender_id, batch in senders.items()]
+
+
+class InboundBatchProcessor(ABC):
+    """Runs webhook batches outside the request, each sender's in order"""
+
+    # Set by subclasses
+    platform = ''
+    default_username = None
+
+    def __init__(self, threads: Optional[int] = None, concurrency: Optional[int] = None,
+                 history_limit: int = 10):
+        prefix = self.platform.upper()
+        self.threads = threads or int(os.environ.get(f"{prefix}_WORKER_THREADS", 16))
+        self.concurrency = concurrency or int(os.environ.get(f"{prefix}_BATCH_CONCURRENCY", 10))
+        self.history_limit = history_limit
+        self.scheduler = KeyedScheduler(f'{self.platform}_batches', workers=self.threads)
+        self._ai = None
+
+    @property
+    def ai(self):
+        if self._ai is None:
+            from services.async_service import AsyncAIService
+            self._ai = AsyncAIService()
+        return self._ai
+
+    @abstractmethod
+    def is_connected(self, bot) -> bool:
+        """Whether the bot has what it needs to answer on this platform"""
+
+    @abstractmethod
+    def sender_service(self, bot):
+        """Async client with send_message(recipient_id, text), or None when sending is not configured"""
+
+    def submit(self, bot_id: int, messages: List[InboundMessage]) -> List[Future]:
+        """Process a parsed delivery in the background, after the same senders' earlier deliveries"""
+        metrics.incr(f'{self.platform}_events_total', len(messages))
+        return [self.scheduler.submit((bot_id, sender.sender_id), self._run, bot_id, sender.messages)
+                for sender in group_by_sender(messages)]
+
+    def _run(self, bot_id: int, messages: List[InboundMessage]) -> int:
+        from app import app, db
+
+        with app.app_context():
+            try:
+                return self.process(bot_id, messages)
+            except Exception as e:
+                db.session.rollback()
+                metrics.incr(f'{self.platform}_batches_failed_total')
+                logger.error(f"{self.platform.title()} batch error for bot {bot_id}: {e}")
+                return 0
+            finally:
+                db.session.remove()
+                metrics.incr(f'{self.platform}_batches_total')
+
+    def process(self, bot_id: int, messages: List[InboundMessage]) -> int:
+        """Answer, store and send one delivery; returns the number of replies sent"""
+        from app import db
+        from models import Bot
+
+        bot = db.session.get(Bot, bot_id)
+        if bot is None or not self.is_connected(bot):
+            return 0
+        system_prompt = bot.system_prompt
+        senders = group_by_sender(messages)
+        self._load_conversations(bot, senders)
+
+        # AI replies: senders concurrently, each sender's messages in order
+        run_async(gather_limited((self._answer(bot_id, system_prompt, sender) for sender in senders),
+                                 limit=self.concurrency))
+        self._store(senders)
+        sent = self._send(bot, senders)
+        metrics.incr(f'{self.platform}_replies_sent_total', sent)
+        return sent
+
+    def _load_conversations(self, bot, senders: List[SenderBatch]) -> None:
+        from app import db
+        from models import Message
+        from services.conversations import get_or_create_conversations
+        from services.message_partitions import message_partitions
+        from utils.language import detect_language
+
+        usernames = {sender.sender_id: next((m.username for m in sender.messages if m.username), None)
+                     for sender in senders}
+        # Missing conversations are inserted and committed now, not with the messages:
+        # no write transaction stays open while the AI answers
+        conversations = get_or_create_conversations(bot.id, self.platform, {
+            sender.sender_id: {
+                'platform_username': usernames[sender.sender_id] or self.default_username,
+                'language': detect_language(sender.messages[0].text),
+            }
+            for sender in senders
+        })
+        for sender in senders:
+            conversation = sender.conversation = conversations[sender.sender_id]
+            username = usernames[sender.sender_id]
+            if username and conversation.platform_username != username:
+                conversation.platform_username = username
+
+        for sender in senders:
+            sender.language = sender.conversation.language or 'uz'
+            history = message_partitions.recent_messages(sender.conversation.id, limit=self.history_limit)
+            # Detached copies: the loaded rows expire with the commit below
+            sender.history = [Message(content=m.content, is_from_user=m.is_from_user) for m in reversed(history)]
+        # Ends the read transaction too: no pooled connection is held while the AI answers
+        db.session.commit()
+
+    async def _answer(self, bot_id: int, system_prompt, sender: SenderBatch) -> None:
+        from models import Message
+
+        for message in sender.messages:
+            reply = await self.ai.generate_response(
+                message.text, system_prompt, sender.language, bot_id,
+                conversation_history=sender.history[-self.history_limit:] or None
+            )
+            sender.replies.append(reply)
+            sender.history.append(Message(content=message.text, is_from_user=True))
+            sender.history.append(Message(content=reply, is_from_user=False))
+
+    def _store(self, senders: List[SenderBatch]) -> None:
+        from app import db
+        from models import Message
+
+        now = datetime.utcnow()
+        for sender in senders:
+            for message, reply in zip(sender.messages, sender.replies):
+                db.session.add(Message(conversation_id=sender.conversation.id, content=message.text,
+                                       is_from_user=True))
+                db.session.add(Message(conversation_id=sender.conversation.id, content=reply,
+                                       is_from_user=False))
+            sender.conversation.updated_at = now
+        db.session.commit()
+
+    def _send(self, bot, senders: List[SenderBatch]) -> int:
+        service = self.sender_service(bot)
+        if service is None:
+            return 0
+
+        async def send_in_order(sender):
+            # A sender's replies go out in the order of their questions
+            results = []
+            for reply in sender.replies:
+                try:
+                    results.append(await service.send_message(sender.sender_id, reply))
+                except Exception as e:
+                    results.append(e)
+            return results
+
+        results = run_async(gather_limited((send_in_order(sender) for sender in senders), limit=self.concurrency))
+
+        delivered = []
+        for sender, sender_results in zip(senders, results):
+            if isinstance(sender_results, Exception):
+                sender_results = [sender_results] * len(sender.replies)
+            for message, reply, result in zip(sender.messages, sender.replies, sender_results):
+                if isinstance(result, Exception) or not result.success:
+                    logger.error(f"Failed to send {self.platform.title()} message to user {sender.sender_id}: {result}")
+                    continue
+                delivered.append((sender, message, reply, result))
+        self._after_send(bot, delivered)
+        return len(delivered)
+
+    def _after_send(self, bot, delivered: List) -> None:
+        """Called with (sender, message, reply, response) for every reply that went out"""
+        from services.notification_aggregator import notification_aggregator
+
+        for sender, message, reply, _ in delivered:
+            try:
+                notification_aggregator.notify(bot, sender.conversation, message.text, reply, self.platform)
+            except Exception as e:
+                logger.error(f"Monitoring notification error: {e}")
@@ -0,0 +1,43 @@
+"""
+Batch processing of Instagram webhook deliveries
+Instagram webhook xabarlarini paket holda qayta ishlash
+
+The webhook parses the messaging events with parse_events and hands them to
+instagram_batches; see services.inbound_batch for the pipeline.
+"""
+from typing import Dict, List
+
+from services.inbound_batch import InboundBatchProcessor, InboundMessage
+
+
+def parse_events(payload: Dict) -> List[InboundMessage]:
+    """Text messages of a webhook payload, in delivery order (echoes of our own replies skipped)"""
+    messages = []
+    for entry in payload.get('entry') or []:
+        for event in entry.get('messaging') or []:
+            message = event.get('message') or {}
+            sender_id = (event.get('sender') or {}).get('id')
+            if not sender_id or 'text' not in message or message.get('is_echo'):
+                continue
+            messages.append(InboundMessage(str(sender_id), message['text'], message.get('mid')))
+    return messages
+
+
+class InstagramBatchProcessor(InboundBatchProcessor):
+    """Instagram Messaging replies through the Graph API"""
+
+    platform = 'instagram'
+    default_username = 'Instagram User'
+
+    def is_connected(self, bot) -> bool:
+        return bool(bot.instagram_token)
+
+    def sender_service(self, bot):
+        from services.async_service import AsyncInstagramService
+
+        if not bot.instagram_page_id:
+            return None
+        return AsyncInstagramService(bot.instagram_token, bot.instagram_page_id)
+
+
+instagram_batches = InstagramBatchProcessor()
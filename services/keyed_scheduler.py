@@ -0,0 +1,116 @@
+"""
+Keyed task scheduler: ordered per key, concurrent across keys
+Kalit bo'yicha navbat: bitta chat ketma-ket, turli chatlar parallel
+
+Tasks submitted with the same key (e.g. (bot_id, chat_id)) run one at a
+time in submission order; tasks of different keys share a thread pool and
+run in parallel. After each task the key's next task goes to the back of
+the pool queue, so one busy chat cannot starve the others.
+
+Concurrent webhook requests can reach submit() slightly out of order;
+tasks given an `order` (Telegram's update_id) are queued behind the
+waiting tasks of their key with a lower one.
+
+Metrics (prefixed with the scheduler name):
+    <name>_queue_depth{key}   tasks waiting or running for a key (dropped when idle)
+    <name>_keys_active        keys with work
+    <name>_queued             tasks waiting or running in total
+    <name>_tasks_total        finished tasks, <name>_tasks_failed_total the ones that raised
+"""
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Hashable, Optional
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _label(key: Hashable) -> str:
+    """(7, 12345) -> '7:12345'"""
+    return ':'.join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+
+class KeyedScheduler:
+    """Thread pool that serializes tasks sharing a key"""
+
+    def __init__(self, name: str, workers: Optional[int] = None):
+        self.name = name
+        self.workers = workers or int(os.environ.get(f"{name.upper()}_WORKERS", 8))
+        self._lock = threading.Lock()
+        # key -> tasks not yet started; a key is present while one of its tasks runs
+        self._queues: Dict[Hashable, Deque] = {}
+        self._queued = 0
+        self._pid = None
+        self._executor = None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Gunicorn preloads the app and forks: the pool belongs to the process that made it
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+                self._queues.clear()
+                self._queued = 0
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, key: Hashable, fn: Callable, *args, order=None) -> Future:
+        """Run fn(*args) after the earlier (or lower `order`) tasks of `key`"""
+        pool = self._pool()
+        future = Future()
+        task = (future, fn, args, order)
+        with self._lock:
+            queue = self._queues.get(key)
+            start = queue is None
+            if start:
+                self._queues[key] = deque()
+            else:
+                position = len(queue)
+                if order is not None:
+                    while position and queue[position - 1][3] is not None and queue[position - 1][3] > order:
+                        position -= 1
+                queue.insert(position, task)
+            self._queued += 1
+            self._publish(key)
+        if start:
+            pool.submit(self._run, key, task)
+        return future
+
+    def depths(self) -> Dict[Hashable, int]:
+        """Tasks waiting or running per key"""
+        with self._lock:
+            return {key: len(queue) + 1 for key, queue in self._queues.items()}
+
+    def _run(self, key: Hashable, task) -> None:
+        future, fn, args, _ = task
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                metrics.incr(f'{self.name}_tasks_failed_total')
+                logger.error(f"{self.name} task for {key} failed: {e}")
+                future.set_exception(e)
+        metrics.incr(f'{self.name}_tasks_total')
+
+        with self._lock:
+            self._queued -= 1
+            queue = self._queues[key]
+            following = queue.popleft() if queue else None
+            if following is None:
+                del self._queues[key]
+            self._publish(key)
+        if following is not None:
+            self._executor.submit(self._run, key, following)
+
+    def _publish(self, key: Hashable) -> None:
+        # Called with the lock held
+        queue = self._queues.get(key)
+        if queue is None:
+            metrics.clear_gauge(f'{self.name}_queue_depth', key=_label(key))
+        else:
+            metrics.set_gauge(f'{self.name}_queue_depth', len(queue) + 1, key=_label(key))
+        metrics.set_gauge(f'{self.name}_keys_active', len(self._queues))
+        metrics.set_gauge(f'{self.name}_queued', self._queued)
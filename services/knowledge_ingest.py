@@ -0,0 +1,501 @@
+"""
+Streaming knowledge-base ingestion
+Bilim bazasi fayllarini oqim (stream) ko'rinishida o'qib, bo'laklarga ajratish
+
+Every reader is a generator over the saved upload that yields small text
+pieces (a line, a CSV row, a JSON record, a DOCX paragraph, a PDF page).
+`chunk_pieces` packs them into content-defined chunks and `store_chunks`
+writes those to KnowledgeChunk in batches, so memory stays flat no matter
+how large the file is. KnowledgeBase.content only keeps a short preview.
+
+Chunks are addressed by their sha256: re-indexing an edited file keeps
+every unchanged chunk and only inserts and deletes the ones that differ.
+Uploads are processed in the background (services/knowledge_worker.py).
+"""
+import os
+import re
+import csv
+import json
+import zlib
+import time
+import hashlib
+import logging
+import zipfile
+import threading
+from collections import defaultdict
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+from sqlalchemy import and_, case, column, delete, func, insert, literal_column, select, table, text, update
+
+logger = logging.getLogger(__name__)
+
+CHUNK_CHARS = int(os.environ.get("KNOWLEDGE_CHUNK_CHARS", 1500))
+INSERT_BATCH_SIZE = int(os.environ.get("KNOWLEDGE_INSERT_BATCH_SIZE", 200))
+PREVIEW_CHARS = 2000
+READ_BLOCK = 64 * 1024
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# A missing full-text table is looked up again after this long (the migration may have run since)
+FULL_TEXT_RECHECK_SECONDS = 60
+
+_backend_lock = threading.Lock()
+# (monotonic time, backend) of the last lookup
+_backend = None
+
+# Errors a malformed upload can raise while being read
+PARSE_ERRORS = (OSError, KeyError, ElementTree.ParseError, UnicodeError, csv.Error)
+
+
+class IngestError(Exception):
+    """The file cannot be read as a knowledge source"""
+
+
+def _open_text(path: str) -> IO[str]:
+    # utf-8-sig drops the BOM Excel and Notepad like to add
+    return open(path, 'r', encoding='utf-8-sig', errors='replace', newline='')
+
+
+def read_text(path: str) -> Iterator[str]:
+    """Lines of a plain-text file (very long lines arrive in READ_BLOCK pieces)"""
+    with _open_text(path) as f:
+        for line in iter(lambda: f.readline(READ_BLOCK), ''):
+            yield line
+
+
+def csv_rows(path: str) -> Iterator[List[str]]:
+    """Non-empty CSV rows as stripped cells, delimiter sniffed from the first block"""
+    with _open_text(path) as f:
+        sample = f.read(READ_BLOCK)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        for row in csv.reader(f, dialect):
+            cells = [cell.strip() for cell in row]
+            if any(cells):
+                yield cells
+
+
+def read_csv(path: str) -> Iterator[str]:
+    """One comma-joined line per CSV row"""
+    for cells in csv_rows(path):
+        yield ', '.join(cells)
+
+
+def _format_json(value) -> str:
+    if isinstance(value, dict):
+        return '\n'.join(
+            f"{key}: {item if isinstance(item, (str, int, float, bool)) else json.dumps(item, ensure_ascii=False)}"
+            for key, item in value.items()
+        )
+    if isinstance(value, list):
+        return '\n'.join(_format_json(item) for item in value)
+    return '' if value is None else str(value)
+
+
+class _JSONStream:
+    """Incremental top-level JSON reader: decodes one value at a time from a growing buffer"""
+
+    def __init__(self, f: IO[str]):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size: int = READ_BLOCK) -> bool:
+        if self.eof:
+            return False
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return False
+        # Drop what was consumed so the buffer never holds more than one value
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character ('' at end of input)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str) -> bool:
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def value(self):
+        self.peek()
+        size = READ_BLOCK
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number cut off by the block boundary decodes fine - make sure it ended
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise IngestError(f"Invalid JSON: {e}")
+            # Value spans the block boundary: read more, doubling for huge values
+            self._fill(size)
+            size *= 2
+
+
+def read_json(path: str) -> Iterator[str]:
+    """
+    Records of a JSON file without loading the whole document
+
+    A top-level array yields its elements and a top-level object its
+    key/value pairs; values after the first (JSON Lines) follow one by one.
+    """
+    with _open_text(path) as f:
+        stream = _JSONStream(f)
+        first = stream.peek()
+        if first == '[':
+            stream.expect('[')
+            while not stream.expect(']'):
+                if not stream.peek():
+                    raise IngestError("Invalid JSON: unterminated array")
+                yield _format_json(stream.value())
+                stream.expect(',')
+        elif first == '{':
+            stream.expect('{')
+            while not stream.expect('}'):
+                if not stream.peek():
+                    raise IngestError("Invalid JSON: unterminated object")
+                key = stream.value()
+                if not stream.expect(':'):
+                    raise IngestError("Invalid JSON: expected ':' after object key")
+                yield f"{key}: {_format_json(stream.value())}"
+                stream.expect(',')
+        # JSON Lines: further values follow the first one
+        while stream.peek():
+            yield _format_json(stream.value())
+
+
+def read_docx(path: str) -> Iterator[str]:
+    """Paragraphs of a DOCX file, parsed straight from the zip member"""
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise IngestError("Not a valid DOCX file")
+
+    with archive, archive.open('word/document.xml') as xml:
+        ancestors = []
+        texts = []
+        for event, element in ElementTree.iterparse(xml, events=('start', 'end')):
+            if event == 'start':
+                ancestors.append(element)
+                continue
+            ancestors.pop()
+            if element.tag == WORD_NS + 't':
+                texts.append(element.text or '')
+            elif element.tag == WORD_NS + 'tab':
+                texts.append('\t')
+            elif element.tag in (WORD_NS + 'br', WORD_NS + 'cr'):
+                texts.append('\n')
+            elif element.tag == WORD_NS + 'p':
+                yield ''.join(texts)
+                texts = []
+                # Detach finished paragraphs so the tree never grows
+                if ancestors:
+                    ancestors[-1].remove(element)
+
+
+def read_pdf(path: str) -> Iterator[str]:
+    """Text of a PDF, one page at a time"""
+    try:
+        from pypdf import PdfReader
+        from pypdf.errors import PdfReadError
+    except ImportError:
+        raise IngestError("PDF support requires the pypdf package")
+
+    try:
+        reader = PdfReader(path)
+        for page in reader.pages:
+            yield page.extract_text() or ''
+    except PdfReadError as e:
+        raise IngestError(f"Invalid PDF: {e}")
+
+
+READERS = {
+    'txt': read_text,
+    'csv': read_csv,
+    'json': read_json,
+    'docx': read_docx,
+    'pdf': read_pdf,
+}
+
+
+def file_extension(filename: str) -> str:
+    return filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+
+def content_hash(text: str) -> str:
+    """Content address of a chunk or catalog row"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _is_boundary(piece: str, target_chars: int) -> bool:
+    # Cut after a piece with probability len/target, decided by the piece's own bytes:
+    # an edit moves only the boundaries next to it, so later chunks keep their hashes
+    return zlib.crc32(piece.encode('utf-8')) % target_chars < len(piece)
+
+
+def chunk_pieces(pieces: Iterable[str], max_chars: int = CHUNK_CHARS) -> Iterator[str]:
+    """
+    Pack text pieces into content-defined chunks of at most max_chars
+
+    Chunks average max_chars / 2; oversized pieces are split on spaces.
+    """
+    target_chars = max(max_chars // 2, 1)
+    min_chars = max_chars // 8
+    parts = []
+    size = 0
+    for piece in pieces:
+        piece = piece.strip()
+        if not piece:
+            continue
+
+        while len(piece) > max_chars:
+            cut = piece.rfind(' ', 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if parts:
+                yield '\n'.join(parts)
+                parts, size = [], 0
+            yield piece[:cut].rstrip()
+            piece = piece[cut:].lstrip()
+        if not piece:
+            continue
+
+        if parts and size + len(piece) + 1 > max_chars:
+            yield '\n'.join(parts)
+            parts, size = [], 0
+        parts.append(piece)
+        size += len(piece) + 1
+
+        if size >= min_chars and _is_boundary(piece, target_chars):
+            yield '\n'.join(parts)
+            parts, size = [], 0
+
+    if parts:
+        yield '\n'.join(parts)
+
+
+def sync_rows(model, kb, rows: Iterable[Dict], progress: Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+    """
+    Make the rows of `kb` in `model` equal `rows`, matching them by content_hash
+
+    Unchanged rows stay as they are (only a moved chunk gets its new
+    position), new ones are inserted and the rest deleted, all in batches
+    of INSERT_BATCH_SIZE. The caller commits. `progress` is called with the
+    number of rows handled after every insert batch.
+    """
+    from app import db
+
+    has_position = hasattr(model, 'position')
+    columns = [model.id, model.content_hash] + ([model.position] if has_position else [])
+    existing = defaultdict(list)
+    for row in db.session.execute(select(*columns).where(model.knowledge_base_id == kb.id)):
+        existing[row.content_hash].append(row)
+
+    stats = {'total': 0, 'reused': 0, 'inserted': 0, 'deleted': 0}
+    inserts = []
+    moves = []
+    for values in rows:
+        stats['total'] += 1
+        matches = existing.get(values['content_hash'])
+        if matches:
+            row = matches.pop()
+            stats['reused'] += 1
+            if has_position and row.position != values['position']:
+                moves.append({'id': row.id, 'position': values['position']})
+        else:
+            inserts.append(dict(values, knowledge_base_id=kb.id, bot_id=kb.bot_id))
+
+        if len(moves) >= INSERT_BATCH_SIZE:
+            db.session.execute(update(model), moves)
+            moves = []
+        if len(inserts) >= INSERT_BATCH_SIZE:
+            db.session.execute(insert(model), inserts)
+            stats['inserted'] += len(inserts)
+            inserts = []
+            if progress:
+                progress(stats['total'])
+    if moves:
+        db.session.execute(update(model), moves)
+    if inserts:
+        db.session.execute(insert(model), inserts)
+        stats['inserted'] += len(inserts)
+
+    stale = [row.id for matches in existing.values() for row in matches]
+    for start in range(0, len(stale), INSERT_BATCH_SIZE):
+        db.session.execute(delete(model).where(model.id.in_(stale[start:start + INSERT_BATCH_SIZE])))
+    stats['deleted'] = len(stale)
+    return stats
+
+
+def store_chunks(kb, chunks: Iterable[str], progress: Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+    """
+    Index `chunks` as the content of `kb`, reusing the chunks it already has
+
+    Sets kb.content to a short preview and kb.chunk_count; the caller commits.
+    Returns the sync_rows counters.
+    """
+    from models import KnowledgeChunk
+
+    preview = []
+    preview_chars = 0
+
+    def rows():
+        nonlocal preview_chars
+        for position, chunk in enumerate(chunks):
+            if preview_chars < PREVIEW_CHARS:
+                preview.append(chunk[:PREVIEW_CHARS - preview_chars])
+                preview_chars += len(preview[-1]) + 1
+            yield {'position': position, 'content': chunk, 'content_hash': content_hash(chunk),
+                   'search_text': chunk.casefold()}
+
+    stats = sync_rows(KnowledgeChunk, kb, rows(), progress)
+    kb.content = '\n'.join(preview)
+    kb.chunk_count = stats['total']
+    return stats
+
+
+def _reader(path: str, extension: Optional[str]):
+    extension = extension or file_extension(path)
+    reader = READERS.get(extension)
+    if reader is None:
+        raise IngestError(f"Unsupported knowledge file type: {extension or 'unknown'}")
+    return reader
+
+
+def spool_chunks(path: str, extension: Optional[str], spool_path: str) -> int:
+    """
+    Parse and chunk `path` into a JSONL spool file; returns the number of chunks
+
+    Needs neither the app nor the database, so it can run in a worker process.
+    """
+    reader = _reader(path, extension)
+    count = 0
+    try:
+        with open(spool_path, 'w', encoding='utf-8') as spool:
+            for chunk in chunk_pieces(reader(path)):
+                spool.write(json.dumps(chunk, ensure_ascii=False) + '\n')
+                count += 1
+    except PARSE_ERRORS as e:
+        raise IngestError(f"Cannot read {os.path.basename(path)}: {e}")
+    return count
+
+
+def read_spool(spool_path: str) -> Iterator[str]:
+    """Chunks written by spool_chunks"""
+    with open(spool_path, 'r', encoding='utf-8') as spool:
+        for line in spool:
+            yield json.loads(line)
+
+
+def ingest_text(kb, text: str) -> Dict[str, int]:
+    """Chunk text typed into the dashboard"""
+    return store_chunks(kb, chunk_pieces(text.splitlines()))
+
+
+def searchable_files():
+    """
+    Filter for knowledge files whose chunks may be searched
+
+    Indexed files, and replaced files still being re-indexed: their
+    previous version stays in place until the new one is committed.
+    """
+    from models import KnowledgeBase, KnowledgeStatus
+
+    return and_(KnowledgeBase.is_active == True, KnowledgeBase.status != KnowledgeStatus.FAILED,
+                KnowledgeBase.chunk_count > 0)
+
+
+def _full_text_backend() -> str:
+    """'tsvector' (Postgres), 'fts5' (SQLite with the knowledge_chunk_fts table) or 'like'"""
+    global _backend
+    from sqlalchemy import inspect
+    from app import db
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return 'tsvector'
+    if dialect != 'sqlite':
+        return 'like'
+    with _backend_lock:
+        if _backend and (_backend[1] == 'fts5' or time.monotonic() - _backend[0] < FULL_TEXT_RECHECK_SECONDS):
+            return _backend[1]
+    backend = 'fts5' if inspect(db.engine).has_table('knowledge_chunk_fts') else 'like'
+    if backend == 'like':
+        logger.warning("knowledge_chunk_fts is missing (run `flask db upgrade`): knowledge search scans chunks")
+    with _backend_lock:
+        _backend = (time.monotonic(), backend)
+    return backend
+
+
+def search_chunks(bot_id: int, query: str, max_chars: int = PREVIEW_CHARS,
+                  max_terms: int = 5) -> List[Tuple[str, str]]:
+    """
+    Chunks of the bot's active knowledge files that share the most words with `query`
+
+    Words match as prefixes through the full-text index of search_text
+    (casefolded, so Cyrillic and Uzbek match whatever their case): FTS5
+    ranked by bm25 on SQLite, a tsvector GIN index ranked by ts_rank on
+    Postgres. Without an index, a LIKE scan of search_text.
+    Returns (original_filename, content) pairs, best first, within max_chars.
+    """
+    from app import db
+    from models import KnowledgeBase, KnowledgeChunk
+
+    # Longest words first - they are the most selective
+    terms = sorted({word.casefold() for word in re.findall(r'[^\W_]{3,}', query or '')},
+                   key=len, reverse=True)[:max_terms]
+    if not terms:
+        return []
+
+    statement = select(KnowledgeBase.original_filename, KnowledgeChunk.content)\
+        .join(KnowledgeBase, KnowledgeBase.id == KnowledgeChunk.knowledge_base_id)\
+        .where(KnowledgeChunk.bot_id == bot_id, searchable_files())
+    order = (KnowledgeChunk.knowledge_base_id, KnowledgeChunk.position)
+    backend = _full_text_backend()
+    if backend == 'tsvector':
+        # Spelled exactly like the index expression (ix_knowledge_chunk_search), not as bound parameters
+        simple = literal_column("'simple'")
+        document = func.to_tsvector(simple, func.coalesce(KnowledgeChunk.search_text, literal_column("''")))
+        matches = func.to_tsquery(simple, ' | '.join(f'{term}:*' for term in terms))
+        statement = statement.where(document.bool_op('@@')(matches))\
+            .order_by(func.ts_rank(document, matches).desc(), *order)
+    elif backend == 'fts5':
+        fts = table('knowledge_chunk_fts', column('rowid'), column('rank'))
+        statement = statement.join(fts, fts.c.rowid == KnowledgeChunk.id)\
+            .where(text('knowledge_chunk_fts MATCH :terms').bindparams(
+                terms=' OR '.join(f'"{term}"*' for term in terms)))\
+            .order_by(fts.c.rank, *order)
+    else:
+        score = sum(case((KnowledgeChunk.search_text.like(f'%{term}%'), 1), else_=0) for term in terms)
+        statement = statement.where(score > 0).order_by(score.desc(), *order)
+    rows = db.session.execute(statement.limit(10)).all()
+
+    results = []
+    total = 0
+    for filename, content in rows:
+        if total >= max_chars:
+            break
+        content = content[:max_chars - total]
+        results.append((filename, content))
+        total += len(content)
+    return results
@@ -0,0 +1,316 @@
+"""
+Background processing of uploaded knowledge files
+Bilim bazasi fayllarini fonda qayta ishlash
+
+upload_knowledge only saves the file and queues a KnowledgeBase row, so the
+request returns at once. Each web process runs a small thread pool that
+picks queued files up:
+
+1. claim the row with a conditional UPDATE (queued -> processing), so the
+   other web processes and the scheduler sweep never process it twice
+2. parse and chunk the file in a process pool (CPU bound; a JSONL spool
+   file carries the chunks back without holding them in memory)
+3. insert the chunks in batches, committing progress after each one;
+   CSV product catalogs are also indexed row by row (catalog_service)
+4. mark the file indexed and log the revision in KnowledgeVersion, or
+   mark it failed with the error
+
+Re-uploading a file under the same name replaces it: the row keeps its
+id, the version is bumped and only chunks whose content hash changed are
+written (see store_chunks). A replacement that fails leaves the previous
+version in place. Its progress is written on a connection of its own
+after each batch (status_updated_at included), so the sweep does not take
+a long replacement for a dead one.
+
+The scheduler sweep re-submits files still queued after a restart and
+re-queues files stuck in processing (their worker died).
+"""
+import os
+import time
+import logging
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, or_, select, update
+
+from services.catalog_service import spool_catalog, store_catalog
+from services.knowledge_ingest import IngestError, file_extension, read_spool, spool_chunks, store_chunks
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Share of the progress bar given to parsing; inserting chunks fills the rest
+PARSE_PROGRESS = 30
+
+
+def knowledge_file_path(filename: str) -> str:
+    """Where upload_knowledge saved a knowledge file"""
+    from app import app
+    return os.path.join(app.root_path, 'uploads', 'knowledge', filename)
+
+
+def record_version(kb, stats: Dict[str, int]):
+    """Log the revision just indexed; returns the version it replaced (or None)"""
+    from app import db
+    from models import KnowledgeVersion
+
+    previous = KnowledgeVersion.query.filter_by(knowledge_base_id=kb.id)\
+        .order_by(KnowledgeVersion.version.desc()).first()
+    db.session.add(KnowledgeVersion(
+        knowledge_base_id=kb.id,
+        version=kb.version or 1,
+        filename=kb.filename,
+        file_size=kb.file_size,
+        chunk_count=stats['total'],
+        chunks_reused=stats['reused'],
+        chunks_inserted=stats['inserted'],
+        chunks_deleted=stats['deleted']
+    ))
+    return previous
+
+
+def remove_replaced_file(kb, previous) -> None:
+    """Delete the upload of the version `kb` replaced, once the new one is indexed"""
+    if not previous or previous.filename == kb.filename:
+        return
+    try:
+        os.remove(knowledge_file_path(previous.filename))
+    except OSError:
+        pass
+
+
+class KnowledgeWorker:
+    """Thread pool for knowledge files, with a process pool for parsing"""
+
+    def __init__(self, threads: Optional[int] = None, processes: Optional[int] = None,
+                 stale_minutes: Optional[int] = None):
+        self.threads = threads or int(os.environ.get("KNOWLEDGE_WORKER_THREADS", 2))
+        # 0 parses in the worker thread itself
+        self.processes = (processes if processes is not None
+                          else int(os.environ.get("KNOWLEDGE_PARSE_PROCESSES", 2)))
+        self.stale_minutes = stale_minutes or int(os.environ.get("KNOWLEDGE_STALE_MINUTES", 15))
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._parse_pool = None
+
+    def _pools(self):
+        # Gunicorn preloads the app and forks: pools belong to the process that made them
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='knowledge')
+                self._parse_pool = None
+                self._pid = os.getpid()
+            if self._parse_pool is None and self.processes > 0:
+                # spawn, not fork: the web process has threads and open connections
+                self._parse_pool = ProcessPoolExecutor(self.processes, mp_context=get_context('spawn'))
+            return self._executor, self._parse_pool
+
+    def submit(self, kb_id: int):
+        """Process a queued knowledge file in the background"""
+        executor, _ = self._pools()
+        return executor.submit(self._run, kb_id)
+
+    def _run(self, kb_id: int) -> bool:
+        from app import app, db
+
+        with app.app_context():
+            try:
+                return self.process(kb_id)
+            except Exception as e:
+                logger.error(f"Knowledge worker error for file {kb_id}: {e}")
+                return False
+            finally:
+                db.session.remove()
+
+    def claim(self, kb_id: int) -> bool:
+        """Move a queued file to processing; False when someone else got it first"""
+        from app import db
+        from models import KnowledgeBase, KnowledgeStatus
+
+        claimed = db.session.execute(
+            update(KnowledgeBase)
+            .where(KnowledgeBase.id == kb_id, KnowledgeBase.status == KnowledgeStatus.QUEUED)
+            .values(status=KnowledgeStatus.PROCESSING, progress=0, error_message=None,
+                    status_updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        return claimed == 1
+
+    def process(self, kb_id: int) -> bool:
+        """Claim, parse and index one file; True when it was indexed"""
+        from app import db
+        from models import CatalogItem, KnowledgeBase, KnowledgeChunk, KnowledgeStatus
+
+        if not self.claim(kb_id):
+            return False
+
+        kb = db.session.get(KnowledgeBase, kb_id)
+        # A replaced document is re-indexed in one transaction: on failure the
+        # previous version stays intact. First versions commit as they go.
+        incremental = bool(kb.chunk_count)
+        started = time.monotonic()
+        fd, spool_path = tempfile.mkstemp(prefix='knowledge_', suffix='.jsonl')
+        os.close(fd)
+        try:
+            path = knowledge_file_path(kb.filename)
+            extension = file_extension(kb.original_filename)
+            total = self._parse(spool_chunks, path, extension, spool_path)
+            self._set_progress(kb, PARSE_PROGRESS)
+
+            def progress(stored):
+                value = PARSE_PROGRESS + (100 - PARSE_PROGRESS) * stored // max(total, 1)
+                if incremental:
+                    self._heartbeat(kb_id, value)
+                else:
+                    self._set_progress(kb, value)
+
+            stats = store_chunks(kb, read_spool(spool_path), progress)
+
+            # Product catalogs are also indexed row by row
+            if extension == 'csv':
+                self._parse(spool_catalog, path, spool_path)
+                items = store_catalog(kb, read_spool(spool_path))
+                if items['total']:
+                    logger.info(f"Knowledge file {kb.original_filename} is a catalog: {items['total']} products, "
+                                f"{items['inserted']} new, {items['deleted']} removed")
+
+            previous = record_version(kb, stats)
+            kb.status = KnowledgeStatus.INDEXED
+            kb.progress = 100
+            kb.status_updated_at = datetime.utcnow()
+            db.session.commit()
+            remove_replaced_file(kb, previous)
+
+            metrics.incr('knowledge_files_indexed_total')
+            metrics.incr('knowledge_chunks_reused_total', stats['reused'])
+            metrics.set_gauge('knowledge_last_ingest_seconds', round(time.monotonic() - started, 3))
+            logger.info(f"Knowledge file {kb.original_filename} v{kb.version} indexed: {stats['total']} chunks, "
+                        f"{stats['reused']} reused, {stats['inserted']} new, {stats['deleted']} removed")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            metrics.incr('knowledge_files_failed_total')
+            if isinstance(e, IngestError):
+                logger.warning(f"Knowledge file {kb.original_filename} rejected: {e}")
+            else:
+                logger.error(f"Knowledge file {kb.original_filename} failed: {e}")
+
+            if incremental:
+                self._restore_previous_version(kb, e)
+                return False
+
+            # Chunks committed with earlier progress updates must not stay behind
+            db.session.execute(delete(KnowledgeChunk).where(KnowledgeChunk.knowledge_base_id == kb_id))
+            db.session.execute(delete(CatalogItem).where(CatalogItem.knowledge_base_id == kb_id))
+            kb.status = KnowledgeStatus.FAILED
+            kb.error_message = str(e)[:500]
+            kb.chunk_count = 0
+            kb.status_updated_at = datetime.utcnow()
+            db.session.commit()
+            return False
+
+        finally:
+            os.remove(spool_path)
+
+    def _restore_previous_version(self, kb, error: Exception) -> None:
+        """A replacement failed: keep serving the last indexed version"""
+        from app import db
+        from models import KnowledgeStatus, KnowledgeVersion
+
+        failed_filename = kb.filename
+        previous = KnowledgeVersion.query.filter_by(knowledge_base_id=kb.id)\
+            .order_by(KnowledgeVersion.version.desc()).first()
+        if previous:
+            kb.filename = previous.filename
+            kb.file_size = previous.file_size
+            kb.version = previous.version
+        kb.status = KnowledgeStatus.INDEXED
+        kb.progress = 100
+        kb.error_message = f"Yangi versiya yuklanmadi: {error}"[:500]
+        kb.status_updated_at = datetime.utcnow()
+        db.session.commit()
+
+        if previous and failed_filename != previous.filename:
+            try:
+                os.remove(knowledge_file_path(failed_filename))
+            except OSError:
+                pass
+
+    def _parse(self, func, *args) -> int:
+        """Run a spooling parser in the process pool (or inline without one)"""
+        _, parse_pool = self._pools()
+        if parse_pool is None:
+            return func(*args)
+        try:
+            return parse_pool.submit(func, *args).result()
+        except BrokenProcessPool:
+            # A parser process died (e.g. killed for memory); start a fresh pool next time
+            with self._lock:
+                self._parse_pool = None
+            raise
+
+    def _set_progress(self, kb, value: int) -> None:
+        from app import db
+
+        kb.progress = value
+        kb.status_updated_at = datetime.utcnow()
+        db.session.commit()
+
+    def _heartbeat(self, kb_id: int, value: int) -> None:
+        """Progress of a replacement whose transaction stays open, committed on another connection"""
+        from app import db
+        from models import KnowledgeBase
+
+        if db.engine.dialect.name == 'sqlite':
+            # The open replacement holds SQLite's write lock: this would wait for it, and so
+            # does the sweep's re-queue, which cannot take the file away meanwhile
+            return
+        # Only called while the replacement has not written the row itself (that would lock it)
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(KnowledgeBase).where(KnowledgeBase.id == kb_id)
+                .values(progress=value, status_updated_at=datetime.utcnow())
+            )
+
+    def sweep(self) -> List[int]:
+        """Re-queue stuck files and submit queued ones; returns the submitted ids"""
+        from app import db
+        from models import KnowledgeBase, KnowledgeStatus
+
+        now = datetime.utcnow()
+        stale = list(db.session.execute(
+            select(KnowledgeBase.id)
+            .where(KnowledgeBase.status == KnowledgeStatus.PROCESSING,
+                   KnowledgeBase.status_updated_at < now - timedelta(minutes=self.stale_minutes))
+        ).scalars())
+        if stale:
+            db.session.execute(
+                update(KnowledgeBase)
+                .where(KnowledgeBase.id.in_(stale), KnowledgeBase.status == KnowledgeStatus.PROCESSING)
+                .values(status=KnowledgeStatus.QUEUED, status_updated_at=now)
+            )
+            db.session.commit()
+            logger.warning(f"Re-queued {len(stale)} stuck knowledge files")
+
+        # Fresh uploads are already being handled by the process that received them
+        queued = list(db.session.execute(
+            select(KnowledgeBase.id)
+            .where(KnowledgeBase.status == KnowledgeStatus.QUEUED,
+                   or_(KnowledgeBase.status_updated_at < now - timedelta(minutes=1),
+                       KnowledgeBase.id.in_(stale)))
+            .order_by(KnowledgeBase.id)
+            .limit(self.threads * 10)
+        ).scalars())
+        for kb_id in queued:
+            self.submit(kb_id)
+        return queued
+
+
+knowledge_worker = KnowledgeWorker()
@@ -6,7 +6,7 @@ import os
 import sys
 import logging
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Email, To, Content
 
@@ -255,63 +255,59 @@ class MarketingEmailService:
         
         return html_content
 
-def get_trial_expired_users() -> List[Dict]:
+def get_trial_expired_users() -> Iterator[Dict]:
     """
     Sinov muddati tugagan foydalanuvchilarni olish
     
     Returns:
-        List[Dict]: Foydalanuvchilar ro'yxati
+        Iterator[Dict]: Foydalanuvchilar (bo'laklab o'qiladi, xotira doimiy)
     """
-    from models import User, AccessStatus
-    from datetime import datetime
+    from models import User
     
     # Sinov muddati tugagan foydalanuvchilar
-    expired_users = User.query.filter(
+    return _recipients(
         User.is_trial_active == True,
         User.trial_end_date <= datetime.utcnow(),
         User.admin_approved == False,
-        User.is_admin == False,
-        User.email.isnot(None)
-    ).all()
-    
-    return [{'email': user.email, 'name': user.username or user.full_name or 'Foydalanuvchi'} 
-            for user in expired_users if user.email]
+        User.is_admin == False
+    )
 
-def get_active_trial_users() -> List[Dict]:
+def get_active_trial_users() -> Iterator[Dict]:
     """
     Faol sinov foydalanuvchilarini olish
     
     Returns:
-        List[Dict]: Foydalanuvchilar ro'yxati
+        Iterator[Dict]: Foydalanuvchilar (bo'laklab o'qiladi, xotira doimiy)
     """
-    from models import User, AccessStatus
-    from datetime import datetime
+    from models import User
     
     # Faol sinov foydalanuvchilari
-    active_trial_users = User.query.filter(
+    return _recipients(
         User.is_trial_active == True,
         User.trial_end_date > datetime.utcnow(),
-        User.is_admin == False,
-        User.email.isnot(None)
-    ).all()
-    
-    return [{'email': user.email, 'name': user.username or user.full_name or 'Foydalanuvchi'} 
-            for user in active_trial_users if user.email]
+        User.is_admin == False
+    )
 
-def get_all_users() -> List[Dict]:
+def get_all_users() -> Iterator[Dict]:
     """
     Barcha foydalanuvchilarni olish
     
     Returns:
-        List[Dict]: Foydalanuvchilar ro'yxati
+        Iterator[Dict]: Foydalanuvchilar (bo'laklab o'qiladi, xotira doimiy)
     """
     from models import User
     
     # Barcha foydalanuvchilar (adminlarni hisobga olmasdan)
-    all_users = User.query.filter(
-        User.is_admin == False,
-        User.email.isnot(None)
-    ).all()
+    return _recipients(User.is_admin == False)
+
+def _recipients(*conditions) -> Iterator[Dict]:
+    """E-mail and name of the matching users, streamed (columns only, no User objects)"""
+    from sqlalchemy import select
+    from models import User
+    from utils.streaming import iter_rows
     
-    return [{'email': user.email, 'name': user.username or user.full_name or 'Foydalanuvchi'} 
-            for user in all_users if user.email]
\ No newline at end of file
+    statement = select(User.email, User.username, User.full_name).where(
+        User.email.isnot(None), User.email != '', *conditions
+    )
+    for email, username, full_name in iter_rows(statement):
+        yield {'email': email, 'name': username or full_name or 'Foydalanuvchi'}
@@ -0,0 +1,434 @@
+"""
+Time-partitioned Message storage
+Xabarlar jadvalini oylar bo'yicha bo'laklash (partitioning) va bo'laklarni hisobga oluvchi so'rovlar
+
+Postgres: `message` is converted once (`flask messages partition`) into a
+table partitioned by RANGE (created_at) with one partition per month
+(message_YYYY_MM) plus message_default. The planner prunes partitions from
+created_at filters, and retention drops whole partitions instead of
+deleting rows.
+
+SQLite has no native partitioning. Finished months are rotated out of
+`message` into message_YYYY_MM tables with the same columns, and the read
+helpers below prune those tables by name.
+
+Rotation and partition creation run from the scheduler when
+MESSAGE_PARTITIONING=true. The read helpers work with or without it.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, Index, MetaData, Table, delete, func, insert, select, text, union_all
+
+from app import db
+from models import Message
+from services.metrics import metrics
+from utils.helpers import as_date
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r'^message_(\d{4})_(\d{2})$')
+DEFAULT_PARTITION = 'message_default'
+# History lookups try the recent partitions first before reading all of them
+HISTORY_WINDOW_DAYS = 31
+
+Partition = namedtuple('Partition', 'name start end')
+DailyCount = namedtuple('DailyCount', 'date message_count')
+
+
+def partitioning_enabled() -> bool:
+    return os.environ.get("MESSAGE_PARTITIONING", "false").lower() == "true"
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(value: datetime) -> datetime:
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"message_{month:%Y_%m}"
+
+
+def _parse_partition(name: str) -> Optional[Partition]:
+    match = PARTITION_NAME.match(name)
+    if not match:
+        return None
+    start = datetime(int(match.group(1)), int(match.group(2)), 1)
+    return Partition(name, start, next_month(start))
+
+
+class MessagePartitions:
+    """Partition maintenance and partition-aware reads for the message table"""
+
+    # Rotated table list is re-read at most this often (seconds)
+    CACHE_TTL = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._native = {}
+        self._rotated = {}
+        self._tables = {}
+
+    # --- discovery -------------------------------------------------------
+
+    @property
+    def dialect(self) -> str:
+        return db.engine.dialect.name
+
+    def is_native(self) -> bool:
+        """True when `message` is a partitioned Postgres table"""
+        key = str(db.engine.url)
+        if key not in self._native:
+            native = False
+            if self.dialect == 'postgresql':
+                native = bool(db.session.execute(text(
+                    "SELECT 1 FROM pg_partitioned_table pt "
+                    "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'message'"
+                )).scalar())
+            self._native[key] = native
+        return self._native[key]
+
+    def list_partitions(self) -> List[Partition]:
+        """Monthly partitions (Postgres) or rotated tables (SQLite), newest first"""
+        if self.dialect == 'postgresql':
+            if not self.is_native():
+                return []
+            names = db.session.execute(text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'message'::regclass"
+            )).scalars()
+        elif self.dialect == 'sqlite':
+            names = db.session.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'message\\_%' ESCAPE '\\'"
+            )).scalars()
+        else:
+            return []
+        partitions = [p for p in (_parse_partition(name) for name in names) if p]
+        return sorted(partitions, key=lambda p: p.start, reverse=True)
+
+    def rotated_partitions(self) -> List[Partition]:
+        """SQLite month tables the read helpers must include (cached, newest first)"""
+        if self.dialect != 'sqlite':
+            return []
+        key = str(db.engine.url)
+        with self._lock:
+            cached = self._rotated.get(key)
+            if cached and time.monotonic() - cached[0] < self.CACHE_TTL:
+                return cached[1]
+        partitions = self.list_partitions()
+        with self._lock:
+            self._rotated[key] = (time.monotonic(), partitions)
+        return partitions
+
+    def _invalidate(self) -> None:
+        with self._lock:
+            self._rotated.clear()
+            self._native.clear()
+
+    def table(self, name: str) -> Table:
+        """Core table with the message columns under another name (no foreign keys)"""
+        if name not in self._tables:
+            columns = [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+                       for c in Message.__table__.columns]
+            self._tables[name] = Table(name, MetaData(), *columns)
+        return self._tables[name]
+
+    def storage_tables(self) -> List[Table]:
+        """Every table holding message rows - the partitioned parent covers all its partitions"""
+        return [Message.__table__] + [self.table(p.name) for p in self.rotated_partitions()]
+
+    def _sources(self, since: Optional[datetime] = None) -> List[Table]:
+        # Rotated months that end before `since` cannot hold matching rows
+        tables = [Message.__table__]
+        for partition in self.rotated_partitions():
+            if since is None or partition.end > since:
+                tables.append(self.table(partition.name))
+        return tables
+
+    # --- partition-aware reads -------------------------------------------
+
+    def recent_messages(self, conversation_id: int, limit: int = 10) -> List[Message]:
+        """Latest `limit` messages of a conversation, newest first"""
+        query = Message.query.filter_by(conversation_id=conversation_id)
+
+        if self.dialect == 'postgresql' and self.is_native():
+            # Recent window first, so only the newest partitions are touched
+            since = datetime.utcnow() - timedelta(days=HISTORY_WINDOW_DAYS)
+            messages = query.filter(Message.created_at >= since)\
+                            .order_by(Message.created_at.desc()).limit(limit).all()
+            if len(messages) >= limit:
+                return messages
+
+        messages = query.order_by(Message.created_at.desc()).limit(limit).all()
+
+        # Older messages may have been rotated out of the live table
+        for partition in self.rotated_partitions():
+            if len(messages) >= limit:
+                break
+            table = self.table(partition.name)
+            stmt = select(*table.c).where(table.c.conversation_id == conversation_id)\
+                .order_by(table.c.created_at.desc()).limit(limit - len(messages))
+            messages.extend(db.session.execute(select(Message).from_statement(stmt)).scalars())
+        return messages
+
+    def latest_messages(self, conversation_ids: List[int], limit: int = 10, from_user: Optional[bool] = None,
+                        since: Optional[datetime] = None) -> Dict[int, List[Message]]:
+        """Latest `limit` messages of each conversation, oldest first - one query for all of them
+
+        Optionally only the customer's (from_user=True) or the bot's messages, created at/after `since`.
+        """
+        if not conversation_ids:
+            return {}
+
+        def source(table):
+            stmt = select(*table.c).where(table.c.conversation_id.in_(conversation_ids))
+            if from_user is not None:
+                stmt = stmt.where(table.c.is_from_user.is_(from_user))
+            if since is not None:
+                stmt = stmt.where(table.c.created_at >= since)
+            return stmt
+
+        sources = [source(t) for t in self._sources(since)]
+        rows = (sources[0] if len(sources) == 1 else union_all(*sources)).subquery()
+        rank = func.row_number().over(partition_by=rows.c.conversation_id, order_by=rows.c.id.desc())
+        ranked = select(rows, rank.label('rank')).subquery()
+        stmt = select(*(ranked.c[c.name] for c in Message.__table__.columns))\
+            .where(ranked.c.rank <= limit).order_by(ranked.c.conversation_id, ranked.c.id)
+        grouped = defaultdict(list)
+        for message in db.session.execute(select(Message).from_statement(stmt)).scalars():
+            grouped[message.conversation_id].append(message)
+        return dict(grouped)
+
+    def conversation_messages(self, conversation_id: int) -> List[Message]:
+        """All messages of a conversation, oldest first"""
+        tables = self._sources()
+        if len(tables) == 1:
+            return Message.query.filter_by(conversation_id=conversation_id)\
+                                .order_by(Message.created_at.asc()).all()
+        stmt = union_all(*(select(*t.c).where(t.c.conversation_id == conversation_id) for t in tables))
+        stmt = select(stmt.subquery()).order_by(text('created_at'))
+        return list(db.session.execute(select(Message).from_statement(stmt)).scalars())
+
+    def message_page(self, conversation_id: int, before_id: Optional[int] = None,
+                     after_id: Optional[int] = None, limit: int = 20) -> List[Message]:
+        """Keyset page of a conversation, oldest first: the `limit` messages just below
+        `before_id`, just above `after_id`, or the newest ones when neither is given"""
+        newer = after_id is not None
+
+        def page(table):
+            stmt = select(*table.c).where(table.c.conversation_id == conversation_id)
+            if newer:
+                return stmt.where(table.c.id > after_id).order_by(table.c.id.asc()).limit(limit)
+            if before_id is not None:
+                stmt = stmt.where(table.c.id < before_id)
+            return stmt.order_by(table.c.id.desc()).limit(limit)
+
+        tables = self._sources()
+        if len(tables) == 1:
+            stmt = page(Message.__table__)
+        else:
+            # Each table's page, then the page of their union
+            pages = union_all(*(select(page(t).subquery()) for t in tables)).subquery()
+            stmt = select(pages).order_by(pages.c.id.asc() if newer else pages.c.id.desc()).limit(limit)
+        messages = list(db.session.execute(select(Message).from_statement(stmt)).scalars())
+        return messages if newer else messages[::-1]
+
+    def count_messages(self, since: Optional[datetime] = None) -> int:
+        """Number of messages, optionally only those created at/after `since`"""
+        total = 0
+        for table in self._sources(since):
+            stmt = select(func.count()).select_from(table)
+            if since is not None:
+                stmt = stmt.where(table.c.created_at >= since)
+            total += db.session.execute(stmt).scalar() or 0
+        return total
+
+    def daily_message_counts(self, since: datetime) -> List[DailyCount]:
+        """Messages per day since `since`, oldest day first"""
+        counts = defaultdict(int)
+        for table in self._sources(since):
+            day = func.date(table.c.created_at)
+            rows = db.session.execute(
+                select(day, func.count()).where(table.c.created_at >= since).group_by(day)
+            ).all()
+            for value, count in rows:
+                counts[as_date(value)] += count
+        return [DailyCount(day, counts[day]) for day in sorted(counts)]
+
+    # --- maintenance -----------------------------------------------------
+
+    def ensure_partitions(self, months_ahead: int = 2, now: Optional[datetime] = None) -> List[str]:
+        """Create this month's and the next months' Postgres partitions"""
+        if not self.is_native():
+            return []
+        existing = {p.name for p in self.list_partitions()}
+        created = []
+        month = month_start(now or datetime.utcnow())
+        for _ in range(months_ahead + 1):
+            name = partition_name(month)
+            if name not in existing:
+                self._create_pg_partition(month)
+                created.append(name)
+            month = next_month(month)
+        db.session.commit()
+        if created:
+            logger.info(f"Created message partitions: {', '.join(created)}")
+        return created
+
+    def _create_pg_partition(self, month: datetime) -> None:
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF message "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+        ))
+
+    def convert(self, batch_size: int = 50000, months_ahead: int = 2) -> int:
+        """
+        Convert a plain Postgres `message` table into a monthly partitioned one
+
+        The swap is one short transaction, so new messages go to the
+        partitioned table right away. Old rows are then copied across in
+        id batches and the legacy table is dropped. Returns rows copied.
+        """
+        if self.dialect != 'postgresql':
+            raise RuntimeError("Native partitioning needs Postgres; SQLite uses rotate()")
+        if self.is_native():
+            return 0
+
+        oldest = db.session.execute(text("SELECT min(created_at) FROM message")).scalar()
+        db.session.execute(text("LOCK TABLE message IN ACCESS EXCLUSIVE MODE"))
+        db.session.execute(text("ALTER TABLE message RENAME TO message_legacy"))
+        db.session.execute(text("ALTER INDEX IF EXISTS message_pkey RENAME TO message_legacy_pkey"))
+        db.session.execute(text(
+            "ALTER INDEX IF EXISTS ix_message_conversation_created RENAME TO ix_message_legacy_conversation_created"
+        ))
+        db.session.execute(text(
+            "ALTER INDEX IF EXISTS ix_message_conversation_id RENAME TO ix_message_legacy_conversation_id"
+        ))
+        sequence = db.session.execute(text("SELECT pg_get_serial_sequence('message_legacy', 'id')")).scalar()
+        db.session.execute(text(
+            "CREATE TABLE message (LIKE message_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+        ))
+        db.session.execute(text("ALTER TABLE message ALTER COLUMN created_at SET NOT NULL"))
+        db.session.execute(text("ALTER TABLE message ALTER COLUMN created_at SET DEFAULT (now() AT TIME ZONE 'utc')"))
+        db.session.execute(text("ALTER TABLE message ADD PRIMARY KEY (id, created_at)"))
+        db.session.execute(text(
+            "ALTER TABLE message ADD FOREIGN KEY (conversation_id) REFERENCES conversation (id)"
+        ))
+        db.session.execute(text(
+            "CREATE INDEX ix_message_conversation_created ON message (conversation_id, created_at)"
+        ))
+        db.session.execute(text("CREATE INDEX ix_message_conversation_id ON message (conversation_id, id)"))
+        if sequence:
+            # Keep the id sequence alive when the legacy table is dropped
+            db.session.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY message.id"))
+
+        month = month_start(oldest or datetime.utcnow())
+        last = next_month(month_start(datetime.utcnow()))
+        for _ in range(months_ahead - 1):
+            last = next_month(last)
+        while month <= last:
+            self._create_pg_partition(month)
+            month = next_month(month)
+        db.session.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF message DEFAULT"))
+        db.session.commit()
+        self._invalidate()
+        logger.info("message table swapped for a partitioned table, copying old rows")
+
+        copied = 0
+        last_id = 0
+        columns = ', '.join(c.name for c in Message.__table__.columns if c.name != 'created_at')
+        while True:
+            ids = db.session.execute(text(
+                "SELECT id FROM message_legacy WHERE id > :last_id ORDER BY id LIMIT :limit"
+            ), {'last_id': last_id, 'limit': batch_size}).scalars().all()
+            if not ids:
+                break
+            db.session.execute(text(
+                f"INSERT INTO message ({columns}, created_at) "
+                f"SELECT {columns}, COALESCE(created_at, now() AT TIME ZONE 'utc') FROM message_legacy "
+                f"WHERE id >= :first AND id <= :last"
+            ), {'first': ids[0], 'last': ids[-1]})
+            db.session.commit()
+            copied += len(ids)
+            last_id = ids[-1]
+            metrics.set_gauge('message_partition_convert_copied', copied)
+        db.session.execute(text("DROP TABLE message_legacy"))
+        db.session.commit()
+        logger.info(f"Message partitioning conversion finished, {copied} rows copied")
+        return copied
+
+    def rotate(self, now: Optional[datetime] = None, batch_size: int = 5000) -> int:
+        """SQLite: move rows from finished months into message_YYYY_MM tables; returns rows moved"""
+        if self.dialect != 'sqlite':
+            return 0
+        live = Message.__table__
+        current_month = month_start(now or datetime.utcnow())
+        # The newest row stays so SQLite never reuses ids of rotated rows
+        max_id = db.session.execute(select(func.max(live.c.id))).scalar()
+        if not max_id:
+            return 0
+
+        moved = 0
+        while True:
+            rows = db.session.execute(
+                select(live.c.id, live.c.created_at)
+                .where(live.c.created_at < current_month, live.c.id < max_id)
+                .order_by(live.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            by_month = defaultdict(list)
+            for row in rows:
+                by_month[month_start(row.created_at)].append(row.id)
+            for month, ids in by_month.items():
+                table = self.table(partition_name(month))
+                table.create(db.session.connection(), checkfirst=True)
+                Index(f'ix_{table.name}_conversation_created', table.c.conversation_id, table.c.created_at)\
+                    .create(db.session.connection(), checkfirst=True)
+                Index(f'ix_{table.name}_conversation_id', table.c.conversation_id, table.c.id)\
+                    .create(db.session.connection(), checkfirst=True)
+                db.session.execute(insert(table).from_select(
+                    [c.name for c in live.c], select(*live.c).where(live.c.id.in_(ids))
+                ))
+            db.session.execute(delete(live).where(live.c.id.in_([row.id for row in rows])))
+            db.session.commit()
+            moved += len(rows)
+
+        if moved:
+            self._invalidate()
+            metrics.incr('message_partition_rotated_total', moved)
+            logger.info(f"Rotated {moved} messages into monthly tables")
+        return moved
+
+    def drop_partition(self, partition: Partition) -> None:
+        """Drop a whole month of messages"""
+        if self.dialect == 'postgresql':
+            db.session.execute(text(f"ALTER TABLE message DETACH PARTITION {partition.name}"))
+        db.session.execute(text(f"DROP TABLE {partition.name}"))
+        db.session.commit()
+        self._invalidate()
+        metrics.incr('message_partitions_dropped_total')
+        logger.info(f"Dropped message partition {partition.name}")
+
+    def maintain(self, now: Optional[datetime] = None) -> None:
+        """Scheduler entry point: create upcoming partitions (Postgres) or rotate months (SQLite)"""
+        if self.dialect == 'postgresql':
+            if self.is_native():
+                self.ensure_partitions(now=now)
+            else:
+                logger.warning("MESSAGE_PARTITIONING is on but message is not partitioned yet - "
+                               "run `flask messages partition`")
+        elif self.dialect == 'sqlite':
+            self.rotate(now=now)
+
+
+message_partitions = MessagePartitions()
@@ -0,0 +1,60 @@
+"""
+In-process metrics registry
+Jarayon ichidagi metrikalar - hisoblagichlar va o'lchagichlar
+"""
+import threading
+from typing import Dict
+
+
+def _metric_key(name: str, labels: Dict) -> str:
+    """Build a Prometheus-style key: name{label="value",...}"""
+    if not labels:
+        return name
+    label_str = ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+class MetricsRegistry:
+    """Thread-safe counters and gauges, exposed through the admin metrics API"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+
+    def incr(self, name: str, value: float = 1, **labels) -> None:
+        """Increase a counter"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """Set a gauge to the current value"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def clear_gauge(self, name: str, **labels) -> None:
+        """Drop a gauge (per-key gauges whose key went away)"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges.pop(key, None)
+
+    def get(self, name: str, **labels) -> float:
+        """Read a counter or gauge value (0 if never recorded)"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            if key in self._gauges:
+                return self._gauges[key]
+            return self._counters.get(key, 0)
+
+    def snapshot(self) -> Dict:
+        """Copy of all current values"""
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges)
+            }
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,316 @@
+"""
+Monitoring notifications to the bot owner's Telegram chat and channel
+Monitoring bildirishnomalari: navbat, birlashtirish va soatlik hisobot
+
+Webhooks only format the notification and hand it over; sending happens on
+the async bridge loop, so a customer reply never waits for the monitoring
+copies. Per target chat, queued notifications are merged into as few
+messages as fit Telegram's 4096-character limit, and sends to one chat are
+spaced NOTIFICATION_CHAT_INTERVAL_SECONDS apart (Telegram allows about 20
+messages a minute into a group or channel).
+
+Bot.notification_mode picks when a chat is flushed:
+
+    immediate   as soon as the chat's rate limit allows (bursts get merged)
+    batched     NOTIFICATION_BATCH_SECONDS after the first queued event
+    digest      nothing per message; the hourly scheduler job sends a summary
+                of the conversations customers wrote to in the past hour
+                (send_digests)
+
+Buffers live in each web process, so with several gunicorn workers the
+rate limit holds per worker. What is still queued at shutdown is sent
+before the bridge loop stops.
+"""
+import os
+import html
+import time
+import atexit
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from services.async_bridge import bridge, run_async
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+SEPARATOR = '\n\n➖➖➖➖➖\n\n'
+PLATFORM_EMOJI = {'telegram': '💬', 'instagram': '📸', 'whatsapp': '💚'}
+DIGEST_PERIOD = timedelta(hours=1)
+# Longest HTML entity html.escape produces (&quot;, &#x27;)
+ENTITY_LENGTH = 6
+
+
+def merge_messages(texts: Iterable[str], limit: int = TELEGRAM_MESSAGE_LIMIT,
+                   separator: str = SEPARATOR) -> List[str]:
+    """Pack texts into as few messages of at most `limit` characters as possible, in order"""
+    pages = []
+    current = ''
+    for text in texts:
+        for part in _split(text.strip(), limit):
+            if current and len(current) + len(separator) + len(part) <= limit:
+                current += separator + part
+            else:
+                if current:
+                    pages.append(current)
+                current = part
+    if current:
+        pages.append(current)
+    return pages
+
+
+def _split(text: str, limit: int) -> List[str]:
+    # A single notification longer than the limit: cut at line breaks where possible,
+    # never inside an escaped entity (&amp; cut in two is invalid HTML to Telegram)
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut < limit // 2:
+            cut = limit
+            entity = text.rfind('&', cut - ENTITY_LENGTH + 1, cut)
+            if entity > 0 and ';' not in text[entity:cut]:
+                cut = entity
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip('\n')
+    if text:
+        parts.append(text)
+    return parts
+
+
+def format_notification(bot, conversation, user_message: str, bot_response: str, platform: str) -> str:
+    """Text of one monitoring notification (HTML parse mode, so user text is escaped)"""
+    platform_emoji = PLATFORM_EMOJI.get(platform, '🤖')
+    if conversation.platform_username:
+        username = f"@{conversation.platform_username}"
+    else:
+        username = "Noma'lum"
+
+    return f"""{platform_emoji} {platform.title()} Conversation
+
+👤 Foydalanuvchi: {html.escape(username)}
+🆔 Chat ID: {conversation.platform_user_id}
+🤖 Bot: {html.escape(bot.name)}
+
+📝 Foydalanuvchi xabari:
+{html.escape(user_message or '')}
+
+🤖 Bot javobi:
+{html.escape(bot_response or '')}
+
+🕐 Vaqt: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC"""
+
+
+def notification_targets(bot) -> List[str]:
+    """Chats that receive the bot's monitoring notifications"""
+    return [chat for chat in (bot.admin_chat_id, bot.notification_channel) if chat]
+
+
+@dataclass
+class ChatBuffer:
+    """Notifications waiting for one (bot token, chat)"""
+    token: str
+    chat_id: str
+    events: Deque[str] = field(default_factory=deque)
+    # Merged pages taken from events and not sent yet
+    sending: int = 0
+    # Monotonic time before which nothing may be sent to this chat
+    next_send_at: float = 0.0
+    task: Optional[asyncio.Task] = None
+    # Set to end a batch delay early (drain)
+    wake: Optional[asyncio.Event] = None
+
+
+class NotificationAggregator:
+    """Per-chat notification buffers flushed on the async bridge loop"""
+
+    def __init__(self, batch_seconds: Optional[float] = None, chat_interval: Optional[float] = None,
+                 max_pending: Optional[int] = None):
+        self.batch_seconds = (batch_seconds if batch_seconds is not None
+                              else float(os.environ.get("NOTIFICATION_BATCH_SECONDS", 30)))
+        self.chat_interval = (chat_interval if chat_interval is not None
+                              else float(os.environ.get("NOTIFICATION_CHAT_INTERVAL_SECONDS", 3)))
+        self.max_pending = max_pending or int(os.environ.get("NOTIFICATION_MAX_PENDING", 500))
+        self.digest_conversations = int(os.environ.get("NOTIFICATION_DIGEST_MAX_CONVERSATIONS", 50))
+        # Only touched from the bridge loop
+        self._buffers: Dict[Tuple[str, str], ChatBuffer] = {}
+        self._services = {}
+
+    def notify(self, bot, conversation, user_message: str, bot_response: str, platform: str) -> None:
+        """Queue a monitoring notification for a finished exchange (no-op in digest mode)"""
+        from models import NotificationMode
+
+        targets = notification_targets(bot)
+        if not bot.telegram_token or not targets:
+            return
+        mode = bot.notification_mode or NotificationMode.IMMEDIATE
+        if mode == NotificationMode.DIGEST:
+            return
+
+        text = format_notification(bot, conversation, user_message, bot_response, platform)
+        delay = self.batch_seconds if mode == NotificationMode.BATCHED else 0.0
+        for chat_id in targets:
+            self.enqueue(bot.telegram_token, chat_id, [text], delay)
+
+    def enqueue(self, token: str, chat_id: str, texts: List[str], delay: float = 0.0) -> None:
+        """Queue texts for a chat from any thread; sent within `delay` seconds (rate limit permitting)"""
+        bridge.loop.call_soon_threadsafe(self._add, token, str(chat_id), texts, delay)
+        metrics.incr('notifications_queued_total', len(texts))
+
+    def _add(self, token: str, chat_id: str, texts: List[str], delay: float) -> None:
+        buffer = self._buffers.get((token, chat_id))
+        if buffer is None:
+            buffer = self._buffers[(token, chat_id)] = ChatBuffer(token, chat_id)
+        buffer.events.extend(texts)
+
+        dropped = len(buffer.events) - self.max_pending
+        if dropped > 0:
+            # The owner is not reading this chat fast enough; keep the newest
+            for _ in range(dropped):
+                buffer.events.popleft()
+            buffer.events.appendleft(f"⚠️ {dropped} ta bildirishnoma o'tkazib yuborildi")
+            metrics.incr('notifications_dropped_total', dropped)
+
+        if buffer.task is None or buffer.task.done():
+            buffer.wake = asyncio.Event()
+            buffer.task = asyncio.get_running_loop().create_task(self._flush(buffer, delay))
+        self._update_gauge()
+
+    async def _flush(self, buffer: ChatBuffer, delay: float) -> None:
+        try:
+            await asyncio.wait_for(buffer.wake.wait(), max(delay, buffer.next_send_at - time.monotonic()))
+        except asyncio.TimeoutError:
+            pass
+        while buffer.events:
+            pages = merge_messages(buffer.events)
+            buffer.events.clear()
+            buffer.sending = len(pages)
+            for index, page in enumerate(pages):
+                wait = buffer.next_send_at - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                retry_after = await self._send(buffer, page)
+                buffer.next_send_at = time.monotonic() + max(self.chat_interval, retry_after or 0)
+                buffer.sending -= 1
+                if retry_after:
+                    # Rate limited: keep this page and the rest for the next round
+                    buffer.events.extendleft(reversed(pages[index:]))
+                    buffer.sending = 0
+                    break
+            self._update_gauge()
+
+    async def _send(self, buffer: ChatBuffer, text: str) -> Optional[float]:
+        """Send one page; returns Telegram's retry_after when rate limited"""
+        from services.async_service import AsyncTelegramService
+
+        service = self._services.get(buffer.token)
+        if service is None:
+            service = self._services[buffer.token] = AsyncTelegramService(buffer.token)
+        try:
+            result = await service.send_message(buffer.chat_id, text)
+        except Exception as e:
+            result = None
+            logger.error(f"Monitoring notification to {buffer.chat_id} failed: {e}")
+
+        if result is not None and result.success:
+            metrics.incr('notifications_sent_total')
+            return None
+        if result is not None and result.status_code == 429:
+            metrics.incr('notifications_rate_limited_total')
+            return float((result.data or {}).get('retry_after', self.chat_interval))
+        metrics.incr('notifications_failed_total')
+        if result is not None:
+            logger.error(f"Monitoring notification to {buffer.chat_id} failed: {result.error_message}")
+        return None
+
+    def _update_gauge(self) -> None:
+        metrics.set_gauge('notifications_pending', self._count_pending())
+
+    def pending(self) -> int:
+        """Notifications queued but not sent yet"""
+        return run_async(self._pending())
+
+    async def _pending(self) -> int:
+        return self._count_pending()
+
+    def _count_pending(self) -> int:
+        return sum(len(b.events) + b.sending for b in self._buffers.values())
+
+    def drain(self, timeout: float = 10.0) -> None:
+        """Send everything queued now, ignoring batch delays (used at shutdown)"""
+        if not self._buffers:
+            return
+        try:
+            run_async(asyncio.wait_for(self._drain(), timeout), timeout + 1)
+        except Exception as e:
+            logger.warning(f"Monitoring notifications not drained: {e}")
+
+    async def _drain(self) -> None:
+        tasks = [buffer.task for buffer in self._buffers.values() if buffer.task and not buffer.task.done()]
+        for buffer in self._buffers.values():
+            if buffer.wake:
+                buffer.wake.set()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def send_digests(self, now: Optional[datetime] = None) -> int:
+        """Queue the hourly summary for every bot in digest mode; returns the number of digests"""
+        from app import db
+        from models import Bot, Conversation, NotificationMode
+        from services.message_partitions import message_partitions
+
+        now = now or datetime.utcnow()
+        since = now - DIGEST_PERIOD
+        bots = Bot.query.filter(
+            Bot.notification_mode == NotificationMode.DIGEST,
+            Bot.telegram_token.isnot(None),
+            db.or_(Bot.admin_chat_id.isnot(None), Bot.notification_channel.isnot(None))
+        ).all()
+        if not bots:
+            return 0
+
+        # Customer activity only: replies and broadcasts also move updated_at
+        active = [Conversation.last_customer_message_at >= since, Conversation.last_customer_message_at < now]
+        counts = dict(db.session.execute(
+            db.select(Conversation.bot_id, db.func.count())
+            .where(Conversation.bot_id.in_([bot.id for bot in bots]), *active)
+            .group_by(Conversation.bot_id)
+        ).all())
+
+        sent = 0
+        for bot in bots:
+            count = counts.get(bot.id, 0)
+            if not count or not notification_targets(bot):
+                continue
+            conversations = Conversation.query.filter(Conversation.bot_id == bot.id, *active)\
+                .order_by(Conversation.last_customer_message_at.desc())\
+                .limit(self.digest_conversations).all()
+            # Each listed conversation's latest customer message, one query for all of them
+            questions = message_partitions.latest_messages([c.id for c in conversations], limit=1,
+                                                           from_user=True, since=since)
+
+            texts = [f"📊 {html.escape(bot.name)}: soatlik hisobot\n"
+                     f"🕐 {since:%Y-%m-%d %H:%M} – {now:%H:%M} UTC\n"
+                     f"💬 Faol suhbatlar: {count}"]
+            for conversation in conversations:
+                last_question = next((m.content for m in questions.get(conversation.id, [])), '')
+                username = f"@{conversation.platform_username}" if conversation.platform_username else "Noma'lum"
+                texts.append(f"{PLATFORM_EMOJI.get(conversation.platform, '🤖')} {html.escape(username)} "
+                             f"({conversation.platform_user_id})\n"
+                             f"📝 {html.escape(last_question[:300])}")
+            if count > len(conversations):
+                texts.append(f"… va yana {count - len(conversations)} ta suhbat")
+
+            # One digest reads better as one message: join the lines, merge_messages pages it
+            digest = '\n\n'.join(texts)
+            for chat_id in notification_targets(bot):
+                self.enqueue(bot.telegram_token, chat_id, [digest])
+            sent += 1
+        return sent
+
+notification_aggregator = NotificationAggregator()
+# Registered after the bridge's own handler, so it runs first (atexit is LIFO)
+atexit.register(notification_aggregator.drain)
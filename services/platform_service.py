@@ -4,6 +4,14 @@ import requests
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
 
+def telegram_api_base() -> str:
+    """Telegram Bot API root - TELEGRAM_API_BASE points it at a local stand-in (benchmarks)"""
+    return os.environ.get("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip('/')
+
+def graph_api_base() -> str:
+    """Meta Graph API root - GRAPH_API_BASE points it at a local stand-in (benchmarks)"""
+    return os.environ.get("GRAPH_API_BASE", "https://graph.facebook.com").rstrip('/')
+
 class ServiceResponse:
     """Standard response object for all platform services"""
     def __init__(self, success: bool, data: Any = None, error_message: Optional[str] = None, status_code: Optional[int] = None):
@@ -15,7 +23,7 @@ class ServiceResponse:
 class TelegramService:
     def __init__(self, bot_token):
         self.bot_token = bot_token
-        self.base_url = f"https://api.telegram.org/bot{bot_token}"
+        self.base_url = f"{telegram_api_base()}/bot{bot_token}"
         self.timeout = 30  # 30 seconds timeout for all requests
     
     def send_message(self, chat_id, text, reply_markup=None) -> ServiceResponse:
@@ -299,7 +307,7 @@ class WhatsAppService:
     def __init__(self, access_token, phone_number_id):
         self.access_token = access_token
         self.phone_number_id = phone_number_id
-        self.base_url = f"https://graph.facebook.com/v17.0/{phone_number_id}"
+        self.base_url = f"{graph_api_base()}/v17.0/{phone_number_id}"
         self.timeout = 30  # 30 seconds timeout for all requests
     
     def send_message(self, to, message_text) -> ServiceResponse:
@@ -442,7 +450,7 @@ class InstagramService:
     def __init__(self, access_token, page_id):
         self.access_token = access_token
         self.page_id = page_id
-        self.base_url = f"https://graph.facebook.com/v17.0/{page_id}"
+        self.base_url = f"{graph_api_base()}/v17.0/{page_id}"
         self.timeout = 30  # 30 seconds timeout for all requests
     
     def send_message(self, recipient_id, message_text) -> ServiceResponse:
@@ -0,0 +1,261 @@
+"""
+Per-request SQL statement counts, database time and slow-statement log
+So'rov (request) boshiga SQL buyruqlar soni, bazada sarflangan vaqt va sekin so'rovlar jurnali
+
+QUERY_PROFILING=true times every statement the app's engine executes
+(before/after_cursor_execute) and charges it to the current scope: the
+request's endpoint, or a named block such as `telegram_update`, which
+answers webhook and polled updates on scheduler threads. Statements are
+grouped by their normalized text (literals and bind parameters become ?, IN
+lists collapse to one), so a lazy relationship walked once per row shows up
+as one SELECT repeated N times. When a scope ends:
+
+    sql_requests_profiled_total{endpoint}
+    sql_statements_total{endpoint}       statements executed
+    sql_time_seconds_total{endpoint}     time spent in the database driver
+    sql_n_plus_one_total{endpoint}       scopes that repeated one SELECT
+                                         QUERY_PROFILING_N1_THRESHOLD or more times
+
+and every such SELECT is logged with its count, so the view can be given an
+eager-loading option or a grouped query instead.
+
+Statements slower than QUERY_SLOW_MS are logged and kept, by normalized
+text, in a log of at most QUERY_SLOW_LOG_SIZE entries (the cheapest in
+total time make room for new ones). Both tables are per process and shown
+on /admin/queries. In debug mode (or QUERY_PROFILING_HEADERS=true) each
+response carries X-SQL-Queries, X-SQL-Time-Ms and a Server-Timing entry.
+
+count_queries() counts the statements of a block whether or not profiling
+is on (benchmarks, flask shell).
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional
+
+from flask import current_app, request
+from sqlalchemy import event
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),                  # string literals
+    (re.compile(r'%\(\w+\)s|%s|\$\d+'), '?'),               # psycopg2 / asyncpg parameters
+    (re.compile(r'(?<![\w.])\d+(?:\.\d+)?\b'), '?'),        # numbers, not digits inside names
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?)'),     # IN lists and VALUES rows
+    (re.compile(r'\s+'), ' '),
+]
+_SELECT_LIST = re.compile(r'SELECT .+? FROM ', re.IGNORECASE)
+# Statements outside any scope (scheduler jobs, startup)
+BACKGROUND = 'background'
+# Scopes a slow statement remembers
+MAX_SLOW_SCOPES = 5
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get("QUERY_PROFILING", "false").lower() in ('1', 'true', 'yes')
+
+
+def normalize(statement: str) -> str:
+    """Statement text with its values replaced, so repeats of one query compare equal"""
+    for pattern, replacement in _NORMALIZE:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def summarize(statement: str, length: int = 300) -> str:
+    """Normalized statement for logs: column lists elided, so the FROM and WHERE stay visible"""
+    return _SELECT_LIST.sub('SELECT … FROM ', statement)[:length]
+
+
+class _Scope:
+    """Statements and database time of one request or named block"""
+
+    __slots__ = ('name', 'statements', 'seconds')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.statements = Counter()
+        self.seconds = 0.0
+
+    @property
+    def total(self) -> int:
+        return sum(self.statements.values())
+
+
+class QueryProfiler:
+    """Times the statements of each scope, flags repeated SELECTs and keeps the slow ones"""
+
+    def __init__(self, threshold: int = None, slow_ms: float = None, slow_log_size: int = None):
+        self.threshold = threshold or int(os.environ.get("QUERY_PROFILING_N1_THRESHOLD", 5))
+        self.slow_seconds = (slow_ms or float(os.environ.get("QUERY_SLOW_MS", 100))) / 1000
+        self.slow_log_size = slow_log_size or int(os.environ.get("QUERY_SLOW_LOG_SIZE", 100))
+        self.enabled = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._since = datetime.utcnow()
+        # scope name -> totals
+        self._scopes: Dict[str, Dict] = {}
+        # normalized statement -> slow executions
+        self._slow: Dict[str, Dict] = {}
+
+    def init_app(self, app, db) -> None:
+        if not profiling_enabled():
+            return
+        self.enabled = True
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._drop_request)
+        logger.info("SQL query profiling enabled")
+
+    @contextmanager
+    def scope(self, name: str):
+        """Charge the statements of the block to `name` (work done outside a request)"""
+        if not self.enabled:
+            yield None
+            return
+        previous = getattr(self._local, 'scope', None)
+        scope = self._local.scope = _Scope(name)
+        try:
+            yield scope
+        finally:
+            self._local.scope = previous
+            self._record(scope)
+
+    def _start_request(self) -> None:
+        self._local.scope = _Scope(request.endpoint or 'unknown')
+
+    def _finish_request(self, response):
+        scope = getattr(self._local, 'scope', None)
+        self._local.scope = None
+        if scope is None:
+            return response
+        self._record(scope)
+        if current_app.debug or os.environ.get("QUERY_PROFILING_HEADERS", "false").lower() in ('1', 'true', 'yes'):
+            milliseconds = round(scope.seconds * 1000, 2)
+            response.headers['X-SQL-Queries'] = str(scope.total)
+            response.headers['X-SQL-Time-Ms'] = str(milliseconds)
+            timing = f'db;dur={milliseconds};desc="{scope.total} queries"'
+            existing = response.headers.get('Server-Timing')
+            response.headers['Server-Timing'] = f"{existing}, {timing}" if existing else timing
+        return response
+
+    def _drop_request(self, exc=None) -> None:
+        # A request that never reached after_request must not leak into the thread's next one
+        self._local.scope = None
+
+    def _before_execute(self, connection, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._profiler_started = time.perf_counter()
+
+    def _after_execute(self, connection, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_profiler_started', None)
+        elapsed = time.perf_counter() - started if started is not None else 0.0
+        scope = getattr(self._local, 'scope', None)
+        normalized = None
+        if scope is not None:
+            normalized = normalize(statement)
+            scope.statements[normalized] += 1
+            scope.seconds += elapsed
+        if elapsed >= self.slow_seconds:
+            self._record_slow(normalized or normalize(statement), elapsed, scope.name if scope else BACKGROUND)
+
+    def _record(self, scope: _Scope) -> None:
+        total = scope.total
+        metrics.incr('sql_requests_profiled_total', endpoint=scope.name)
+        metrics.incr('sql_statements_total', total, endpoint=scope.name)
+        metrics.incr('sql_time_seconds_total', scope.seconds, endpoint=scope.name)
+
+        repeated = [(statement, count) for statement, count in scope.statements.most_common()
+                    if count >= self.threshold and statement.upper().startswith('SELECT')]
+        if repeated:
+            metrics.incr('sql_n_plus_one_total', endpoint=scope.name)
+            for statement, count in repeated:
+                logger.warning(f"Possible N+1 in {scope.name}: {count}x {summarize(statement)}")
+
+        with self._lock:
+            totals = self._scopes.setdefault(scope.name, {
+                'name': scope.name, 'requests': 0, 'statements': 0, 'max_statements': 0,
+                'seconds': 0.0, 'max_seconds': 0.0, 'n_plus_one': 0,
+            })
+            totals['requests'] += 1
+            totals['statements'] += total
+            totals['max_statements'] = max(totals['max_statements'], total)
+            totals['seconds'] += scope.seconds
+            totals['max_seconds'] = max(totals['max_seconds'], scope.seconds)
+            totals['n_plus_one'] += 1 if repeated else 0
+
+    def _record_slow(self, statement: str, elapsed: float, scope_name: str) -> None:
+        metrics.incr('sql_slow_statements_total', endpoint=scope_name)
+        logger.warning(f"Slow SQL ({elapsed * 1000:.0f} ms) in {scope_name}: {summarize(statement)}")
+        with self._lock:
+            entry = self._slow.get(statement)
+            if entry is None:
+                if len(self._slow) >= self.slow_log_size:
+                    cheapest = min(self._slow, key=lambda key: self._slow[key]['seconds'])
+                    del self._slow[cheapest]
+                entry = self._slow[statement] = {
+                    'statement': statement, 'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'scopes': [],
+                }
+            entry['count'] += 1
+            entry['seconds'] += elapsed
+            entry['max_seconds'] = max(entry['max_seconds'], elapsed)
+            entry['last_seen'] = datetime.utcnow()
+            if scope_name not in entry['scopes'] and len(entry['scopes']) < MAX_SLOW_SCOPES:
+                entry['scopes'].append(scope_name)
+
+    def report(self, limit: Optional[int] = 50) -> Dict:
+        """Scopes by total database time and slow statements by total time, slowest first"""
+        with self._lock:
+            scopes = [dict(totals) for totals in self._scopes.values()]
+            slow = [dict(entry, scopes=list(entry['scopes'])) for entry in self._slow.values()]
+        for totals in scopes:
+            totals['avg_statements'] = totals['statements'] / totals['requests']
+            totals['avg_ms'] = totals['seconds'] * 1000 / totals['requests']
+        for entry in slow:
+            entry['avg_ms'] = entry['seconds'] * 1000 / entry['count']
+        return {
+            'enabled': self.enabled,
+            'since': self._since,
+            'slow_ms': self.slow_seconds * 1000,
+            'scopes': sorted(scopes, key=lambda totals: totals['seconds'], reverse=True)[:limit],
+            'slow': sorted(slow, key=lambda entry: entry['seconds'], reverse=True)[:limit],
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._scopes.clear()
+            self._slow.clear()
+            self._since = datetime.utcnow()
+
+
+query_profiler = QueryProfiler()
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Count the statements executed inside the block: yields a Counter of normalized statements"""
+    if engine is None:
+        from app import db
+        engine = db.engine
+
+    statements = Counter()
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements[normalize(statement)] += 1
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
@@ -0,0 +1,272 @@
+"""
+Sampled stack profiles of requests, written as collapsed stacks
+So'rovlarning namunaviy stek profillari (flamegraph uchun collapsed format)
+
+REQUEST_PROFILING=true profiles REQUEST_PROFILING_SAMPLE_PERCENT of the
+requests to REQUEST_PROFILING_ENDPOINTS (the webhook, the operator chat and
+the admin dashboards by default). A request is also profiled when it sends
+X-Profile-Request: <REQUEST_PROFILING_TOKEN>, or when an admin sends
+X-Profile-Request: 1.
+
+While a profiled request runs, a sampler thread reads the stack of the
+request thread every REQUEST_PROFILING_INTERVAL_MS. Work the request hands
+to a scheduler thread (the webhook's update processing, which runs after
+the acknowledgement) is sampled on that thread too, and the profile stays
+open until it finishes, see hand_off. The samples are written to
+REQUEST_PROFILING_DIR as one collapsed-stack file per request:
+
+    <handler> (routes.py:731);<callee> (services/x.py:12) 42
+
+which flamegraph.pl, speedscope and inferno read directly. File names carry
+the endpoint and duration, so /admin/profiles lists the slowest ones without
+an index; only the newest REQUEST_PROFILING_KEEP files are kept. The
+directory is shared by every worker on the host.
+"""
+import os
+import sys
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from functools import wraps
+from typing import Dict, List, Optional
+
+from flask import g, request
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINTS = 'telegram_webhook,bot_chat,admin_dashboard,admin.dashboard'
+HEADER = 'X-Profile-Request'
+SUFFIX = '.collapsed'
+# Frames in the app's own files are labelled with their path relative to the repository
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get("REQUEST_PROFILING", "false").lower() in ('1', 'true', 'yes')
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(_ROOT + os.sep):
+        filename = filename[len(_ROOT) + 1:]
+    else:
+        filename = os.path.basename(filename)
+    # ; and newlines separate frames and stacks in the collapsed format
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':').replace('\n', ' ')
+
+
+def collapse(frame) -> str:
+    """A frame's stack, outermost call first, as one collapsed line"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Profile:
+    """Stack samples of the threads working on one request"""
+
+    def __init__(self, endpoint: str, interval: float):
+        self.endpoint = endpoint
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.started_at = datetime.utcnow()
+        self.duration = 0.0
+        self.samples = Counter()
+        self.threads = {threading.get_ident()}
+        # The request itself plus handed-off work not finished yet
+        self._open = 1
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+        self._sampler.start()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.threads):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.samples[collapse(frame)] += 1
+
+    def hold(self) -> None:
+        with self._lock:
+            self._open += 1
+
+    def release(self) -> bool:
+        """True once the request and all its handed-off work are done"""
+        with self._lock:
+            self._open -= 1
+            return self._open == 0
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self.started
+
+
+class RequestProfiler:
+    """Chooses the requests to profile and writes their samples to disk"""
+
+    def __init__(self, directory: str = None, percent: float = None, interval_ms: float = None,
+                 keep: int = None, endpoints: str = None):
+        self.directory = directory or os.environ.get("REQUEST_PROFILING_DIR", "profiles")
+        self.percent = percent if percent is not None else float(
+            os.environ.get("REQUEST_PROFILING_SAMPLE_PERCENT", 1))
+        self.interval = (interval_ms or float(os.environ.get("REQUEST_PROFILING_INTERVAL_MS", 5))) / 1000
+        self.keep = keep or int(os.environ.get("REQUEST_PROFILING_KEEP", 500))
+        self.endpoints = {name.strip() for name in
+                          (endpoints or os.environ.get("REQUEST_PROFILING_ENDPOINTS", DEFAULT_ENDPOINTS)).split(',')
+                          if name.strip()}
+        self.token = os.environ.get("REQUEST_PROFILING_TOKEN")
+        self.enabled = False
+
+    def init_app(self, app) -> None:
+        if not profiling_enabled():
+            return
+        self.enabled = True
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+        logger.info(f"Request profiling enabled: {self.percent}% of {', '.join(sorted(self.endpoints))}")
+
+    def _requested(self) -> bool:
+        value = request.headers.get(HEADER)
+        if not value:
+            return False
+        if self.token and value == self.token:
+            return True
+        from flask_login import current_user
+        return current_user.is_authenticated and current_user.is_admin
+
+    def _start(self) -> None:
+        sampled = request.endpoint in self.endpoints and random.random() * 100 < self.percent
+        if sampled or self._requested():
+            g._request_profile = Profile(request.endpoint or 'unknown', self.interval)
+
+    def _finish(self, exc=None) -> None:
+        profile = g.pop('_request_profile', None)
+        if profile is None:
+            return
+        profile.threads.discard(threading.get_ident())
+        if profile.release():
+            self._complete(profile)
+
+    def _complete(self, profile: Profile) -> None:
+        profile.stop()
+        metrics.incr('request_profiles_total', endpoint=profile.endpoint)
+        try:
+            self._write(profile)
+        except OSError as e:
+            logger.warning(f"Could not write request profile: {e}")
+
+    def hand_off(self, fn):
+        """fn, sampled on the thread that runs it; the request's profile is written once it returns"""
+        profile = g.get('_request_profile') if self.enabled else None
+        if profile is None:
+            return fn
+        profile.hold()
+
+        @wraps(fn)
+        def handed_off(*args, **kwargs):
+            thread_id = threading.get_ident()
+            profile.threads.add(thread_id)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.threads.discard(thread_id)
+                if profile.release():
+                    self._complete(profile)
+        return handed_off
+
+    def _write(self, profile: Profile) -> None:
+        if not profile.samples:
+            # Finished within one interval: nothing worth drawing
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        name = (f"{profile.started_at.strftime('%Y%m%dT%H%M%S')}_{profile.endpoint}"
+                f"_{round(profile.duration * 1000)}ms_{os.getpid()}-{random.randrange(16 ** 4):04x}{SUFFIX}")
+        with open(os.path.join(self.directory, name), 'w', encoding='utf-8') as f:
+            for stack, count in profile.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self._prune()
+
+    def _prune(self) -> None:
+        files = sorted(name for name in os.listdir(self.directory) if name.endswith(SUFFIX))
+        # Names start with the timestamp: the oldest sort first
+        for name in files[:max(0, len(files) - self.keep)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def path(self, name: str) -> Optional[str]:
+        """Path of a stored profile, None for names that are not one"""
+        if os.path.basename(name) != name or not name.endswith(SUFFIX):
+            return None
+        path = os.path.abspath(os.path.join(self.directory, name))
+        return path if os.path.isfile(path) else None
+
+    def worst(self, limit: int = 50, endpoint: str = None) -> List[Dict]:
+        """Stored profiles, slowest first, each with its hottest function (most samples on top of the stack)"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            parsed = _parse_name(name)
+            if parsed and (endpoint is None or parsed['endpoint'] == endpoint):
+                profiles.append(parsed)
+        profiles.sort(key=lambda profile: profile['duration_ms'], reverse=True)
+        profiles = profiles[:limit]
+        for profile in profiles:
+            profile.update(_hottest(os.path.join(self.directory, profile['name'])))
+        return profiles
+
+    def endpoint_names(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted({parsed['endpoint'] for parsed in map(_parse_name, os.listdir(self.directory)) if parsed})
+
+
+def _parse_name(name: str) -> Optional[Dict]:
+    """<timestamp>_<endpoint>_<duration>ms_<pid-suffix>.collapsed; endpoints may contain _"""
+    if not name.endswith(SUFFIX):
+        return None
+    parts = name[:-len(SUFFIX)].split('_')
+    if len(parts) < 4 or not parts[-2].endswith('ms'):
+        return None
+    try:
+        return {
+            'name': name,
+            'created_at': datetime.strptime(parts[0], '%Y%m%dT%H%M%S'),
+            'endpoint': '_'.join(parts[1:-2]),
+            'duration_ms': int(parts[-2][:-2]),
+        }
+    except ValueError:
+        return None
+
+
+def _hottest(path: str) -> Dict:
+    samples = 0
+    leaves = Counter()
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if not count.isdigit():
+                    continue
+                samples += int(count)
+                leaves[stack.rsplit(';', 1)[-1]] += int(count)
+    except OSError:
+        pass
+    hottest, hottest_samples = leaves.most_common(1)[0] if leaves else (None, 0)
+    return {'samples': samples, 'hottest': hottest,
+            'hottest_share': hottest_samples / samples if samples else 0}
+
+
+request_profiler = RequestProfiler()
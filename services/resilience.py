@@ -0,0 +1,225 @@
+"""
+Resilience helpers for upstream API calls
+Tashqi API chaqiruvlari uchun circuit breaker va qayta urinish (retry) yordamchilari
+"""
+import time
+import asyncio
+import random
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open"""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the overall call deadline has passed"""
+
+
+class CircuitBreaker:
+    """Per-upstream circuit breaker (closed -> open -> half_open -> closed)"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    # Numeric values reported to the metrics registry
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._report_state()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Check whether a call may go through right now"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                # Only one probe call at a time while half-open
+                self._probe_in_flight = True
+                return True
+            metrics.incr('circuit_breaker_rejected_total', breaker=self.name)
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self._state != self.CLOSED:
+                logger.info(f"Circuit breaker {self.name} closed")
+                self._state = self.CLOSED
+                self._report_state()
+
+    def record_ignored(self) -> None:
+        """The call ended without saying anything about upstream health (e.g. a 4xx)
+
+        Frees the half-open probe slot; the state and the failure count stay as they are.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"Circuit breaker {self.name} opened after {self._failures} failures")
+                    metrics.incr('circuit_breaker_opened_total', breaker=self.name)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._report_state()
+
+    def _maybe_half_open(self) -> None:
+        # Caller must hold the lock
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+            self._report_state()
+
+    def _report_state(self) -> None:
+        metrics.set_gauge('circuit_breaker_state', self.STATE_VALUES[self._state], breaker=self.name)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0) -> CircuitBreaker:
+    """Get (or create) the process-wide breaker for an upstream"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, failure_threshold, recovery_timeout)
+            _breakers[name] = breaker
+        return breaker
+
+
+def backoff_delay(attempt: int, base_delay: float = 0.5, max_delay: float = 8.0) -> float:
+    """Exponential backoff with full jitter for the given retry attempt (0-based)"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def call_with_retries(func: Callable, attempts: int = 3, base_delay: float = 0.5,
+                      max_delay: float = 8.0, deadline: Optional[float] = None,
+                      is_retryable: Callable[[Exception], bool] = lambda e: True,
+                      breaker: Optional[CircuitBreaker] = None):
+    """
+    Call func() with bounded retries and jittered backoff
+
+    Args:
+        func: Callable receiving the remaining time budget in seconds (or None)
+        attempts: Maximum number of calls
+        deadline: Absolute time.monotonic() deadline for all attempts
+        is_retryable: Decides whether an exception is worth another attempt
+        breaker: Circuit breaker that records each attempt's outcome
+
+    Returns:
+        The value returned by func
+    """
+    last_error = None
+    for attempt in range(attempts):
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+        if breaker and not breaker.allow_request():
+            raise CircuitOpenError(f"Circuit breaker {breaker.name} is open")
+
+        try:
+            result = func(remaining)
+        except Exception as e:
+            retryable = is_retryable(e)
+            if breaker:
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    # Caller errors say nothing about upstream health
+                    breaker.record_ignored()
+            if not retryable:
+                raise
+            last_error = e
+            if attempt + 1 < attempts:
+                delay = backoff_delay(attempt, base_delay, max_delay)
+                if deadline is not None:
+                    delay = min(delay, max(0.0, deadline - time.monotonic()))
+                metrics.incr('upstream_retries_total', breaker=breaker.name if breaker else 'none')
+                time.sleep(delay)
+            continue
+
+        if breaker:
+            breaker.record_success()
+        return result
+
+    if last_error is not None:
+        raise last_error
+    raise DeadlineExceeded("Deadline exceeded before the call could be made")
+
+
+async def async_call_with_retries(func: Callable, attempts: int = 3, base_delay: float = 0.5,
+                                  max_delay: float = 8.0, deadline: Optional[float] = None,
+                                  is_retryable: Callable[[Exception], bool] = lambda e: True,
+                                  breaker: Optional[CircuitBreaker] = None):
+    """Asyncio variant of call_with_retries - func is an async callable"""
+    last_error = None
+    for attempt in range(attempts):
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+        if breaker and not breaker.allow_request():
+            raise CircuitOpenError(f"Circuit breaker {breaker.name} is open")
+
+        try:
+            if remaining is not None:
+                result = await asyncio.wait_for(func(remaining), timeout=remaining)
+            else:
+                result = await func(remaining)
+        except Exception as e:
+            retryable = is_retryable(e) or isinstance(e, asyncio.TimeoutError)
+            if breaker:
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.record_ignored()
+            if not retryable:
+                raise
+            last_error = e
+            if attempt + 1 < attempts:
+                delay = backoff_delay(attempt, base_delay, max_delay)
+                if deadline is not None:
+                    delay = min(delay, max(0.0, deadline - time.monotonic()))
+                metrics.incr('upstream_retries_total', breaker=breaker.name if breaker else 'none')
+                await asyncio.sleep(delay)
+            continue
+
+        if breaker:
+            breaker.record_success()
+        return result
+
+    if last_error is not None:
+        raise last_error
+    raise DeadlineExceeded("Deadline exceeded before the call could be made")
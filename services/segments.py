@@ -0,0 +1,117 @@
+"""
+Marketing audience segments computed in SQL
+Marketing auditoriyalari (segmentlar) - SQL orqali hisoblash va keshlash
+
+A segment is a list of conditions on User. counts() counts every segment in
+one SELECT (a count(CASE ...) column each); member_ids() reads the user ids
+of one segment. Both are cached per process for SEGMENT_CACHE_SECONDS, so the
+marketing page and the send that follows it do not recompute them.
+
+iter_members() streams a segment for delivery: its cached ids in chunks of
+SEGMENT_CHUNK_SIZE, each chunk read with only the columns a message needs
+and with the segment's conditions applied again, so users who opted out or
+were messaged since the ids were cached are skipped. Sends change
+marketing_last_sent_at, so they call invalidate() when done.
+"""
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import and_, case, func, or_, select
+
+# Trial-expired users are messaged again after this long
+TRIAL_EXPIRED_RESEND = timedelta(days=3)
+# Segments whose members have a Telegram chat to deliver to
+DELIVERABLE = ('trial_expired', 'trial_active', 'all_telegram')
+
+
+def _conditions(now: datetime) -> Dict[str, List]:
+    from models import AccessStatus, User
+
+    customer = User.is_admin.is_(False)
+    telegram = [customer, User.telegram_chat_id.isnot(None), User.marketing_opt_out.is_(False)]
+    return {
+        'all': [customer],
+        'trial': [customer, User.access_status == AccessStatus.TRIAL],
+        'subscription': [customer, User.access_status.in_([AccessStatus.MONTHLY, AccessStatus.YEARLY])],
+        'approved': [customer, User.access_status == AccessStatus.APPROVED],
+        'all_telegram': telegram,
+        'trial_expired': telegram + [
+            User.access_status == AccessStatus.TRIAL,
+            User.trial_end_date <= now,
+            User.admin_approved.is_(False),
+            or_(User.marketing_last_sent_at.is_(None), User.marketing_last_sent_at < now - TRIAL_EXPIRED_RESEND),
+        ],
+        'trial_active': telegram + [
+            User.is_trial_active.is_(True),
+            User.trial_end_date > now,
+            User.admin_approved.is_(False),
+        ],
+    }
+
+
+class SegmentEngine:
+    """Segment counts and member ids, cached for a short time"""
+
+    def __init__(self, ttl: Optional[float] = None, chunk_size: Optional[int] = None):
+        self.ttl = ttl if ttl is not None else float(os.environ.get("SEGMENT_CACHE_SECONDS", 60))
+        self.chunk_size = chunk_size or int(os.environ.get("SEGMENT_CHUNK_SIZE", 500))
+        self._lock = threading.Lock()
+        # key -> (monotonic time, value)
+        self._cache = {}
+
+    def _cached(self, key, compute):
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and time.monotonic() - cached[0] < self.ttl:
+                return cached[1]
+        value = compute()
+        with self._lock:
+            self._cache[key] = (time.monotonic(), value)
+        return value
+
+    def counts(self) -> Dict[str, int]:
+        """Members of every segment, one query"""
+        def compute():
+            from app import db
+            from models import User
+
+            columns = [func.count(case((and_(*conditions), 1))).label(name)
+                       for name, conditions in _conditions(datetime.utcnow()).items()]
+            return dict(db.session.execute(select(*columns).select_from(User)).one()._mapping)
+        return self._cached('counts', compute)
+
+    def member_ids(self, segment: str) -> List[int]:
+        """User ids of a segment, in id order"""
+        def compute():
+            from app import db
+            from models import User
+
+            conditions = _conditions(datetime.utcnow())[segment]
+            return list(db.session.execute(select(User.id).where(*conditions).order_by(User.id)).scalars())
+        return self._cached(('members', segment), compute)
+
+    def iter_members(self, segment: str, chunk_size: Optional[int] = None) -> Iterator[List]:
+        """The segment's members in chunks of rows (id, username, full_name, telegram_chat_id)"""
+        from app import db
+        from models import User
+
+        ids = self.member_ids(segment)
+        size = chunk_size or self.chunk_size
+        for start in range(0, len(ids), size):
+            conditions = _conditions(datetime.utcnow())[segment]
+            rows = db.session.execute(
+                select(User.id, User.username, User.full_name, User.telegram_chat_id)
+                .where(User.id.in_(ids[start:start + size]), *conditions).order_by(User.id)
+            ).all()
+            if rows:
+                yield rows
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+segments = SegmentEngine()
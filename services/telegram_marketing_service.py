@@ -2,7 +2,7 @@ import os
 import logging
 import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
 from services.telegram_service import TelegramService
 
 logger = logging.getLogger(__name__)
@@ -184,106 +184,77 @@ Sizning bepul sinov mudatingiz {days_left} kun qoldi!
 
 
 def get_trial_expired_telegram_users() -> List[Dict]:
-    """Trial muddati tugagan foydalanuvchilarni olish"""
-    from app import app, db
-    from models import User, AccessStatus
+    """Trial muddati tugagan foydalanuvchilarni olish (3 kun ichida xabar olganlar bundan mustasno)"""
+    from app import app
+    from services.segments import segments
     
     with app.app_context():
-        users = User.query.filter(
-            User.access_status == AccessStatus.TRIAL,
-            User.trial_end_date <= datetime.utcnow(),
-            User.admin_approved == False,
-            User.is_admin == False,
-            User.telegram_chat_id != None,
-            User.marketing_opt_out == False
-        ).all()
-        
-        result = []
-        for user in users:
-            # 3 kun ichida oxirgi xabar yuborilgan bo'lsa, qayta yubormaymiz
-            if user.marketing_last_sent_at:
-                last_sent = user.marketing_last_sent_at
-                if datetime.utcnow() - last_sent < timedelta(days=3):
-                    continue
-            
-            result.append({
-                'id': user.id,
-                'username': user.username,
-                'full_name': user.full_name or user.username,
-                'telegram_chat_id': user.telegram_chat_id,
-                'trial_end_date': user.trial_end_date,
-                'marketing_last_sent_at': user.marketing_last_sent_at
-            })
-        
-        return result
+        return [{
+            'id': member.id,
+            'username': member.username,
+            'full_name': member.full_name or member.username,
+            'telegram_chat_id': member.telegram_chat_id,
+        } for members in segments.iter_members('trial_expired') for member in members]
 
 
-def get_active_trial_users() -> List[Dict]:
-    """Hali trial davom etayotgan foydalanuvchilarni olish"""
-    from app import app, db
+def get_active_trial_users() -> Iterator[Dict]:
+    """Trial tugashiga 1 kun qolgan foydalanuvchilarni olish (app context ichida, bo'laklab o'qiladi)"""
+    from sqlalchemy import or_, select
     from models import User, AccessStatus
+    from utils.streaming import iter_rows
     
-    with app.app_context():
-        users = User.query.filter(
-            User.access_status == AccessStatus.TRIAL,
-            User.trial_end_date > datetime.utcnow(),
-            User.admin_approved == False,
-            User.is_admin == False,
-            User.telegram_chat_id != None,
-            User.marketing_opt_out == False
-        ).all()
-        
-        result = []
-        for user in users:
-            # Faqat trial tugashiga 1 kun qolganda xabar yuboramiz
-            days_left = (user.trial_end_date - datetime.utcnow()).days
-            if days_left != 1:
-                continue
-                
-            # 1 kun ichida oxirgi xabar yuborilgan bo'lsa, qayta yubormaymiz
-            if user.marketing_last_sent_at:
-                last_sent = user.marketing_last_sent_at
-                if datetime.utcnow() - last_sent < timedelta(days=1):
-                    continue
-            
-            result.append({
-                'id': user.id,
-                'username': user.username,
-                'full_name': user.full_name or user.username,
-                'telegram_chat_id': user.telegram_chat_id,
-                'trial_end_date': user.trial_end_date,
-                'days_left': days_left,
-                'marketing_last_sent_at': user.marketing_last_sent_at
-            })
-        
-        return result
+    now = datetime.utcnow()
+    statement = select(
+        User.id, User.username, User.full_name, User.telegram_chat_id,
+        User.trial_end_date, User.marketing_last_sent_at
+    ).where(
+        User.access_status == AccessStatus.TRIAL,
+        # Faqat trial tugashiga 1 kun qolganda xabar yuboramiz
+        User.trial_end_date >= now + timedelta(days=1),
+        User.trial_end_date < now + timedelta(days=2),
+        User.admin_approved == False,
+        User.is_admin == False,
+        User.telegram_chat_id != None,
+        User.marketing_opt_out == False,
+        # 1 kun ichida oxirgi xabar yuborilgan bo'lsa, qayta yubormaymiz
+        or_(User.marketing_last_sent_at.is_(None), User.marketing_last_sent_at <= now - timedelta(days=1))
+    )
+    for row in iter_rows(statement):
+        yield {
+            'id': row.id,
+            'username': row.username,
+            'full_name': row.full_name or row.username,
+            'telegram_chat_id': row.telegram_chat_id,
+            'trial_end_date': row.trial_end_date,
+            'days_left': (row.trial_end_date - now).days,
+            'marketing_last_sent_at': row.marketing_last_sent_at
+        }
 
 
-def get_all_telegram_users() -> List[Dict]:
-    """Telegram chat_id ga ega barcha foydalanuvchilarni olish"""
-    from app import app, db
+def get_all_telegram_users() -> Iterator[Dict]:
+    """Telegram chat_id ga ega barcha foydalanuvchilarni olish (app context ichida, bo'laklab o'qiladi)"""
+    from sqlalchemy import select
     from models import User
+    from utils.streaming import iter_rows
     
-    with app.app_context():
-        users = User.query.filter(
-            User.is_admin == False,
-            User.telegram_chat_id != None,
-            User.marketing_opt_out == False
-        ).all()
-        
-        result = []
-        for user in users:
-            result.append({
-                'id': user.id,
-                'username': user.username,
-                'full_name': user.full_name or user.username,
-                'telegram_chat_id': user.telegram_chat_id,
-                'access_status': user.access_status.value if user.access_status else 'unknown',
-                'admin_approved': user.admin_approved,
-                'marketing_last_sent_at': user.marketing_last_sent_at
-            })
-        
-        return result
+    statement = select(
+        User.id, User.username, User.full_name, User.telegram_chat_id,
+        User.access_status, User.admin_approved, User.marketing_last_sent_at
+    ).where(
+        User.is_admin == False,
+        User.telegram_chat_id != None,
+        User.marketing_opt_out == False
+    )
+    for row in iter_rows(statement):
+        yield {
+            'id': row.id,
+            'username': row.username,
+            'full_name': row.full_name or row.username,
+            'telegram_chat_id': row.telegram_chat_id,
+            'access_status': row.access_status.value if row.access_status else 'unknown',
+            'admin_approved': row.admin_approved,
+            'marketing_last_sent_at': row.marketing_last_sent_at
+        }
 
 
 def update_marketing_sent_timestamp(user_ids: List[int]) -> None:
@@ -0,0 +1,195 @@
+"""
+Telegram ingestion by long polling (getUpdates) instead of webhooks
+Telegram yangilanishlarini getUpdates orqali olish (webhook o'rniga)
+
+For deployments without a reachable public endpoint. One process
+(`flask telegram poll`) long-polls every connected bot on a single asyncio
+loop; each token gets its own client with one keep-alive connection, which
+the long poll occupies anyway.
+
+A response carries up to TELEGRAM_POLL_LIMIT updates. They are answered by
+process_telegram_update on the same per-chat scheduler as the webhook
+(routes.telegram_updates): different chats in parallel, one chat's updates
+in order. The next
+offset is stored in Bot.telegram_update_offset once the batch is done, so
+after a restart polling resumes where it stopped (an update whose batch was
+interrupted is delivered again).
+
+The bot list is re-read every TELEGRAM_POLL_REFRESH_SECONDS: new tokens
+start polling, removed or changed ones stop.
+"""
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_UPDATES = ['message', 'callback_query']
+MAX_BACKOFF_SECONDS = 60
+
+
+def polling_enabled() -> bool:
+    """TELEGRAM_INGESTION=polling: bots are not given a webhook and the poller feeds them"""
+    return os.environ.get("TELEGRAM_INGESTION", "webhook").lower() == 'polling'
+
+
+def update_chat_id(update: Optional[Dict]):
+    """Chat an update belongs to (updates without one are keyed by their own id)"""
+    update = update or {}
+    message = update.get('message') or (update.get('callback_query') or {}).get('message') or {}
+    return (message.get('chat') or {}).get('id', f"update:{update.get('update_id')}")
+
+
+class TelegramPoller:
+    """getUpdates loops for all connected bots, multiplexed on one event loop"""
+
+    def __init__(self, poll_timeout: Optional[int] = None, limit: Optional[int] = None,
+                 refresh_seconds: Optional[float] = None, workers: Optional[int] = None):
+        self.poll_timeout = poll_timeout if poll_timeout is not None else int(
+            os.environ.get("TELEGRAM_POLL_TIMEOUT_SECONDS", 25))
+        self.limit = limit or int(os.environ.get("TELEGRAM_POLL_LIMIT", 100))
+        self.refresh_seconds = refresh_seconds or float(os.environ.get("TELEGRAM_POLL_REFRESH_SECONDS", 30))
+        self.workers = workers or int(os.environ.get("TELEGRAM_POLL_WORKERS", 8))
+        # Database reads and batches waiting for their updates (one per bot at a time);
+        # the updates themselves run on the scheduler's own pool
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='telegram-poll')
+        # bot_id -> (token, polling task)
+        self._tasks: Dict[int, Tuple[str, asyncio.Task]] = {}
+        # Tokens Telegram rejected; retried only after the token changes
+        self._rejected = set()
+
+    async def run(self, stop: Optional[asyncio.Event] = None) -> None:
+        """Poll until `stop` is set"""
+        stop = stop or asyncio.Event()
+        try:
+            while not stop.is_set():
+                try:
+                    self._sync_tasks(await self._run_blocking(self._load_bots))
+                except Exception as e:
+                    logger.error(f"Telegram poller refresh error: {e}")
+                try:
+                    await asyncio.wait_for(stop.wait(), self.refresh_seconds)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            tasks = [task for _, task in self._tasks.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._tasks.clear()
+            self._executor.shutdown(wait=True)
+
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _load_bots(self) -> Dict[int, str]:
+        from app import app, db
+        from models import Bot
+
+        with app.app_context():
+            try:
+                return dict(db.session.query(Bot.id, Bot.telegram_token).filter(
+                    Bot.telegram_token.isnot(None), Bot.is_active.is_(True)))
+            finally:
+                db.session.remove()
+
+    def _sync_tasks(self, bots: Dict[int, str]) -> None:
+        for bot_id, (token, task) in list(self._tasks.items()):
+            if bots.get(bot_id) != token or task.done():
+                task.cancel()
+                del self._tasks[bot_id]
+        for bot_id, token in bots.items():
+            if bot_id not in self._tasks and token not in self._rejected:
+                task = asyncio.get_running_loop().create_task(self._poll_bot(bot_id, token))
+                self._tasks[bot_id] = (token, task)
+        metrics.set_gauge('telegram_pollers_active', len(self._tasks))
+
+    async def _poll_bot(self, bot_id: int, token: str) -> None:
+        from services.async_service import AsyncTelegramService
+
+        client = httpx.AsyncClient(limits=httpx.Limits(max_connections=1, max_keepalive_connections=1))
+        service = AsyncTelegramService(token, client=client)
+        backoff = 1
+        try:
+            offset = await self._run_blocking(self._load_offset, bot_id)
+            while True:
+                response = await service.get_updates(offset, self.limit, self.poll_timeout, ALLOWED_UPDATES)
+                metrics.incr('telegram_poll_requests_total')
+                if not response.success:
+                    metrics.incr('telegram_poll_errors_total')
+                    if response.status_code == 409:
+                        # A webhook is still set; getUpdates works only without one
+                        logger.warning(f"Bot {bot_id} has a Telegram webhook set, deleting it for polling")
+                        await service.delete_webhook()
+                        await asyncio.sleep(backoff)
+                        backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+                        continue
+                    if response.status_code in (401, 404):
+                        logger.error(f"Telegram rejected the token of bot {bot_id}, polling stopped")
+                        self._rejected.add(token)
+                        return
+                    if response.status_code == 429:
+                        delay = float((response.data or {}).get('retry_after', backoff))
+                    else:
+                        delay = backoff
+                        backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+                    await asyncio.sleep(delay)
+                    continue
+
+                backoff = 1
+                updates = response.data or []
+                if updates:
+                    metrics.incr('telegram_poll_updates_total', len(updates))
+                    offset = await self._run_blocking(self.process_batch, bot_id, updates)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # The next refresh starts a fresh task for this bot
+            logger.error(f"Telegram poller error for bot {bot_id}: {e}")
+        finally:
+            await client.aclose()
+
+    def _load_offset(self, bot_id: int) -> Optional[int]:
+        from app import app, db
+        from models import Bot
+
+        with app.app_context():
+            try:
+                return db.session.query(Bot.telegram_update_offset).filter(Bot.id == bot_id).scalar()
+            finally:
+                db.session.remove()
+
+    def process_batch(self, bot_id: int, updates: List[Dict]) -> int:
+        """Answer a getUpdates batch and store the next offset; returns that offset"""
+        from app import app, db
+        from models import Bot
+        from routes import run_telegram_update, telegram_updates
+
+        futures = [
+            telegram_updates.submit((bot_id, update_chat_id(update)), run_telegram_update, bot_id, update,
+                                    order=update['update_id'])
+            for update in sorted(updates, key=lambda u: u['update_id'])
+        ]
+        for future in futures:
+            try:
+                _, status = future.result()
+                outcome = 'ok' if status == 200 else 'error'
+            except Exception as e:
+                logger.error(f"Telegram update processing error for bot {bot_id}: {e}")
+                outcome = 'error'
+            metrics.incr('telegram_poll_processed_total', outcome=outcome)
+
+        offset = max(update['update_id'] for update in updates) + 1
+        with app.app_context():
+            try:
+                Bot.query.filter_by(id=bot_id).update({'telegram_update_offset': offset})
+                db.session.commit()
+            finally:
+                db.session.remove()
+        return offset
@@ -9,6 +9,8 @@ import requests
 from typing import List, Dict, Optional, Tuple, Any
 import logging
 
+from services.platform_service import telegram_api_base
+
 logger = logging.getLogger(__name__)
 
 class ServiceResponse:
@@ -26,7 +28,7 @@ class TelegramService:
         if not bot_token:
             raise ValueError("Telegram bot token bo'sh bo'lishi mumkin emas")
         self.bot_token = bot_token
-        self.base_url = f"https://api.telegram.org/bot{bot_token}"
+        self.base_url = f"{telegram_api_base()}/bot{bot_token}"
         
     def send_message(self, chat_id: str, text: str, parse_mode: str = 'HTML') -> Dict:
         """
@@ -215,16 +217,17 @@ def get_user_chat_ids_from_conversations(target_all_users: bool = True,
     Returns:
         List[str]: Chat ID'lar ro'yxati
     """
+    from app import db
     from models import Conversation, User, AccessStatus
     from sqlalchemy import and_
     
-    # Base query - join Conversation with User and Bot
-    base_query = Conversation.query.join(
+    # Base query - join Conversation with User (chat ids only, no ORM rows)
+    base_query = db.session.query(Conversation.platform_user_id).join(
         User, 
         and_(
             Conversation.user_id == User.id,
             User.is_admin == False,  # Exclude admins
-            User.is_active == True   # Only active users
+            User.is_active.is_(True)  # Only active users
         )
     ).filter(
         Conversation.platform == 'telegram',
@@ -256,7 +259,4 @@ def get_user_chat_ids_from_conversations(target_all_users: bool = True,
         base_query = base_query.filter(or_(*user_filters))
     
     # Get distinct chat IDs
-    conversations = base_query.distinct(Conversation.platform_user_id).all()
-    
-    chat_ids = [conv.platform_user_id for conv in conversations if conv.platform_user_id]
-    return chat_ids
\ No newline at end of file
+    return [chat_id for chat_id, in base_query.distinct() if chat_id]
\ No newline at end of file
@@ -0,0 +1,348 @@
+"""
+WhatsApp Cloud API webhook processing and bulk sends
+WhatsApp xabarlari: kiruvchi paketlar, holat qayta qo'ng'iroqlari va shablon tarqatish
+
+Inbound messages go through the same batch pipeline as Instagram
+(services.inbound_batch): the webhook acknowledges at once and workers
+answer the senders of the delivery in parallel, each sender's messages in
+order.
+
+Status callbacks (sent / delivered / read / failed) arrive as one webhook
+call per message per state, so a broadcast to N people produces up to 3N
+calls. They are only buffered in the webhook; per message just the most
+advanced state is kept, and the buffer is written to WhatsAppDelivery every
+WHATSAPP_STATUS_FLUSH_SECONDS with one SELECT ... IN and one commit per
+WHATSAPP_STATUS_BATCH_SIZE messages.
+
+send_templates fans approved template messages out over the pooled async
+client, at most WHATSAPP_SEND_RATE_PER_SECOND sends started per second
+(Cloud API numbers start at 80 messages a second), retrying sends the API
+rejects for throughput.
+"""
+import os
+import time
+import atexit
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services.async_bridge import gather_limited, run_async
+from services.inbound_batch import InboundBatchProcessor, InboundMessage
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Throughput, pair rate and account rate limit errors
+RATE_LIMIT_CODES = {130429, 131056, 80007}
+# Free-form message outside the 24-hour customer service window
+REENGAGEMENT_CODE = 131047
+SERVICE_WINDOW = timedelta(hours=24)
+
+
+@dataclass
+class WhatsAppStatus:
+    """One entry of a status callback"""
+    message_id: str
+    recipient_id: str
+    status: object  # models.DeliveryStatus
+    timestamp: datetime
+    error_code: Optional[int] = None
+    error_message: Optional[str] = None
+
+    @property
+    def rank(self) -> int:
+        from models import DeliveryStatus
+        return list(DeliveryStatus).index(self.status)
+
+
+def message_text(message: Dict) -> Optional[str]:
+    """Text of an inbound message: typed text, quick-reply button or interactive reply"""
+    kind = message.get('type')
+    if kind == 'text':
+        return (message.get('text') or {}).get('body')
+    if kind == 'button':
+        return (message.get('button') or {}).get('text')
+    if kind == 'interactive':
+        interactive = message.get('interactive') or {}
+        reply = interactive.get('button_reply') or interactive.get('list_reply') or {}
+        return reply.get('title')
+    return None
+
+
+def parse_events(payload: Dict) -> Tuple[List[InboundMessage], List[WhatsAppStatus]]:
+    """Text messages and status updates of a webhook payload, in delivery order"""
+    from models import DeliveryStatus
+
+    messages, statuses = [], []
+    for entry in payload.get('entry') or []:
+        for change in entry.get('changes') or []:
+            value = change.get('value') or {}
+            names = {contact.get('wa_id'): (contact.get('profile') or {}).get('name')
+                     for contact in value.get('contacts') or []}
+            for message in value.get('messages') or []:
+                text = message_text(message)
+                sender_id = message.get('from')
+                if not sender_id or not text:
+                    continue
+                messages.append(InboundMessage(str(sender_id), text, message.get('id'), names.get(sender_id)))
+            for status in value.get('statuses') or []:
+                try:
+                    state = DeliveryStatus(status.get('status'))
+                except ValueError:
+                    continue
+                if not status.get('id'):
+                    continue
+                error = (status.get('errors') or [{}])[0]
+                statuses.append(WhatsAppStatus(
+                    message_id=status['id'],
+                    recipient_id=str(status.get('recipient_id') or ''),
+                    status=state,
+                    timestamp=datetime.utcfromtimestamp(int(status.get('timestamp') or time.time())),
+                    error_code=error.get('code'),
+                    error_message=(error.get('title') or error.get('message') or '')[:500] or None
+                ))
+    return messages, statuses
+
+
+def sent_message_id(response) -> Optional[str]:
+    """wamid of a successful send"""
+    messages = (response.data or {}).get('messages') or [{}]
+    return messages[0].get('id')
+
+
+def in_service_window(conversation, now: Optional[datetime] = None) -> bool:
+    """Whether free-form text may still be sent (the customer wrote within 24 hours)
+
+    The window is opened by the customer's messages only; our own replies and
+    broadcasts (which move updated_at) do not extend it.
+    """
+    now = now or datetime.utcnow()
+    last_inbound = conversation.last_customer_message_at
+    return bool(last_inbound) and now - last_inbound < SERVICE_WINDOW
+
+
+def record_deliveries(bot_id: int, sent: Iterable[Tuple]) -> int:
+    """
+    Store the wamids of successful sends so status callbacks can be matched
+
+    `sent` holds (conversation_id, recipient_id, response, template_name) tuples.
+    """
+    from app import db
+    from models import WhatsAppDelivery
+    from sqlalchemy.exc import IntegrityError
+
+    rows = {}
+    for conversation_id, recipient_id, response, template_name in sent:
+        message_id = sent_message_id(response)
+        if message_id:
+            rows[message_id] = (conversation_id, str(recipient_id), template_name)
+    if not rows:
+        return 0
+
+    # A status callback can win the race and create the row first
+    existing = {d.message_id: d for d in WhatsAppDelivery.query.filter(WhatsAppDelivery.message_id.in_(list(rows)))}
+    for message_id, (conversation_id, recipient_id, template_name) in rows.items():
+        delivery = existing.get(message_id)
+        if delivery is None:
+            db.session.add(WhatsAppDelivery(bot_id=bot_id, conversation_id=conversation_id, message_id=message_id,
+                                            recipient_id=recipient_id, template_name=template_name))
+        else:
+            delivery.conversation_id = conversation_id
+            delivery.template_name = template_name
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        logger.warning(f"WhatsApp deliveries of bot {bot_id} already recorded by a status callback")
+        return 0
+    return len(rows)
+
+
+def apply_statuses(bot_id: int, statuses: List[WhatsAppStatus], batch_size: Optional[int] = None) -> int:
+    """Move deliveries forward to the reported states; returns the number of rows changed"""
+    from app import db
+    from models import WhatsAppDelivery
+    from sqlalchemy.exc import IntegrityError
+
+    batch_size = batch_size or int(os.environ.get("WHATSAPP_STATUS_BATCH_SIZE", 500))
+    changed = 0
+    for start in range(0, len(statuses), batch_size):
+        batch = statuses[start:start + batch_size]
+        for attempt in range(2):
+            try:
+                changed += _apply_status_batch(bot_id, batch)
+                db.session.commit()
+                break
+            except IntegrityError:
+                # Another worker inserted one of the rows; the retry updates it instead
+                db.session.rollback()
+                if attempt:
+                    raise
+    return changed
+
+
+def _apply_status_batch(bot_id: int, batch: List[WhatsAppStatus]) -> int:
+    from app import db
+    from models import DeliveryStatus, WhatsAppDelivery
+
+    order = list(DeliveryStatus)
+    existing = {d.message_id: d for d in WhatsAppDelivery.query.filter(
+        WhatsAppDelivery.message_id.in_([s.message_id for s in batch]))}
+    changed = 0
+    for status in batch:
+        delivery = existing.get(status.message_id)
+        if delivery is None:
+            # Sent by another worker that has not recorded it yet, or from outside the app
+            delivery = WhatsAppDelivery(bot_id=bot_id, message_id=status.message_id,
+                                        recipient_id=status.recipient_id, status=status.status)
+            db.session.add(delivery)
+            existing[status.message_id] = delivery
+        elif order.index(delivery.status) >= status.rank:
+            continue
+        delivery.status = status.status
+        delivery.status_at = status.timestamp
+        if status.error_code is not None:
+            delivery.error_code = status.error_code
+            delivery.error_message = status.error_message
+        changed += 1
+    return changed
+
+
+class WhatsAppBatchProcessor(InboundBatchProcessor):
+    """WhatsApp Cloud API replies, plus the buffered status callback writer"""
+
+    platform = 'whatsapp'
+    default_username = 'WhatsApp User'
+
+    def __init__(self, *args, status_flush_seconds: Optional[float] = None,
+                 status_max_pending: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.status_flush_seconds = (status_flush_seconds if status_flush_seconds is not None
+                                     else float(os.environ.get("WHATSAPP_STATUS_FLUSH_SECONDS", 2)))
+        self.status_max_pending = status_max_pending or int(os.environ.get("WHATSAPP_STATUS_MAX_PENDING", 5000))
+        self._status_lock = threading.Lock()
+        # wamid -> (bot_id, most advanced status seen)
+        self._statuses: Dict[str, Tuple[int, WhatsAppStatus]] = {}
+        self._status_timer: Optional[threading.Timer] = None
+
+    def is_connected(self, bot) -> bool:
+        return bool(bot.whatsapp_token)
+
+    def sender_service(self, bot):
+        from services.async_service import AsyncWhatsAppService
+
+        if not bot.whatsapp_phone_number_id:
+            return None
+        return AsyncWhatsAppService(bot.whatsapp_token, bot.whatsapp_phone_number_id)
+
+    def _after_send(self, bot, delivered: List) -> None:
+        from app import db
+
+        try:
+            record_deliveries(bot.id, ((sender.conversation.id, sender.sender_id, response, None)
+                                       for sender, _, _, response in delivered))
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"WhatsApp delivery records not saved for bot {bot.id}: {e}")
+        super()._after_send(bot, delivered)
+
+    def add_statuses(self, bot_id: int, statuses: List[WhatsAppStatus]) -> None:
+        """Buffer status callbacks; written within WHATSAPP_STATUS_FLUSH_SECONDS"""
+        flush_now = False
+        with self._status_lock:
+            for status in statuses:
+                current = self._statuses.get(status.message_id)
+                if current is None or status.rank >= current[1].rank:
+                    self._statuses[status.message_id] = (bot_id, status)
+            if len(self._statuses) >= self.status_max_pending:
+                flush_now = True
+            elif self._status_timer is None or not self._status_timer.is_alive():
+                # Also true in a forked worker, where the parent's timer thread does not exist
+                self._status_timer = threading.Timer(self.status_flush_seconds, self.flush_statuses)
+                self._status_timer.daemon = True
+                self._status_timer.start()
+        metrics.incr('whatsapp_statuses_total', len(statuses))
+        if flush_now:
+            # One key: flushes run one after another
+            self.scheduler.submit('statuses', self.flush_statuses)
+
+    def pending_statuses(self) -> int:
+        with self._status_lock:
+            return len(self._statuses)
+
+    def flush_statuses(self) -> int:
+        """Write the buffered statuses now; returns the number of deliveries changed"""
+        from app import app, db
+
+        with self._status_lock:
+            pending, self._statuses = self._statuses, {}
+        if not pending:
+            return 0
+
+        by_bot: Dict[int, List[WhatsAppStatus]] = {}
+        for bot_id, status in pending.values():
+            by_bot.setdefault(bot_id, []).append(status)
+
+        changed = 0
+        with app.app_context():
+            try:
+                for bot_id, statuses in by_bot.items():
+                    changed += apply_statuses(bot_id, statuses)
+                metrics.incr('whatsapp_status_flushes_total')
+            except Exception as e:
+                db.session.rollback()
+                metrics.incr('whatsapp_status_flushes_failed_total')
+                logger.error(f"WhatsApp status flush error ({len(pending)} statuses): {e}")
+            finally:
+                db.session.remove()
+        return changed
+
+
+def send_templates(bot, recipients: List[Tuple[str, Optional[int]]], template_name: str,
+                   language_code: str = 'en_US', components: Optional[List] = None) -> List:
+    """
+    Send one template to many (recipient_id, conversation_id) pairs
+
+    Returns a ServiceResponse or exception per recipient, in order; successful
+    sends are recorded as WhatsAppDelivery rows.
+    """
+    from app import db
+    from services.async_service import AsyncWhatsAppService
+
+    service = AsyncWhatsAppService(bot.whatsapp_token, bot.whatsapp_phone_number_id)
+    retries = int(os.environ.get("WHATSAPP_RATE_LIMIT_RETRIES", 2))
+
+    async def send(recipient_id):
+        for attempt in range(retries + 1):
+            response = await service.send_template_message(recipient_id, template_name, language_code, components)
+            if response.success or response.status_code not in RATE_LIMIT_CODES or attempt == retries:
+                return response
+            metrics.incr('whatsapp_rate_limited_total')
+            await asyncio.sleep(2 ** attempt)
+        return response
+
+    responses = run_async(gather_limited(
+        (send(recipient_id) for recipient_id, _ in recipients),
+        limit=int(os.environ.get("WHATSAPP_SEND_CONCURRENCY", 20)),
+        rate_per_second=float(os.environ.get("WHATSAPP_SEND_RATE_PER_SECOND", 80))
+    ))
+
+    sent = [(conversation_id, recipient_id, response, template_name)
+            for (recipient_id, conversation_id), response in zip(recipients, responses)
+            if not isinstance(response, Exception) and response.success]
+    metrics.incr('whatsapp_templates_sent_total', len(sent))
+    metrics.incr('whatsapp_templates_failed_total', len(recipients) - len(sent))
+    try:
+        record_deliveries(bot.id, sent)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"WhatsApp delivery records not saved for bot {bot.id}: {e}")
+    return responses
+
+
+whatsapp_batches = WhatsAppBatchProcessor()
+# Statuses still buffered at shutdown are written before the process exits
+atexit.register(whatsapp_batches.flush_statuses)
@@ -1,8 +1,6 @@
 // Send Message Page JavaScript
 document.addEventListener('DOMContentLoaded', function() {
     console.log('DOM Content Loaded - Send Message Page');
-    const conversationItems = document.querySelectorAll('.conversation-item');
-    console.log('Found conversation items:', conversationItems.length);
     const selectedUser = document.getElementById('selectedUser');
     const messageText = document.getElementById('messageText');
     const sendButton = document.getElementById('sendButton');
@@ -11,68 +9,202 @@ document.addEventListener('DOMContentLoaded', function() {
     const platformUserId = document.getElementById('platformUserId');
     const recentMessages = document.getElementById('recentMessages');
 
-    conversationItems.forEach((item, index) => {
-        console.log(`Adding click listener to item ${index}:`, item);
-        console.log('Item data attributes:', {
-            conversationId: item.dataset.conversationId,
-            platform: item.dataset.platform,
-            userId: item.dataset.userId,
-            username: item.dataset.username
+    const conversationList = document.getElementById('conversationList');
+    const moreConversations = document.getElementById('moreConversations');
+    const moreConversationsButton = document.getElementById('moreConversationsButton');
+    const languageNames = {uz: 'O\'zbek', ru: 'Русский', en: 'English'};
+    const badgeColors = {telegram: 'success', instagram: 'info'};
+    // Recent messages of the selected conversation: ids of the loaded range and the
+    // fallback poll timer (used only without EventSource)
+    let oldestId = null;
+    let newestId = null;
+    let pollTimer = null;
+    let liveFeed = null;
+
+    function escapeHtml(text) {
+        const div = document.createElement('div');
+        div.textContent = text == null ? '' : text;
+        return div.innerHTML;
+    }
+
+    // JSON routes answer 429 once the dashboard limit is used up, with an HTML body: refreshes
+    // are then skipped until pausedUntil, and the pause doubles while failures continue
+    const RETRY_MIN_MS = 5000;
+    const RETRY_MAX_MS = 120000;
+    let retryDelay = 0;
+    let pausedUntil = 0;
+
+    function getJson(url) {
+        return fetch(url).then(response => {
+            if (!response.ok) {
+                const error = new Error(`HTTP ${response.status}`);
+                error.retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 0;
+                throw error;
+            }
+            retryDelay = 0;
+            return response.json();
         });
-        item.addEventListener('click', function() {
-            console.log('Conversation item clicked!', this);
-            // Remove active class from all items
-            conversationItems.forEach(i => i.classList.remove('active'));
-            // Add active class to clicked item
-            this.classList.add('active');
-
-            // Get conversation data
-            const convId = this.dataset.conversationId;
-            const platformType = this.dataset.platform;
-            const userId = this.dataset.userId; // data-user-id
-            const username = this.dataset.username;
-
-            // Update form fields
-            conversationId.value = convId;
-            platform.value = platformType;
-            platformUserId.value = userId;
-
-            // Update selected user display
-            selectedUser.innerHTML = `
-                <i class="fab fa-${platformType} me-1"></i>
-                <strong>@${username}</strong> (${platformType.toUpperCase()})
-                <br><small class="text-muted">ID: ${userId}</small>
-            `;
-            selectedUser.className = 'alert alert-info';
-
-            // Enable form elements
-            messageText.disabled = false;
-            sendButton.disabled = false;
+    }
+
+    function backOff(error) {
+        retryDelay = Math.min(Math.max(retryDelay * 2, RETRY_MIN_MS), RETRY_MAX_MS);
+        pausedUntil = Date.now() + Math.max(retryDelay, (error.retryAfter || 0) * 1000);
+    }
 
-            // Load recent messages
-            loadRecentMessages(convId);
+    function paused() {
+        return Date.now() < pausedUntil;
+    }
+
+    function formatDate(value) {
+        // The API sends naive UTC timestamps
+        return new Date(value + 'Z').toLocaleString('uz-UZ');
+    }
+
+    // Clicks are delegated so conversations loaded later work the same way
+    if (conversationList) {
+        conversationList.addEventListener('click', function(e) {
+            const item = e.target.closest('.conversation-item');
+            if (item) {
+                selectConversation(item);
+            }
         });
-    });
+    }
+
+    function selectConversation(item) {
+        // Remove active class from all items
+        document.querySelectorAll('.conversation-item').forEach(i => i.classList.remove('active'));
+        // Add active class to clicked item
+        item.classList.add('active');
+        item.classList.remove('border-primary', 'fw-bold');
+        const unread = item.querySelector('.unread-count');
+        if (unread) unread.remove();
+
+        // Get conversation data
+        const convId = item.dataset.conversationId;
+        const platformType = item.dataset.platform;
+        const userId = item.dataset.userId; // data-user-id
+        const username = item.dataset.username;
+
+        // Update form fields
+        conversationId.value = convId;
+        platform.value = platformType;
+        platformUserId.value = userId;
+
+        // Update selected user display
+        selectedUser.innerHTML = `
+            <i class="fab fa-${escapeHtml(platformType)} me-1"></i>
+            <strong>@${escapeHtml(username)}</strong> (${escapeHtml(platformType.toUpperCase())})
+            <br><small class="text-muted">ID: ${escapeHtml(userId)}</small>
+        `;
+        selectedUser.className = 'alert alert-info';
+
+        // Enable form elements
+        messageText.disabled = false;
+        sendButton.disabled = false;
+
+        // Load recent messages
+        loadRecentMessages(convId);
+    }
+
+    function renderConversation(conv) {
+        const item = document.createElement('div');
+        item.className = 'list-group-item list-group-item-action conversation-item';
+        item.dataset.conversationId = conv.id;
+        item.dataset.platform = conv.platform;
+        item.dataset.userId = conv.platform_user_id;
+        item.dataset.username = conv.platform_username || '';
+        const platformName = conv.platform.charAt(0).toUpperCase() + conv.platform.slice(1);
+        item.innerHTML = `
+            <div class="d-flex justify-content-between align-items-center">
+                <div>
+                    <h6 class="mb-1">
+                        <i class="fab fa-${escapeHtml(conv.platform)} me-1"></i>
+                        @${escapeHtml(conv.platform_username)}
+                    </h6>
+                    <p class="mb-1 text-muted small">
+                        <i class="fas fa-id-card me-1"></i>
+                        ID: ${escapeHtml(conv.platform_user_id)}
+                    </p>
+                    <p class="mb-0 text-muted small">
+                        <i class="fas fa-language me-1"></i>
+                        ${escapeHtml(languageNames[conv.language] || conv.language)}
+                    </p>
+                    ${conv.last_message_preview ? `<p class="mb-0 small text-truncate conversation-preview">${escapeHtml(conv.last_message_preview)}</p>` : ''}
+                </div>
+                <div class="text-end">
+                    <small class="text-muted">${formatDate(conv.updated_at)}</small>
+                    ${conv.unread_count ? `<span class="badge bg-danger ms-1 unread-count">${conv.unread_count}</span>` : ''}
+                    <br>
+                    <span class="badge bg-${badgeColors[conv.platform] || 'primary'}">${escapeHtml(platformName)}</span>
+                </div>
+            </div>
+        `;
+        return item;
+    }
+
+    // Next page of conversations
+    if (moreConversationsButton) {
+        moreConversationsButton.addEventListener('click', function() {
+            const before = encodeURIComponent(conversationList.dataset.before);
+            moreConversationsButton.disabled = true;
+            getJson(`/bot/${conversationList.dataset.botId}/conversations?active=1&limit=20&before=${before}`)
+                .then(data => {
+                    data.conversations.forEach(conv => conversationList.appendChild(renderConversation(conv)));
+                    if (data.before) {
+                        conversationList.dataset.before = data.before;
+                    }
+                    moreConversations.hidden = !data.has_more;
+                })
+                .catch(error => showMessage('Suhbatlarni yuklab bo\'lmadi', 'error'))
+                .finally(() => {
+                    moreConversationsButton.disabled = false;
+                });
+        });
+    }
+
+    function renderMessage(msg) {
+        const div = document.createElement('div');
+        div.className = 'border-bottom pb-2 mb-2';
+        div.innerHTML = `
+            <div class="d-flex justify-content-between">
+                <strong class="small">${msg.is_from_user ? 'Mijoz' : 'Bot'}</strong>
+                <small class="text-muted">${formatDate(msg.created_at)}</small>
+            </div>
+            <p class="small mb-0">${escapeHtml(msg.content)}</p>
+        `;
+        return div;
+    }
+
+    function olderButton() {
+        const div = document.createElement('div');
+        div.className = 'text-center mb-2';
+        div.id = 'olderMessages';
+        div.innerHTML = '<button type="button" class="btn btn-link btn-sm">Oldingi xabarlar</button>';
+        div.querySelector('button').addEventListener('click', loadOlderMessages);
+        return div;
+    }
 
     function loadRecentMessages(convId) {
         recentMessages.innerHTML = '<p class="text-muted">Yuklanmoqda...</p>';
+        clearInterval(pollTimer);
         
-        fetch(`/conversation/${convId}/messages`)
-            .then(response => response.json())
+        getJson(`/conversation/${convId}/messages?limit=10`)
             .then(data => {
+                if (convId !== conversationId.value) return;
+                recentMessages.innerHTML = '';
+                oldestId = data.oldest_id;
+                newestId = data.newest_id;
+                if (data.has_more) {
+                    recentMessages.appendChild(olderButton());
+                }
                 if (data.messages && data.messages.length > 0) {
-                    const messagesHtml = data.messages.slice(-5).map(msg => `
-                        <div class="border-bottom pb-2 mb-2">
-                            <div class="d-flex justify-content-between">
-                                <strong class="small">${msg.is_from_user ? 'Mijoz' : 'Bot'}</strong>
-                                <small class="text-muted">${new Date(msg.created_at).toLocaleString('uz-UZ')}</small>
-                            </div>
-                            <p class="small mb-0">${msg.content}</p>
-                        </div>
-                    `).join('');
-                    recentMessages.innerHTML = messagesHtml;
+                    data.messages.forEach(msg => recentMessages.appendChild(renderMessage(msg)));
                 } else {
-                    recentMessages.innerHTML = '<p class="text-muted">Xabarlar yo\'q</p>';
+                    recentMessages.insertAdjacentHTML('beforeend', '<p class="text-muted" id="noMessages">Xabarlar yo\'q</p>');
+                }
+                // Without the live feed: poll for new messages only, unchanged polls are answered 304 from the ETag
+                if (!liveFeed) {
+                    startPolling();
                 }
             })
             .catch(error => {
@@ -80,6 +212,151 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
 
+    function loadNewMessages(convId) {
+        if (paused()) return;
+        const after = newestId ? `&after_id=${newestId}` : '';
+        getJson(`/conversation/${convId}/messages?limit=50${after}`)
+            .then(data => {
+                if (convId !== conversationId.value || !data.messages.length) return;
+                const empty = document.getElementById('noMessages');
+                if (empty) empty.remove();
+                data.messages.forEach(msg => recentMessages.appendChild(renderMessage(msg)));
+                newestId = data.newest_id;
+                oldestId = oldestId || data.oldest_id;
+            })
+            .catch(error => {
+                console.error('Poll error:', error);
+                backOff(error);
+                if (liveFeed) scheduleMessageRefresh();
+            });
+    }
+
+    function loadOlderMessages() {
+        const convId = conversationId.value;
+        const button = document.getElementById('olderMessages');
+        getJson(`/conversation/${convId}/messages?limit=10&before_id=${oldestId}`)
+            .then(data => {
+                if (convId !== conversationId.value) return;
+                const first = button.nextElementSibling;
+                data.messages.forEach(msg => recentMessages.insertBefore(renderMessage(msg), first));
+                oldestId = data.oldest_id;
+                if (!data.has_more) button.remove();
+            })
+            .catch(error => showMessage('Xabarlarni yuklab bo\'lmadi', 'error'));
+    }
+
+    // Live inbox: the server pushes an event per new message of this bot; a burst of
+    // events is answered with one refresh of the conversations active since the last one
+    // and one fetch of the open conversation's new messages. While refreshes are paused
+    // (429) they wait for the pause to end instead of being dropped.
+    const REFRESH_DELAY_MS = 300;
+    let refreshTimer = null;
+    let messageTimer = null;
+
+    function refreshDelay() {
+        return Math.max(REFRESH_DELAY_MS, pausedUntil - Date.now());
+    }
+
+    function scheduleConversationRefresh() {
+        if (!refreshTimer) {
+            refreshTimer = setTimeout(() => {
+                refreshTimer = null;
+                loadNewConversations();
+            }, refreshDelay());
+        }
+    }
+
+    function scheduleMessageRefresh() {
+        if (!messageTimer) {
+            messageTimer = setTimeout(() => {
+                messageTimer = null;
+                if (!conversationId.value) return;
+                if (paused()) {
+                    scheduleMessageRefresh();
+                } else {
+                    loadNewMessages(conversationId.value);
+                }
+            }, refreshDelay());
+        }
+    }
+
+    function loadNewConversations() {
+        if (paused()) {
+            scheduleConversationRefresh();
+            return;
+        }
+        const after = conversationList.dataset.after ? `&after=${encodeURIComponent(conversationList.dataset.after)}` : '';
+        getJson(`/bot/${conversationList.dataset.botId}/conversations?active=1&limit=20${after}`)
+            .then(data => {
+                data.conversations.slice().reverse().forEach(conv => {
+                    const old = conversationList.querySelector(`.conversation-item[data-conversation-id="${conv.id}"]`);
+                    if (old) old.remove();
+                    const item = renderConversation(conv);
+                    if (String(conv.id) === conversationId.value) {
+                        // Open conversation: its messages are on screen already
+                        item.classList.add('active');
+                        const unread = item.querySelector('.unread-count');
+                        if (unread) unread.remove();
+                    } else {
+                        item.classList.add('border-primary', 'fw-bold');
+                    }
+                    conversationList.prepend(item);
+                });
+                if (data.after) {
+                    conversationList.dataset.after = data.after;
+                }
+            })
+            .catch(error => {
+                console.error('Conversation refresh error:', error);
+                backOff(error);
+                scheduleConversationRefresh();
+            });
+    }
+
+    // The server refuses a stream (503) when its stream slots are taken: the browser then
+    // closes the EventSource for good, so poll every POLL_MS and try the stream again later
+    const POLL_MS = 15000;
+    const LIVE_FEED_RETRY_MS = 30000;
+
+    function startPolling() {
+        clearInterval(pollTimer);
+        pollTimer = setInterval(() => {
+            if (conversationId.value) loadNewMessages(conversationId.value);
+            scheduleConversationRefresh();
+        }, POLL_MS);
+    }
+
+    function openLiveFeed() {
+        const feed = new EventSource(`/bot/${conversationList.dataset.botId}/events`);
+        feed.addEventListener('open', function() {
+            if (liveFeed === feed) return;
+            // Back from polling: catch up on what arrived meanwhile
+            liveFeed = feed;
+            clearInterval(pollTimer);
+            if (conversationId.value) scheduleMessageRefresh();
+            scheduleConversationRefresh();
+        });
+        feed.addEventListener('message', function(e) {
+            const event = JSON.parse(e.data);
+            const convId = String(event.conversation_id);
+            if (convId === conversationId.value && (!newestId || event.message_id > newestId)) {
+                scheduleMessageRefresh();
+            }
+            scheduleConversationRefresh();
+        });
+        feed.addEventListener('error', function() {
+            if (feed.readyState !== EventSource.CLOSED) return;
+            liveFeed = null;
+            startPolling();
+            setTimeout(openLiveFeed, LIVE_FEED_RETRY_MS);
+        });
+        return feed;
+    }
+
+    if (conversationList && window.EventSource) {
+        liveFeed = openLiveFeed();
+    }
+
     // Form submission
     document.getElementById('messageForm').addEventListener('submit', function(e) {
         e.preventDefault();
@@ -110,9 +387,9 @@ document.addEventListener('DOMContentLoaded', function() {
                 messageText.value = '';
                 // Show success message
                 showMessage('Xabar muvaffaqiyatli yuborildi!', 'success');
-                // Reload recent messages
+                // Fetch what was just sent
                 if (conversationId.value) {
-                    loadRecentMessages(conversationId.value);
+                    loadNewMessages(conversationId.value);
                 }
             } else {
                 showMessage(data.error || 'Xabar yuborishda xatolik yuz berdi', 'error');
@@ -0,0 +1,280 @@
+"""
+Message retention: archive expiring messages, then delete them in small batches
+Xabarlarni saqlash muddati: eskirgan xabarlarni arxivlab, kichik qismlarda o'chirish
+
+Months that have expired for every bot are archived and dropped as whole
+partitions (see services/message_partitions.py). For the rest, instead of
+one DELETE over the whole table (long locks, table bloat, data gone for
+good), the engine walks the expired rows in primary-key order:
+
+1. select up to `batch_size` expired rows (keyset: id > last id seen)
+2. append them to gzip JSONL archives partitioned by bot and month
+   (archive_dir/bot_<id>/<YYYY-MM>.jsonl.gz, appended as new gzip members)
+3. delete exactly those ids and commit
+4. pause, so replicas and other writers keep up
+
+Retention is per bot: Bot.message_retention_days, falling back to
+MESSAGE_RETENTION_DAYS. Zero or a negative value keeps messages forever.
+Archiving is at-least-once - a crash between steps 2 and 3 can archive a
+batch twice, never lose it.
+"""
+import os
+import json
+import gzip
+import time
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, delete, func, or_, select
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+class RetentionEngine:
+    """Batched, archived message retention"""
+
+    def __init__(self, batch_size: Optional[int] = None, pause_seconds: Optional[float] = None,
+                 archive_dir: Optional[str] = None, archive: Optional[bool] = None,
+                 default_days: Optional[int] = None, max_seconds: Optional[float] = None):
+        self.batch_size = batch_size or int(os.environ.get("RETENTION_BATCH_SIZE", 5000))
+        self.pause_seconds = (pause_seconds if pause_seconds is not None
+                              else float(os.environ.get("RETENTION_BATCH_PAUSE_SECONDS", 0.2)))
+        self.archive_dir = archive_dir or os.environ.get("RETENTION_ARCHIVE_DIR", "archives/messages")
+        self.archive = archive if archive is not None else _env_bool("RETENTION_ARCHIVE_ENABLED", True)
+        self.default_days = (default_days if default_days is not None
+                             else int(os.environ.get("MESSAGE_RETENTION_DAYS", 90)))
+        # Stop after this long and let the next run continue (0 = no limit)
+        self.max_seconds = (max_seconds if max_seconds is not None
+                            else float(os.environ.get("RETENTION_MAX_SECONDS", 0)))
+        self.progress: Dict = {}
+        self._started = time.monotonic()
+
+    def expiry_condition(self, now: datetime, custom_days: List[int], table):
+        """
+        SQL condition matching expired rows of `table` (joined to Conversation and Bot)
+
+        Returns None when every bot keeps its messages forever.
+        """
+        from models import Bot
+
+        clauses = []
+        if self.default_days > 0:
+            clauses.append(and_(Bot.message_retention_days.is_(None),
+                                table.c.created_at < now - timedelta(days=self.default_days)))
+        for days in custom_days:
+            clauses.append(and_(Bot.message_retention_days == days,
+                                table.c.created_at < now - timedelta(days=days)))
+
+        return or_(*clauses) if clauses else None
+
+    def keep_forever_condition(self):
+        """Bots whose messages never expire"""
+        from models import Bot
+
+        if self.default_days <= 0:
+            return or_(Bot.message_retention_days <= 0, Bot.message_retention_days.is_(None))
+        return Bot.message_retention_days <= 0
+
+    def run(self, now: Optional[datetime] = None) -> Dict:
+        """Archive and delete all expired messages; returns the run's progress counters"""
+        from services.message_partitions import message_partitions
+
+        now = now or datetime.utcnow()
+        self._started = time.monotonic()
+        self.progress = {'batches': 0, 'archived': 0, 'deleted': 0, 'last_id': 0,
+                         'partitions_dropped': 0, 'finished': False, 'started_at': now.isoformat()}
+
+        custom_days = self._custom_days()
+        retention_days = [days for days in [self.default_days] + custom_days if days > 0]
+        if not retention_days:
+            self.progress['finished'] = True
+            return self.progress
+
+        # Whole months expired for every bot go in one DROP instead of row deletes
+        self._drop_expired_partitions(now, max(retention_days))
+
+        finished = True
+        for table in message_partitions.storage_tables():
+            if not self._delete_expired(table, now, custom_days, min(retention_days)):
+                finished = False
+                break
+        self.progress['finished'] = finished
+
+        elapsed = time.monotonic() - self._started
+        metrics.set_gauge('retention_last_run_seconds', round(elapsed, 3))
+        metrics.set_gauge('retention_last_run_deleted', self.progress['deleted'])
+        metrics.set_gauge('retention_last_run_timestamp', int(time.time()))
+        return self.progress
+
+    def _out_of_time(self) -> bool:
+        return bool(self.max_seconds) and time.monotonic() - self._started >= self.max_seconds
+
+    def _drop_expired_partitions(self, now: datetime, longest_days: int) -> None:
+        from app import db
+        from models import Conversation, Bot
+        from services.message_partitions import message_partitions
+
+        cutoff = now - timedelta(days=longest_days)
+        expired = [p for p in message_partitions.list_partitions() if p.end <= cutoff]
+        if not expired:
+            return
+        any_keep_forever = db.session.execute(
+            select(Bot.id).where(self.keep_forever_condition()).limit(1)
+        ).first()
+
+        for partition in expired:
+            if self._out_of_time():
+                return
+            table = message_partitions.table(partition.name)
+
+            # Months holding rows of keep-forever bots fall back to row deletes
+            if any_keep_forever and db.session.execute(
+                select(table.c.id)
+                .join(Conversation, Conversation.id == table.c.conversation_id)
+                .join(Bot, Bot.id == Conversation.bot_id)
+                .where(self.keep_forever_condition()).limit(1)
+            ).first():
+                continue
+
+            if self.archive:
+                rows_in_partition = 0
+                for rows in self._batches(table, None, outer=True):
+                    self._archive_rows(rows)
+                    rows_in_partition += len(rows)
+                self.progress['archived'] += rows_in_partition
+                metrics.incr('retention_messages_archived_total', rows_in_partition)
+            else:
+                rows_in_partition = db.session.execute(select(func.count()).select_from(table)).scalar()
+
+            message_partitions.drop_partition(partition)
+            self.progress['partitions_dropped'] += 1
+            self.progress['deleted'] += rows_in_partition
+            metrics.incr('retention_messages_deleted_total', rows_in_partition)
+            logger.info(f"Retention dropped partition {partition.name} ({rows_in_partition} messages)")
+
+    def _delete_expired(self, table, now: datetime, custom_days: List[int], shortest_days: int) -> bool:
+        """Batched archive + delete over one table; False when the time budget ran out"""
+        from app import db
+
+        condition = self.expiry_condition(now, custom_days, table)
+        if condition is None:
+            return True
+
+        # Ids follow insertion time: no row newer than the latest cutoff can expire,
+        # so the scan stops at the highest id created before it
+        upper_id = db.session.execute(
+            select(func.max(table.c.id)).where(table.c.created_at < now - timedelta(days=shortest_days))
+        ).scalar()
+        if not upper_id:
+            return True
+
+        for rows in self._batches(table, condition, upper_id=upper_id):
+            ids = [row.id for row in rows]
+            if self.archive:
+                self._archive_rows(rows)
+                self.progress['archived'] += len(rows)
+                metrics.incr('retention_messages_archived_total', len(rows))
+
+            deleted = db.session.execute(delete(table).where(table.c.id.in_(ids))).rowcount
+            db.session.commit()
+
+            self.progress['batches'] += 1
+            self.progress['deleted'] += deleted
+            self.progress['last_id'] = ids[-1]
+            metrics.incr('retention_messages_deleted_total', deleted)
+            metrics.incr('retention_batches_total')
+            metrics.set_gauge('retention_last_deleted_id', ids[-1])
+
+            if self.progress['batches'] % 20 == 0:
+                logger.info(f"Retention progress: {self.progress['deleted']} messages deleted, "
+                            f"{table.name} id {ids[-1]} of {upper_id}")
+
+            if self._out_of_time():
+                logger.info(f"Retention run stopped after {self.max_seconds}s, next run continues")
+                return False
+            if len(rows) == self.batch_size and self.pause_seconds:
+                time.sleep(self.pause_seconds)
+        return True
+
+    def _batches(self, table, condition, upper_id: Optional[int] = None, outer: bool = False):
+        """Yield rows of `table` (with their bot id) in primary-key order, batch_size at a time"""
+        from app import db
+        from models import Conversation, Bot
+
+        columns = [table.c.id, Conversation.bot_id, table.c.conversation_id, table.c.content,
+                   table.c.message_type, table.c.is_from_user, table.c.tokens_used,
+                   table.c.response_time, table.c.created_at]
+        last_id = 0
+        while True:
+            stmt = select(*columns).where(table.c.id > last_id)
+            if outer:
+                stmt = stmt.outerjoin(Conversation, Conversation.id == table.c.conversation_id)
+            else:
+                stmt = stmt.join(Conversation, Conversation.id == table.c.conversation_id)\
+                           .join(Bot, Bot.id == Conversation.bot_id)
+            if condition is not None:
+                stmt = stmt.where(condition)
+            if upper_id is not None:
+                stmt = stmt.where(table.c.id <= upper_id)
+
+            rows = db.session.execute(stmt.order_by(table.c.id).limit(self.batch_size)).all()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < self.batch_size:
+                return
+            last_id = rows[-1].id
+
+    def _custom_days(self) -> List[int]:
+        """Distinct per-bot retention overrides"""
+        from app import db
+        from models import Bot
+        return list(db.session.execute(
+            select(Bot.message_retention_days).where(Bot.message_retention_days > 0).distinct()
+        ).scalars())
+
+    def _archive_rows(self, rows) -> None:
+        """Append rows to their bot/month archive files and fsync before the delete"""
+        partitions = defaultdict(list)
+        for row in rows:
+            partitions[(row.bot_id, row.created_at.strftime('%Y-%m'))].append(row)
+
+        for (bot_id, month), partition_rows in partitions.items():
+            directory = os.path.join(self.archive_dir, f'bot_{bot_id or "unknown"}')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'{month}.jsonl.gz')
+
+            # Each batch becomes one more gzip member; gzip readers read them back to back
+            with open(path, 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as archive:
+                    for row in partition_rows:
+                        record = {
+                            'id': row.id,
+                            'bot_id': row.bot_id,
+                            'conversation_id': row.conversation_id,
+                            'content': row.content,
+                            'message_type': row.message_type,
+                            'is_from_user': row.is_from_user,
+                            'tokens_used': row.tokens_used,
+                            'response_time': row.response_time,
+                            'created_at': row.created_at.isoformat(),
+                        }
+                        archive.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+
+
+def read_archive(path: str):
+    """Iterate the records of one archive file"""
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            if line.strip():
+                yield json.loads(line)
@@ -1,4 +1,5 @@
 import logging
+import time
 import atexit
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -8,24 +9,28 @@ def check_trial_expiry():
     """Check for expired trials and update user status"""
     try:
         from app import app, db
-        from models import User, AdminAction
+        from models import User
+        from sqlalchemy import select
+        from utils.streaming import iter_rows
         
         with app.app_context():
-            # Find users with expired trials
-            expired_users = User.query.filter(
+            # Find users with expired trials (usernames only, streamed)
+            expired_users = select(User.username).where(
                 User.is_trial_active == True,
                 User.trial_end_date <= datetime.utcnow(),
                 User.admin_approved == False,
                 User.is_admin == False
-            ).all()
+            )
             
-            for user in expired_users:
-                logging.info(f"Trial expired for user: {user.username}")
+            expired_count = 0
+            for username, in iter_rows(expired_users):
+                expired_count += 1
+                logging.info(f"Trial expired for user: {username}")
                 # Trial expiry is handled by the has_access property
                 # No need to change is_trial_active here
             
-            if expired_users:
-                logging.info(f"Found {len(expired_users)} users with expired trials")
+            if expired_count:
+                logging.info(f"Found {expired_count} users with expired trials")
             
     except Exception as e:
         logging.error(f"Error checking trial expiry: {e}")
@@ -34,8 +39,9 @@ def update_daily_stats():
     """Update daily statistics"""
     try:
         from app import app, db
-        from models import User, Bot, Message, SystemStats
+        from models import User, Bot, SystemStats
         from sqlalchemy import func
+        from services.message_partitions import message_partitions
         
         with app.app_context():
             today = datetime.utcnow().date()
@@ -53,7 +59,7 @@ def update_daily_stats():
             ).count()
             approved_users = User.query.filter_by(admin_approved=True).count()
             total_bots = Bot.query.count()
-            total_messages = Message.query.count()
+            total_messages = message_partitions.count_messages()
             
             # Create daily stats
             stats = SystemStats()
@@ -76,14 +82,13 @@ def cleanup_old_data():
     """Clean up old data (optional)"""
     try:
         from app import app, db
-        from models import Message, SystemStats
+        from models import SystemStats
+        from tasks.retention import RetentionEngine
         
         with app.app_context():
-            # Delete messages older than 90 days
-            ninety_days_ago = datetime.utcnow() - timedelta(days=90)
-            old_messages = Message.query.filter(
-                Message.created_at < ninety_days_ago
-            ).delete()
+            # Archive and delete expired messages in small batches (per-bot retention)
+            progress = RetentionEngine().run()
+            old_messages = progress['deleted']
             
             # Delete old stats (keep last 365 days)
             year_ago = datetime.utcnow().date() - timedelta(days=365)
@@ -99,20 +104,73 @@ def cleanup_old_data():
     except Exception as e:
         logging.error(f"Error cleaning up old data: {e}")
 
+def maintain_message_partitions():
+    """Create upcoming message partitions (Postgres) or rotate finished months (SQLite)"""
+    try:
+        from app import app
+        from services.message_partitions import message_partitions, partitioning_enabled
+        
+        if not partitioning_enabled():
+            return
+        
+        with app.app_context():
+            message_partitions.maintain()
+            
+    except Exception as e:
+        logging.error(f"Error maintaining message partitions: {e}")
+
+def process_pending_knowledge():
+    """Resume knowledge files left queued or stuck after a restart"""
+    try:
+        from app import app
+        from services.knowledge_worker import knowledge_worker
+        
+        with app.app_context():
+            submitted = knowledge_worker.sweep()
+            if submitted:
+                logging.info(f"Submitted {len(submitted)} pending knowledge files")
+            
+    except Exception as e:
+        logging.error(f"Error processing pending knowledge files: {e}")
+
+def send_notification_digests():
+    """Send the hourly monitoring digest of bots in digest mode"""
+    try:
+        from app import app
+        from services.notification_aggregator import notification_aggregator
+        
+        with app.app_context():
+            sent = notification_aggregator.send_digests()
+            if sent:
+                logging.info(f"Queued {sent} monitoring digests")
+            
+    except Exception as e:
+        logging.error(f"Error sending monitoring digests: {e}")
+
+def prune_conversation_events():
+    """Drop live-inbox events older than the retention window"""
+    try:
+        from app import app
+        from services.change_feed import prune_events
+        
+        with app.app_context():
+            deleted = prune_events()
+            if deleted:
+                logging.info(f"Pruned {deleted} conversation events")
+            
+    except Exception as e:
+        logging.error(f"Error pruning conversation events: {e}")
+
 def send_marketing_telegrams():
     """Send marketing Telegram messages to trial users every 3 days (optimized bulk sending)"""
     try:
         from app import app, db
-        from services.telegram_marketing_service import (
-            TelegramMarketingService, get_trial_expired_telegram_users, 
-            update_marketing_sent_timestamp
-        )
+        from services.segments import segments
+        from services.telegram_marketing_service import TelegramMarketingService, update_marketing_sent_timestamp
         
         with app.app_context():
-            # Get trial expired users who have telegram_chat_id
-            trial_expired_users = get_trial_expired_telegram_users()
-            
-            if not trial_expired_users:
+            # Trial expired users who have telegram_chat_id, streamed in chunks
+            if not segments.member_ids('trial_expired'):
                 logging.info("No trial expired users with Telegram found for marketing messages")
                 return
             
@@ -122,41 +180,41 @@ def send_marketing_telegrams():
             # Send individual personalized messages with rate limiting
             sent_count = 0
             failed_count = 0
-            successful_user_ids = []
             
-            for user_data in trial_expired_users:
-                try:
-                    # Create personalized message for each user
-                    message = marketing_service.create_trial_expired_message(
-                        user_name=user_data['full_name'] or user_data['username']
-                    )
-                    
-                    result = marketing_service.send_marketing_message(
-                        chat_id=user_data['telegram_chat_id'],
-                        message=message
-                    )
-                    
-                    if result and result.get('success'):
-                        sent_count += 1
-                        successful_user_ids.append(user_data['id'])
-                        logging.info(f"Marketing Telegram sent to user {user_data['full_name'] or user_data['username']} (chat_id: {user_data['telegram_chat_id']})")
-                    else:
-                        failed_count += 1
-                        logging.warning(f"Failed to send marketing Telegram to user {user_data['full_name'] or user_data['username']}: {result.get('error', 'Unknown error')}")
-                    
-                    # Rate limiting - wait 1 second between sends
-                    import time
-                    time.sleep(1.0)
+            for members in segments.iter_members('trial_expired'):
+                successful_user_ids = []
+                for member in members:
+                    name = member.full_name or member.username
+                    try:
+                        # Create personalized message for each user
+                        message = marketing_service.create_trial_expired_message(user_name=name)
                         
-                except Exception as user_error:
-                    failed_count += 1
-                    logging.error(f"Error sending marketing Telegram to user {user_data['full_name'] or user_data['username']}: {user_error}")
-            
-            # Update marketing sent timestamp for successful sends
-            if successful_user_ids:
-                update_marketing_sent_timestamp(successful_user_ids)
+                        result = marketing_service.send_marketing_message(
+                            chat_id=member.telegram_chat_id,
+                            message=message
+                        )
+                        
+                        if result and result.get('success'):
+                            sent_count += 1
+                            successful_user_ids.append(member.id)
+                            logging.info(f"Marketing Telegram sent to user {name} (chat_id: {member.telegram_chat_id})")
+                        else:
+                            failed_count += 1
+                            logging.warning(f"Failed to send marketing Telegram to user {name}: {result.get('error', 'Unknown error')}")
+                        
+                        # Rate limiting - wait 1 second between sends
+                        time.sleep(1.0)
+                            
+                    except Exception as user_error:
+                        failed_count += 1
+                        logging.error(f"Error sending marketing Telegram to user {name}: {user_error}")
+                
+                # Update marketing sent timestamp for the chunk's successful sends
+                if successful_user_ids:
+                    update_marketing_sent_timestamp(successful_user_ids)
             
-            logging.info(f"Marketing Telegrams sent: {sent_count} successful, {failed_count} failed to {len(trial_expired_users)} trial expired users")
+            segments.invalidate()
+            logging.info(f"Marketing Telegrams sent: {sent_count} successful, {failed_count} failed to trial expired users")
             
     except Exception as e:
         logging.error(f"Error sending marketing Telegrams: {e}")
@@ -249,6 +307,42 @@ def start_scheduler():
         replace_existing=True
     )
     
+    # Message partitions: ahead of the month change and before the weekly cleanup
+    scheduler.add_job(
+        func=maintain_message_partitions,
+        trigger=CronTrigger(hour=0, minute=20),  # Daily at 00:20
+        id='message_partitions',
+        name='Maintain message partitions',
+        replace_existing=True
+    )
+    
+    # Knowledge files interrupted by a restart or a dead worker
+    scheduler.add_job(
+        func=process_pending_knowledge,
+        trigger=CronTrigger(minute='*'),  # Every minute
+        id='knowledge_sweep',
+        name='Process pending knowledge files',
+        replace_existing=True
+    )
+    
+    # Monitoring digests for bots that asked for one summary per hour
+    scheduler.add_job(
+        func=send_notification_digests,
+        trigger=CronTrigger(minute=0),  # Hourly
+        id='notification_digests',
+        name='Send monitoring notification digests',
+        replace_existing=True
+    )
+    
+    # Live-inbox change feed: keep only the resume window
+    scheduler.add_job(
+        func=prune_conversation_events,
+        trigger=CronTrigger(minute=40),  # Hourly at minute 40
+        id='conversation_events_prune',
+        name='Prune conversation events',
+        replace_existing=True
+    )
+    
     scheduler.start()
     logging.info("Background scheduler started")
     
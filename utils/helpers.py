@@ -1,8 +1,9 @@
 import os
 import re
 import logging
+from datetime import datetime
 from functools import wraps
-from flask import flash, redirect, url_for, current_app
+from flask import flash, redirect, url_for, current_app, jsonify, request
 from flask_login import current_user
 
 def admin_required(f):
@@ -30,39 +31,24 @@ def trial_required(f):
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx', 'json', 'csv'}
+    ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx', 'json', 'csv'}
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def detect_language(text):
-    """Detect language of the text"""
+def page_limit(value, default=20, maximum=100):
+    """`limit` query parameter clamped to 1..maximum"""
     try:
-        # Simple language detection based on character patterns
-        if not text:
-            return 'uz'
-        
-        # Count specific characters for each language
-        uzbek_chars = set('qxʻoʻgʻ')
-        russian_chars = set('ёяю')
-        
-        uzbek_count = sum(1 for char in text.lower() if char in uzbek_chars)
-        russian_count = sum(1 for char in text.lower() if char in russian_chars)
-        
-        # Check for Cyrillic characters
-        cyrillic_count = sum(1 for char in text if '\u0400' <= char <= '\u04FF')
-        
-        if russian_count > 0 or cyrillic_count > len(text) * 0.3:
-            return 'ru'
-        elif uzbek_count > 0:
-            return 'uz'
-        elif any(ord(char) > 127 for char in text):
-            return 'uz'  # Default to Uzbek for non-ASCII
-        else:
-            return 'en'  # Default to English for ASCII
-            
-    except Exception as e:
-        logging.error(f"Language detection error: {e}")
-        return 'uz'  # Default to Uzbek
+        return max(1, min(int(value), maximum))
+    except (TypeError, ValueError):
+        return default
+
+def conditional_json(payload):
+    """JSON response with an ETag; an If-None-Match poll of unchanged data gets 304 Not Modified"""
+    response = jsonify(payload)
+    response.add_etag()
+    # Private data: the browser may keep it but must revalidate every time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 def format_datetime(dt, format_type='full'):
     """Format datetime for display"""
@@ -78,6 +64,14 @@ def format_datetime(dt, format_type='full'):
     else:  # full
         return dt.strftime('%d.%m.%Y %H:%M:%S')
 
+def as_date(value):
+    """Normalize a SQL date() result - SQLite returns 'YYYY-MM-DD' strings, Postgres returns dates"""
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
 def format_file_size(size_bytes):
     """Format file size in human readable format"""
     if size_bytes == 0:
@@ -0,0 +1,124 @@
+"""
+Language identification for incoming messages
+Xabar tilini aniqlash: o'zbek (lotin va kirill), rus va ingliz
+
+A naive Bayes classifier over character 1-3 grams of each word. The
+profiles (log probabilities per n-gram and script) are built once per
+process from utils.language_corpus. A word's score in every profile is the
+sum of its n-gram lookups, done with a C-level sum(map(dict.get, ...)) and
+then cached, so a typical chat message costs one dict lookup per word.
+
+    detect_language("Narxi qancha?")                -> 'uz'
+    identify("Нархи қанча?")                        -> LanguageGuess('uz', 'cyrl', ...)
+    detect_languages(texts)                         -> ['uz', 'ru', ...]
+
+Both Uzbek scripts report 'uz', the code the rest of the app uses.
+"""
+import re
+import math
+from collections import Counter
+from itertools import repeat
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from utils.language_corpus import CORPUS
+
+DEFAULT_LANGUAGE = 'uz'
+# Profile name -> (language code, script)
+PROFILES = {
+    'uz_latn': ('uz', 'latn'),
+    'uz_cyrl': ('uz', 'cyrl'),
+    'ru': ('ru', 'cyrl'),
+    'en': ('en', 'latn'),
+}
+MAX_ORDER = 3
+# Add-k smoothing for n-grams a profile never saw
+SMOOTHING = 0.5
+# The language of a message is clear well before this many characters
+MAX_CHARS = 400
+# Distinct words whose scores are kept (the cache is emptied when full)
+WORD_CACHE_SIZE = 50_000
+
+# o‘ g‘ and the tutuq belgisi are typed with many different apostrophes
+_APOSTROPHES = str.maketrans({c: "'" for c in "ʻʼ‘’`´"})
+_NON_LETTERS = re.compile(r"(?:[^\w']|[\d_])+")
+
+
+class LanguageGuess(NamedTuple):
+    language: str
+    script: str
+    # Margin between the best and second-best profile, per n-gram (0 = a tie)
+    confidence: float
+
+
+def normalize(text: str, max_chars: Optional[int] = MAX_CHARS) -> str:
+    """Lowercase words of letters and apostrophes, separated by single spaces"""
+    return _NON_LETTERS.sub(' ', text[:max_chars].lower().translate(_APOSTROPHES)).strip()
+
+
+def ngrams(word: str) -> List[str]:
+    """Character 1..MAX_ORDER grams of a word; longer ones include the word boundaries"""
+    grams = list(word)
+    padded = f' {word} '
+    for order in range(2, MAX_ORDER + 1):
+        grams.extend(padded[i:i + order] for i in range(len(padded) - order + 1))
+    return grams
+
+
+def build_profiles(corpus: Dict[str, str]) -> Tuple[Dict[str, Dict[str, float]], Dict[str, float]]:
+    """Log probability tables per profile, plus the score of an unseen n-gram"""
+    counts = {name: Counter(g for word in normalize(text, max_chars=None).split() for g in ngrams(word))
+              for name, text in corpus.items()}
+    vocabulary = len(set().union(*counts.values()))
+    profiles, unseen = {}, {}
+    for name, counter in counts.items():
+        denominator = sum(counter.values()) + SMOOTHING * vocabulary
+        profiles[name] = {g: math.log((c + SMOOTHING) / denominator) for g, c in counter.items()}
+        unseen[name] = math.log(SMOOTHING / denominator)
+    return profiles, unseen
+
+
+_profiles, _unseen = build_profiles(CORPUS)
+_names = list(_profiles)
+_word_cache: Dict[str, Tuple[float, ...]] = {}
+
+
+def _word_scores(word: str) -> Tuple[float, ...]:
+    """Score of `word` in each profile (in _names order), then its n-gram count"""
+    scores = _word_cache.get(word)
+    if scores is None:
+        grams = ngrams(word)
+        scores = tuple(sum(map(_profiles[name].get, grams, repeat(_unseen[name]))) for name in _names)
+        scores += (len(grams),)
+        if len(_word_cache) >= WORD_CACHE_SIZE:
+            _word_cache.clear()
+        _word_cache[word] = scores
+    return scores
+
+
+def identify(text: str, default: str = DEFAULT_LANGUAGE) -> LanguageGuess:
+    """Best language and script for `text`; `default` when it has no letters"""
+    words = normalize(text or '').split()
+    if not words:
+        return LanguageGuess(default, '', 0.0)
+    *totals, grams = map(sum, zip(*map(_word_scores, words)))
+    ranked = sorted(zip(totals, _names), reverse=True)
+    (best, name), (second, _) = ranked[0], ranked[1]
+    language, script = PROFILES[name]
+    return LanguageGuess(language, script, (best - second) / grams)
+
+
+def detect_language(text: str, default: str = DEFAULT_LANGUAGE) -> str:
+    """'uz', 'ru' or 'en' for `text`"""
+    return identify(text, default).language
+
+
+def detect_languages(texts: Iterable[str], default: str = DEFAULT_LANGUAGE) -> List[str]:
+    """detect_language for many texts (broadcasts, analytics); repeated texts are scored once"""
+    seen = {}
+    result = []
+    for text in texts:
+        language = seen.get(text)
+        if language is None:
+            language = seen[text] = identify(text, default).language
+        result.append(language)
+    return result
@@ -0,0 +1,189 @@
+"""
+Training text for the language detector (utils.language)
+Til aniqlash uchun namuna matnlar
+
+Short customer-chat sentences plus some plain prose per language and script.
+Uzbek Cyrillic includes informal spellings without ў/қ/ғ/ҳ, as people often
+type them. Keep these apart from the benchmark set in
+benchmarks/language_detection.py, or its accuracy figure means nothing.
+"""
+
+CORPUS = {
+    'uz_latn': """
+Assalomu alaykum! Sizlarda bu mahsulot bormi?
+Narxi qancha turadi, chegirma bormi?
+Yetkazib berish xizmati bormi, Toshkent bo'ylab necha pul?
+Buyurtma bermoqchi edim, qanday qilib to'lov qilsam bo'ladi?
+Rahmat, juda yaxshi xizmat ekan.
+Kechirasiz, men sizga qo'ng'iroq qila olmadim.
+Ertaga soat nechida ishlaysizlar?
+Do'koningiz qayerda joylashgan, manzilni yuboring iltimos.
+Bu telefonning kafolati necha oy?
+Menga ikki dona kerak, qachon olib kelasizlar?
+Click yoki Payme orqali to'lasam bo'ladimi?
+Rangi boshqacha bo'lsa almashtirib berasizmi?
+Mahsulot sifati qanday, foydalanganlar fikri bormi?
+O'zbekiston bo'ylab yetkazib berish bepulmi?
+Hozir aksiya bormi yoki yo'qmi?
+Salom, yordam bera olasizmi? Buyurtmam hali kelmadi.
+Operator bilan gaplashmoqchiman.
+Men bu kursga yozilmoqchiman, darslar qachon boshlanadi?
+Kurs narxi oyiga qancha, to'lovni bo'lib to'lasa bo'ladimi?
+Ish vaqtingiz dushanbadan shanbagacha soat to'qqizdan oltigacha.
+Bizning kompaniyamiz o'n yildan beri mijozlarga xizmat ko'rsatib kelmoqda.
+Barcha mahsulotlarimiz sertifikatlangan va sifat kafolatiga ega.
+Savollaringiz bo'lsa, bemalol yozing, biz tez orada javob beramiz.
+Buyurtmangiz qabul qilindi, tez orada operatorimiz siz bilan bog'lanadi.
+Yangi kolleksiya keldi, ko'ylaklar va shimlar arzon narxlarda.
+Qishloq xo'jaligi mahsulotlari ulgurji narxda sotiladi.
+Bolalar uchun o'yinchoqlar va kiyimlar ham bor.
+Ertalabdan beri kutyapman, nega javob bermayapsiz?
+Yaxshi, tushundim, katta rahmat sizga.
+Qaysi o'lcham menga to'g'ri keladi? Bo'yim bir yetmish.
+Menda savol bor edi, iltimos javob bering.
+Xonalar bo'shmi, bir kecha necha so'm?
+Shifokor qabuliga yozilish mumkinmi?
+Toshkentdan Samarqandgacha yo'l kira qancha bo'ladi?
+Oylik to'lov har oyning beshinchi sanasigacha amalga oshiriladi.
+Shartnoma imzolangandan keyin ish boshlanadi.
+Mening ismim Dilshod, men Farg'onadanman.
+Bugun havo juda issiq, ko'chaga chiqqim kelmayapti.
+Kitob o'qish bilimni oshiradi va dunyoqarashni kengaytiradi.
+Ota-onamizni hurmat qilishimiz kerak.
+Biz bilan bog'laning va eng yaxshi takliflardan foydalaning.
+Nechchi kunda yetib keladi? Viloyatlarga ham jo'natasizlarmi?
+Ha, albatta. Yo'q, kerak emas. Mayli, keyinroq yozaman.
+Chegirmali narxlar faqat shu hafta amal qiladi.
+Telefon raqamingizni qoldiring, sizga qayta qo'ng'iroq qilamiz.
+""",
+    'uz_cyrl': """
+Ассалому алайкум! Сизларда бу маҳсулот борми?
+Нархи қанча туради, чегирма борми?
+Етказиб бериш хизмати борми, Тошкент бўйлаб неча пул?
+Буюртма бермоқчи эдим, қандай қилиб тўлов қилсам бўлади?
+Раҳмат, жуда яхши хизмат экан.
+Кечирасиз, мен сизга қўнғироқ қила олмадим.
+Эртага соат нечида ишлайсизлар?
+Дўконингиз қаерда жойлашган, манзилни юборинг илтимос.
+Бу телефоннинг кафолати неча ой?
+Менга икки дона керак, қачон олиб келасизлар?
+Ранги бошқача бўлса алмаштириб берасизми?
+Ўзбекистон бўйлаб етказиб бериш бепулми?
+Ҳозир акция борми ёки йўқми?
+Салом, ёрдам бера оласизми? Буюртмам ҳали келмади.
+Оператор билан гаплашмоқчиман.
+Ишимиз душанбадан шанбагача соат тўққиздан олтигача.
+Бизнинг компаниямиз ўн йилдан бери мижозларга хизмат кўрсатиб келмоқда.
+Барча маҳсулотларимиз сертификатланган ва сифат кафолатига эга.
+Саволларингиз бўлса, бемалол ёзинг, биз тез орада жавоб берамиз.
+Буюртмангиз қабул қилинди, тез орада операторимиз сиз билан боғланади.
+Янги коллекция келди, кўйлаклар ва шимлар арзон нархларда.
+Болалар учун ўйинчоқлар ва кийимлар ҳам бор.
+Эрталабдан бери кутяпман, нега жавоб бермаяпсиз?
+Яхши, тушундим, катта раҳмат сизга.
+Менинг исмим Дилшод, мен Фарғонаданман.
+Бугун ҳаво жуда иссиқ, кўчага чиққим келмаяпти.
+Китоб ўқиш билимни оширади ва дунёқарашни кенгайтиради.
+Ота-онамизни ҳурмат қилишимиз керак.
+Биз билан боғланинг ва энг яхши таклифлардан фойдаланинг.
+Ҳа, албатта. Йўқ, керак эмас. Майли, кейинроқ ёзаман.
+Салом, нархи канча? Бу махсулот борми сизларда?
+Етказиб бериш неча кунда булади, вилоятларга хам жунатасизларми?
+Рахмат, тушундим, эртага ёзаман.
+Буюртма бермокчиман, кандай килиб тулов киламан?
+Менга шу керак эди, качон олиб келасизлар?
+Курс нархи ойига канча, дарслар качон бошланади?
+Шартнома имзолангандан кейин иш бошланади.
+Ойлик тўлов ҳар ойнинг бешинчи санасигача амалга оширилади.
+Телефон рақамингизни қолдиринг, сизга қайта қўнғироқ қиламиз.
+Маънавият ва маърифат жамиятнинг асосидир.
+""",
+    'ru': """
+Здравствуйте! У вас есть этот товар в наличии?
+Сколько стоит, есть ли скидка?
+Есть ли доставка по Ташкенту и сколько она стоит?
+Хочу сделать заказ, как можно оплатить?
+Спасибо, очень хороший сервис.
+Извините, я не смог до вас дозвониться.
+Во сколько вы завтра открываетесь?
+Где находится ваш магазин, отправьте адрес пожалуйста.
+Какая гарантия на этот телефон?
+Мне нужно две штуки, когда привезёте?
+Можно оплатить через Click или Payme?
+Если цвет не подойдёт, можно будет обменять?
+Какое качество у товара, есть отзывы?
+Доставка по Узбекистану бесплатная?
+Сейчас есть какие-нибудь акции?
+Привет, можете помочь? Мой заказ ещё не пришёл.
+Хочу поговорить с оператором.
+Я хочу записаться на курс, когда начинаются занятия?
+Сколько стоит курс в месяц, можно платить частями?
+Мы работаем с понедельника по субботу с девяти до шести.
+Наша компания уже десять лет обслуживает клиентов.
+Вся наша продукция сертифицирована и имеет гарантию качества.
+Если у вас есть вопросы, пишите, мы скоро ответим.
+Ваш заказ принят, наш оператор скоро свяжется с вами.
+Пришла новая коллекция, платья и брюки по низким ценам.
+Для детей тоже есть игрушки и одежда.
+Жду с самого утра, почему вы не отвечаете?
+Хорошо, понял, большое спасибо.
+Какой размер мне подойдёт? Мой рост сто семьдесят.
+У меня был вопрос, ответьте пожалуйста.
+Есть свободные номера, сколько стоит одна ночь?
+Можно записаться на приём к врачу?
+Ежемесячный платёж вносится до пятого числа каждого месяца.
+Работа начинается после подписания договора.
+Меня зовут Дмитрий, я из Самарканда.
+Сегодня очень жарко, не хочется выходить на улицу.
+Чтение книг расширяет кругозор и развивает мышление.
+Свяжитесь с нами и воспользуйтесь лучшими предложениями.
+Через сколько дней придёт? В регионы тоже отправляете?
+Да, конечно. Нет, не нужно. Ладно, напишу позже.
+Цены со скидкой действуют только на этой неделе.
+Оставьте свой номер телефона, мы вам перезвоним.
+""",
+    'en': """
+Hello! Do you have this product in stock?
+How much does it cost, is there a discount?
+Do you deliver in Tashkent and how much is the delivery?
+I would like to place an order, how can I pay?
+Thank you, great service.
+Sorry, I could not reach you by phone.
+What time do you open tomorrow?
+Where is your shop located, please send me the address.
+What is the warranty on this phone?
+I need two of them, when can you bring them?
+Can I pay with a card or through the app?
+If the colour does not fit, can I exchange it?
+What is the quality like, are there any reviews?
+Is shipping free anywhere in the country?
+Are there any promotions right now?
+Hi, can you help me? My order has not arrived yet.
+I want to talk to an operator.
+I would like to sign up for the course, when do classes start?
+How much is the course per month, can I pay in instalments?
+We are open from Monday to Saturday, nine to six.
+Our company has been serving customers for ten years.
+All our products are certified and come with a quality guarantee.
+If you have any questions, feel free to write and we will reply soon.
+Your order has been received, our operator will contact you shortly.
+The new collection has arrived, dresses and trousers at low prices.
+We also have toys and clothes for children.
+I have been waiting since the morning, why are you not answering?
+Okay, I understand, thank you very much.
+Which size will fit me? I am one seventy tall.
+I had a question, please answer.
+Are there free rooms, how much is one night?
+Is it possible to book an appointment with the doctor?
+The monthly payment is due by the fifth of each month.
+Work starts after the contract is signed.
+My name is David and I am from London.
+It is very hot today, I do not want to go outside.
+Reading books broadens your horizons and develops thinking.
+Contact us and take advantage of the best offers.
+How many days will it take? Do you ship to other cities too?
+Yes, of course. No, thanks. Fine, I will write later.
+The discounted prices are valid this week only.
+Leave your phone number and we will call you back.
+""",
+}
@@ -0,0 +1,67 @@
+"""
+Constant-memory scans of large tables
+Katta jadvallarni doimiy xotira bilan o'qish (server-side cursor, yield_per)
+
+stream_rows() runs a select on a connection of its own with stream_results
+(a server-side cursor on Postgres; SQLite's cursor steps lazily anyway) and
+yields the rows in partitions of STREAM_CHUNK_SIZE, so one partition is in
+memory at a time however large the table. Select columns, not entities: a
+row tuple costs a fraction of an ORM instance and nothing piles up in the
+session's identity map.
+
+A stream keeps its connection and transaction open until it is exhausted.
+Loops that write between chunks use stream_by_key instead: keyset pages,
+each a short query of its own, so committing in between is safe (a Postgres
+server-side cursor does not outlive the commit, and an unfinished SQLite
+read blocks another connection's commit).
+
+    for row in iter_rows(select(User.email, User.username).where(...)):
+        ...
+    for rows in stream_by_key(select(Conversation.id, ...).where(...), Conversation.id):
+        ...
+        db.session.commit()
+"""
+import os
+from typing import Iterator, List, Optional
+
+
+def _chunk_size(chunk_size: Optional[int]) -> int:
+    return chunk_size or int(os.environ.get("STREAM_CHUNK_SIZE", 1000))
+
+
+def stream_rows(statement, chunk_size: Optional[int] = None) -> Iterator[List]:
+    """Rows of a read-only select, in partitions of chunk_size"""
+    from app import db
+
+    size = _chunk_size(chunk_size)
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=size).execute(statement)
+        for partition in result.partitions():
+            yield partition
+
+
+def iter_rows(statement, chunk_size: Optional[int] = None) -> Iterator:
+    """Rows of a read-only select, one at a time, fetched chunk_size at a time"""
+    for partition in stream_rows(statement, chunk_size):
+        yield from partition
+
+
+def stream_by_key(statement, key, chunk_size: Optional[int] = None) -> Iterator[List]:
+    """Rows of a select in keyset pages ordered by `key` (unique, and in the select list)
+
+    Each page is its own query on the session, so the caller may commit between pages.
+    """
+    from app import db
+
+    size = _chunk_size(chunk_size)
+    last = None
+    while True:
+        page = statement.order_by(key).limit(size)
+        if last is not None:
+            page = page.where(key > last)
+        rows = db.session.execute(page).all()
+        if rows:
+            yield rows
+        if len(rows) < size:
+            return
+        last = rows[-1]._mapping[key]